@@ -1,14 +1,53 @@
 // middleware/upload.js
 const multer = require("multer");
 const path = require("path");
+const fs = require("fs");
 
-const storage = multer.diskStorage({
-  destination: "uploads/",
-  filename: (req, file, cb) => {
-    cb(null, Date.now() + path.extname(file.originalname));
+const UPLOAD_DIR = "uploads/";
+
+// Writes uploads to disk as they arrive. If req.onUploadStart is set it
+// is called with the absolute path as soon as the file exists, so
+// processing can start on the growing file; <file>.complete marks the
+// end of the upload, <file>.aborted (with the reason) a failed one.
+const progressiveStorage = {
+  _handleFile(req, file, cb) {
+    fs.mkdirSync(UPLOAD_DIR, { recursive: true });
+    const filename = Date.now() + path.extname(file.originalname);
+    const filePath = path.join(UPLOAD_DIR, filename);
+    const out = fs.createWriteStream(filePath);
+    let done = false;
+
+    const fail = (err) => {
+      if (done) return;
+      done = true;
+      out.destroy();
+      fs.writeFile(filePath + ".aborted", err.message, () => cb(err));
+    };
+
+    out.on("open", () => {
+      if (req.onUploadStart) req.onUploadStart(path.resolve(filePath));
+    });
+    out.on("error", fail);
+    file.stream.on("error", fail);
+    req.on("close", () => {
+      if (!req.complete) fail(new Error("Client aborted the upload"));
+    });
+    out.on("finish", () => {
+      if (done) return;
+      done = true;
+      fs.writeFile(filePath + ".complete", "", (err) => {
+        if (err) return cb(err);
+        cb(null, { destination: UPLOAD_DIR, filename, path: filePath, size: out.bytesWritten });
+      });
+    });
+    file.stream.pipe(out);
   },
-});
 
-const upload = multer({ storage });
+  _removeFile(req, file, cb) {
+    fs.unlink(file.path, cb);
+  }
+};
+
+const upload = multer({ storage: progressiveStorage });
 
 module.exports = upload;
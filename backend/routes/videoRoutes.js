@@ -1,19 +1,11 @@
 const express = require("express");
 const router = express.Router();
-const { spawnSync } = require("child_process");
 const Video = require("../models/Video");
 const upload = require("../middleware/upload");
+const { runJob, cancelJob } = require("../services/pythonWorkerPool");
 const path = require("path");
 const fs = require("fs");
 
-// Paths
-const pythonDir = path.join(__dirname, "../../python_scripts");
-const youtubeScript = path.join(pythonDir, "youtube_downloader.py");
-const thumbnailScript = path.join(pythonDir, "thumbnail_generator.py");
-const trailerScript = path.join(pythonDir, "trailer_generator.py");
-const metadataScript = path.join(pythonDir, "metadata_generator.py");
-const subtitleScript = path.join(pythonDir, "subtitle_generator.py");
-
 // Timeout configuration (in milliseconds)
 const TIMEOUTS = {
   youtube: 60000,      // 1 minute for URL extraction
@@ -23,39 +15,63 @@ const TIMEOUTS = {
   subtitles: 300000    // 5 minutes
 };
 
-// Helper function to run Python scripts synchronously
-function runPython(scriptPath, args, timeoutMs = 120000, allowRetry = true) {
-  const spawnArgs = [scriptPath].concat(args);
-  console.log(`[Python] Running: ${path.basename(scriptPath)} with ${args.length} args (timeout ${timeoutMs/1000}s)`);
+// All stages run in one pipeline job on the warm worker pool
+const PIPELINE_TIMEOUT = TIMEOUTS.thumbnail + TIMEOUTS.trailer + TIMEOUTS.metadata + TIMEOUTS.subtitles;
 
-  const res = spawnSync('python', spawnArgs, {
-    encoding: 'utf8',
-    timeout: timeoutMs,
-    maxBuffer: 1024 * 1024 * 50 // 50MB buffer
-  });
+// Each job publishes its outputs to jobs/<job_id>/ (served at /jobs)
+const BACKEND_DIR = path.join(__dirname, "..");
+const JOBS_DIR = path.join(BACKEND_DIR, "jobs");
 
-  if (res.error) {
-    console.error(`[Python Error] ${res.error.code}:`, res.error.message);
-    if (res.error.code === 'ETIMEDOUT') {
-      if (allowRetry && timeoutMs < 900000) {
-        const newTimeout = Math.min(timeoutMs * 2, 900000);
-        console.log(`[Python] Timeout after ${timeoutMs/1000}s. Retrying with ${newTimeout/1000}s...`);
-        return runPython(scriptPath, args, newTimeout, false);
-      }
-      throw new Error(`Script timeout after ${timeoutMs / 1000}s`);
-    }
-    throw res.error;
-  }
+// Transcripts of published jobs are added to this search index
+const TRANSCRIPT_INDEX_DIR = path.join(BACKEND_DIR, ".cache", "transcript_index");
+const SEARCH_TIMEOUT = 10000;
 
-  if (res.status !== 0) {
-    console.error(`[Python Exit Code ${res.status}]`);
-    if (res.stderr) console.error('stderr:', res.stderr);
-    if (res.stdout) console.error('stdout:', res.stdout);
-    throw new Error(res.stderr || `Script exited with code ${res.status}`);
-  }
+// Public path of a file under the backend directory
+const publicPath = (file) => path.relative(BACKEND_DIR, file).split(path.sep).join("/");
+
+// Most recently published job directory (job ids sort by start time), or null
+function latestJobDir() {
+  if (!fs.existsSync(JOBS_DIR)) return null;
+  const jobs = fs.readdirSync(JOBS_DIR)
+    .filter(d => !d.startsWith(".") && fs.existsSync(path.join(JOBS_DIR, d, "manifest.json")))
+    .sort();
+  return jobs.length ? path.join(JOBS_DIR, jobs[jobs.length - 1]) : null;
+}
 
-  if (res.stdout) console.log(res.stdout);
-  return res.stdout || '';
+// One pipeline job for all stages on the warm worker pool
+function runPipeline(source, proxyUrl, growing) {
+  // Outputs go to a directory of this job's own, so jobs can run side by side
+  if (!fs.existsSync(JOBS_DIR)) fs.mkdirSync(JOBS_DIR, { recursive: true });
+  return runJob("pipeline", {
+    source,
+    output_dir: JOBS_DIR,
+    cpu_budget: Number(process.env.PYTHON_JOB_CPUS || 2),
+    options: {
+      num_candidates: 20,
+      trailer_mode: "highlights",
+      // Stages cut quality to finish within this, well before the job timeout
+      time_budget: (PIPELINE_TIMEOUT / 1000) * 0.8,
+      // Analyse the low-resolution stream; thumbnails and trailer come from videoPath
+      proxy_source: proxyUrl,
+      transcript_index: TRANSCRIPT_INDEX_DIR,
+      // The upload is still being written; Python finishes when it is complete
+      growing
+    }
+  }, PIPELINE_TIMEOUT);
+}
+
+// Uploads start processing as soon as their first bytes are on disk:
+// scene detection and transcription read the file while it arrives.
+// Not when the form already carried a YouTube URL: that is what gets processed
+function startOnUpload(req, res, next) {
+  req.onUploadStart = (filePath) => {
+    if (req.body && req.body.youtubeUrl) return;
+    console.log("[Upload] Processing while the upload is still being written:", filePath);
+    req.pipelineJob = runPipeline(filePath, null, true);
+    // Awaited by the handler; a failed upload must not go unhandled meanwhile
+    req.pipelineJob.catch(() => {});
+  };
+  next();
 }
 
 // Get all videos
@@ -69,43 +85,35 @@ router.get("/", async (req, res) => {
 });
 
 // Process video
-router.post("/process", upload.single("video"), async (req, res) => {
+router.post("/process", startOnUpload, upload.single("video"), async (req, res) => {
   const { youtubeUrl } = req.body;
   let videoPath = null;
+  let proxyUrl = null;
   let tempFiles = [];
 
   console.log("=== Starting Video Processing ===");
   if (youtubeUrl) console.log("YouTube URL:", youtubeUrl);
   if (req.file) console.log("Uploaded file:", req.file.filename);
 
+  // The URL field came after the file: stop the job started on the upload
+  if (youtubeUrl && req.pipelineJob && cancelJob(req.pipelineJob.jobId)) {
+    console.log("[Upload] Cancelled the upload's job, processing the YouTube URL instead");
+  }
+
   try {
     // Step 1: Get video source
     if (youtubeUrl) {
       console.log("\n[Step 1] Extracting streaming URL from YouTube (NO DOWNLOAD)...");
       
       try {
-        const output = runPython(youtubeScript, [youtubeUrl], TIMEOUTS.youtube);
-        
-        console.log(`[Debug] Raw output length: ${output.length}`);
-        
-        // Find and extract JSON from output
-        let jsonMatch = output.match(/\{[\s\S]*\}/);
-        if (!jsonMatch) {
-          console.error("[Debug] No JSON found in output");
-          console.error("[Debug] First 500 chars:", output.substring(0, 500));
-          throw new Error("YouTube script returned invalid JSON");
-        }
-        
-        const jsonStr = jsonMatch[0];
-        console.log(`[Debug] Extracted JSON length: ${jsonStr.length}`);
-        
-        const result = JSON.parse(jsonStr);
+        const result = await runJob("resolve", { url: youtubeUrl }, TIMEOUTS.youtube);
         
         if (!result.success) {
           throw new Error(result.error || "Failed to get stream URL");
         }
         
         videoPath = result.url;
+        proxyUrl = result.proxy_url || null;
         console.log("✓ Stream URL extracted successfully");
         console.log(`  Type: ${result.type}`);
         console.log(`  Has audio: ${result.has_audio}`);
@@ -116,99 +124,62 @@ router.post("/process", upload.single("video"), async (req, res) => {
       }
     } 
     else if (req.file) {
-      videoPath = req.file.path;
+      // Absolute, since the worker pool runs from python_scripts/
+      videoPath = path.resolve(req.file.path);
       console.log("✓ Using uploaded file:", videoPath);
     } 
     else {
       return res.status(400).json({ error: "Provide YouTube URL or upload video file" });
     }
 
-    // Step 2: Generate Thumbnails
-    console.log("\n[Step 2] Generating smart thumbnails with quality filtering...");
+    // Steps 2-5: Thumbnails, trailer, subtitles and metadata in one pipeline job
+    console.log("\n[Steps 2-5] Generating thumbnails, trailer, subtitles and metadata...");
     
-    const thumbnailsDir = path.join(__dirname, "../thumbnails");
-    if (fs.existsSync(thumbnailsDir)) {
-      fs.readdirSync(thumbnailsDir).forEach(f => {
-        try { fs.unlinkSync(path.join(thumbnailsDir, f)); } catch(e) {}
-      });
+    let pipelineResult = {};
+    try {
+      // An upload's job started while it was arriving
+      pipelineResult = await ((!youtubeUrl && req.pipelineJob) || runPipeline(videoPath, proxyUrl, false));
+    } catch (e) {
+      console.log("✗ Pipeline failed:", e.message);
     }
     
-    runPython(thumbnailScript, [videoPath, thumbnailsDir, "20"], TIMEOUTS.thumbnail);
+    if (pipelineResult.job_dir) console.log(`  Job output: ${pipelineResult.job_dir}`);
     
-    const thumbnailFiles = fs.readdirSync(thumbnailsDir)
-      .filter(f => f.startsWith('thumb_') && f.endsWith('.jpg'))
-      .sort((a, b) => {
-        const numA = parseInt(a.split('_')[1]);
-        const numB = parseInt(b.split('_')[1]);
-        return numA - numB;
-      });
+    const thumbnailFiles = (pipelineResult.thumbnails || []).filter(f => fs.existsSync(f));
+    const trailerPath = pipelineResult.trailer;
+    const subtitlePath = pipelineResult.subtitles;
     
     console.log(`✓ Generated ${thumbnailFiles.length} high-quality thumbnails`);
-
-    // Step 3: Generate Highlight Trailer
-    console.log("\n[Step 3] Generating highlight trailer from best moments...");
-    
-    const trailersDir = path.join(__dirname, "../trailers");
-    if (!fs.existsSync(trailersDir)) fs.mkdirSync(trailersDir, { recursive: true });
     
-    const trailerPath = path.join(trailersDir, `trailer_${Date.now()}.mp4`);
     let trailerGenerated = false;
-    
-    try {
-      // Pass videoPath (which works for both URLs and local files)
-      runPython(trailerScript, [videoPath, trailerPath, "highlights"], TIMEOUTS.trailer);
-      
-      if (fs.existsSync(trailerPath) && fs.statSync(trailerPath).size > 10000) {
-        trailerGenerated = true;
-        const trailerSize = (fs.statSync(trailerPath).size / 1024 / 1024).toFixed(2);
-        console.log(`✓ Highlight trailer generated (${trailerSize} MB)`);
-        console.log(`  Path: ${trailerPath}`);
-      } else {
-        console.log("✗ Trailer file is empty or not created");
-      }
-    } catch (e) {
-      console.log("✗ Trailer generation failed:", e.message);
+    if (trailerPath && fs.existsSync(trailerPath) && fs.statSync(trailerPath).size > 10000) {
+      trailerGenerated = true;
+      const trailerSize = (fs.statSync(trailerPath).size / 1024 / 1024).toFixed(2);
+      console.log(`✓ Highlight trailer generated (${trailerSize} MB)`);
+      console.log(`  Path: ${trailerPath}`);
+    } else {
+      console.log("✗ Trailer file is empty or not created");
     }
-
-  // Step 4: Generate AI Subtitles with Whisper
-    console.log("\n[Step 4] Generating subtitles using Whisper AI...");
-
-    const subtitlePath = path.join(trailersDir, `subtitles_${Date.now()}.srt`);
+    
     let subtitleGenerated = false;
-
-    try {
-      runPython(subtitleScript, [videoPath, subtitlePath], TIMEOUTS.subtitles);
-      if (fs.existsSync(subtitlePath)) {
-        const subSize = fs.statSync(subtitlePath).size;
-        if (subSize > 100) { // Verify it's not empty
-          subtitleGenerated = true;
-          console.log(`✓ Subtitles generated (${subSize} bytes)`);
-          console.log(`  Path: ${subtitlePath}`);
-        } else {
-          console.log("✗ Subtitle file is empty");
-        }
+    if (subtitlePath && fs.existsSync(subtitlePath)) {
+      const subSize = fs.statSync(subtitlePath).size;
+      if (subSize > 100) { // Verify it's not empty
+        subtitleGenerated = true;
+        console.log(`✓ Subtitles generated (${subSize} bytes)`);
+        console.log(`  Path: ${subtitlePath}`);
+      } else {
+        console.log("✗ Subtitle file is empty");
       }
-    } catch (e) {
-      console.log("✗ Subtitles failed:", e.message);
     }
-
-
-    // Step 5: Generate Metadata (using transcript if available)
-    console.log("\n[Step 5] Generating AI metadata...");
-
-    let metadata = {};
-    try {
-      const args = [videoPath];
-      if (subtitleGenerated) {
-        args.push(subtitlePath);
-      }
-      const output = runPython(metadataScript, args, TIMEOUTS.metadata);
-      metadata = JSON.parse(output.trim());
+    
+    let metadata = pipelineResult.metadata;
+    if (metadata) {
       console.log("✓ Metadata generated");
       console.log(`  Title: ${metadata.title}`);
       console.log(`  Genre: ${metadata.genre}`);
-    } catch (e) {
-      console.log("✗ Metadata failed, using defaults:", e.message);
+    } else {
+      console.log("✗ Metadata failed, using defaults");
       metadata = {
         title: "AI Generated Video",
         description: "Auto-generated metadata",
@@ -217,20 +188,29 @@ router.post("/process", upload.single("video"), async (req, res) => {
         duration: 0
       };
     }
+    
+    if (pipelineResult.schedule) {
+      console.log(`  Critical path: ${pipelineResult.schedule.critical_path.join(" -> ")} (${pipelineResult.schedule.critical_path_seconds}s)`);
+    }
+    
+    const degradations = pipelineResult.degradations || [];
+    degradations.forEach(d => console.log(`  Degraded ${d.stage}: ${d.what} (${d.detail})`));
 
     // Result
     const result = {
       success: true,
       message: "Processing complete!",
-      thumbnails: thumbnailFiles.map(f => `thumbnails/${f}`),
-      trailer: trailerGenerated ? `trailers/${path.basename(trailerPath)}` : null,
-      subtitles: subtitleGenerated ? `trailers/${path.basename(subtitlePath)}` : null,
+      job_id: pipelineResult.job_id || null,
+      thumbnails: thumbnailFiles.map(publicPath),
+      trailer: trailerGenerated ? publicPath(trailerPath) : null,
+      subtitles: subtitleGenerated ? publicPath(subtitlePath) : null,
       metadata: metadata,
       stats: {
         thumbnail_count: thumbnailFiles.length,
         has_trailer: trailerGenerated,
         has_subtitles: subtitleGenerated,
-        processing_type: youtubeUrl ? "streaming" : "uploaded"
+        processing_type: youtubeUrl ? "streaming" : "uploaded",
+        degradations: degradations
       }
     };
 
@@ -253,30 +233,40 @@ router.post("/process", upload.single("video"), async (req, res) => {
   }
 });
 
-// Status endpoint
-router.get('/status', (req, res) => {
+// Search transcripts: /search?q=solar panel&limit=20
+// Hits name the job (video) and the cue timestamps to jump to
+router.get('/search', async (req, res) => {
+  const query = (req.query.q || "").trim();
+  if (!query) return res.status(400).json({ error: "Missing query parameter q" });
   try {
-    const thumbnailsDir = path.join(__dirname, '../thumbnails');
-    const trailersDir = path.join(__dirname, '../trailers');
-
-    const thumbnails = fs.existsSync(thumbnailsDir)
-      ? fs.readdirSync(thumbnailsDir).filter(f => f.startsWith('thumb_') && f.endsWith('.jpg'))
-      : [];
+    const result = await runJob("search", {
+      query,
+      limit: Math.min(Number(req.query.limit) || 20, 100),
+      index_dir: TRANSCRIPT_INDEX_DIR
+    }, SEARCH_TIMEOUT);
+    res.json(result);
+  } catch (err) {
+    console.error('[SEARCH ERROR]', err);
+    res.status(500).json({ error: err.message });
+  }
+});
 
-    const trailerFiles = fs.existsSync(trailersDir)
-      ? fs.readdirSync(trailersDir).filter(f => f.endsWith('.mp4'))
-      : [];
+// Status endpoint: outputs of the latest published job
+router.get('/status', (req, res) => {
+  try {
+    const jobDir = latestJobDir();
+    const manifest = jobDir ? JSON.parse(fs.readFileSync(path.join(jobDir, 'manifest.json'), 'utf8')) : null;
+    const files = manifest ? manifest.files.map(f => f.path) : [];
 
-    let trailer = null;
-    if (trailerFiles.length > 0) {
-      trailerFiles.sort();
-      trailer = `trailers/${trailerFiles[trailerFiles.length - 1]}`;
-    }
+    const thumbnails = files.filter(f => f.startsWith('thumbnails/thumb_') && f.endsWith('.jpg')).sort();
+    const trailerFile = files.find(f => f.endsWith('.mp4'));
+    const trailer = trailerFile ? publicPath(path.join(jobDir, trailerFile)) : null;
 
-    console.log(`[STATUS] thumbnails=${thumbnails.length}, trailer=${trailer || 'none'}`);
+    console.log(`[STATUS] job=${manifest ? manifest.job_id : 'none'}, thumbnails=${thumbnails.length}, trailer=${trailer || 'none'}`);
 
     res.json({
-      thumbnails: thumbnails.map(f => `thumbnails/${f}`),
+      job_id: manifest ? manifest.job_id : null,
+      thumbnails: thumbnails.map(f => publicPath(path.join(jobDir, f))),
       trailer: trailer
     });
   } catch (err) {
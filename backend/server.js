@@ -12,9 +12,10 @@ const path = require('path');
 app.use(cors());
 app.use(express.json());
 
-// Serve static assets (thumbnails, trailers, uploads)
+// Serve static assets (thumbnails, trailers, per-job outputs, uploads)
 app.use('/thumbnails', express.static(path.join(__dirname, 'thumbnails')));
 app.use('/trailers', express.static(path.join(__dirname, 'trailers')));
+app.use('/jobs', express.static(path.join(__dirname, 'jobs')));
 app.use('/uploads', express.static(path.join(__dirname, 'uploads')));
 
 // Disable buffering for streaming responses
@@ -30,6 +31,8 @@ mongoose
   .catch((err) => console.error(err));
 
 const PORT = process.env.PORT || 5000;
-app.listen(PORT, () =>
-  console.log(`Server running on port ${PORT}`)
-);
+app.listen(PORT, () => {
+  console.log(`Server running on port ${PORT}`);
+  // Warm Python workers before the first job arrives
+  require("./services/pythonWorkerPool").startPool();
+});
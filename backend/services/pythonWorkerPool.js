@@ -0,0 +1,110 @@
+const { spawn } = require("child_process");
+const path = require("path");
+const readline = require("readline");
+
+// Long-running python_scripts/worker_pool.py process, shared by all requests
+const pythonDir = path.join(__dirname, "../../python_scripts");
+const poolScript = path.join(pythonDir, "worker_pool.py");
+
+let poolProcess = null;
+let nextJobId = 1;
+const jobs = new Map();
+
+function startPool() {
+  if (poolProcess) return poolProcess;
+
+  const workers = String(process.env.PYTHON_WORKERS || 2);
+  console.log(`[WorkerPool] Starting ${workers} Python workers`);
+
+  poolProcess = spawn("python", [poolScript, "--workers", workers], {
+    cwd: pythonDir,
+    stdio: ["pipe", "pipe", "inherit"]
+  });
+
+  const lines = readline.createInterface({ input: poolProcess.stdout });
+  lines.on("line", (line) => {
+    let event;
+    try {
+      event = JSON.parse(line);
+    } catch (e) {
+      console.log("[WorkerPool]", line);
+      return;
+    }
+    handleEvent(event);
+  });
+
+  poolProcess.on("exit", (code) => {
+    console.error(`[WorkerPool] Exited with code ${code}`);
+    poolProcess = null;
+    for (const [id, job] of jobs) {
+      clearTimeout(job.timer);
+      job.reject(new Error("Python worker pool exited"));
+    }
+    jobs.clear();
+  });
+
+  return poolProcess;
+}
+
+function send(request) {
+  startPool().stdin.write(JSON.stringify(request) + "\n");
+}
+
+function handleEvent(event) {
+  const job = jobs.get(event.id);
+  if (!job) return;
+
+  switch (event.event) {
+    case "queued":
+    case "started":
+      console.log(`[Python] ${job.type} ${event.id} ${event.event}`);
+      break;
+    case "progress":
+      if (event.stage) console.log(`[Python] ${event.id} ${event.stage}: ${event.status}`);
+      if (job.onProgress) job.onProgress(event);
+      break;
+    case "result":
+      jobs.delete(event.id);
+      clearTimeout(job.timer);
+      job.resolve(event.result);
+      break;
+    default:
+      // error, rejected, cancelled
+      jobs.delete(event.id);
+      clearTimeout(job.timer);
+      job.reject(new Error(event.error || `Job ${event.event}`));
+  }
+}
+
+// Run a job on a warm worker without blocking the event loop.
+// The returned promise carries the job's id (promise.jobId) for cancelJob
+function runJob(type, params, timeoutMs = 120000, onProgress = null) {
+  const id = `job-${process.pid}-${nextJobId++}`;
+
+  const promise = new Promise((resolve, reject) => {
+    const timer = setTimeout(() => {
+      if (!jobs.has(id)) return;
+      jobs.delete(id);
+      send({ id, type: "cancel" });
+      reject(new Error(`Job timeout after ${timeoutMs / 1000}s`));
+    }, timeoutMs);
+
+    jobs.set(id, { type, resolve, reject, timer, onProgress });
+    send({ id, type, params });
+  });
+  promise.jobId = id;
+  return promise;
+}
+
+// Stop a queued or running job; its promise rejects. False if it already finished
+function cancelJob(id) {
+  const job = jobs.get(id);
+  if (!job) return false;
+  jobs.delete(id);
+  clearTimeout(job.timer);
+  send({ id, type: "cancel" });
+  job.reject(new Error("Job cancelled"));
+  return true;
+}
+
+module.exports = { runJob, cancelJob, startPool };
@@ -9,7 +9,8 @@ export default defineConfig({
     proxy: {
       '/api': 'http://localhost:5000',
       '/thumbnails': 'http://localhost:5000',
-      '/trailers': 'http://localhost:5000'
+      '/trailers': 'http://localhost:5000',
+      '/jobs': 'http://localhost:5000'
     }
   }
 })
\ No newline at end of file
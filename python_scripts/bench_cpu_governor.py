@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Throughput of concurrent jobs with and without a per-job CPU budget
+
+Each job runs an OpenCV pass over the video and an x264 encode of it,
+the two thread-hungry halves of a real job. Jobs run at several levels
+of concurrency, once with library defaults and once governed, each job
+budgeted to cores / concurrency threads (cpu_governor).
+
+Usage: python bench_cpu_governor.py [video] [--levels 1,2,4] [--jobs 8]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import cpu_governor
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+def make_video(path, seconds=10):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"testsrc2=size=1280x720:rate=25:duration={seconds}",
+        '-pix_fmt', 'yuv420p', path
+    ], check=True)
+
+def run_job(video_path, output_path):
+    """One synthetic job in this process, under whatever budget is applied"""
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        blurred = cv2.GaussianBlur(frame, (31, 31), 0)
+        cv2.Canny(cv2.cvtColor(blurred, cv2.COLOR_BGR2GRAY), 50, 150)
+    cap.release()
+
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-nostdin', *cpu_governor.ffmpeg_threads(), '-i', video_path,
+        *cpu_governor.ffmpeg_threads(), '-c:v', 'libx264', '-preset', 'veryfast', '-an', output_path
+    ], check=True)
+
+def run_level(video_path, concurrency, num_jobs, governed, tmp):
+    """Run num_jobs jobs, concurrency at a time, each in its own process"""
+    cpus = max(1, len(cpu_governor.available_cores()) // concurrency)
+
+    def one(i):
+        cmd = [sys.executable, os.path.abspath(__file__), '--job', video_path,
+               os.path.join(tmp, f"out_{concurrency}_{i}.mp4")]
+        if governed:
+            cmd += ['--cpus', str(cpus)]
+        started = time.perf_counter()
+        subprocess.run(cmd, check=True)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(one, range(num_jobs)))
+    wall = time.perf_counter() - started
+    return {
+        'cpus_per_job': cpus if governed else None,
+        'wall_s': wall,
+        'jobs_per_min': 60.0 * num_jobs / wall,
+        'mean_s': sum(latencies) / len(latencies),
+        'p95_s': latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('video', nargs='?', help='Input video (default: a generated 10 s 720p clip)')
+    parser.add_argument('--levels', default='1,2,4', help='Comma-separated job concurrency levels')
+    parser.add_argument('--jobs', type=int, default=8, help='Jobs per level and mode')
+    parser.add_argument('--job', nargs=2, metavar=('VIDEO', 'OUTPUT'), help=argparse.SUPPRESS)
+    parser.add_argument('--cpus', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.job:
+        if args.cpus:
+            cpu_governor.apply(args.cpus)
+        run_job(*args.job)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = args.video
+        if not video_path:
+            video_path = os.path.join(tmp, 'bench.mp4')
+            make_video(video_path)
+
+        safe_print(f"[Bench] {len(cpu_governor.available_cores())} cores, {args.jobs} jobs per run")
+        for level in [int(n) for n in args.levels.split(',')]:
+            for governed in (False, True):
+                r = run_level(video_path, level, args.jobs, governed, tmp)
+                mode = f"governed ({r['cpus_per_job']} cpus/job)" if governed else 'default'
+                safe_print(f"[Bench] concurrency {level}  {mode:24s} {r['jobs_per_min']:6.1f} jobs/min  "
+                           f"mean {r['mean_s']:6.2f}s  p95 {r['p95_s']:6.2f}s  wall {r['wall_s']:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Compare FaceEngine with full-size Haar detection: speed and agreement
+
+Usage: python bench_face_engine.py <video|--synthetic> [num_frames]
+"""
+import sys
+import time
+import random
+
+import face_engine
+from face_engine import FaceEngine
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+def draw_face(frame, cx, cy, size):
+    """Cartoon face the frontal cascade detects, about `size` pixels wide"""
+    import cv2
+    cv2.ellipse(frame, (cx, cy), (int(0.42 * size), int(0.55 * size)), 0, 0, 360, (140, 170, 220), -1)
+    for side in (-1, 1):
+        ex, ey = cx + side * int(0.18 * size), cy - int(0.12 * size)
+        cv2.ellipse(frame, (ex, ey - int(0.1 * size)), (int(0.12 * size), int(0.03 * size)), 0, 0, 360, (30, 40, 60), -1)
+        cv2.ellipse(frame, (ex, ey), (int(0.09 * size), int(0.05 * size)), 0, 0, 360, (40, 40, 40), -1)
+    cv2.ellipse(frame, (cx, cy + int(0.28 * size)), (int(0.15 * size), int(0.04 * size)), 0, 0, 360, (60, 60, 120), -1)
+    cv2.line(frame, (cx, cy - int(0.05 * size)), (cx, cy + int(0.12 * size)), (110, 130, 180), max(1, int(0.03 * size)))
+
+def synthetic_frames(num_frames=120, width=640, height=360, seed=0):
+    """Shots of a moving face, textured backgrounds and blank frames, with positions"""
+    import cv2
+    import numpy as np
+    rng = random.Random(seed)
+    noise = np.random.RandomState(seed)
+    frames, positions = [], []
+    position = 0
+    while len(frames) < num_frames:
+        kind = rng.choice(['face', 'face', 'texture', 'blank'])
+        cx, cy, size = rng.randint(160, width - 160), rng.randint(120, height - 120), rng.randint(70, 150)
+        background = noise.randint(60, 120, (height // 8, width // 8, 3)).astype(np.uint8)
+        background = cv2.resize(background, (width, height), interpolation=cv2.INTER_LINEAR)
+        for _ in range(min(12, num_frames - len(frames))):
+            if kind == 'blank':
+                frame = np.full((height, width, 3), 16, np.uint8)
+            else:
+                frame = background.copy()
+                if kind == 'face':
+                    draw_face(frame, cx, cy, size)
+                    cx, cy = cx + rng.randint(-4, 4), cy + rng.randint(-3, 3)
+            frames.append(cv2.GaussianBlur(frame, (5, 5), 0))
+            positions.append(position)
+            position += 5
+        position += 500
+    return frames, positions
+
+def frames_from_video(video_path, num_frames=120, seed=0):
+    """Sorted random positions read at 640 px, like thumbnail candidate sampling"""
+    import seek_index
+    with seek_index.open_frame_reader(video_path, max_width=640) as reader:
+        rng = random.Random(seed)
+        positions = sorted(rng.sample(range(reader.frame_count), min(num_frames, reader.frame_count)))
+        frames = [reader.read(p) for p in positions]
+    kept = [(f, p) for f, p in zip(frames, positions) if f is not None]
+    return [f for f, _ in kept], [p for _, p in kept]
+
+def _iou(a, b):
+    ax1, ay1, bx1, by1 = a[0] + a[2], a[1] + a[3], b[0] + b[2], b[1] + b[3]
+    iw = max(0, min(ax1, bx1) - max(a[0], b[0]))
+    ih = max(0, min(ay1, by1) - max(a[1], b[1]))
+    inter = iw * ih
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / float(union) if union else 0.0
+
+def baseline_detect(frame, min_neighbors=4):
+    """What score_frame_quality did before: the cascade over the whole frame"""
+    import cv2
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    found = face_engine.load_cascade().detectMultiScale(gray, 1.1, min_neighbors, minSize=(30, 30))
+    return [list(int(v) for v in box) for box in found]
+
+def compare(frames, positions, engine=None):
+    engine = engine or FaceEngine()
+    face_engine.load_cascade()
+
+    started = time.perf_counter()
+    reference = [baseline_detect(f) for f in frames]
+    baseline_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    results = [engine.detect(f, p) for f, p in zip(frames, positions)]
+    engine_seconds = time.perf_counter() - started
+
+    presence = sum(bool(r) == (res['count'] > 0) for r, res in zip(reference, results))
+    counts = sum(len(r) == res['count'] for r, res in zip(reference, results))
+    ious = [max(_iou(box, other) for other in res['boxes'])
+            for r, res in zip(reference, results) if res['boxes'] for box in r]
+    n = float(len(frames))
+    return {
+        'frames': len(frames),
+        'baseline_ms': 1000 * baseline_seconds / n,
+        'engine_ms': 1000 * engine_seconds / n,
+        'speedup': baseline_seconds / engine_seconds if engine_seconds else float('inf'),
+        'presence_agreement': presence / n,
+        'count_agreement': counts / n,
+        'mean_iou': sum(ious) / len(ious) if ious else None,
+        'stats': dict(engine.stats),
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        safe_print(__doc__.strip())
+        sys.exit(1)
+
+    num_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    if sys.argv[1] == '--synthetic':
+        frames, positions = synthetic_frames(num_frames)
+    else:
+        frames, positions = frames_from_video(sys.argv[1], num_frames)
+    report = compare(frames, positions)
+
+    safe_print(f"[Bench] {report['frames']} frames: baseline {report['baseline_ms']:.2f} ms/frame, "
+               f"engine {report['engine_ms']:.2f} ms/frame ({report['speedup']:.1f}x)")
+    iou = f"{report['mean_iou']:.2f}" if report['mean_iou'] is not None else 'n/a'
+    safe_print(f"[Bench] agreement: presence {report['presence_agreement'] * 100:.1f}%, "
+               f"count {report['count_agreement'] * 100:.1f}%, mean box IoU {iou}")
+    safe_print(f"[Bench] engine frames: {report['stats']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Compare IndexedFrameReader with OpenCV seeking: frame accuracy and latency
+
+Usage: python bench_seek_index.py <video> [num_positions] [--sorted]
+"""
+import sys
+import time
+import random
+import hashlib
+import subprocess
+
+import seek_index
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+def _digest(frame):
+    return hashlib.blake2b(frame.tobytes(), digest_size=8).hexdigest()
+
+def reference_digests_ffmpeg(video_path, width, height):
+    """Digest of every frame from one sequential ffmpeg decode"""
+    frame_bytes = width * height * 3
+    process = subprocess.Popen([
+        'ffmpeg', '-v', 'error', '-nostdin', '-i', video_path, '-an', '-sn',
+        '-vsync', 'passthrough', '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1'
+    ], stdout=subprocess.PIPE)
+    digests = []
+    while True:
+        raw = process.stdout.read(frame_bytes)
+        if len(raw) < frame_bytes:
+            break
+        digests.append(hashlib.blake2b(raw, digest_size=8).hexdigest())
+    process.wait()
+    return digests
+
+def reference_digests_capture(video_path):
+    """Digest of every frame from one sequential OpenCV read"""
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    digests = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        digests.append(_digest(frame))
+    cap.release()
+    return digests
+
+def run_reader(reader, positions, reference):
+    latencies = []
+    correct = 0
+    for pos in positions:
+        started = time.perf_counter()
+        frame = reader.read(pos)
+        latencies.append(time.perf_counter() - started)
+        if frame is not None and pos < len(reference) and _digest(frame) == reference[pos]:
+            correct += 1
+    reader.close()
+    latencies.sort()
+    return {
+        'accuracy': correct / float(len(positions)),
+        'mean_ms': 1000 * sum(latencies) / len(latencies),
+        'p95_ms': 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+        'total_s': sum(latencies),
+    }
+
+def benchmark(video_path, num_positions=50, in_order=False, seed=0):
+    started = time.perf_counter()
+    index = seek_index.load_or_build_index(video_path)
+    index_seconds = time.perf_counter() - started
+
+    frame_count = len(index['pts'])
+    rng = random.Random(seed)
+    positions = [rng.randrange(frame_count) for _ in range(num_positions)]
+    if in_order:
+        positions.sort()
+
+    indexed = run_reader(
+        seek_index.IndexedFrameReader(video_path, index=index), positions,
+        reference_digests_ffmpeg(video_path, index['width'], index['height'])
+    )
+    capture = run_reader(
+        seek_index.CaptureFrameReader(video_path), positions,
+        reference_digests_capture(video_path)
+    )
+    return {
+        'frames': frame_count,
+        'keyframes': len(index['keyframes']),
+        'index_seconds': index_seconds,
+        'indexed': indexed,
+        'capture': capture,
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        safe_print(__doc__.strip())
+        sys.exit(1)
+
+    video_path = sys.argv[1]
+    args = [a for a in sys.argv[2:] if not a.startswith('--')]
+    num_positions = int(args[0]) if args else 50
+    report = benchmark(video_path, num_positions, in_order='--sorted' in sys.argv)
+
+    safe_print(f"[Bench] {report['frames']} frames, {report['keyframes']} keyframes, "
+               f"index ready in {report['index_seconds']:.2f}s")
+    for name in ('indexed', 'capture'):
+        r = report[name]
+        safe_print(f"[Bench] {name:8s} accuracy {r['accuracy'] * 100:5.1f}%  "
+                   f"mean {r['mean_ms']:7.1f}ms  p95 {r['p95_ms']:7.1f}ms  total {r['total_s']:.2f}s")
+
+if __name__ == "__main__":
+    main()
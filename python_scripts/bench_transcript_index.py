@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Build a transcript index of synthetic transcripts and time queries
+
+Usage: python bench_transcript_index.py <index_dir> [num_transcripts] [cues_per_transcript]
+"""
+import sys
+import time
+import random
+import itertools
+
+from transcript_index import TranscriptIndex
+
+# Transcripts are added in batches of this many, one segment each
+BATCH = 1000
+
+QUERIES = ['solar', 'the', 'solar panel', '"solar panel"', '"of the"', 'sol*', 'th*', 'word123 word77', 'missingword']
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+def vocabulary(size=20000):
+    common = ['the', 'of', 'and', 'to', 'a', 'in', 'is', 'it', 'that', 'this', 'solar', 'panel', 'energy', 'video']
+    return common + [f"word{i}" for i in range(size - len(common))]
+
+def synthetic_transcript(rng, words, cum_weights, num_cues=30, words_per_cue=8):
+    """Cues of Zipf-distributed words, like the vocabulary of speech"""
+    cues = []
+    for c in range(num_cues):
+        text = ' '.join(rng.choices(words, cum_weights=cum_weights, k=words_per_cue))
+        cues.append((c * 3.0, c * 3.0 + 2.8, text))
+    return cues
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    return {q: ordered[min(len(ordered) - 1, int(q / 100.0 * len(ordered)))] for q in (50, 95, 99)}
+
+def main():
+    if len(sys.argv) < 2:
+        safe_print(__doc__.strip())
+        sys.exit(1)
+    num = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    num_cues = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+
+    rng = random.Random(0)
+    words = vocabulary()
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(words))))
+    index = TranscriptIndex(sys.argv[1])
+
+    started = time.perf_counter()
+    for first in range(0, num, BATCH):
+        batch = [(f"video-{n}", synthetic_transcript(rng, words, cum_weights, num_cues), None)
+                 for n in range(first, min(num, first + BATCH))]
+        index.add_many(batch)
+    build = time.perf_counter() - started
+    stats = index.stats()
+    safe_print(f"[Bench] indexed {num} transcripts in {build:.1f}s: {stats['segments']} segments, "
+               f"{stats['terms']} terms, {stats['bytes'] / 1e6:.1f} MB")
+
+    started = time.perf_counter()
+    index.add('video-new', synthetic_transcript(rng, words, cum_weights, num_cues))
+    safe_print(f"[Bench] one more transcript: {1000 * (time.perf_counter() - started):.1f} ms")
+
+    index.search('warm up')
+    for query in QUERIES:
+        samples, hits = [], []
+        for _ in range(20):
+            started = time.perf_counter()
+            hits = index.search(query)
+            samples.append(1000 * (time.perf_counter() - started))
+        p = percentiles(samples)
+        safe_print(f"[Bench] {query!r:20} {len(hits):3} hits  p50 {p[50]:.2f} ms  p95 {p[95]:.2f} ms")
+
+if __name__ == "__main__":
+    main()
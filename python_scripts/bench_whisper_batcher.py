@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Audio transcribed per CPU second, one window at a time vs batched across jobs
+
+Several jobs transcribe the same audio concurrently, once each through
+the model a window at a time and once through a shared BatchScheduler
+(whisper_batcher). Needs openai-whisper.
+
+Usage: python bench_whisper_batcher.py <video_or_audio> [--jobs 4] [--model tiny] [--batch 8]
+"""
+import os
+import time
+import argparse
+import threading
+
+import whisper_batcher
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+def load_audio(path, seconds):
+    import numpy as np
+    import subtitle_generator
+    chunks = subtitle_generator.stream_audio(path, whisper_batcher.WINDOW_SECONDS, growing=False)
+    samples = [s for _, s in chunks]
+    audio = np.concatenate(samples) if samples else np.zeros(0, dtype=np.float32)
+    return audio[:int(seconds * whisper_batcher.SAMPLE_RATE)]
+
+def run_jobs(num_jobs, transcribe):
+    """Wall seconds, CPU seconds and per-job latencies of num_jobs concurrent transcriptions"""
+    latencies = []
+
+    def one(i):
+        started = time.perf_counter()
+        transcribe(i)
+        latencies.append(time.perf_counter() - started)
+
+    cpu = os.times()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=one, args=(i,)) for i in range(num_jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    after = os.times()
+    return wall, (after.user - cpu.user) + (after.system - cpu.system), sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('media')
+    parser.add_argument('--jobs', type=int, default=4, help='Concurrent jobs')
+    parser.add_argument('--model', default=os.environ.get('WHISPER_MODEL', 'tiny'))
+    parser.add_argument('--seconds', type=float, default=120, help='Audio per job')
+    parser.add_argument('--batch', type=int, default=whisper_batcher.batch_size(), help='Maximum batch size')
+    args = parser.parse_args()
+
+    import subtitle_generator
+    model = whisper_batcher.BatchedWhisper(subtitle_generator.load_whisper_model(args.model))
+    audio = load_audio(args.media, args.seconds)
+    audio_seconds = args.jobs * len(audio) / float(whisper_batcher.SAMPLE_RATE)
+    lock = threading.Lock()
+
+    def one_at_a_time(i):
+        # One model shared by the jobs, each window decoded on its own
+        for _, window in whisper_batcher.windows(audio):
+            with lock:
+                model.transcribe_batch([window])
+
+    scheduler = whisper_batcher.BatchScheduler(model, max_batch=args.batch)
+    single = run_jobs(1, lambda i: scheduler.transcribe(audio, job=i))
+    modes = [('one at a time', run_jobs(args.jobs, one_at_a_time)),
+             (f"batched (<= {args.batch})", run_jobs(args.jobs, lambda i: scheduler.transcribe(audio, job=i)))]
+    scheduler.close()
+
+    safe_print(f"[Bench] {args.jobs} jobs x {len(audio) / whisper_batcher.SAMPLE_RATE:.0f}s of audio, "
+               f"Whisper '{args.model}'; one batched job alone: {single[0]:.1f}s")
+    for name, (wall, cpu, latencies) in modes:
+        safe_print(f"[Bench] {name:16s} wall {wall:6.1f}s  cpu {cpu:6.1f}s  "
+                   f"{audio_seconds / max(cpu, 1e-6):6.2f} audio s per cpu s  "
+                   f"latency mean {sum(latencies) / len(latencies):.1f}s max {latencies[-1]:.1f}s")
+    safe_print(f"[Bench] batches: {scheduler.batches}, {scheduler.windows / max(1, scheduler.batches):.1f} windows each")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Per-job CPU budget applied to every thread pool a job can start.
+
+OpenCV, torch (Whisper) and ffmpeg each size their thread pools to the
+whole machine, so a few jobs running side by side oversubscribe the
+CPUs. apply(cpus) makes all of them use cpus threads in this process:
+cv2.setNumThreads, torch intra-op threads, the OpenMP/BLAS environment
+variables (also inherited by child processes), and ffmpeg_threads() for
+the -threads option of ffmpeg commands. Until a budget is applied the
+libraries keep their own defaults.
+"""
+import os
+import sys
+import contextlib
+
+# The budget of this process; child processes inherit it
+BUDGET_ENV = 'JOB_CPUS'
+# Set to 1 to pin each pool worker to its own slice of cores
+AFFINITY_ENV = 'CPU_AFFINITY'
+
+# Read by OpenMP, BLAS and OpenCV when their thread pools start
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'OPENCV_FOR_THREADS_NUM')
+
+# Whisper runs one operator at a time; inter-op threads would only add
+# to the intra-op ones
+TORCH_INTEROP_THREADS = 1
+
+def available_cores():
+    """Cores this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def current():
+    """Threads per pool under the applied budget, None if none was applied"""
+    try:
+        return max(1, int(os.environ[BUDGET_ENV]))
+    except (KeyError, ValueError):
+        return None
+
+def worker_cores(index, num_workers, cores=None):
+    """Slice of cores for pool worker index out of num_workers
+
+    Cores are split into contiguous, disjoint slices; with more workers
+    than cores, workers share single cores round-robin.
+    """
+    cores = list(cores or available_cores())
+    num_workers = max(1, num_workers)
+    if num_workers >= len(cores):
+        return [cores[index % len(cores)]]
+    per_worker, extra = divmod(len(cores), num_workers)
+    start = index * per_worker + min(index, extra)
+    return cores[start:start + per_worker + (1 if index < extra else 0)]
+
+def pin(cores):
+    """Restrict this process (and children started later) to cores; False where unsupported"""
+    if not hasattr(os, 'sched_setaffinity'):
+        return False
+    try:
+        os.sched_setaffinity(0, cores)
+        return True
+    except OSError:
+        return False
+
+def configure_cv2():
+    """Apply the budget to OpenCV, if it is loaded"""
+    cpus = current()
+    cv2 = sys.modules.get('cv2')
+    if cpus and cv2 is not None and hasattr(cv2, 'setNumThreads'):
+        cv2.setNumThreads(cpus)
+
+def configure_torch():
+    """Apply the budget to torch, if it is loaded"""
+    cpus = current()
+    torch = sys.modules.get('torch')
+    if not cpus or torch is None or not hasattr(torch, 'set_num_threads'):
+        return
+    torch.set_num_threads(cpus)
+    try:
+        # Only allowed once, before torch runs anything in parallel
+        torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+    except RuntimeError:
+        pass
+
+def apply(cpus):
+    """Make every thread pool of this process use cpus threads; returns cpus"""
+    cpus = max(1, int(cpus))
+    os.environ[BUDGET_ENV] = str(cpus)
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(cpus)
+    configure_cv2()
+    configure_torch()
+    return cpus
+
+@contextlib.contextmanager
+def limit(cpus):
+    """Run a block under a budget of cpus threads, restoring the previous settings after"""
+    env = {name: os.environ.get(name) for name in (BUDGET_ENV,) + THREAD_ENV_VARS}
+    cv2, torch = sys.modules.get('cv2'), sys.modules.get('torch')
+    cv2_threads = cv2.getNumThreads() if hasattr(cv2, 'getNumThreads') else None
+    torch_threads = torch.get_num_threads() if hasattr(torch, 'get_num_threads') else None
+    apply(cpus)
+    try:
+        yield
+    finally:
+        for name, value in env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        if cv2_threads is not None:
+            cv2.setNumThreads(cv2_threads)
+        if torch_threads is not None:
+            torch.set_num_threads(torch_threads)
+
+def clamp(cpus):
+    """cpus, reduced to the budget already applied to this process"""
+    cpus = max(1, int(cpus or 1))
+    return min(cpus, current() or cpus)
+
+def ffmpeg_threads(share=1):
+    """-threads option for an ffmpeg command, empty without a budget
+
+    Placed before -i it limits decoding, after it encoding and filtering.
+    share: number of ffmpeg processes splitting the budget between them.
+    """
+    cpus = current()
+    return ['-threads', str(max(1, cpus // max(1, share)))] if cpus else []
+
+def init_worker(index, num_workers):
+    """Budget a pool worker to its share of the cores, pinned if CPU_AFFINITY=1
+
+    Called before any model is loaded, so torch's inter-op pool is
+    sized once, correctly. Returns the worker's share in cores.
+    """
+    cores = worker_cores(index, num_workers)
+    if os.environ.get(AFFINITY_ENV) == '1':
+        pin(cores)
+    return apply(len(cores))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import time
+
+class Budget:
+    """Wall-clock deadline for one stage, plus the degradations it caused
+
+    Stages check it as they go and trade quality for time (fewer
+    candidates, a smaller model, ...) instead of overrunning. A Budget
+    without a deadline never asks for anything to be dropped. Deadlines
+    are absolute (time.time()), so a Budget can be handed to a worker
+    process.
+    """
+
+    def __init__(self, seconds=None, deadline=None, clock=time.time):
+        self.clock = clock
+        if deadline is None and seconds is not None:
+            deadline = clock() + seconds
+        self.deadline = deadline
+        self.degradations = []
+
+    @property
+    def limited(self):
+        return self.deadline is not None
+
+    def remaining(self):
+        if self.deadline is None:
+            return float('inf')
+        return max(0.0, self.deadline - self.clock())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds, share=1.0):
+        """True if `seconds` more work fits in `share` of the remaining time"""
+        return seconds <= self.remaining() * share
+
+    def split(self, share):
+        """Child budget ending after `share` of the remaining time; degradations are shared"""
+        if self.deadline is None:
+            child = Budget(clock=self.clock)
+        else:
+            child = Budget(deadline=self.clock() + self.remaining() * share, clock=self.clock)
+        child.degradations = self.degradations
+        return child
+
+    def degrade(self, what, detail):
+        """Record a quality reduction made to stay within the budget"""
+        self.degradations.append({'what': what, 'detail': detail})
+
+class RateMeter:
+    """Seconds per unit of work, measured as the work runs"""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.units = 0
+        self.seconds = 0.0
+        self._started = None
+
+    def start(self):
+        self._started = self.clock()
+
+    def stop(self, units=1):
+        if self._started is not None:
+            self.seconds += self.clock() - self._started
+            self.units += units
+            self._started = None
+
+    def per_unit(self, default=None):
+        return self.seconds / self.units if self.units else default
+
+    def estimate(self, units, default=None):
+        """Projected seconds for `units` more, or default before any measurement"""
+        rate = self.per_unit()
+        return rate * units if rate is not None else default
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+
+# Detection runs on a copy this wide. The cascade's 24 px window then
+# finds faces from about 24 * width / DETECT_WIDTH pixels in the frame
+# (48 px at 640), which is smaller than any face that matters here.
+DETECT_WIDTH = 320
+
+# Prefilter: frames flatter than this (grey-level std) or with fewer
+# skin-tone pixels than this fraction cannot show a face
+PREFILTER_MIN_STD = 12.0
+PREFILTER_MIN_SKIN = 0.003
+
+# Tracking: a face is searched for again in its box grown by this
+# fraction of its size on every side, at 0.7x-1.4x its size
+TRACK_MARGIN = 0.5
+# Frames may be this many positions apart and still count as adjacent
+DEFAULT_TRACK_GAP = 30
+# Full detection at least every this many frames, to pick up new faces
+REDETECT_EVERY = 5
+
+_CASCADE = []
+
+def load_cascade():
+    """The frontal face cascade, loaded once per process"""
+    if not _CASCADE:
+        import cv2
+        _CASCADE.append(cv2.CascadeClassifier(cv2.data.haarcascades + CASCADE_FILE))
+    return _CASCADE[0]
+
+class FaceEngine:
+    """Face presence for a sequence of frames, cheaper than a full-size cascade
+
+    Each frame is reduced to detect_width before detection. Flat frames
+    and frames without skin tones are ruled out first. When a frame
+    follows the previous one closely (positions at most max_track_gap
+    apart), faces already found are looked for again only around their
+    last box; a full detection still runs every REDETECT_EVERY frames
+    or when a face is lost. detect() reports boxes in the pixels of the
+    frame it was given. stats counts frames by how they were handled.
+    """
+
+    def __init__(self, detect_width=DETECT_WIDTH, scale_factor=1.1, min_neighbors=4, min_size=30,
+                 max_track_gap=DEFAULT_TRACK_GAP, prefilter=True, track=True):
+        self.detect_width = detect_width
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.max_track_gap = max_track_gap
+        self.prefilter = prefilter
+        self.track = track
+        self.stats = {'frames': 0, 'prefiltered': 0, 'tracked': 0, 'detected': 0}
+        self.reset()
+
+    def reset(self):
+        """Forget tracked faces, e.g. at a scene cut"""
+        self._tracks = []
+        self._last_position = None
+        self._since_detect = 0
+
+    def detect(self, frame, position=None):
+        """Faces in a BGR or grey frame: {'count', 'boxes': [[x, y, w, h], ...], 'method'}"""
+        import cv2
+
+        self.stats['frames'] += 1
+        h, w = frame.shape[:2]
+        scale = min(1.0, self.detect_width / float(w))
+        small = frame
+        if scale < 1.0:
+            small = cv2.resize(frame, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        gray = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        adjacent = (
+            self.track and self._tracks and position is not None and self._last_position is not None
+            and 0 < position - self._last_position <= self.max_track_gap
+        )
+        self._last_position = position
+
+        if self.prefilter and not self._might_contain_face(small, gray):
+            self._tracks = []
+            self.stats['prefiltered'] += 1
+            return self._result([], scale, 'prefiltered')
+
+        if adjacent and self._since_detect < REDETECT_EVERY:
+            boxes = self._follow(gray)
+            if boxes is not None:
+                self._tracks = boxes
+                self._since_detect += 1
+                self.stats['tracked'] += 1
+                return self._result(boxes, scale, 'tracked')
+
+        boxes = self._detect(gray, (max(1, int(self.min_size * scale)),) * 2)
+        self._tracks = boxes
+        self._since_detect = 0
+        self.stats['detected'] += 1
+        return self._result(boxes, scale, 'detected')
+
+    def _might_contain_face(self, small, gray):
+        import cv2
+        import numpy as np
+
+        if float(gray.std()) < PREFILTER_MIN_STD:
+            return False
+        if small.ndim == 2:
+            return True
+        ycrcb = cv2.cvtColor(small, cv2.COLOR_BGR2YCrCb)
+        # Black-and-white footage carries no skin tone to look for
+        if float(ycrcb[:, :, 1].std()) < 2.0 and float(ycrcb[:, :, 2].std()) < 2.0:
+            return True
+        skin = cv2.inRange(ycrcb, np.array([0, 133, 77], np.uint8), np.array([255, 173, 127], np.uint8))
+        return cv2.countNonZero(skin) >= PREFILTER_MIN_SKIN * skin.size
+
+    def _detect(self, gray, min_size, max_size=None):
+        cascade = load_cascade()
+        if max_size:
+            found = cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors,
+                                             minSize=min_size, maxSize=max_size)
+        else:
+            found = cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors, minSize=min_size)
+        return [tuple(int(v) for v in box) for box in found]
+
+    def _follow(self, gray):
+        """Boxes of the tracked faces in this frame, None if any was lost"""
+        h, w = gray.shape[:2]
+        boxes = []
+        for x, y, bw, bh in self._tracks:
+            mx, my = int(bw * TRACK_MARGIN), int(bh * TRACK_MARGIN)
+            x0, y0 = max(0, x - mx), max(0, y - my)
+            x1, y1 = min(w, x + bw + mx), min(h, y + bh + my)
+            found = self._detect(gray[y0:y1, x0:x1],
+                                 (int(bw * 0.7), int(bh * 0.7)), (int(bw * 1.4) + 1, int(bh * 1.4) + 1))
+            if not found:
+                return None
+            # The candidate closest to where the face was
+            fx, fy, fw, fh = min(found, key=lambda b: abs(b[0] + x0 - x) + abs(b[1] + y0 - y))
+            boxes.append((fx + x0, fy + y0, fw, fh))
+        return boxes
+
+    def _result(self, boxes, scale, method):
+        return {
+            'count': len(boxes),
+            'boxes': [[int(round(v / scale)) for v in box] for box in boxes],
+            'method': method,
+        }
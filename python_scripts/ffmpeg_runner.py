@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""Runs ffmpeg and ffprobe processes on one asyncio loop per process.
+
+ffmpeg processes go through a limit, so callers can submit several
+encodes and only that many run at once. An explicit FFMPEG_CONCURRENCY
+holds for the whole machine: every process running ffmpeg (pool
+workers, stage processes, command-line scripts) takes one of that many
+slots, flock'd files in FFMPEG_SLOT_DIR, for each process it starts.
+Without it the limit is per process: the process's CPU budget, which
+worker_pool and the stage scheduler already divide between jobs and
+stages. ffprobe calls do not wait behind encodes; they have their own
+allowance of FFPROBE_CONCURRENCY per process. ffmpeg reports machine-readable progress
+(-progress pipe:1), parsed into events with out_time, speed and fps.
+stderr is kept only as its last STDERR_LINES lines, for error reports.
+A timeout or a cancellation stops the process: SIGTERM, then SIGKILL
+after KILL_GRACE_SECONDS. Processes stay in the caller's process group,
+so a worker pool tearing down a whole job reaches them too.
+
+Synchronous callers use run() and run_many(); asyncio code awaits
+arun() from its own loop. Each returns a result dict:
+{'returncode', 'status': 'ok' | 'failed' | 'timeout', 'stderr',
+'elapsed', 'progress' (last event), 'stdout' (with capture_stdout)}.
+"""
+import os
+import time
+import asyncio
+import threading
+import collections
+
+import cpu_governor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# ffmpeg processes running at once on the machine (default: per process, its CPU budget)
+CONCURRENCY_ENV = 'FFMPEG_CONCURRENCY'
+# Directory of the machine-wide slot files
+SLOT_DIR_ENV = 'FFMPEG_SLOT_DIR'
+# ffprobe processes running at once in this process
+PROBE_CONCURRENCY_ENV = 'FFPROBE_CONCURRENCY'
+DEFAULT_PROBE_CONCURRENCY = 4
+# Seconds between attempts to take a machine-wide slot
+SLOT_POLL_SECONDS = 0.05
+# Lines of stderr kept for error reports
+STDERR_LINES = 40
+# Seconds a process gets to exit after SIGTERM before it is killed
+KILL_GRACE_SECONDS = 2.0
+# Progress is logged at most this often per process
+PROGRESS_LOG_SECONDS = 2.0
+
+READ_CHUNK_BYTES = 65536
+
+def machine_limit():
+    """FFMPEG_CONCURRENCY when set: ffmpeg processes allowed on the whole machine"""
+    try:
+        return max(1, int(os.environ[CONCURRENCY_ENV]))
+    except (KeyError, ValueError):
+        return None
+
+def concurrency_limit():
+    """ffmpeg processes this process may run at once, read at every start"""
+    return machine_limit() or cpu_governor.current() or os.cpu_count() or 1
+
+def probe_limit():
+    try:
+        return max(1, int(os.environ[PROBE_CONCURRENCY_ENV]))
+    except (KeyError, ValueError):
+        return DEFAULT_PROBE_CONCURRENCY
+
+def is_probe(cmd):
+    return os.path.basename(cmd[0]).split('.')[0] == 'ffprobe'
+
+def slot_dir():
+    import tempfile
+    return os.environ.get(SLOT_DIR_ENV) or os.path.join(tempfile.gettempdir(), 'ai_video_ffmpeg_slots')
+
+def try_slot(count, directory=None):
+    """Open file of a free machine-wide slot, locked, or None when all count are taken
+
+    The lock goes away with the process, so a killed process never
+    keeps its slot.
+    """
+    directory = directory or slot_dir()
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        f = open(os.path.join(directory, f"slot-{i}"), 'a+b')
+        try:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return f
+        except OSError:
+            f.close()
+    return None
+
+def release_slot(f):
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        f.close()
+
+def _number(value, cast=float):
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_progress(fields, duration=None):
+    """Event from one block of -progress key=value lines"""
+    out_us = _number(fields.get('out_time_us'), int)
+    if out_us is None:
+        # Older ffmpeg: out_time_ms, despite its name, in microseconds
+        out_us = _number(fields.get('out_time_ms'), int)
+    out_time = max(0.0, out_us / 1e6) if out_us is not None else None
+    speed = fields.get('speed', '').strip().rstrip('x')
+    event = {
+        'out_time': out_time,
+        'speed': _number(speed),
+        'fps': _number(fields.get('fps')),
+        'frame': _number(fields.get('frame'), int),
+        'total_size': _number(fields.get('total_size'), int),
+        'done': fields.get('progress') == 'end',
+    }
+    if duration and out_time is not None:
+        event['fraction'] = min(1.0, out_time / float(duration))
+    return event
+
+def with_progress(cmd):
+    """cmd with ffmpeg's progress report on stdout instead of stats on stderr"""
+    if os.path.basename(cmd[0]).split('.')[0] != 'ffmpeg' or '-progress' in cmd:
+        return list(cmd)
+    return [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+
+def error_summary(result, lines=3):
+    """Last lines of a result's stderr, for a one-line error report"""
+    tail = [line for line in (result.get('stderr') or '').splitlines() if line.strip()]
+    if result.get('status') == 'timeout':
+        tail.append('timed out')
+    return ' | '.join(tail[-lines:]) or f"exit code {result.get('returncode')}"
+
+def progress_printer(print_fn, label_format="{label}", every=PROGRESS_LOG_SECONDS):
+    """on_progress callback printing at most every `every` seconds per label"""
+    last = {}
+
+    def on_progress(event):
+        now = time.time()
+        if not event['done'] and now - last.get(event.get('label'), 0.0) < every:
+            return
+        last[event.get('label')] = now
+        parts = [label_format.format(label=event.get('label'))]
+        if event['out_time'] is not None:
+            parts.append(f"{event['out_time']:.1f}s")
+        if event.get('fraction') is not None:
+            parts.append(f"({event['fraction'] * 100:.0f}%)")
+        if event['speed']:
+            parts.append(f"at {event['speed']:.2f}x")
+        if event['fps']:
+            parts.append(f"{event['fps']:.0f} fps")
+        print_fn(' '.join(parts) + (' done' if event['done'] else ''))
+
+    return on_progress
+
+async def _lines(stream, on_line):
+    """Feed each line of stream to on_line, without a per-line length limit"""
+    pending = b''
+    while True:
+        chunk = await stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            on_line(line.decode('utf-8', 'replace').rstrip('\r'))
+    if pending:
+        on_line(pending.decode('utf-8', 'replace').rstrip('\r'))
+
+async def _stop(process):
+    """SIGTERM, then SIGKILL if the process does not exit in time"""
+    if process is None or process.returncode is not None:
+        return
+    try:
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE_SECONDS)
+            return
+        except asyncio.TimeoutError:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+class FfmpegManager:
+    """Process-wide runner owning an event loop in a daemon thread"""
+
+    def __init__(self, limit=concurrency_limit):
+        self.limit = limit
+        self.running = 0
+        self.peak_running = 0
+        self.probes_running = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._slots = None
+        self._tasks = set()
+
+    def _ensure_loop(self):
+        with self._lock:
+            # A forked child inherits the object but not the loop thread
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                self._slots = None
+                self._tasks = set()
+                self.running = 0
+                self.probes_running = 0
+                threading.Thread(target=self._loop.run_forever, name='ffmpeg-runner', daemon=True).start()
+            return self._loop
+
+    async def _acquire(self, probe=False):
+        """Take a slot in this process, then one on the machine; returns the machine slot or None"""
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+        async with self._slots:
+            if probe:
+                await self._slots.wait_for(lambda: self.probes_running < probe_limit())
+                self.probes_running += 1
+                return None
+            await self._slots.wait_for(lambda: self.running < max(1, int(self.limit())))
+            self.running += 1
+            self.peak_running = max(self.peak_running, self.running)
+        try:
+            while machine_limit():
+                slot = try_slot(machine_limit())
+                if slot is not None:
+                    return slot
+                await asyncio.sleep(SLOT_POLL_SECONDS)
+        except BaseException:
+            await self._release(None, probe)
+            raise
+        return None
+
+    async def _release(self, slot, probe=False):
+        if slot is not None:
+            release_slot(slot)
+        async with self._slots:
+            if probe:
+                self.probes_running -= 1
+            else:
+                self.running -= 1
+            self._slots.notify_all()
+
+    async def run_async(self, cmd, timeout=None, on_progress=None, duration=None, label=None,
+                        capture_stdout=False):
+        """Run cmd on this manager's loop once a slot is free; see the module docstring"""
+        progress = not capture_stdout
+        if progress:
+            cmd = with_progress(cmd)
+        stderr = collections.deque(maxlen=STDERR_LINES)
+        stdout = []
+        last = {}
+        fields = {}
+
+        def on_progress_line(line):
+            key, _, value = line.partition('=')
+            fields[key.strip()] = value.strip()
+            if key.strip() != 'progress':
+                return
+            event = dict(parse_progress(fields, duration), label=label)
+            fields.clear()
+            last.update(event)
+            if on_progress:
+                try:
+                    on_progress(event)
+                except Exception:
+                    pass
+
+        async def read_stdout():
+            if progress:
+                await _lines(process.stdout, on_progress_line)
+            else:
+                stdout.append(await process.stdout.read())
+
+        probe = is_probe(cmd)
+        slot = await self._acquire(probe)
+        started = time.time()
+        process = None
+        status = 'ok'
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                await asyncio.wait_for(asyncio.gather(
+                    read_stdout(), _lines(process.stderr, stderr.append), process.wait()
+                ), timeout)
+            except asyncio.TimeoutError:
+                status = 'timeout'
+                await _stop(process)
+            except asyncio.CancelledError:
+                await _stop(process)
+                raise
+        except OSError as e:
+            stderr.append(f"{type(e).__name__}: {e}")
+        finally:
+            await self._release(slot, probe)
+
+        returncode = process.returncode if process else None
+        if status == 'ok' and returncode != 0:
+            status = 'failed'
+        result = {
+            'returncode': returncode,
+            'status': status,
+            'stderr': '\n'.join(stderr),
+            'elapsed': round(time.time() - started, 3),
+            'progress': last or None,
+        }
+        if capture_stdout:
+            result['stdout'] = b''.join(stdout).decode('utf-8', 'replace')
+        return result
+
+    async def _tracked(self, coro):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            return await coro
+        finally:
+            self._tasks.discard(task)
+
+    def submit(self, cmd, **kwargs):
+        """Start cmd; returns a concurrent.futures.Future of its result dict
+
+        Cancelling the future stops the process.
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._tracked(self.run_async(cmd, **kwargs)), loop)
+
+    def cancel_all(self, timeout=None):
+        """Stop every queued and running process, waiting for them to exit"""
+        if self._loop is None or self._pid != os.getpid():
+            return
+
+        async def cancel():
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel(), self._loop).result(timeout)
+
+    def run(self, cmd, label=None, **kwargs):
+        """Run cmd and wait for its result dict"""
+        return self.run_many([cmd], labels=[label], **kwargs)[0]
+
+    def run_many(self, cmds, labels=None, **kwargs):
+        """Run cmds concurrently (within the limit); results in the same order
+
+        labels name each command in its progress events (default: its
+        index). If the caller is interrupted, all of them are stopped.
+        """
+        labels = labels or list(range(len(cmds)))
+        futures = [self.submit(cmd, label=label, **kwargs) for cmd, label in zip(cmds, labels)]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            self._wait_stopped()
+            raise
+
+    def _wait_stopped(self, timeout=KILL_GRACE_SECONDS + 5):
+        """Wait until cancelled submissions have stopped their processes"""
+        deadline = time.time() + timeout
+        while self._tasks and time.time() < deadline:
+            time.sleep(0.02)
+
+_MANAGER = []
+_MANAGER_LOCK = threading.Lock()
+
+def manager():
+    """The FfmpegManager of this process"""
+    with _MANAGER_LOCK:
+        if not _MANAGER:
+            _MANAGER.append(FfmpegManager())
+        return _MANAGER[0]
+
+def run(cmd, **kwargs):
+    return manager().run(cmd, **kwargs)
+
+def run_many(cmds, **kwargs):
+    return manager().run_many(cmds, **kwargs)
+
+async def arun(cmd, **kwargs):
+    """Await cmd's result from any event loop; cancelling stops the process"""
+    return await asyncio.wrap_future(manager().submit(cmd, **kwargs))
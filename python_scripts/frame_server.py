@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import subprocess
+import threading
+import collections
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import growing_file
+import cpu_governor
+
+MAX_CONSUMERS = 8
+# Lines of ffmpeg's stderr kept for the error report
+STDERR_LINES = 20
+# Polling interval while waiting on the ring, doubled up to the maximum while idle
+POLL_SECONDS = 0.001
+MAX_POLL_SECONDS = 0.05
+
+# Header layout (int64 slots) at the start of the shared memory block
+H_WRITE_SEQ = 0    # frames published so far
+H_EOF = 1          # 1 once the decoder finished, 2 if it failed
+H_SLOTS = 2
+H_WIDTH = 3
+H_HEIGHT = 4
+H_CHANNELS = 5
+H_FPS_MILLI = 6
+H_CURSORS = 7      # MAX_CONSUMERS cursors: next seq each consumer needs, -1 = unused
+HEADER_LEN = H_CURSORS + MAX_CONSUMERS
+
+PIX_FMT_CHANNELS = {'gray': 1, 'bgr24': 3}
+
+def _layout(num_slots, width, height, channels):
+    header_bytes = HEADER_LEN * 8
+    meta_bytes = num_slots * 2 * 8
+    frame_bytes = width * height * channels
+    return header_bytes, meta_bytes, frame_bytes, header_bytes + meta_bytes + num_slots * frame_bytes
+
+def _views(buf, num_slots, width, height, channels):
+    header_bytes, meta_bytes, frame_bytes, _ = _layout(num_slots, width, height, channels)
+    header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=buf)
+    meta = np.ndarray((num_slots, 2), dtype=np.int64, buffer=buf, offset=header_bytes)
+    shape = (num_slots, height, width) if channels == 1 else (num_slots, height, width, channels)
+    frames = np.ndarray(shape, dtype=np.uint8, buffer=buf, offset=header_bytes + meta_bytes)
+    return header, meta, frames
+
+class FrameServer:
+    """Decode a source once with ffmpeg into a shared-memory ring of frames
+
+    Scaling, frame-rate reduction and pixel-format conversion happen in
+    ffmpeg; frames land directly in fixed-size ring slots that any
+    process can map by name. The decoder never overwrites a slot that a
+    subscribed consumer has not released, so slow consumers throttle it
+    instead of missing frames.
+    """
+
+    def __init__(self, source, width=320, height=180, fps=2.0, pix_fmt='gray', num_slots=32):
+        if pix_fmt not in PIX_FMT_CHANNELS:
+            raise ValueError(f"Unsupported pix_fmt: {pix_fmt}")
+        self.source = source
+        self.width = width
+        self.height = height
+        self.fps = float(fps)
+        self.pix_fmt = pix_fmt
+        self.channels = PIX_FMT_CHANNELS[pix_fmt]
+        self.num_slots = num_slots
+
+        _, _, self.frame_bytes, total = _layout(num_slots, width, height, self.channels)
+        self.shm = shared_memory.SharedMemory(create=True, size=total)
+        self.header, self.meta, self.frames = _views(self.shm.buf, num_slots, width, height, self.channels)
+        self.header[:] = 0
+        self.header[H_SLOTS] = num_slots
+        self.header[H_WIDTH] = width
+        self.header[H_HEIGHT] = height
+        self.header[H_CHANNELS] = self.channels
+        self.header[H_FPS_MILLI] = int(round(self.fps * 1000))
+        self.header[H_CURSORS:] = -1
+
+        self.process = None
+        self.error = None
+        self._thread = None
+        self._stderr = collections.deque(maxlen=STDERR_LINES)
+        self._stderr_thread = None
+        self._stop = threading.Event()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def subscribe(self, every=1, sample_fps=None):
+        """Register a consumer; returns a handle to pass to FrameSubscriber
+
+        every: deliver every Nth frame. sample_fps: alternative to every,
+        derived from the server frame rate. Register consumers before
+        start() to be sure they see the first frame.
+        """
+        if sample_fps:
+            every = max(1, int(round(self.fps / float(sample_fps))))
+        for i in range(MAX_CONSUMERS):
+            if self.header[H_CURSORS + i] == -1:
+                self.header[H_CURSORS + i] = self.header[H_WRITE_SEQ]
+                return {'name': self.name, 'consumer': i, 'every': max(1, int(every)),
+                        'server_pid': os.getpid()}
+        raise RuntimeError(f"Frame server supports at most {MAX_CONSUMERS} consumers")
+
+    def ffmpeg_command(self):
+        vf = f"fps={self.fps},scale={self.width}:{self.height}"
+        return [
+            'ffmpeg', '-v', 'error', '-nostdin', *cpu_governor.ffmpeg_threads(), '-i', self.source,
+            '-an', '-vf', vf, '-pix_fmt', self.pix_fmt,
+            '-f', 'rawvideo', 'pipe:1'
+        ]
+
+    def start(self, stdin=None):
+        """Start decoding in the background; stdin optionally feeds the source"""
+        self.process = subprocess.Popen(
+            self.ffmpeg_command(), stdin=stdin or subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0
+        )
+        # Drained all along: a full stderr pipe would stall ffmpeg, and with it the pump
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, name='frame-server-stderr', daemon=True)
+        self._stderr_thread.start()
+        self._thread = threading.Thread(target=self._pump, name='frame-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def _drain_stderr(self):
+        try:
+            for line in self.process.stderr:
+                self._stderr.append(line.decode('utf-8', 'replace'))
+        except (OSError, ValueError):
+            pass
+
+    def _wait_for_slot(self, seq):
+        """Block until no active consumer still needs the frame stored in seq's slot"""
+        oldest_allowed = seq - self.num_slots + 1
+        pause = POLL_SECONDS
+        while not self._stop.is_set():
+            cursors = self.header[H_CURSORS:]
+            active = cursors[cursors >= 0]
+            if not len(active) or active.min() >= oldest_allowed:
+                return True
+            time.sleep(pause)
+            pause = min(pause * 2, MAX_POLL_SECONDS)
+        return False
+
+    def _pump(self):
+        stdout = self.process.stdout
+        seq = 0
+        try:
+            while not self._stop.is_set():
+                if not self._wait_for_slot(seq):
+                    break
+                slot = seq % self.num_slots
+                view = memoryview(self.frames[slot].reshape(-1))
+                filled = 0
+                while filled < self.frame_bytes:
+                    n = stdout.readinto(view[filled:])
+                    if not n:
+                        break
+                    filled += n
+                view.release()
+                if filled < self.frame_bytes:
+                    break
+
+                self.meta[slot, 0] = seq
+                self.meta[slot, 1] = int(round(seq * 1000.0 / self.fps))
+                seq += 1
+                self.header[H_WRITE_SEQ] = seq
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            code = self.process.wait()
+            if code != 0 and not self._stop.is_set():
+                self._stderr_thread.join(5)
+                stderr = ''.join(self._stderr)
+                self.error = self.error or stderr.strip()[-500:] or f"ffmpeg exited with code {code}"
+            self.header[H_EOF] = 2 if self.error else 1
+
+    def wait(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+        return self.error is None
+
+    def close(self):
+        """Stop decoding and release the shared memory"""
+        self._stop.set()
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+        if self._thread:
+            self._thread.join(5)
+        if self.process:
+            for pipe in (self.process.stdout, self.process.stderr):
+                try:
+                    pipe.close()
+                except Exception:
+                    pass
+        del self.header, self.meta, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # a caller still holds a frame view; the mapping goes with it
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class FrameSubscriber:
+    """Read frames from a FrameServer ring, in this or another process
+
+    Iterating yields (seq, pts_seconds, frame) where frame is a view into
+    shared memory, valid until the next iteration; copy it to keep it.
+    """
+
+    def __init__(self, handle, timeout=30.0):
+        self.consumer = handle['consumer']
+        self.every = handle['every']
+        self.timeout = timeout
+        # track=False: the server owns (and unlinks) the block
+        try:
+            self.shm = shared_memory.SharedMemory(name=handle['name'], track=False)
+        except TypeError:
+            # Python < 3.13 has no track flag; keep the resource tracker from unlinking it
+            self.shm = shared_memory.SharedMemory(name=handle['name'])
+            if os.getpid() != handle.get('server_pid'):
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+        header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+        self.num_slots = int(header[H_SLOTS])
+        self.width = int(header[H_WIDTH])
+        self.height = int(header[H_HEIGHT])
+        self.channels = int(header[H_CHANNELS])
+        self.fps = header[H_FPS_MILLI] / 1000.0
+        del header
+        self.header, self.meta, self.frames = _views(
+            self.shm.buf, self.num_slots, self.width, self.height, self.channels
+        )
+
+    def _release(self, next_seq):
+        self.header[H_CURSORS + self.consumer] = next_seq
+
+    def __iter__(self):
+        cursor_index = H_CURSORS + self.consumer
+        seq = int(self.header[cursor_index])
+        deadline = None
+        pause = POLL_SECONDS
+        while True:
+            if seq >= self.header[H_WRITE_SEQ]:
+                if self.header[H_EOF]:
+                    if seq >= self.header[H_WRITE_SEQ]:
+                        break
+                    continue
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                elif now >= deadline:
+                    raise TimeoutError("No frame from frame server")
+                time.sleep(min(pause, deadline - now))
+                pause = min(pause * 2, MAX_POLL_SECONDS)
+                continue
+            deadline = None
+            pause = POLL_SECONDS
+
+            if seq % self.every == 0:
+                slot = seq % self.num_slots
+                yield seq, self.meta[slot, 1] / 1000.0, self.frames[slot]
+            seq += 1
+            self._release(seq)
+
+    def close(self):
+        """Release the ring for the producer and detach"""
+        self._release(-1)
+        del self.header, self.meta, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+
+def iter_frames(source, width=320, height=180, fps=2.0, pix_fmt='gray', growing=False):
+    """Single-consumer convenience: yield (pts_seconds, frame) from one ffmpeg decode
+
+    growing: source is still being written (see growing_file); it is
+    fed to ffmpeg as it arrives and frames keep coming until the writer
+    marks it complete.
+    """
+    server = FrameServer('pipe:0' if growing else source, width, height, fps, pix_fmt)
+    handle = server.subscribe()
+    subscriber = FrameSubscriber(handle, timeout=growing_file.DEFAULT_IDLE_TIMEOUT if growing else 30.0)
+    feeder = None
+    try:
+        server.start(stdin=subprocess.PIPE if growing else None)
+        if growing:
+            feeder = growing_file.Feeder(source, server.process.stdin)
+        for _, pts, frame in subscriber:
+            yield pts, frame
+        if feeder:
+            feeder.join()
+            if feeder.error:
+                raise feeder.error
+        if server.error:
+            raise RuntimeError(server.error)
+    finally:
+        if feeder:
+            feeder.cancel()
+        subscriber.close()
+        server.close()
+
+def ffmpeg_available():
+    from shutil import which
+    return which('ffmpeg') is not None and os.environ.get('FRAME_SERVER', '1') != '0'
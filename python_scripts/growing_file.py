@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import time
+import threading
+
+# A writer marks the end of a file by creating <path>.complete, or
+# <path>.aborted (holding the reason) if it gave up
+COMPLETE_SUFFIX = '.complete'
+ABORTED_SUFFIX = '.aborted'
+
+# How often end-of-data is rechecked
+POLL_SECONDS = 0.1
+# A writer that adds nothing for this long is presumed dead
+DEFAULT_IDLE_TIMEOUT = float(os.environ.get('INGEST_IDLE_TIMEOUT', 300))
+
+FEED_CHUNK_BYTES = 1024 * 1024
+
+class IngestAborted(IOError):
+    """The writer of a growing file marked it aborted"""
+
+def mark_complete(path):
+    open(path + COMPLETE_SUFFIX, 'w').close()
+
+def mark_aborted(path, reason=''):
+    with open(path + ABORTED_SUFFIX, 'w', encoding='utf-8') as f:
+        f.write(reason)
+
+def is_complete(path):
+    return os.path.exists(path + COMPLETE_SUFFIX)
+
+def _check_aborted(path):
+    marker = path + ABORTED_SUFFIX
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8', errors='replace') as f:
+            raise IngestAborted(f"Upload of {path} was aborted: {f.read().strip() or 'no reason given'}")
+
+def wait_until_complete(path, idle_timeout=DEFAULT_IDLE_TIMEOUT, poll=POLL_SECONDS):
+    """Block until path is marked complete; returns its final size
+
+    Raises IngestAborted if the writer aborted, TimeoutError if the file
+    stops growing for idle_timeout seconds without being completed.
+    """
+    last_size, last_change = -1, time.time()
+    while not is_complete(path):
+        _check_aborted(path)
+        size = os.path.getsize(path) if os.path.exists(path) else -1
+        if size != last_size:
+            last_size, last_change = size, time.time()
+        elif idle_timeout and time.time() - last_change > idle_timeout:
+            raise TimeoutError(f"{path} has not grown for {idle_timeout:.0f}s and is not complete")
+        time.sleep(poll)
+    return os.path.getsize(path)
+
+class GrowingFileReader(io.RawIOBase):
+    """Sequential reader of a file that is still being written
+
+    At end-of-data, reads wait for more data instead of returning EOF,
+    until the writer marks the file complete (then EOF is real) or
+    aborted (IngestAborted). A file that neither grows nor completes
+    for idle_timeout seconds raises TimeoutError. cancel() makes a
+    waiting read return EOF, for consumers that stop early.
+    """
+
+    def __init__(self, path, idle_timeout=DEFAULT_IDLE_TIMEOUT, poll=POLL_SECONDS):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.poll = poll
+        self._cancelled = threading.Event()
+        started = time.time()
+        # The writer may not have created the file yet
+        while not os.path.exists(path):
+            _check_aborted(path)
+            if idle_timeout and time.time() - started > idle_timeout:
+                raise TimeoutError(f"{path} did not appear within {idle_timeout:.0f}s")
+            time.sleep(poll)
+        self._file = open(path, 'rb', buffering=0)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        idle_since = time.time()
+        while True:
+            n = self._file.readinto(buffer)
+            if n or self._cancelled.is_set():
+                return n or 0
+            if is_complete(self.path):
+                # Data written just before the marker
+                return self._file.readinto(buffer) or 0
+            _check_aborted(self.path)
+            if self.idle_timeout and time.time() - idle_since > self.idle_timeout:
+                raise TimeoutError(f"{self.path} has not grown for {self.idle_timeout:.0f}s and is not complete")
+            self._cancelled.wait(self.poll)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+class Feeder:
+    """Thread copying a growing file into a pipe (e.g. ffmpeg's stdin)
+
+    The pipe is closed at the end of the file, so the consumer sees EOF
+    exactly when the writer is done. A consumer that quits early only
+    breaks the pipe; call cancel() to stop waiting for more data.
+    error holds what stopped the copy, if anything but a broken pipe.
+    """
+
+    def __init__(self, path, pipe, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.path = path
+        self.pipe = pipe
+        self.idle_timeout = idle_timeout
+        self.bytes_fed = 0
+        self.error = None
+        self._reader = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='growing-feeder', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._reader = GrowingFileReader(self.path, self.idle_timeout)
+            self._ready.set()
+            with self._reader:
+                while True:
+                    chunk = self._reader.read(FEED_CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    self.pipe.write(chunk)
+                    self.bytes_fed += len(chunk)
+        except (BrokenPipeError, ValueError):
+            pass  # the consumer stopped reading
+        except Exception as e:
+            self.error = e
+        finally:
+            self._ready.set()
+            try:
+                self.pipe.close()
+            except OSError:
+                pass
+
+    def cancel(self):
+        self._ready.wait(1.0)
+        if self._reader:
+            self._reader.cancel()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+def read_exactly(f, n):
+    """n bytes from f, fewer only at end of file"""
+    data = b''
+    while len(data) < n:
+        more = f.read(n - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+def is_streamable(path, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """Whether the container can be decoded front to back as it arrives
+
+    MP4/MOV qualify when their index (moov, or fragments) comes before
+    the media data: fragmented and faststart files. Matroska/WebM and
+    MPEG-TS always do. Reads only the first boxes, waiting for them.
+    """
+    with GrowingFileReader(path, idle_timeout) as f:
+        head = read_exactly(f, 8)
+        if len(head) < 8:
+            return False
+        if head[:4] == b'\x1a\x45\xdf\xa3' or head[0] == 0x47:
+            return True
+        if head[4:8] != b'ftyp':
+            return False
+        while len(head) == 8:
+            size, box = int.from_bytes(head[:4], 'big'), head[4:8]
+            if box in (b'moov', b'moof'):
+                return True
+            if box == b'mdat' or size < 8:
+                return False
+            remaining = size - 8
+            while remaining > 0:
+                skipped = f.read(min(remaining, 65536))
+                if not skipped:
+                    return False
+                remaining -= len(skipped)
+            head = read_exactly(f, 8)
+        return False
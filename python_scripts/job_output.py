@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+STAGING_DIR = '.staging'
+MANIFEST_NAME = 'manifest.json'
+
+def new_job_id():
+    """Collision-free job id that still sorts by start time"""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:12]}"
+
+def unique_name(prefix):
+    """Temp file base name no other job or process can pick"""
+    return f"{prefix}_{os.getpid()}_{uuid.uuid4().hex}"
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class JobOutput:
+    """Output directory of one job, published atomically when it finishes
+
+    The job writes into <root>/.staging/<job_id>/; publish() adds
+    manifest.json and renames it to <root>/<job_id>/, so readers see
+    either nothing or the complete output. Nothing is shared between
+    jobs, and staging is on the same filesystem as the final directory.
+    """
+
+    def __init__(self, root, job_id=None):
+        self.root = os.path.abspath(root)
+        self.job_id = job_id or new_job_id()
+        self.staging = os.path.join(self.root, STAGING_DIR, self.job_id)
+        self.final = os.path.join(self.root, self.job_id)
+        if os.path.exists(self.final):
+            raise FileExistsError(f"Job output already published: {self.final}")
+        os.makedirs(self.staging)
+        self.created_at = time.time()
+
+    @property
+    def dir(self):
+        """Where the job writes until it is published"""
+        return self.staging
+
+    def final_path(self, path):
+        """Published location of a path inside the staging directory"""
+        if isinstance(path, str) and os.path.abspath(path).startswith(self.staging + os.sep):
+            return os.path.join(self.final, os.path.relpath(path, self.staging))
+        return path
+
+    def manifest(self, document=None):
+        files = []
+        for dirpath, _, names in os.walk(self.staging):
+            for name in sorted(names):
+                path = os.path.join(dirpath, name)
+                files.append({
+                    'path': os.path.relpath(path, self.staging).replace(os.sep, '/'),
+                    'size': os.path.getsize(path),
+                    'sha256': _sha256(path),
+                })
+        files.sort(key=lambda f: f['path'])
+        document = document or {}
+        return {
+            'job_id': self.job_id,
+            'source': document.get('source'),
+            'success': document.get('success'),
+            'created_at': self.created_at,
+            'published_at': time.time(),
+            'stages': {name: s.get('success') for name, s in document.get('stages', {}).items()},
+            'degradations': document.get('degradations', []),
+            'files': files,
+        }
+
+    def publish(self, document=None):
+        """Write the manifest and move the output into place; returns the manifest"""
+        manifest = self.manifest(document)
+        path = os.path.join(self.staging, MANIFEST_NAME)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.rename(self.staging, self.final)
+        return manifest
+
+    def discard(self):
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+def read_manifest(job_dir):
+    """Manifest of a published job directory, None if it is not one"""
+    try:
+        with open(os.path.join(job_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,616 @@
+# -*- coding: utf-8 -*-
+"""End-to-end load test of the worker pool, with local stand-ins for YouTube
+
+Generates test videos and serves them from a local HTTP server (Range
+requests, optional bandwidth cap), then sends jobs through a WorkerPool
+the way the backend does. URL jobs resolve a fake YouTube URL with a
+stub extractor (no yt-dlp, no network) and run the pipeline on the
+resolved stream. Upload jobs write the video into an upload directory
+while the pipeline already runs on it. Jobs arrive as a Poisson process
+at --rate per minute, with a mix of kinds and video durations.
+
+Reports throughput, job latency percentiles, time queued for a worker,
+time each stage waited for cpus once runnable, and CPU, memory and pool
+saturation.
+
+Usage: python load_harness.py [--jobs 20] [--rate 6] [--mix url=1,upload=1]
+       [--durations 15,60] [--workers 2] [--cpu-budget 2] [--report out.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# Base URL of the media server, inherited by the pool's workers
+MEDIA_URL_ENV = 'LOAD_HARNESS_MEDIA_URL'
+FAKE_URL_PREFIX = 'https://www.youtube.com/watch?v='
+
+# Resource usage is sampled this often
+SAMPLE_SECONDS = 1.0
+
+COPY_CHUNK_BYTES = 256 * 1024
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+def video_name(seconds):
+    return f"clip_{seconds:g}s"
+
+def make_video(path, seconds, size):
+    """Test pattern with a tone, index up front so it streams over HTTP"""
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=25:duration={seconds}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:duration={seconds}",
+        '-shortest', '-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-preset', 'veryfast',
+        '-c:a', 'aac', '-movflags', '+faststart', path
+    ], check=True)
+
+def proxy_size(size):
+    """Half the resolution, at most youtube_downloader's proxy height"""
+    width, height = (int(v) for v in size.split('x'))
+    proxy_height = min(360, height // 4 * 2)
+    return f"{width * proxy_height // height // 2 * 2}x{proxy_height}"
+
+def make_library(root, durations, size='1280x720'):
+    """Videos of each duration, a low-resolution proxy of each, and an info sidecar
+
+    Existing files are reused. Returns {name: info}.
+    """
+    os.makedirs(root, exist_ok=True)
+    proxy = proxy_size(size)
+    library = {}
+    for seconds in durations:
+        name = video_name(seconds)
+        info_path = os.path.join(root, f"{name}.json")
+        if not os.path.exists(info_path):
+            safe_print(f"[Load] Generating {name} ({size}, proxy {proxy})")
+            make_video(os.path.join(root, f"{name}.mp4"), seconds, size)
+            make_video(os.path.join(root, f"{name}_proxy.mp4"), seconds, proxy)
+            width, height = (int(v) for v in size.split('x'))
+            proxy_width, proxy_height = (int(v) for v in proxy.split('x'))
+            info = {'id': name, 'title': f"Load test clip, {seconds:g} s", 'duration': seconds,
+                    'width': width, 'height': height, 'proxy_width': proxy_width, 'proxy_height': proxy_height}
+            with open(info_path, 'w', encoding='utf-8') as f:
+                json.dump(info, f)
+        with open(info_path, encoding='utf-8') as f:
+            library[name] = json.load(f)
+    return library
+
+def parse_range(header, size):
+    """(first, last) byte of a single 'bytes=' range, None for the whole file
+
+    Raises ValueError when the range cannot be satisfied.
+    """
+    match = re.match(r'bytes=(\d*)-(\d*)$', (header or '').strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        # Suffix range: the last n bytes
+        length = int(match.group(2))
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    first = int(match.group(1))
+    last = int(match.group(2)) if match.group(2) else size - 1
+    if first >= size or last < first:
+        raise ValueError(header)
+    return first, min(last, size - 1)
+
+class MediaServer:
+    """Serves a directory over HTTP on localhost, like a video CDN
+
+    Supports HEAD and single Range requests; bandwidth (bytes/s) caps
+    each response. Counts requests and bytes sent.
+    """
+
+    def __init__(self, root, bandwidth=None):
+        from http.server import ThreadingHTTPServer
+        self.root = os.path.abspath(root)
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='media-server', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _count(self, sent):
+        with self._lock:
+            self.bytes_sent += sent
+
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self._serve(body=False)
+
+            def do_GET(self):
+                self._serve(body=True)
+
+            def _serve(self, body):
+                with server._lock:
+                    server.requests += 1
+                name = os.path.basename(self.path.split('?')[0])
+                path = os.path.join(server.root, name)
+                if not name or not os.path.isfile(path):
+                    self.send_error(404)
+                    return
+                size = os.path.getsize(path)
+                try:
+                    byte_range = parse_range(self.headers.get('Range'), size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header('Content-Range', f"bytes */{size}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                first, last = byte_range or (0, size - 1)
+                self.send_response(206 if byte_range else 200)
+                self.send_header('Content-Type', 'application/json' if name.endswith('.json') else 'video/mp4')
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Length', str(last - first + 1))
+                if byte_range:
+                    self.send_header('Content-Range', f"bytes {first}-{last}/{size}")
+                self.end_headers()
+                if body:
+                    self._send_file(path, first, last - first + 1)
+
+            def _send_file(self, path, offset, length):
+                started = time.time()
+                sent = 0
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    try:
+                        while sent < length:
+                            chunk = f.read(min(COPY_CHUNK_BYTES, length - sent))
+                            if not chunk:
+                                break
+                            self.wfile.write(chunk)
+                            sent += len(chunk)
+                            if server.bandwidth:
+                                ahead = sent / float(server.bandwidth) - (time.time() - started)
+                                if ahead > 0:
+                                    time.sleep(ahead)
+                    except (BrokenPipeError, ConnectionResetError):
+                        # ffmpeg closes connections it no longer needs
+                        self.close_connection = True
+                server._count(sent)
+
+        return Handler
+
+def media_url():
+    url = os.environ.get(MEDIA_URL_ENV)
+    if not url:
+        raise Exception(f"{MEDIA_URL_ENV} is not set")
+    return url
+
+def stub_extract(url):
+    """Stands in for youtube_downloader.ytdlp_extract: fake YouTube URL -> info dict on the media server"""
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    match = re.search(r'[?&]v=([\w.-]+)', url)
+    if not match:
+        raise Exception(f"Unsupported URL: {url}")
+    base = media_url()
+    try:
+        with urlopen(f"{base}/{match.group(1)}.json", timeout=30) as response:
+            info = json.load(response)
+    except HTTPError as e:
+        if e.code == 404:
+            raise Exception('Video unavailable')
+        raise
+
+    # Signed like a real stream URL, valid for an hour
+    expire = int(time.time()) + 3600
+    stream = {'url': f"{base}/{info['id']}.mp4?expire={expire}", 'ext': 'mp4', 'format_id': '22',
+              'width': info['width'], 'height': info['height'], 'vcodec': 'avc1', 'acodec': 'mp4a'}
+    proxy = {'url': f"{base}/{info['id']}_proxy.mp4?expire={expire}", 'ext': 'mp4', 'format_id': '18',
+             'width': info['proxy_width'], 'height': info['proxy_height'], 'vcodec': 'avc1', 'acodec': 'mp4a'}
+    return dict(stream, id=info['id'], title=info['title'], duration=info['duration'], formats=[proxy, stream])
+
+def fetch(url, temp_dir, format_spec=None, max_bytes=None):
+    """Stands in for thumbnail_generator.download_streaming_video: a plain HTTP download"""
+    from urllib.request import urlopen
+    from job_output import unique_name
+    path = os.path.join(temp_dir, unique_name('video') + '.mp4')
+    written = 0
+    with urlopen(url, timeout=30) as response, open(path, 'wb') as out:
+        while True:
+            chunk = response.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                break
+            written += len(chunk)
+            if max_bytes is not None and written > max_bytes:
+                raise Exception(f"File is larger than max-filesize ({max_bytes} bytes)")
+            out.write(chunk)
+    return path
+
+def handle_resolve(params, progress):
+    import youtube_downloader
+    return youtube_downloader.get_video_stream_urls(params['url'], extractor=stub_extract, cache=False)
+
+def handle_pipeline(params, progress):
+    import worker_pool
+    import thumbnail_generator
+    thumbnail_generator.download_streaming_video = fetch
+    return worker_pool.handle_pipeline(params, progress)
+
+HANDLERS = {'resolve': handle_resolve, 'pipeline': handle_pipeline}
+
+def upload(source, dest, bytes_per_second=None):
+    """Write source to dest in chunks like the upload middleware, then mark it complete"""
+    import growing_file
+    started = time.time()
+    written = 0
+    with open(source, 'rb') as f, open(dest, 'wb') as out:
+        while True:
+            chunk = f.read(COPY_CHUNK_BYTES)
+            if not chunk:
+                break
+            out.write(chunk)
+            out.flush()
+            written += len(chunk)
+            if bytes_per_second:
+                ahead = written / float(bytes_per_second) - (time.time() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+    growing_file.mark_complete(dest)
+
+def parse_weights(text, cast=str):
+    """'url=3,upload=1' or '15,60' -> [(value, weight)]"""
+    weights = []
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        value, _, weight = item.partition('=')
+        weights.append((cast(value.strip()), float(weight) if weight else 1.0))
+    return weights
+
+def choose(rng, weights):
+    return rng.choices([v for v, _ in weights], [w for _, w in weights])[0]
+
+def arrival_times(num_jobs, rate_per_minute, rng):
+    """Seconds from the start at which each job arrives (Poisson process)"""
+    times = []
+    now = 0.0
+    for _ in range(num_jobs):
+        times.append(now)
+        now += rng.expovariate(rate_per_minute / 60.0)
+    return times
+
+def percentile(values, q):
+    """q-th percentile (0-100) by linear interpolation, None for no values"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+def distribution(values):
+    values = [v for v in values if v is not None]
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+def _cpu_times():
+    """(busy, total) jiffies of all cores, None without /proc"""
+    try:
+        with open('/proc/stat') as f:
+            fields = [int(v) for v in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return sum(fields) - idle, sum(fields)
+
+def _mem_available_mb():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError):
+        pass
+    return None
+
+class ResourceSampler(threading.Thread):
+    """Samples machine CPU, load, free memory and pool occupancy every SAMPLE_SECONDS"""
+
+    def __init__(self, pool, interval=SAMPLE_SECONDS):
+        super().__init__(name='resource-sampler', daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        last = _cpu_times()
+        while not self._done.wait(self.interval):
+            now = _cpu_times()
+            busy = None
+            if last and now and now[1] > last[1]:
+                busy = (now[0] - last[0]) / float(now[1] - last[1])
+            last = now
+            self.samples.append({
+                'cpu_busy': busy,
+                'load_per_core': os.getloadavg()[0] / (os.cpu_count() or 1) if hasattr(os, 'getloadavg') else None,
+                'mem_available_mb': _mem_available_mb(),
+                'workers_busy': len(self.pool.running_jobs()) / float(self.pool.num_workers),
+                'queued': self.pool.pending_count(),
+            })
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def summary(self):
+        def series(key):
+            return [s[key] for s in self.samples if s[key] is not None]
+
+        cpu, workers, queued = series('cpu_busy'), series('workers_busy'), series('queued')
+        memory, load = series('mem_available_mb'), series('load_per_core')
+        return {
+            'samples': len(self.samples),
+            'cpu_busy_mean': sum(cpu) / len(cpu) if cpu else None,
+            'cpu_busy_p95': percentile(cpu, 95),
+            'load_per_core_max': max(load) if load else None,
+            'mem_available_min_mb': min(memory) if memory else None,
+            'workers_busy_mean': sum(workers) / len(workers) if workers else None,
+            'queued_mean': sum(queued) / len(queued) if queued else None,
+            'queued_max': max(queued) if queued else None,
+            # Share of the run with jobs waiting for a worker
+            'queue_nonempty': sum(1 for q in queued if q) / float(len(queued)) if queued else None,
+        }
+
+def call(pool, job_type, params, job_id):
+    """Submit one pool job and wait for it; returns (result, error, seconds queued for a worker)"""
+    done = threading.Event()
+    events = {}
+
+    def emit(event):
+        events.setdefault(event['event'], time.time())
+        if event['event'] in ('result', 'error', 'cancelled', 'rejected'):
+            events['final'] = event
+            done.set()
+
+    pool.submit({'id': job_id, 'type': job_type, 'params': params}, emit=emit)
+    done.wait()
+    final = events['final']
+    waited = events.get('started', events.get('queued', 0)) - events.get('queued', 0)
+    if final['event'] != 'result':
+        return None, final.get('error') or final['event'], waited
+    return final['result'], None, waited
+
+def run_job(pool, spec, workdir, options):
+    """Run one arrival end to end; returns its record"""
+    record = dict(spec, success=False, error=None, pool_wait=0.0, stages={})
+    job_id = f"load-{spec['index']}"
+    params = {
+        'output_dir': os.path.join(workdir, 'output'),
+        'stages': options['stages'],
+        'cpu_budget': options['cpu_budget'],
+        'options': {'use_cache': False, 'job_id': job_id},
+    }
+    name = video_name(spec['duration'])
+
+    if spec['kind'] == 'url':
+        resolved, error, waited = call(pool, 'resolve', {'url': FAKE_URL_PREFIX + name}, f"{job_id}-resolve")
+        record['pool_wait'] += waited
+        if error or not resolved.get('success'):
+            record['error'] = error or resolved.get('error')
+            return record
+        params['source'] = resolved['url']
+        params['options']['proxy_source'] = resolved.get('proxy_url')
+    else:
+        dest = os.path.join(workdir, 'uploads', f"{job_id}.mp4")
+        writer = threading.Thread(target=upload, args=(os.path.join(options['library'], f"{name}.mp4"), dest,
+                                                       options['upload_bandwidth']), daemon=True)
+        writer.start()
+        params['source'] = dest
+        params['options']['growing'] = True
+
+    document, error, waited = call(pool, 'pipeline', params, job_id)
+    record['pool_wait'] += waited
+    if error:
+        record['error'] = error
+        return record
+    record['success'] = bool(document.get('success'))
+    record['error'] = document.get('error')
+    record['stages'] = {
+        stage: {'elapsed': s.get('elapsed'), 'waited': s.get('waited'), 'success': s.get('success')}
+        for stage, s in (document.get('stages') or {}).items()
+    }
+    if document.get('job_dir') and not options['keep_output']:
+        shutil.rmtree(document['job_dir'], ignore_errors=True)
+    return record
+
+def run_load(pool, specs, workdir, options):
+    """Start each spec at its arrival time; returns (records, wall seconds)"""
+    os.makedirs(os.path.join(workdir, 'uploads'), exist_ok=True)
+    records = [None] * len(specs)
+    threads = []
+    started = time.time()
+
+    def one(i, spec):
+        arrived = time.time()
+        record = run_job(pool, spec, workdir, options)
+        record['latency'] = time.time() - arrived
+        records[i] = record
+        status = 'ok' if record['success'] else f"failed: {record['error']}"
+        safe_print(f"[Load] Job {spec['index']} ({spec['kind']}, {spec['duration']:g}s) "
+                   f"{record['latency']:.1f}s, {status}")
+
+    for i, spec in enumerate(specs):
+        delay = started + spec['arrival'] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        thread = threading.Thread(target=one, args=(i, spec), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return records, time.time() - started
+
+def summarize(records, wall, resources):
+    """Report dict: throughput, latency by kind, pool wait, per-stage timings, saturation"""
+    ok = [r for r in records if r['success']]
+    stages = sorted({name for r in records for name in r['stages']})
+    return {
+        'jobs': len(records),
+        'succeeded': len(ok),
+        'failed': len(records) - len(ok),
+        'errors': sorted({str(r['error']) for r in records if not r['success']}),
+        'wall_seconds': wall,
+        'jobs_per_minute': 60.0 * len(ok) / wall if wall else None,
+        # Minutes of video finished per minute of wall time
+        'video_realtime_factor': sum(r['duration'] for r in ok) / wall if wall else None,
+        'latency': distribution([r['latency'] for r in ok]),
+        'latency_by_kind': {kind: distribution([r['latency'] for r in ok if r['kind'] == kind])
+                            for kind in sorted({r['kind'] for r in records})},
+        'pool_wait': distribution([r['pool_wait'] for r in records]),
+        'stages': {
+            name: {
+                'elapsed': distribution([r['stages'][name]['elapsed'] for r in records if name in r['stages']]),
+                'waited': distribution([r['stages'][name]['waited'] for r in records if name in r['stages']]),
+                'failed': sum(1 for r in records if name in r['stages'] and not r['stages'][name]['success']),
+            }
+            for name in stages
+        },
+        'resources': resources,
+    }
+
+def _seconds(value):
+    return '     -' if value is None else f"{value:6.1f}"
+
+def print_report(report):
+    safe_print(f"[Load] {report['succeeded']}/{report['jobs']} jobs in {report['wall_seconds']:.0f}s: "
+               f"{report['jobs_per_minute']:.2f} jobs/min, {report['video_realtime_factor']:.2f}x realtime")
+    for error in report['errors']:
+        safe_print(f"[Load]   error: {error}")
+
+    safe_print(f"[Load] {'seconds':28s}   mean    p50    p95    p99    max")
+    rows = [('job latency', report['latency'])]
+    rows += [(f"  {kind}", d) for kind, d in report['latency_by_kind'].items()]
+    rows.append(('queued for a worker', report['pool_wait']))
+    for name, stage in report['stages'].items():
+        rows.append((f"{name} running", stage['elapsed']))
+        rows.append((f"{name} waiting for cpus", stage['waited']))
+    for label, d in rows:
+        safe_print(f"[Load] {label:28s} {_seconds(d['mean'])} {_seconds(d['p50'])} {_seconds(d['p95'])} "
+                   f"{_seconds(d['p99'])} {_seconds(d['max'])}")
+
+    r = report['resources']
+    percent = lambda v: '-' if v is None else f"{100 * v:.0f}%"
+    safe_print(f"[Load] cpu busy {percent(r['cpu_busy_mean'])} mean, {percent(r['cpu_busy_p95'])} p95; "
+               f"workers busy {percent(r['workers_busy_mean'])}; jobs waiting for a worker "
+               f"{percent(r['queue_nonempty'])} of the time (max {r['queued_max']}); "
+               f"min free memory {r['mem_available_min_mb'] or 0:.0f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=20, help='Jobs to run')
+    parser.add_argument('--rate', type=float, default=6.0, help='Mean arrivals per minute (Poisson)')
+    parser.add_argument('--mix', default='url=1,upload=1', help='Job kinds and weights')
+    parser.add_argument('--durations', default='15,60', help='Video seconds, optionally weighted (15=3,60=1)')
+    parser.add_argument('--stages', default=None, help='Comma-separated pipeline stages (default: all)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=8)
+    parser.add_argument('--cpu-budget', type=int, default=2, help='cpu_budget of each pipeline job')
+    parser.add_argument('--size', default='1280x720', help='Resolution of the generated videos')
+    parser.add_argument('--bandwidth', type=float, help='Media server MB/s per connection (default: unlimited)')
+    parser.add_argument('--upload-bandwidth', type=float, help='Upload MB/s (default: unlimited)')
+    parser.add_argument('--library', help='Directory for the generated videos, kept for later runs')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-warmup', action='store_true', help='Skip preloading models in the workers')
+    parser.add_argument('--keep-output', action='store_true', help='Keep each job\'s output directory')
+    parser.add_argument('--report', help='Also write the report as JSON to this file')
+    args = parser.parse_args()
+
+    import worker_pool
+    rng = random.Random(args.seed)
+    mix = parse_weights(args.mix)
+    durations = parse_weights(args.durations, float)
+    unknown = [kind for kind, _ in mix if kind not in ('url', 'upload')]
+    if unknown:
+        parser.error(f"unknown job kinds: {', '.join(unknown)}")
+
+    specs = [{'index': i, 'arrival': at, 'kind': choose(rng, mix), 'duration': choose(rng, durations)}
+             for i, at in enumerate(arrival_times(args.jobs, args.rate, rng))]
+
+    with tempfile.TemporaryDirectory(prefix='load_harness_') as workdir:
+        library_dir = args.library or os.path.join(workdir, 'library')
+        make_library(library_dir, sorted({d for d, _ in durations}), args.size)
+        server = MediaServer(library_dir, args.bandwidth * 1e6 if args.bandwidth else None).start()
+        os.environ[MEDIA_URL_ENV] = server.url
+
+        batcher = worker_pool.start_whisper_batcher(args.workers)
+        pool = worker_pool.WorkerPool(args.workers, args.max_pending, handlers=HANDLERS,
+                                      warmup=None if args.no_warmup else worker_pool.warm_up)
+        try:
+            while not all(w.ready for w in pool.workers):
+                time.sleep(0.2)
+            safe_print(f"[Load] {args.workers} workers ready; {args.jobs} jobs at {args.rate:g}/min, "
+                       f"media at {server.url}")
+
+            sampler = ResourceSampler(pool)
+            sampler.start()
+            options = {
+                'stages': [s.strip() for s in args.stages.split(',')] if args.stages else None,
+                'cpu_budget': args.cpu_budget,
+                'library': library_dir,
+                'upload_bandwidth': args.upload_bandwidth * 1e6 if args.upload_bandwidth else None,
+                'keep_output': args.keep_output,
+            }
+            records, wall = run_load(pool, specs, workdir, options)
+            sampler.stop()
+        finally:
+            pool.close(drain=False)
+            server.close()
+            if batcher:
+                import whisper_batcher
+                whisper_batcher.stop_server(batcher)
+
+        report = summarize(records, wall, sampler.summary())
+        report['media_server'] = {'requests': server.requests, 'bytes_sent': server.bytes_sent}
+        report['config'] = vars(args)
+        print_report(report)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(dict(report, records=records), f, indent=2)
+    return 0 if report['failed'] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
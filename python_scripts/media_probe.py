@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import hashlib
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', '.cache', 'probe')
+
+# Remote probes are trusted this long; local ones until the file changes
+URL_TTL_SECONDS = 3600
+
+# In-process memo on top of the disk cache
+_MEMO = {}
+
+def parse_rate(rate):
+    """Convert an ffprobe rate string like '30000/1001' to float"""
+    try:
+        if '/' in str(rate):
+            num, den = str(rate).split('/', 1)
+            den = float(den)
+            return float(num) / den if den else 0.0
+        return float(rate)
+    except (TypeError, ValueError):
+        return 0.0
+
+def summarize_probe(data):
+    """Reduce raw ffprobe JSON to the fields the processing scripts need"""
+    streams = data.get('streams', []) or []
+    fmt = data.get('format', {}) or {}
+
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+
+    duration = parse_rate(fmt.get('duration'))
+    if duration <= 0 and video:
+        duration = parse_rate(video.get('duration'))
+
+    fps = 0.0
+    frame_count = 0
+    width = height = 0
+    if video:
+        fps = parse_rate(video.get('avg_frame_rate')) or parse_rate(video.get('r_frame_rate'))
+        try:
+            frame_count = int(video.get('nb_frames') or 0)
+        except (TypeError, ValueError):
+            frame_count = 0
+        if frame_count <= 0 and duration > 0 and fps > 0:
+            frame_count = int(round(duration * fps))
+        width = int(video.get('width') or 0)
+        height = int(video.get('height') or 0)
+
+    return {
+        'duration': duration,
+        'fps': fps,
+        'frame_count': frame_count,
+        'width': width,
+        'height': height,
+        'has_video': video is not None,
+        'has_audio': audio is not None,
+        'streams': [
+            {
+                'index': s.get('index'),
+                'codec_type': s.get('codec_type'),
+                'codec_name': s.get('codec_name'),
+            }
+            for s in streams
+        ],
+    }
+
+def _is_url(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+def cache_key(source):
+    """Key a local file by path, size and mtime; a URL by the URL itself"""
+    if _is_url(source):
+        ident = f"url:{source}"
+    else:
+        stat = os.stat(source)
+        ident = f"file:{os.path.abspath(source)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.blake2b(ident.encode('utf-8'), digest_size=16).hexdigest()
+
+def _cache_dir():
+    return os.path.abspath(os.environ.get('PROBE_CACHE_DIR') or DEFAULT_CACHE_DIR)
+
+def _url_ttl():
+    try:
+        return float(os.environ.get('PROBE_URL_TTL', URL_TTL_SECONDS))
+    except ValueError:
+        return URL_TTL_SECONDS
+
+def _fresh(source, entry):
+    return not _is_url(source) or time.time() - entry.get('stored_at', 0) < _url_ttl()
+
+def _load_cached(source, key):
+    entry = _MEMO.get(key)
+    if entry and _fresh(source, entry):
+        return entry['probe']
+    try:
+        with open(os.path.join(_cache_dir(), key + '.json'), 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not _fresh(source, entry):
+        return None
+    _MEMO[key] = entry
+    return entry['probe']
+
+def _store_cached(key, probe):
+    entry = {'probe': probe, 'stored_at': time.time()}
+    _MEMO[key] = entry
+    cache_dir = _cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(cache_dir, key + '.json')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def run_ffprobe(source, timeout=30):
+    """Probe a file or URL with one ffprobe JSON call, returns None on failure"""
+    cmd = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_format', '-show_streams', source
+    ]
+    try:
+        import ffmpeg_runner
+        result = ffmpeg_runner.run(cmd, timeout=timeout, capture_stdout=True)
+        if result['status'] != 'ok':
+            return None
+        return summarize_probe(json.loads(result['stdout']))
+    except Exception:
+        return None
+
+def probe_media(source, timeout=30, use_cache=True):
+    """Probe summary for a file or URL, memoized in-process and on disk
+
+    Local files are keyed by path, size and mtime; URLs by the URL and
+    expire after PROBE_URL_TTL seconds. Failed probes are not cached.
+    Returns None on failure.
+    """
+    try:
+        key = cache_key(source)
+    except OSError:
+        return None
+
+    if use_cache:
+        probe = _load_cached(source, key)
+        import metrics
+        metrics.inc('probe_cache_lookups', result='hit' if probe is not None else 'miss')
+        if probe is not None:
+            return probe
+
+    probe = run_ffprobe(source, timeout)
+    if probe is not None:
+        _store_cached(key, probe)
+    return probe
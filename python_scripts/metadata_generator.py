@@ -1,19 +1,27 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import re
 import json
 import random
 
+import seek_index
+import video_stats
+from deadline import Budget, RateMeter
+from face_engine import FaceEngine
+from media_probe import probe_media
+
 sys.stdout.reconfigure(encoding='utf-8')
 os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-# Load environment variables from backend/.env
-try:
-    from dotenv import load_dotenv
-    backend_env = os.path.join(os.path.dirname(__file__), '..', 'backend', '.env')
-    load_dotenv(backend_env)
-except ImportError:
-    pass  # dotenv not available, continue
+def load_backend_env():
+    """Load environment variables from backend/.env (deferred until main runs)"""
+    try:
+        from dotenv import load_dotenv
+        backend_env = os.path.join(os.path.dirname(__file__), '..', 'backend', '.env')
+        load_dotenv(backend_env)
+    except ImportError:
+        pass  # dotenv not available, continue
 
 def safe_print(text):
     """Print to stderr to avoid interfering with JSON output"""
@@ -23,6 +31,33 @@ def safe_print(text):
     except:
         pass
 
+# Words: runs of letters or digits, with inner apostrophes ("don't")
+_WORD = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+_SRT_TIME = re.compile(r'(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)')
+
+def tokenize(text):
+    """Lower-case words of a text, as used for tags and transcript search"""
+    return _WORD.findall(text.lower())
+
+def read_cues(transcript_path):
+    """Cues of an SRT file as (start_seconds, end_seconds, text)"""
+    with open(transcript_path, 'r', encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    cues = []
+    for block in re.split(r'\n\s*\n', content.replace('\r\n', '\n').strip()):
+        lines = block.strip().split('\n')
+        for i, line in enumerate(lines):
+            match = _SRT_TIME.search(line)
+            if match:
+                v = [int(g) for g in match.groups()]
+                start = v[0] * 3600 + v[1] * 60 + v[2] + v[3] / 1000.0
+                end = v[4] * 3600 + v[5] * 60 + v[6] + v[7] / 1000.0
+                text = ' '.join(l.strip() for l in lines[i + 1:] if l.strip())
+                if text:
+                    cues.append((start, end, text))
+                break
+    return cues
+
 def read_transcript(transcript_path):
     """Read and extract text from SRT transcript file"""
     try:
@@ -49,7 +84,7 @@ def generate_metadata_with_llm(transcript_text, video_analysis):
     """Use free intelligent text analysis to generate metadata from transcript"""
     try:
         import nltk
-        from nltk.tokenize import word_tokenize, sent_tokenize
+        from nltk.tokenize import sent_tokenize
         from nltk.corpus import stopwords
         from nltk.probability import FreqDist
         from collections import Counter
@@ -94,7 +129,7 @@ def generate_metadata_with_llm(transcript_text, video_analysis):
 
         # Tokenize and remove stopwords
         stop_words = set(stopwords.words('english'))
-        words = word_tokenize(transcript_lower)
+        words = tokenize(transcript_lower)
         filtered_words = [word for word in words if word.isalnum() and word not in stop_words and len(word) > 2]
 
         # Find most common words (potential tags)
@@ -221,31 +256,87 @@ def generate_metadata_with_llm(transcript_text, video_analysis):
         traceback.print_exc()
         return None
 
-def main():
-    # Parse arguments only when run as main script
-    if len(sys.argv) < 2:
-        safe_print("Usage: python metadata_generator.py <video_path> [transcript_path]")
-        sys.exit(1)
+# Frames analysed whatever the time budget
+MIN_ANALYSIS_SAMPLES = 4
+# Frames checked for faces in statistics mode
+FACE_SAMPLES = 12
+
+def analyze_video_stats(video_path, probe, budget=None, sample_fps=video_stats.DEFAULT_SAMPLE_FPS):
+    """Brightness and motion over the whole video from one ffmpeg pass
+
+    Same fields as the sampled analysis, plus 'visual_stats' with the
+    distributions (mean, percentiles, per-minute series). Faces are
+    looked for in FACE_SAMPLES frames taken from the same pass, and
+    'avg_motion' is measured between them, as in the sampled analysis. Returns
+    None if the pass fails; a pass cut short by the budget covers the
+    start of the video only.
+    """
+    budget = budget or Budget()
+    duration = probe['duration']
+    sample_times = [(i + 0.5) * duration / FACE_SAMPLES for i in range(FACE_SAMPLES)]
+
+    stats, frames = video_stats.run_stats_pass(
+        video_path, sample_fps, sample_times, (probe['width'], probe['height']),
+        timeout=budget.remaining() if budget.limited else None
+    )
+    if stats is None:
+        return None
+    if not stats['complete']:
+        budget.degrade('visual_stats', f"first {stats['covered_seconds']:.0f}s of {duration:.0f}s")
 
-    video_path = sys.argv[1]
-    transcript_path = sys.argv[2] if len(sys.argv) > 2 else None
+    import cv2
+    face_engine = FaceEngine(min_neighbors=3)
+    total_faces = sum(face_engine.detect(frame, int(t * sample_fps))['count'] for t, frame in frames)
+
+    # On the sampled analysis' scale, which the tag and genre thresholds
+    # assume: the pass's own motion compares frames 1/sample_fps apart
+    grays = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for _, frame in frames]
+    motion_scores = [float(cv2.absdiff(a, b).mean()) for a, b in zip(grays, grays[1:])]
 
+    return {
+        "duration": round(duration, 2),
+        "avg_brightness": stats['brightness']['mean'],
+        "avg_motion": sum(motion_scores) / len(motion_scores) if motion_scores else 0,
+        "face_detected": total_faces > 0,
+        "total_faces_found": total_faces,
+        "visual_stats": stats
+    }
+
+def analyze_video(video_path, probe=None, budget=None, stats_mode=None):
+    """Measure brightness, motion and faces, returns None if unreadable
+
+    stats_mode: 'pass' (default, or METADATA_STATS) measures the whole
+    video in one ffmpeg pass (analyze_video_stats); 'sampled' seeks to
+    12 frames. budget: deadline.Budget; sampling stops early (after at
+    least MIN_ANALYSIS_SAMPLES frames) when the next frame would not fit.
+    """
     import cv2
+    budget = budget or Budget()
 
     cap = cv2.VideoCapture(video_path)
 
     if not cap.isOpened():
-        safe_print("ERROR: Cannot open video file")
-        sys.exit(1)
+        return None
 
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = frame_count / fps if fps > 0 else 0
+    probe = probe or probe_media(video_path)
+    if probe and probe.get('frame_count', 0) > 0:
+        frame_count = probe['frame_count']
+        duration = probe['duration']
+    else:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration = frame_count / fps if fps > 0 else 0
+
+    stats_mode = stats_mode or os.environ.get('METADATA_STATS', 'pass')
+    if stats_mode == 'pass' and video_stats.available() and probe and probe.get('width') and not budget.expired():
+        cap.release()
+        analysis = analyze_video_stats(video_path, probe, budget)
+        if analysis is not None:
+            return analysis
+        safe_print("[Metadata] Statistics pass failed, sampling frames instead")
 
     # OPTIMIZATION: Seek-based sampling with downscaled processing for speed and low memory
-    face_cascade = cv2.CascadeClassifier(
-        cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    )
+    face_engine = FaceEngine(min_neighbors=3)
 
     # Settings: cap sample count to keep analysis fast
     sample_count = min(12, 15)
@@ -264,27 +355,27 @@ def main():
 
     MAX_PROC_WIDTH = 640
 
+    cap.release()
+    reader = seek_index.open_frame_reader(video_path, max_width=MAX_PROC_WIDTH)
+
+    meter = RateMeter()
+
     for i, pos in enumerate(sample_positions):
+        if i >= MIN_ANALYSIS_SAMPLES and not budget.allows(meter.per_unit(0.0)):
+            budget.degrade('analysis_samples', f"{sample_count} -> {i}")
+            break
+        meter.start()
         try:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
-            ret, frame = cap.read()
-            if not ret or frame is None:
+            small = reader.read(min(pos, reader.frame_count - 1))
+            if small is None:
                 safe_print(f"[Metadata] Warning: cannot read frame at {pos}")
                 continue
 
-            h, w = frame.shape[:2]
-            if w > MAX_PROC_WIDTH:
-                scale = MAX_PROC_WIDTH / float(w)
-                small = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
-            else:
-                small = frame
-
             gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
             brightness_sum += float(gray.mean())
 
             try:
-                faces = face_cascade.detectMultiScale(gray, 1.1, 3, minSize=(30, 30))
-                total_faces += len(faces)
+                total_faces += face_engine.detect(small, pos)['count']
             except Exception as e:
                 safe_print(f"[Metadata] face detect error at {pos}: {e}")
 
@@ -294,6 +385,7 @@ def main():
 
             prev_gray = gray
             sample_frames.append(small)
+            meter.stop()
 
             # Removed progress print to avoid JSON parsing issues
 
@@ -301,14 +393,14 @@ def main():
             safe_print("[Metadata] MemoryError during sampling — skipping")
             continue
 
-    cap.release()
+    reader.close()
 
     # Calculate metrics
     avg_brightness = brightness_sum / len(sample_frames) if sample_frames else 128
     avg_motion = sum(motion_scores) / len(motion_scores) if motion_scores else 0
     has_faces = total_faces > 0
 
-    video_analysis = {
+    return {
         "duration": round(duration, 2),
         "avg_brightness": round(avg_brightness, 2),
         "avg_motion": round(avg_motion, 2),
@@ -316,9 +408,67 @@ def main():
         "total_faces_found": total_faces
     }
 
+def generate_heuristic_metadata(video_analysis):
+    """Build metadata from visual analysis alone (no transcript)"""
+    duration = video_analysis.get('duration', 0)
+    avg_brightness = video_analysis.get('avg_brightness', 128)
+    avg_motion = video_analysis.get('avg_motion', 0)
+    has_faces = video_analysis.get('face_detected', False)
+
+    # Genre selection logic
+    genres = ["Entertainment", "Education", "Sports", "Music", "Gaming", "Tech", "Lifestyle", "News"]
+    moods = ["Exciting", "Calm", "Inspiring", "Informative", "Fun", "Serious"]
+
+    if has_faces:
+        selected_genres = random.sample(["Entertainment", "Sports", "Music", "Gaming"], 2) if avg_motion > 5 else random.sample(["Education", "Lifestyle", "News", "Tech"], 2)
+    else:
+        selected_genres = random.sample(["Sports", "Gaming", "Music"], 2) if avg_motion > 10 else random.sample(["Nature", "Tech", "Education"], 2)
+
+    # Metadata generation
+    title_prefixes = ["Amazing", "Epic", "Incredible", "Must Watch", "Viral", "Exclusive", "Breaking", "Top 10"]
+    title = f"{random.choice(title_prefixes)} {random.choice(selected_genres)} Video"
+
+    description_templates = [
+        f"Discover everything about {random.choice(selected_genres).lower()} in this amazing video.",
+        f"This {random.choice(moods).lower()} video brings you the most exciting content.",
+        f"Join us for an amazing journey into {random.choice(selected_genres).lower()}."
+    ]
+
+    tags = [random.choice(genres).lower(), "video", "trending", random.choice(selected_genres).lower()]
+    if has_faces:
+        tags.append("featured")
+    if avg_motion > 5:
+        tags.extend(["action", "exciting"])
+    if avg_brightness > 150:
+        tags.append("bright")
+    elif avg_brightness < 80:
+        tags.append("cinematic")
+
+    return {
+        "title": title,
+        "description": random.choice(description_templates),
+        "tags": tags,
+        "genre": selected_genres[0],
+        "duration": round(duration, 2),
+        "analysis": video_analysis
+    }
+
+def generate_metadata(video_path, transcript_path=None, probe=None, budget=None):
+    """Analyze the video and build metadata, returns None if the video cannot be opened
+
+    budget: deadline.Budget; transcript analysis is skipped once it has run out.
+    """
+    budget = budget or Budget()
+    video_analysis = analyze_video(video_path, probe, budget)
+    if video_analysis is None:
+        return None
+
     # Try LLM metadata generation if transcript is available
     metadata = None
-    if transcript_path:
+    if transcript_path and budget.expired():
+        safe_print("[Metadata] Time budget reached, skipping transcript analysis")
+        budget.degrade('transcript_analysis', 'skipped')
+    elif transcript_path:
         safe_print(f"[Metadata] Transcript available, attempting LLM generation...")
         transcript_text = read_transcript(transcript_path)
         if transcript_text:
@@ -327,45 +477,27 @@ def main():
     # Fall back to heuristic generation if LLM failed or no transcript
     if not metadata:
         safe_print("[Metadata] Using heuristic metadata generation")
-        # Genre selection logic
-        genres = ["Entertainment", "Education", "Sports", "Music", "Gaming", "Tech", "Lifestyle", "News"]
-        moods = ["Exciting", "Calm", "Inspiring", "Informative", "Fun", "Serious"]
+        metadata = generate_heuristic_metadata(video_analysis)
 
-        if has_faces:
-            selected_genres = random.sample(["Entertainment", "Sports", "Music", "Gaming"], 2) if avg_motion > 5 else random.sample(["Education", "Lifestyle", "News", "Tech"], 2)
-        else:
-            selected_genres = random.sample(["Sports", "Gaming", "Music"], 2) if avg_motion > 10 else random.sample(["Nature", "Tech", "Education"], 2)
-
-        # Metadata generation
-        title_prefixes = ["Amazing", "Epic", "Incredible", "Must Watch", "Viral", "Exclusive", "Breaking", "Top 10"]
-        title = f"{random.choice(title_prefixes)} {random.choice(selected_genres)} Video"
-
-        description_templates = [
-            f"Discover everything about {random.choice(selected_genres).lower()} in this amazing video.",
-            f"This {random.choice(moods).lower()} video brings you the most exciting content.",
-            f"Join us for an amazing journey into {random.choice(selected_genres).lower()}."
-        ]
-
-        tags = [random.choice(genres).lower(), "video", "trending", random.choice(selected_genres).lower()]
-        if has_faces:
-            tags.append("featured")
-        if avg_motion > 5:
-            tags.extend(["action", "exciting"])
-        if avg_brightness > 150:
-            tags.append("bright")
-        elif avg_brightness < 80:
-            tags.append("cinematic")
+    return metadata
 
-        metadata = {
-            "title": title,
-            "description": random.choice(description_templates),
-            "tags": tags,
-            "genre": selected_genres[0],
-            "duration": round(duration, 2),
-            "analysis": video_analysis
-        }
+def main():
+    # Parse arguments only when run as main script
+    if len(sys.argv) < 2:
+        safe_print("Usage: python metadata_generator.py <video_path> [transcript_path]")
+        sys.exit(1)
+
+    video_path = sys.argv[1]
+    transcript_path = sys.argv[2] if len(sys.argv) > 2 else None
+
+    load_backend_env()
+
+    metadata = generate_metadata(video_path, transcript_path)
+    if metadata is None:
+        safe_print("ERROR: Cannot open video file")
+        sys.exit(1)
 
     print(json.dumps(metadata, ensure_ascii=False))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
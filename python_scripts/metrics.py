@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+"""Counters and latency histograms, aggregated across processes.
+
+Scripts record with inc() and observe(). A sample only updates this
+process's Registry, a few microseconds, so recording stays on in
+production. A background thread sends what changed every FLUSH_SECONDS
+(flush() sends it now): as datagrams to METRICS_SOCKET, or else as JSON
+lines appended to METRICS_FILE. Without either, samples stay in the
+process.
+
+The Aggregator (`python metrics.py aggregate`, started by worker_pool)
+merges what every process sends. It writes METRICS_DIR/metrics.prom in
+the Prometheus text format for a local collector to scrape, and keeps
+its totals in state.json across restarts.
+
+Histograms are HDR-style: log-linear buckets, SUB_BUCKETS per power of
+two, so every value is kept to within 1/SUB_BUCKETS (about 1.6%), from
+microseconds to hours, in a few dozen sparse buckets. Histograms merge
+by adding bucket counts.
+"""
+import os
+import sys
+import json
+import math
+import time
+import atexit
+import threading
+
+SOCKET_ENV = 'METRICS_SOCKET'
+FILE_ENV = 'METRICS_FILE'
+DIR_ENV = 'METRICS_DIR'
+# Set to 0 to keep worker_pool from starting an aggregator
+ENABLE_ENV = 'METRICS'
+
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', '.cache', 'metrics')
+
+# Seconds between sends from a recording process
+FLUSH_SECONDS = 5.0
+# Seconds between rewrites of the Prometheus file
+EXPORT_SECONDS = 15.0
+
+# Buckets per power of two; relative error of a recorded value is below 1/SUB_BUCKETS
+SUB_BUCKETS = 64
+
+# Larger sends are split into several datagrams
+DATAGRAM_BYTES = 60000
+
+PREFIX = 'ai_video_'
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Video duration buckets for labels, upper bounds in seconds
+DURATION_BUCKETS = [(60, '<1m'), (300, '1-5m'), (1200, '5-20m'), (3600, '20-60m')]
+
+def duration_bucket(seconds):
+    if not seconds:
+        return 'unknown'
+    for limit, label in DURATION_BUCKETS:
+        if seconds < limit:
+            return label
+    return '>60m'
+
+class Histogram:
+    """Sparse log-linear histogram of non-negative values"""
+
+    __slots__ = ('counts', 'count', 'sum', 'min', 'max', 'zeros')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.zeros = 0
+
+    def record(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        mantissa, exponent = math.frexp(value)
+        index = exponent * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    @staticmethod
+    def bucket_bounds(index):
+        exponent, sub = divmod(index, SUB_BUCKETS)
+        return (math.ldexp(0.5 + sub / (2.0 * SUB_BUCKETS), exponent),
+                math.ldexp(0.5 + (sub + 1) / (2.0 * SUB_BUCKETS), exponent))
+
+    def _values(self):
+        """(representative value, count) in increasing order"""
+        if self.zeros:
+            yield 0.0, self.zeros
+        for index in sorted(self.counts):
+            lower, upper = self.bucket_bounds(index)
+            # Bucket midpoint, within the values actually recorded
+            yield min(max((lower + upper) / 2.0, self.min), self.max), self.counts[index]
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(q * self.count)))
+        seen = 0
+        for value, count in self._values():
+            seen += count
+            if seen >= target:
+                return value
+        return self.max
+
+    def cumulative(self, bounds):
+        """Count of values at or below each bound"""
+        counts = [0] * len(bounds)
+        values = list(self._values())
+        for i, bound in enumerate(bounds):
+            counts[i] = sum(count for value, count in values if value <= bound)
+        return counts
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.zeros += other.zeros
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def to_dict(self):
+        return {'n': self.count, 's': self.sum, 'lo': self.min, 'hi': self.max, 'z': self.zeros,
+                'b': {str(i): c for i, c in self.counts.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        histogram.count = data['n']
+        histogram.sum = data['s']
+        histogram.min = data['lo']
+        histogram.max = data['hi']
+        histogram.zeros = data.get('z', 0)
+        histogram.counts = {int(i): c for i, c in data['b'].items()}
+        return histogram
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+class Registry:
+    """Counters and histograms by (name, labels)"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, labels=None):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.record(value)
+
+    def entries(self):
+        """Wire form: ['c' | 'h', name, labels, value or histogram dict]"""
+        with self._lock:
+            return ([['c', name, dict(labels), value] for (name, labels), value in self.counters.items()]
+                    + [['h', name, dict(labels), h.to_dict()] for (name, labels), h in self.histograms.items()])
+
+    def take(self):
+        """Entries recorded since the last take(), clearing them"""
+        with self._lock:
+            counters, self.counters = self.counters, {}
+            histograms, self.histograms = self.histograms, {}
+        return ([['c', name, dict(labels), value] for (name, labels), value in counters.items()]
+                + [['h', name, dict(labels), h.to_dict()] for (name, labels), h in histograms.items()])
+
+    def merge(self, entries):
+        with self._lock:
+            for kind, name, labels, value in entries:
+                key = _key(name, labels)
+                if kind == 'c':
+                    self.counters[key] = self.counters.get(key, 0) + value
+                elif kind == 'h':
+                    histogram = self.histograms.get(key)
+                    if histogram is None:
+                        histogram = self.histograms[key] = Histogram()
+                    histogram.merge(Histogram.from_dict(value))
+
+    def to_prometheus(self, prefix=PREFIX):
+        """Prometheus text exposition of everything recorded"""
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = dict(self.histograms)
+
+        lines = []
+        by_name = {}
+        for (name, labels), value in counters.items():
+            by_name.setdefault(name, []).append((labels, value))
+        for name in sorted(by_name):
+            family = prefix + (name if name.endswith('_total') else name + '_total')
+            lines.append(f"# TYPE {family} counter")
+            for labels, value in sorted(by_name[name]):
+                lines.append(f"{family}{_labels(labels)} {_number(value)}")
+
+        by_name = {}
+        for (name, labels), histogram in histograms.items():
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name in sorted(by_name):
+            family = prefix + name
+            series = sorted(by_name[name], key=lambda item: item[0])
+            bounds = export_bounds([h for _, h in series])
+            lines.append(f"# TYPE {family} histogram")
+            for labels, histogram in series:
+                for bound, count in zip(bounds, histogram.cumulative(bounds)):
+                    lines.append(f"{family}_bucket{_labels(labels, le=_number(bound))} {count}")
+                lines.append(f"{family}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+                lines.append(f"{family}_sum{_labels(labels)} {_number(histogram.sum)}")
+                lines.append(f"{family}_count{_labels(labels)} {histogram.count}")
+            # The histogram's own quantiles, sharper than interpolating the buckets above
+            lines.append(f"# TYPE {family}_quantile gauge")
+            for labels, histogram in series:
+                for q in QUANTILES:
+                    lines.append(f"{family}_quantile{_labels(labels, quantile=_number(q))} "
+                                 f"{_number(histogram.quantile(q))}")
+        return '\n'.join(lines) + '\n'
+
+def export_bounds(histograms, max_bounds=30):
+    """1-2-5 bucket bounds covering every positive value of a metric family"""
+    low = min((h.min for h in histograms if h.min), default=None)
+    high = max((h.max for h in histograms if h.max), default=None)
+    if not low or not high:
+        return []
+    steps = (1, 2, 5)
+    decade = int(math.floor(math.log10(low)))
+    # Wide ranges get one bound per decade
+    if (math.log10(high) - decade + 1) * len(steps) > max_bounds:
+        steps = (1,)
+    bounds = []
+    while not bounds or bounds[-1] < high:
+        for step in steps:
+            bound = step * 10.0 ** decade
+            if bound >= low / 10.0 and (not bounds or bounds[-1] < high):
+                bounds.append(float(f"{bound:.12g}"))
+        decade += 1
+    return bounds
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return f"{value:.9g}"
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in items) + '}'
+
+# This process's samples; a forked child starts its own
+_REGISTRY = Registry()
+_PID = os.getpid()
+_FLUSHER = [None]
+_LOCK = threading.Lock()
+
+def registry():
+    global _REGISTRY, _PID
+    if _PID != os.getpid():
+        # The parent sends what it recorded before the fork
+        with _LOCK:
+            if _PID != os.getpid():
+                _REGISTRY = Registry()
+                _PID = os.getpid()
+                _FLUSHER[0] = None
+    if _FLUSHER[0] is None:
+        _start_flusher()
+    return _REGISTRY
+
+def inc(name, value=1, **labels):
+    registry().inc(name, value, labels)
+
+def observe(name, value, **labels):
+    registry().observe(name, value, labels)
+
+def _start_flusher():
+    with _LOCK:
+        if _FLUSHER[0] is not None:
+            return
+        if not (os.environ.get(SOCKET_ENV) or os.environ.get(FILE_ENV)):
+            # Nowhere to send to; flush() still checks again
+            _FLUSHER[0] = False
+            return
+        thread = threading.Thread(target=_flush_loop, name='metrics-flusher', daemon=True)
+        _FLUSHER[0] = thread
+        thread.start()
+        atexit.register(flush)
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        flush()
+
+def flush():
+    """Send what this process recorded since the last flush; False if it could not be sent
+
+    Unsent entries are kept for the next flush.
+    """
+    entries = registry().take()
+    if not entries:
+        return True
+    unsent = send(entries)
+    if unsent:
+        _REGISTRY.merge(unsent)
+    return not unsent
+
+def _messages(entries, limit=DATAGRAM_BYTES):
+    """JSON messages of at most limit bytes (unless one entry is larger), with their entries"""
+    messages = []
+    batch, size = [], 0
+    for entry in entries:
+        encoded = json.dumps(entry, separators=(',', ':'))
+        if batch and size + len(encoded) + 1 > limit:
+            messages.append(batch)
+            batch, size = [], 0
+        batch.append((entry, encoded))
+        size += len(encoded) + 1
+    if batch:
+        messages.append(batch)
+    return [('{"pid":%d,"entries":[%s]}' % (os.getpid(), ','.join(e for _, e in batch)), [e for e, _ in batch])
+            for batch in messages]
+
+def send(entries, address=None, path=None):
+    """Send entries to the socket, or else append them to the file; returns the entries not sent"""
+    address = address or os.environ.get(SOCKET_ENV)
+    path = path or os.environ.get(FILE_ENV)
+    unsent = []
+    sock = None
+    try:
+        for message, batch in _messages(entries):
+            data = message.encode('utf-8')
+            if address:
+                try:
+                    if sock is None:
+                        import socket
+                        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                        sock.setblocking(False)
+                    sock.sendto(data, address)
+                    continue
+                except OSError:
+                    pass
+            if path and _append(path, data):
+                continue
+            unsent.extend(batch)
+    finally:
+        if sock is not None:
+            sock.close()
+    return unsent
+
+def _append(path, data):
+    """One write with O_APPEND, so lines from concurrent processes never interleave"""
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data + b'\n')
+        finally:
+            os.close(fd)
+        return True
+    except OSError:
+        return False
+
+def metrics_dir():
+    return os.path.abspath(os.environ.get(DIR_ENV) or DEFAULT_DIR)
+
+class Aggregator:
+    """Merges metrics from a datagram socket and appended files into one registry
+
+    Writes <out_dir>/metrics.prom every export_seconds, and state.json
+    with the totals and how far each file was read, so a restart neither
+    loses nor double counts anything.
+    """
+
+    def __init__(self, out_dir=None, socket_path=None, files=(), export_seconds=EXPORT_SECONDS):
+        self.out_dir = out_dir or metrics_dir()
+        self.prom_path = os.path.join(self.out_dir, 'metrics.prom')
+        self.state_path = os.path.join(self.out_dir, 'state.json')
+        self.files = list(files)
+        self.export_seconds = export_seconds
+        self.registry = Registry()
+        self.offsets = {}
+        self.messages = 0
+        self._sock = None
+        self._load_state()
+        if socket_path:
+            import socket
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.bind(socket_path)
+            self.socket_path = socket_path
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.registry.merge(state.get('entries', []))
+        self.offsets = state.get('offsets', {})
+
+    def receive(self, message):
+        try:
+            entries = json.loads(message)['entries']
+        except (ValueError, KeyError, TypeError):
+            return
+        self.registry.merge(entries)
+        self.messages += 1
+
+    def tail(self, path):
+        """Merge the complete lines appended to path since the last read"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        offset = self.offsets.get(path, 0)
+        if size < offset:
+            # Truncated or replaced: start over
+            offset = 0
+        if size == offset:
+            return
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size - offset)
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if line.strip():
+                self.receive(line.decode('utf-8', 'replace'))
+        self.offsets[path] = offset + end
+
+    def poll(self, timeout=0.0):
+        """Read pending datagrams (waiting up to timeout for the first) and appended files"""
+        if self._sock is not None:
+            import select
+            deadline = time.time() + timeout
+            while True:
+                ready, _, _ = select.select([self._sock], [], [], max(0.0, deadline - time.time()))
+                if not ready:
+                    break
+                self.receive(self._sock.recv(1 << 20).decode('utf-8', 'replace'))
+                deadline = time.time()
+        elif timeout:
+            time.sleep(timeout)
+        for path in self.files:
+            self.tail(path)
+
+    def export(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        _write_atomic(self.prom_path, self.registry.to_prometheus())
+        _write_atomic(self.state_path, json.dumps({'entries': self.registry.entries(), 'offsets': self.offsets}))
+
+    def serve_forever(self):
+        next_export = time.time()
+        try:
+            while True:
+                self.poll(max(0.0, min(1.0, next_export - time.time())))
+                if time.time() >= next_export:
+                    self.export()
+                    next_export = time.time() + self.export_seconds
+        finally:
+            self.export()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+def _write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def _aggregator_main(socket_path, out_dir, files=()):
+    """Aggregator process: exports once more when terminated"""
+    import signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    # Started by worker_pool, whose stdout carries protocol events
+    try:
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    except (OSError, ValueError, AttributeError):
+        pass
+    aggregator = Aggregator(out_dir, socket_path, files)
+    try:
+        aggregator.serve_forever()
+    finally:
+        aggregator.close()
+
+def start_aggregator(ctx, out_dir=None):
+    """Start the aggregator process and point this process's children at it"""
+    import tempfile
+    out_dir = out_dir or metrics_dir()
+    socket_path = os.path.join(tempfile.mkdtemp(prefix='metrics_'), 'socket')
+    files = [os.environ[FILE_ENV]] if os.environ.get(FILE_ENV) else []
+    process = ctx.Process(target=_aggregator_main, args=(socket_path, out_dir, files), daemon=True)
+    process.start()
+    os.environ[SOCKET_ENV] = socket_path
+    return process
+
+def stop_aggregator(process):
+    socket_path = os.environ.pop(SOCKET_ENV, None)
+    process.terminate()
+    process.join(10)
+    if socket_path:
+        try:
+            os.rmdir(os.path.dirname(socket_path))
+        except OSError:
+            pass
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Aggregate metrics into a Prometheus text file')
+    sub = parser.add_subparsers(dest='command', required=True)
+    aggregate = sub.add_parser('aggregate', help='Run the aggregator')
+    aggregate.add_argument('--socket', help='Unix datagram socket to receive on')
+    aggregate.add_argument('--file', action='append', default=[], help='Appended metrics file to follow')
+    aggregate.add_argument('--dir', help=f"Output directory (default: {DIR_ENV} or backend/.cache/metrics)")
+    show = sub.add_parser('show', help='Merge metrics files once and print the Prometheus text')
+    show.add_argument('files', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'show':
+        registry = Registry()
+        for path in args.files:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        registry.merge(json.loads(line)['entries'])
+        sys.stdout.write(registry.to_prometheus())
+        return 0
+
+    if not args.socket and not args.file:
+        parser.error('give --socket and/or --file')
+    print(f"[Metrics] Aggregating into {args.dir or metrics_dir()}", flush=True)
+    aggregator = Aggregator(args.dir, args.socket, args.file)
+    try:
+        aggregator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        aggregator.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
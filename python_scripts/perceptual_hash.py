@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Hash size in cells per side: HASH_SIZE**2 = 64 bits
+HASH_SIZE = 8
+
+# Frames whose hashes differ in at most this many of the 64 bits are
+# near-duplicates: the same shot a few seconds apart, a static talking
+# head, recompression noise
+NEAR_DUPLICATE_BITS = 6
+
+def dhash(gray, size=HASH_SIZE):
+    """Difference hash of a grayscale frame, as an int of size*size bits
+
+    The frame is shrunk to (size + 1) x size and each bit says whether
+    a cell is brighter than its right-hand neighbour, so the hash keeps
+    the coarse structure and ignores scale, brightness and small noise.
+    """
+    import cv2
+    tiny = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (tiny[:, 1:] > tiny[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+class BKTree:
+    """Hashes indexed by Hamming distance (Burkhard-Keller tree)
+
+    Each node's children are keyed by their distance to it; the triangle
+    inequality limits a radius search to children whose key is within
+    the radius of the query's distance to the node, so only a small part
+    of the tree is visited for small radii.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item=None):
+        node = [value, item, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find(self, value, radius):
+        """(distance, hash, item) of every entry within radius of value, closest first"""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.append((distance, node[0], node[1]))
+            for key, child in node[2].items():
+                if distance - radius <= key <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda entry: entry[0])
+        return found
+
+    def nearest(self, value, radius):
+        """Closest entry within radius, None if there is none"""
+        found = self.find(value, radius)
+        return found[0] if found else None
+
+    def __len__(self):
+        return self.size
+
+def largest_gap_midpoint(positions, first, last):
+    """Middle of the widest stretch of [first, last] containing none of positions
+
+    None when no position is left between the ones taken.
+    """
+    points = sorted(set(p for p in positions if first <= p <= last) | {first - 1, last + 1})
+    start, end = max(zip(points, points[1:]), key=lambda pair: pair[1] - pair[0])
+    if end - start < 2:
+        return None
+    return (start + end) // 2
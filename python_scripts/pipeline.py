@@ -0,0 +1,527 @@
+# -*- coding: utf-8 -*-
+import sys
+import os
+import json
+import time
+import argparse
+import contextlib
+
+sys.stdout.reconfigure(encoding='utf-8')
+os.environ['PYTHONIOENCODING'] = 'utf-8'
+
+from deadline import Budget
+from job_output import JobOutput
+from media_probe import probe_media
+from workspace import Workspace
+from stage_scheduler import Stage, InlineExecutor, run_stages
+from result_store import ResultStore, content_fingerprint, stage_key, restore_artifact
+import growing_file
+import cpu_governor
+import thumbnail_generator
+import trailer_generator
+import subtitle_generator
+import metadata_generator
+
+STAGE_ORDER = ['thumbnails', 'trailer', 'subtitles', 'metadata']
+
+def safe_print(text):
+    """Print to stderr so stdout carries only the JSON result"""
+    try:
+        sys.stderr.write(str(text) + "\n")
+        sys.stderr.flush()
+    except:
+        pass
+
+def is_url(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+def prepare_source(source, workspace, proxy_source=None):
+    """Resolve the source to a local file once, downloading into workspace
+
+    With proxy_source (a low-resolution stream of the same video) only the
+    proxy is downloaded; stages that need full resolution read the
+    source stream directly.
+    """
+    if not is_url(source):
+        return source
+
+    video_path = thumbnail_generator.download_streaming_video(
+        proxy_source or source, workspace.dir, max_bytes=workspace.available()
+    )
+    workspace.check()
+    import metrics
+    metrics.observe('download_bytes', os.path.getsize(video_path), kind='proxy' if proxy_source else 'source')
+    return video_path
+
+def wait_for_growing_source(video_path):
+    """Probe of a file still being written, once its header has arrived
+
+    Returns (probe, growing): growing is False when the file has to be
+    complete before anything can be decoded (e.g. an MP4 with its index
+    at the end), in which case this waits for it.
+    """
+    if growing_file.is_streamable(video_path):
+        while not growing_file.is_complete(video_path):
+            probe = probe_media(video_path, use_cache=False)
+            if probe and probe.get('has_video') and probe.get('fps'):
+                return probe, True
+            time.sleep(growing_file.POLL_SECONDS)
+    else:
+        safe_print("[Pipeline] Source cannot be decoded before it is complete, waiting for it")
+    growing_file.wait_until_complete(video_path)
+    return probe_media(video_path), False
+
+def complete_probe(ctx):
+    """The source's probe once it is complete, waiting for a growing source"""
+    if not ctx.get('growing'):
+        return ctx['probe']
+    growing_file.wait_until_complete(ctx['video_path'])
+    return probe_media(ctx['video_path'])
+
+def thumbnails_dir(ctx):
+    return ctx['options'].get('thumbnails_dir') or os.path.join(ctx['output_dir'], 'thumbnails')
+
+def trailer_path(ctx):
+    return ctx['options'].get('trailer_path') or os.path.join(ctx['output_dir'], 'trailer.mp4')
+
+def subtitles_path(ctx):
+    return ctx['options'].get('subtitles_path') or os.path.join(ctx['output_dir'], 'subtitles.srt')
+
+def run_thumbnails_stage(upstream, ctx):
+    output_dir = thumbnails_dir(ctx)
+    artifacts = {}
+    count = thumbnail_generator.generate_smart_thumbnails(
+        ctx['video_path'], output_dir,
+        ctx['options'].get('num_candidates', 20),
+        probe=ctx['probe'], artifacts=artifacts, hq_source=ctx.get('hq_source'),
+        budget=ctx['budget'], growing=ctx.get('growing', False)
+    )
+    files = []
+    if os.path.isdir(output_dir):
+        files = sorted(f for f in os.listdir(output_dir) if f.startswith('thumb_') and f.endswith('.jpg'))
+    return {
+        'success': count > 0,
+        'thumbnails': [os.path.join(output_dir, f) for f in files],
+        'stats': {'candidate_pool': artifacts.get('candidate_pool'), 'face_engine': artifacts.get('face_engine')},
+    }
+
+def run_trailer_stage(upstream, ctx):
+    output_path = trailer_path(ctx)
+    success = trailer_generator.generate_highlight_trailer(
+        ctx['video_path'], output_path,
+        ctx['options'].get('trailer_mode', 'highlights'),
+        probe=complete_probe(ctx), segment_source=ctx.get('hq_source'),
+        budget=ctx['budget']
+    )
+    return {'success': bool(success), 'trailer': output_path if success else None}
+
+def run_subtitles_stage(upstream, ctx):
+    output_path = subtitles_path(ctx)
+    success = subtitle_generator.generate_subtitles(
+        ctx['video_path'], output_path, probe=ctx['probe'], budget=ctx['budget'],
+        growing=ctx.get('growing', False)
+    )
+    return {'success': bool(success), 'subtitles': output_path if success else None}
+
+def run_metadata_stage(upstream, ctx):
+    transcript_path = (upstream.get('subtitles') or {}).get('subtitles')
+    metadata = metadata_generator.generate_metadata(
+        ctx['video_path'], transcript_path, probe=complete_probe(ctx), budget=ctx['budget']
+    )
+    return {'success': metadata is not None, 'metadata': metadata}
+
+STAGE_RUNNERS = {
+    'thumbnails': run_thumbnails_stage,
+    'trailer': run_trailer_stage,
+    'subtitles': run_subtitles_stage,
+    'metadata': run_metadata_stage,
+}
+
+# Metadata only needs the transcript; it still runs if subtitles fail
+STAGE_SOFT_DEPS = {'metadata': ['subtitles']}
+
+# Share of the job CPU budget each stage occupies (Whisper is the heaviest)
+STAGE_CPUS = {'thumbnails': 1, 'trailer': 1, 'subtitles': 2, 'metadata': 1}
+
+# Stage result keys that are internal hand-offs, not part of the document
+INTERNAL_KEYS = {'stats', 'degradations'}
+
+# Result field holding each stage's output files, and where they are restored to
+STAGE_ARTIFACTS = {
+    'thumbnails': ('thumbnails', thumbnails_dir),
+    'trailer': ('trailer', trailer_path),
+    'subtitles': ('subtitles', subtitles_path),
+}
+
+def publish_job(job, document):
+    """Publish the job directory and point the document at the published files"""
+    for field, _ in STAGE_ARTIFACTS.values():
+        value = document.get(field)
+        if isinstance(value, list):
+            document[field] = [job.final_path(p) for p in value]
+        elif value:
+            document[field] = job.final_path(value)
+    job.publish(document)
+    document['job_dir'] = job.final
+
+def index_transcript(document, index_dir):
+    """Add the job's published transcript to the search index"""
+    try:
+        import transcript_index
+        transcript_index.TranscriptIndex(index_dir).add_srt(document['subtitles'], video=document['job_id'])
+        safe_print("[Pipeline] Transcript indexed for search")
+    except Exception as e:
+        # Search lags behind; the job itself succeeded
+        safe_print(f"[Pipeline] Could not index transcript: {e}")
+
+def stage_params(name, options):
+    """Parameters that change a stage's output; part of its result-store key"""
+    if name == 'thumbnails':
+        params = {'num_candidates': options.get('num_candidates', 20)}
+    elif name == 'trailer':
+        params = {'trailer_mode': options.get('trailer_mode', 'highlights')}
+    elif name == 'subtitles':
+        return {'whisper_model': os.environ.get('WHISPER_MODEL', 'tiny')}
+    else:
+        return {}
+    if options.get('proxy_source'):
+        # Output taken from the full stream, not the analysed proxy
+        params['full_resolution'] = True
+    return params
+
+def compute_stage_keys(names, options):
+    """Chain stage keys so a change upstream also invalidates dependents"""
+    keys = {}
+    for name in STAGE_ORDER:
+        if name in names:
+            upstream = [keys[d] for d in STAGE_SOFT_DEPS.get(name, []) if d in keys]
+            keys[name] = stage_key(name, stage_params(name, options), upstream)
+    return keys
+
+def stage_artifacts(name, result):
+    field = STAGE_ARTIFACTS.get(name, (None,))[0]
+    value = (result or {}).get(field) if field else None
+    if not value:
+        return []
+    return list(value) if isinstance(value, list) else [value]
+
+def restore_stage(name, entry, ctx):
+    """Put a stored stage's artifacts at this job's output locations"""
+    result = dict(entry['result'])
+    if name not in STAGE_ARTIFACTS:
+        return result
+
+    field, location = STAGE_ARTIFACTS[name]
+    if isinstance(result.get(field), list):
+        dest_dir = location(ctx)
+        result[field] = [
+            restore_artifact(path, os.path.join(dest_dir, artifact))
+            for artifact, path in sorted(entry['artifacts'].items())
+        ]
+    elif entry['artifacts']:
+        path = next(iter(entry['artifacts'].values()))
+        result[field] = restore_artifact(path, location(ctx))
+    return result
+
+# Relative running time of each stage, used to split a job's time budget
+STAGE_TIME_SHARE = {'thumbnails': 3, 'trailer': 2, 'subtitles': 4, 'metadata': 1}
+
+def stage_budget(name, ctx):
+    """Time budget for a stage starting now, leaving room for the stages after it
+
+    Sequential runs reserve time for every later stage; concurrent runs
+    only for the stages that wait on this one.
+    """
+    if not ctx.get('deadline'):
+        return Budget()
+    names = ctx['stages']
+    if ctx.get('concurrent'):
+        later = [d for d in names if name in STAGE_SOFT_DEPS.get(d, [])]
+    else:
+        later = names[names.index(name) + 1:]
+    share = STAGE_TIME_SHARE.get(name, 1)
+    share = share / float(share + sum(STAGE_TIME_SHARE.get(d, 1) for d in later))
+    return Budget(deadline=ctx['deadline']).split(share)
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+
+def stage_cpus(name, ctx):
+    """Threads a stage may use: its STAGE_CPUS share when stages run side
+    by side, the whole job budget when it runs alone
+    """
+    cpu_budget = ctx.get('cpu_budget') or 1
+    if ctx.get('concurrent'):
+        return min(STAGE_CPUS.get(name, 1), cpu_budget)
+    return cpu_budget
+
+def run_stage(upstream, name, ctx):
+    """Scheduler entry point; keeps stage logging off stdout in worker processes too"""
+    budget = stage_budget(name, ctx)
+    with contextlib.redirect_stdout(sys.stderr), cpu_governor.limit(stage_cpus(name, ctx)):
+        result = STAGE_RUNNERS[name](upstream, dict(ctx, budget=budget))
+    # Stage worker processes exit without running atexit handlers
+    import metrics
+    metrics.flush()
+    if isinstance(result, dict):
+        result.setdefault('stats', {})['peak_rss_mb'] = peak_rss_mb()
+        if budget.degradations:
+            result['degradations'] = budget.degradations
+    return result
+
+def build_stages(names, ctx):
+    """Build the scheduler DAG for the requested stage names"""
+    return [
+        Stage(
+            name, run_stage,
+            soft_deps=[d for d in STAGE_SOFT_DEPS.get(name, []) if d in names],
+            cpus=STAGE_CPUS.get(name, 1),
+            args=(name, ctx),
+        )
+        for name in names
+    ]
+
+def run_pipeline(source, output_dir, stages=None, options=None, cpu_budget=1, on_event=None):
+    """Run the requested stages sharing one probe and one download
+
+    With cpu_budget=1 the stages run one after another in this process;
+    a larger budget runs independent stages concurrently in worker
+    processes (see stage_scheduler). Outputs go to a directory of their
+    own, output_dir/<job_id> (options['job_id'], default: a new unique
+    id), which appears atomically with a manifest.json once the job
+    finishes; options naming thumbnails_dir, trailer_path or
+    subtitles_path write there directly instead.
+    on_event(stage, status, info) reports stage progress. Returns a
+    single result document. options['time_budget'] (seconds) sets a
+    deadline for the whole job; stages degrade quality to meet it and
+    the document lists what they gave up under 'degradations'.
+    options['transcript_index'] names a transcript search index
+    (transcript_index) the published subtitles are added to.
+    options['growing']: source is a local file still being written,
+    complete once <source>.complete exists (growing_file). Scene
+    detection and transcription then consume it as it arrives; the
+    other stages start once it is complete.
+    """
+    import metrics
+    started = time.time()
+    stages = [s for s in STAGE_ORDER if s in (stages or STAGE_ORDER)]
+    options = options or {}
+
+    document = {
+        'success': False,
+        'source': source,
+        'probe': None,
+        'thumbnails': [],
+        'trailer': None,
+        'subtitles': None,
+        'metadata': None,
+        'stages': {},
+    }
+
+    # A growing source may not have been created yet
+    if not is_url(source) and not os.path.exists(source) and not options.get('growing'):
+        document['error'] = f"Invalid input: {source}"
+        return document
+
+    job = JobOutput(output_dir, options.get('job_id'))
+    document['job_id'] = job.job_id
+
+    workspace = Workspace(f"job-{job.job_id}")
+    published = False
+    try:
+        try:
+            video_path = prepare_source(source, workspace, options.get('proxy_source'))
+        except Exception as e:
+            document['error'] = f"Failed to download video: {e}"
+            return document
+
+        growing = bool(options.get('growing')) and not is_url(source)
+        if growing:
+            safe_print("[Pipeline] Source is still being written, starting on what has arrived")
+            probe, growing = wait_for_growing_source(video_path)
+        else:
+            probe = probe_media(video_path)
+        document['probe'] = probe
+        if probe:
+            safe_print(f"[Pipeline] Probed {video_path}: {probe['duration']:.1f}s, "
+                       f"{probe['fps']:.2f} fps, audio={probe['has_audio']}")
+
+        ctx = {
+            'source': source,
+            'video_path': video_path,
+            'hq_source': source if options.get('proxy_source') and is_url(source) else None,
+            'output_dir': job.dir,
+            'probe': probe,
+            'options': options,
+            'stages': stages,
+            'concurrent': cpu_budget > 1,
+            'cpu_budget': cpu_budget,
+            'growing': growing,
+            'deadline': started + options['time_budget'] if options.get('time_budget') else None,
+        }
+
+        def log_event(name, status, info):
+            if status == 'started':
+                safe_print(f"[Pipeline] Running stage: {name}")
+            elif status != 'ok':
+                error = (info.get('error') or '').splitlines()
+                safe_print(f"[Pipeline] Stage {name} {status}: {error[0] if error else ''}")
+            if on_event:
+                on_event(name, status, info)
+
+        def open_store():
+            try:
+                fingerprint = content_fingerprint(video_path, (document['probe'] or {}).get('duration'))
+                document['fingerprint'] = fingerprint
+                return ResultStore(options.get('result_store')), fingerprint
+            except OSError as e:
+                safe_print(f"[Pipeline] Result store disabled, cannot fingerprint source: {e}")
+                return None, None
+
+        # Stages already computed for this content and these parameters;
+        # a growing source has no fingerprint until it is complete
+        store = None
+        completed = {}
+        keys = compute_stage_keys(stages, options)
+        if options.get('use_cache', True) and not growing:
+            store, fingerprint = open_store()
+            for name in (stages if store else []):
+                entry = store.get(fingerprint, name, keys[name])
+                metrics.inc('result_store_lookups', stage=name, result='hit' if entry else 'miss')
+                if entry:
+                    try:
+                        completed[name] = restore_stage(name, entry, ctx)
+                        safe_print(f"[Pipeline] Stage {name} restored from result store")
+                    except OSError as e:
+                        safe_print(f"[Pipeline] Could not restore stored {name}: {e}")
+
+        executor = InlineExecutor() if cpu_budget <= 1 else None
+        report = run_stages(build_stages(stages, ctx), cpu_budget, executor, log_event, completed)
+
+        if growing and growing_file.is_complete(video_path):
+            document['probe'] = probe_media(video_path)
+            if options.get('use_cache', True):
+                store, fingerprint = open_store()
+
+        if store:
+            stored = set(completed)
+            for name in (n for n in STAGE_ORDER if n in stages):
+                stage_report = report['stages'][name]
+                # Degraded output is not what these parameters normally produce
+                if name in completed or stage_report['status'] != 'ok' or stage_report['result'].get('degradations'):
+                    continue
+                # Its key assumes the soft dependencies' stored output, e.g. a real transcript
+                if any(d in stages and d not in stored for d in STAGE_SOFT_DEPS.get(name, [])):
+                    continue
+                try:
+                    store.put(fingerprint, name, keys[name], stage_report['result'],
+                              stage_artifacts(name, stage_report['result']))
+                    stored.add(name)
+                except OSError as e:
+                    safe_print(f"[Pipeline] Could not store {name} result: {e}")
+
+        duration = metrics.duration_bucket((document['probe'] or {}).get('duration'))
+        for name in stages:
+            stage_report = report['stages'][name]
+            status = {
+                'success': stage_report['status'] == 'ok',
+                'elapsed': stage_report['elapsed'],
+                'started': stage_report['started'],
+                # Runnable but held back by the job's cpu budget
+                'waited': round(max(0.0, stage_report['started'] - stage_report['ready']), 3),
+            }
+            if (stage_report['result'] or {}).get('stats'):
+                status['stats'] = stage_report['result']['stats']
+            if (stage_report['result'] or {}).get('degradations'):
+                status['degradations'] = stage_report['result']['degradations']
+                document.setdefault('degradations', []).extend(
+                    dict(d, stage=name) for d in status['degradations']
+                )
+            if name in completed:
+                status['cached'] = True
+            if stage_report['error']:
+                status['error'] = stage_report['error'].splitlines()[0]
+            document['stages'][name] = status
+            metrics.observe('stage_seconds', stage_report['elapsed'], stage=name, duration=duration,
+                            status='cached' if name in completed else stage_report['status'])
+            if name not in completed:
+                metrics.observe('stage_wait_seconds', status['waited'], stage=name, duration=duration)
+            for key, value in (stage_report['result'] or {}).items():
+                if key not in ('success', 'error') and key not in INTERNAL_KEYS:
+                    document[key] = value
+
+        document['schedule'] = {
+            'critical_path': report['critical_path'],
+            'critical_path_seconds': report['critical_path_seconds'],
+            'wall_time': report['wall_time'],
+        }
+        document['success'] = any(s['success'] for s in document['stages'].values())
+        metrics.observe('job_seconds', time.time() - started, duration=duration,
+                        source='url' if is_url(source) else 'file', status='ok' if document['success'] else 'failed')
+        publish_job(job, document)
+        published = True
+        if options.get('transcript_index') and document.get('subtitles'):
+            index_transcript(document, options['transcript_index'])
+        return document
+
+    finally:
+        if not published:
+            job.discard()
+        workspace.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description='Run all processing stages in one process')
+    parser.add_argument('source', help='Local video path or streaming URL')
+    parser.add_argument('output_dir', help='Directory receiving one <job_id> directory per run')
+    parser.add_argument('--stages', default=','.join(STAGE_ORDER),
+                        help='Comma-separated stages to run')
+    parser.add_argument('--num-candidates', type=int, default=20)
+    parser.add_argument('--trailer-mode', default='highlights')
+    parser.add_argument('--cpu-budget', type=int, default=os.cpu_count() or 1,
+                        help='Cores the job may use; independent stages run concurrently within it')
+    parser.add_argument('--result-store', help='Result store directory (default: RESULT_STORE_DIR or backend/.cache/results)')
+    parser.add_argument('--job-id', help='Name of the job directory (default: a new unique id)')
+    parser.add_argument('--no-cache', action='store_true', help='Always recompute every stage')
+    parser.add_argument('--time-budget', type=float,
+                        help='Seconds the whole job may take; stages degrade quality to finish in time')
+    parser.add_argument('--transcript-index', help='Add the transcript to this search index directory')
+    parser.add_argument('--growing', action='store_true',
+                        help='Source is still being written; start now and finish when <source>.complete appears')
+    parser.add_argument('--proxy-source', help='Low-resolution stream of the source, analysed instead of downloading the source')
+    args = parser.parse_args()
+
+    options = {
+        'num_candidates': args.num_candidates,
+        'trailer_mode': args.trailer_mode,
+        'result_store': args.result_store,
+        'use_cache': not args.no_cache,
+        'proxy_source': args.proxy_source,
+        'time_budget': args.time_budget,
+        'job_id': args.job_id,
+        'transcript_index': args.transcript_index,
+        'growing': args.growing,
+    }
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+
+    try:
+        # Stage scripts log to stdout, keep it clean for the JSON document
+        with contextlib.redirect_stdout(sys.stderr):
+            document = run_pipeline(args.source, args.output_dir, stages, options, args.cpu_budget)
+    except Exception as e:
+        safe_print(f"[Pipeline] FATAL ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        document = {'success': False, 'source': args.source, 'error': str(e)}
+
+    print(json.dumps(document, ensure_ascii=False))
+    sys.exit(0 if document.get('success') else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', '.cache', 'results')
+
+# Sampled-block fingerprint: a few evenly spaced blocks instead of a full read
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 16
+
+def content_fingerprint(path, duration=None, block_size=SAMPLE_BLOCK_SIZE, blocks=SAMPLE_BLOCKS):
+    """Fingerprint a media file from its size, duration and sampled blocks
+
+    Reads at most blocks * block_size bytes whatever the file size; the
+    first and last blocks are always included.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"size={size};duration={round(duration or 0.0, 3)};".encode('ascii'))
+
+    with open(path, 'rb') as f:
+        if size <= block_size * blocks:
+            digest.update(f.read())
+        else:
+            last = size - block_size
+            for i in range(blocks):
+                f.seek(last * i // (blocks - 1))
+                digest.update(f.read(block_size))
+
+    return f"{size:x}-{digest.hexdigest()}"
+
+def stage_key(stage, params, upstream_keys=()):
+    """Key for one stage's output: its parameters plus the keys it consumed"""
+    payload = json.dumps({
+        'stage': stage,
+        'params': params,
+        'upstream': list(upstream_keys),
+    }, sort_keys=True)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=12).hexdigest()
+
+class ResultStore:
+    """Stage results on local disk, keyed by content fingerprint and stage key
+
+    Layout: <root>/<fingerprint>/<stage>-<key>/ holding result.json and
+    the stage's artifact files. Entries are published with an atomic
+    rename, so readers never see a partial entry.
+    """
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get('RESULT_STORE_DIR') or DEFAULT_STORE_DIR)
+
+    def _entry_dir(self, fingerprint, stage, key):
+        return os.path.join(self.root, fingerprint, f"{stage}-{key}")
+
+    def get(self, fingerprint, stage, key):
+        """Return the stored result with artifact names resolved to store paths, or None"""
+        entry_dir = self._entry_dir(fingerprint, stage, key)
+        try:
+            with open(os.path.join(entry_dir, 'result.json'), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        artifacts = {name: os.path.join(entry_dir, name) for name in entry.get('artifacts', [])}
+        if not all(os.path.exists(p) for p in artifacts.values()):
+            return None
+        return {'result': entry['result'], 'artifacts': artifacts, 'stored_at': entry.get('stored_at')}
+
+    def put(self, fingerprint, stage, key, result, files=()):
+        """Store a stage result and copies of its artifact files"""
+        entry_dir = self._entry_dir(fingerprint, stage, key)
+        staging = f"{entry_dir}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(staging)
+        try:
+            names = []
+            for path in files:
+                name = os.path.basename(path)
+                _link_or_copy(path, os.path.join(staging, name))
+                names.append(name)
+
+            with open(os.path.join(staging, 'result.json'), 'w', encoding='utf-8') as f:
+                json.dump({'result': result, 'artifacts': names, 'stored_at': time.time()}, f, ensure_ascii=False)
+
+            if os.path.exists(entry_dir):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(staging, entry_dir)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+def _link_or_copy(src, dst):
+    """Hard-link when possible (same filesystem), otherwise copy"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def restore_artifact(stored_path, dest_path):
+    """Place a stored artifact at dest_path, replacing what is there"""
+    dest_dir = os.path.dirname(dest_path)
+    if dest_dir:
+        os.makedirs(dest_dir, exist_ok=True)
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    _link_or_copy(stored_path, dest_path)
+    return dest_path
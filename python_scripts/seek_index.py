@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import bisect
+import hashlib
+import subprocess
+from shutil import which
+
+import cpu_governor
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.seekidx.json'
+FALLBACK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', '.cache', 'seek_index')
+
+def available():
+    return which('ffprobe') is not None and which('ffmpeg') is not None
+
+def _fallback_path(video_path):
+    digest = hashlib.sha1(os.path.abspath(video_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(FALLBACK_DIR, digest + INDEX_SUFFIX)
+
+def build_index(video_path, timeout=600):
+    """Scan the first video stream's packets with ffprobe (demux only, no decode)
+
+    Returns {'pts': [...], 'pos': [...], 'keyframes': [...], ...} with
+    packets sorted into presentation order, so list position == frame number.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,start_time:packet=pts_time,pos,flags',
+        '-of', 'json', video_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip()[-300:]}")
+    data = json.loads(result.stdout)
+
+    packets = []
+    for packet in data.get('packets', []):
+        try:
+            pts = float(packet['pts_time'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        pos = int(packet['pos']) if str(packet.get('pos', '')).isdigit() else -1
+        packets.append((pts, pos, 'K' in packet.get('flags', '')))
+    packets.sort()
+
+    stream = (data.get('streams') or [{}])[0]
+    try:
+        start_time = float(stream.get('start_time'))
+    except (TypeError, ValueError):
+        start_time = packets[0][0] if packets else 0.0
+
+    stat = os.stat(video_path)
+    return {
+        'version': INDEX_VERSION,
+        'source_size': stat.st_size,
+        'source_mtime': int(stat.st_mtime),
+        'width': int(stream.get('width') or 0),
+        'height': int(stream.get('height') or 0),
+        'start_time': start_time,
+        'pts': [p[0] for p in packets],
+        'pos': [p[1] for p in packets],
+        'keyframes': [i for i, p in enumerate(packets) if p[2]],
+    }
+
+def _is_current(index, video_path):
+    stat = os.stat(video_path)
+    return (index.get('version') == INDEX_VERSION
+            and index.get('source_size') == stat.st_size
+            and index.get('source_mtime') == int(stat.st_mtime))
+
+def load_or_build_index(video_path):
+    """Load the index stored next to the source (or in the cache dir), building it if stale"""
+    candidates = [video_path + INDEX_SUFFIX, _fallback_path(video_path)]
+    for path in candidates:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if _is_current(index, video_path):
+                return index
+        except (OSError, ValueError):
+            continue
+
+    index = build_index(video_path)
+    for path in candidates:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp, path)
+            break
+        except OSError:
+            continue
+    return index
+
+class IndexedFrameReader:
+    """Frame-accurate random access using a seek index
+
+    Each read seeks ffmpeg to the target's presentation time, which
+    lands on the nearest preceding keyframe and decodes forward only to
+    the target. Reads in increasing order keep decoding forward from the
+    current position when the target is in the same GOP or closer than
+    max_forward frames, instead of seeking again. Frames come back as
+    BGR arrays, optionally scaled to max_width inside ffmpeg.
+    """
+
+    def __init__(self, video_path, index=None, max_width=None, max_forward=None):
+        self.video_path = video_path
+        self.index = index or load_or_build_index(video_path)
+        self.pts = self.index['pts']
+        self.keyframes = self.index['keyframes']
+        self.frame_count = len(self.pts)
+
+        width, height = self.index['width'], self.index['height']
+        if max_width and width > max_width:
+            height = int(round(height * max_width / float(width) / 2)) * 2
+            width = max_width
+        self.width, self.height = width, height
+        self.frame_bytes = width * height * 3
+
+        if max_forward is None:
+            gaps = [b - a for a, b in zip(self.keyframes, self.keyframes[1:])]
+            max_forward = max(gaps) if gaps else 250
+        self.max_forward = max_forward
+
+        self.process = None
+        self.next_frame = None
+        self.seeks = 0
+        self.decoded = 0
+
+    def keyframe_before(self, frame_number):
+        i = bisect.bisect_right(self.keyframes, frame_number) - 1
+        return self.keyframes[i] if i >= 0 else 0
+
+    def timestamp(self, frame_number):
+        """Presentation time of a frame, relative to the stream start"""
+        return self.pts[frame_number] - self.index['start_time']
+
+    def _seek_time(self, frame_number):
+        # Midway to the previous frame, so rounding can neither drop the
+        # target nor let the previous frame through
+        t = self.timestamp(frame_number)
+        if frame_number > 0:
+            t -= (self.pts[frame_number] - self.pts[frame_number - 1]) / 2.0
+        return max(0.0, t)
+
+    def _start(self, frame_number):
+        self._stop()
+        vf = ['-vf', f"scale={self.width}:{self.height}"] if self.width != self.index['width'] else []
+        cmd = [
+            'ffmpeg', '-v', 'error', '-nostdin', *cpu_governor.ffmpeg_threads(),
+            '-ss', f"{self._seek_time(frame_number):.6f}", '-i', self.video_path,
+            '-an', '-sn', '-vsync', 'passthrough', *vf,
+            '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1'
+        ]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.next_frame = frame_number
+        self.seeks += 1
+
+    def _stop(self):
+        if self.process:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.stdout.close()
+            self.process.wait()
+        self.process = None
+        self.next_frame = None
+
+    def _read_raw(self):
+        buf = bytearray(self.frame_bytes)
+        view = memoryview(buf)
+        filled = 0
+        while filled < self.frame_bytes:
+            n = self.process.stdout.readinto(view[filled:])
+            if not n:
+                return None
+            filled += n
+        self.next_frame += 1
+        self.decoded += 1
+        return buf
+
+    def read(self, frame_number):
+        """Return the BGR frame at frame_number (presentation order), or None"""
+        import numpy as np
+
+        if frame_number < 0 or frame_number >= self.frame_count:
+            return None
+
+        reuse = (
+            self.process is not None
+            and self.next_frame <= frame_number
+            and (self.keyframe_before(frame_number) <= self.next_frame
+                 or frame_number - self.next_frame <= self.max_forward)
+        )
+        if not reuse:
+            self._start(frame_number)
+
+        while self.next_frame < frame_number:
+            if self._read_raw() is None:
+                self._stop()
+                return None
+
+        raw = self._read_raw()
+        if raw is None:
+            self._stop()
+            return None
+        return np.frombuffer(raw, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def close(self):
+        self._stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class CaptureFrameReader:
+    """Same interface as IndexedFrameReader on top of OpenCV seeking (fallback)"""
+
+    def __init__(self, video_path, max_width=None):
+        import cv2
+        self.cap = cv2.VideoCapture(video_path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"Cannot open video: {video_path}")
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.max_width = max_width
+
+    def read(self, frame_number):
+        import cv2
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        ret, frame = self.cap.read()
+        if not ret or frame is None:
+            return None
+        h, w = frame.shape[:2]
+        if self.max_width and w > self.max_width:
+            scale = self.max_width / float(w)
+            frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def close(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_frame_reader(video_path, max_width=None):
+    """IndexedFrameReader when ffmpeg/ffprobe are usable, else CaptureFrameReader
+
+    Set SEEK_INDEX=0 to force the OpenCV path.
+    """
+    if available() and os.environ.get('SEEK_INDEX', '1') != '0' and not video_path.startswith('http'):
+        try:
+            reader = IndexedFrameReader(video_path, max_width=max_width)
+            if reader.frame_count > 0:
+                return reader
+        except Exception:
+            pass
+    return CaptureFrameReader(video_path, max_width=max_width)
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+class Stage:
+    """A unit of work in the job DAG
+
+    func is called as func(upstream, *args) where upstream maps each
+    dependency name to its result dict. A failed hard dependency (deps)
+    skips the stage; soft_deps only order it and pass their results on,
+    successful or not. cpus is the share of the job's CPU budget the
+    stage occupies while it runs.
+    """
+
+    def __init__(self, name, func, deps=(), soft_deps=(), cpus=1, args=()):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.soft_deps = tuple(soft_deps)
+        self.cpus = max(1, int(cpus))
+        self.args = tuple(args)
+
+    @property
+    def all_deps(self):
+        return self.deps + self.soft_deps
+
+class InlineExecutor:
+    """Executor that runs each submission immediately in the calling process"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+def _run_stage(func, upstream, args):
+    """Worker-side wrapper: never raises, reports timing measured in the worker"""
+    started = time.time()
+    try:
+        result = func(upstream, *args)
+        error = None
+    except Exception as e:
+        result = None
+        error = f"{type(e).__name__}: {e}\n{traceback.format_exc()}"
+    return result, error, started, time.time()
+
+def validate_stages(stages):
+    """Check names are unique, deps exist and the graph is acyclic"""
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage: {stage.name}")
+        by_name[stage.name] = stage
+
+    for stage in stages:
+        for dep in stage.all_deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+
+    visiting, done = set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through stage {name}")
+        visiting.add(name)
+        for dep in by_name[name].all_deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+    return by_name
+
+def critical_path(stages, timings):
+    """Longest chain of dependent stages by measured duration
+
+    Returns (names, seconds). Skipped stages count as zero duration.
+    """
+    by_name = {s.name: s for s in stages}
+    memo = {}
+
+    def longest(name):
+        if name not in memo:
+            own = timings.get(name, 0.0)
+            best = ([], 0.0)
+            for dep in by_name[name].all_deps:
+                candidate = longest(dep)
+                if candidate[1] > best[1]:
+                    best = candidate
+            memo[name] = (best[0] + [name], best[1] + own)
+        return memo[name]
+
+    path, seconds = [], 0.0
+    for stage in stages:
+        candidate = longest(stage.name)
+        if candidate[1] > seconds:
+            path, seconds = candidate
+    return path, round(seconds, 3)
+
+def run_stages(stages, cpu_budget=None, executor=None, on_event=None, completed=None):
+    """Run a DAG of stages, starting each as soon as its dependencies finish
+
+    Independent stages run concurrently in separate processes as long as
+    the sum of their cpus fits in cpu_budget (a stage larger than the
+    budget still runs, alone). A failing stage never aborts other
+    branches. on_event(name, status, info) is called in this process
+    when a stage starts, finishes or is skipped. completed maps stage
+    names to results obtained elsewhere (e.g. a cache); those stages
+    are not run and count as successful.
+
+    Stage times are seconds since the call: ready (dependencies done),
+    queued (handed to the executor), started, finished.
+    Returns {'stages': {name: {...}}, 'critical_path': [...],
+    'critical_path_seconds': s, 'wall_time': s}.
+    """
+    by_name = validate_stages(stages)
+    cpu_budget = max(1, int(cpu_budget or os.cpu_count() or 1))
+
+    job_started = time.time()
+    results = {}
+    queued = {}
+    pending = [s.name for s in stages]
+
+    own_executor = executor is None
+    if own_executor:
+        to_run = len([n for n in pending if n not in (completed or {})])
+        executor = ProcessPoolExecutor(max_workers=max(1, min(cpu_budget, to_run)))
+    running = {}
+    cpus_in_use = 0
+
+    def emit(name, status, info=None):
+        if on_event:
+            try:
+                on_event(name, status, info or {})
+            except Exception:
+                pass
+
+    def record(name, status, result=None, error=None, started=None, finished=None):
+        started = started if started is not None else time.time()
+        finished = finished if finished is not None else started
+        # Runnable from here on; any later start waited for cpus or a process
+        ready = max([0.0] + [results[d]['finished'] for d in by_name[name].all_deps if d in results])
+        results[name] = {
+            'status': status,
+            'result': result,
+            'error': error,
+            'ready': ready,
+            'queued': round(queued.get(name, started) - job_started, 3),
+            'started': round(started - job_started, 3),
+            'finished': round(finished - job_started, 3),
+            'elapsed': round(finished - started, 3),
+        }
+        emit(name, status, results[name])
+
+    for name, result in (completed or {}).items():
+        if name in pending:
+            pending.remove(name)
+            record(name, 'ok', result, started=job_started, finished=job_started)
+
+    try:
+        while pending or running:
+            progressed = False
+            for name in list(pending):
+                stage = by_name[name]
+                if any(dep not in results for dep in stage.all_deps):
+                    continue
+
+                failed = [d for d in stage.deps if results[d]['status'] != 'ok']
+                if failed:
+                    pending.remove(name)
+                    record(name, 'skipped', error=f"Dependency failed: {', '.join(failed)}")
+                    progressed = True
+                    continue
+
+                cpus = min(stage.cpus, cpu_budget)
+                if running and cpus_in_use + cpus > cpu_budget:
+                    continue
+
+                upstream = {d: results[d]['result'] for d in stage.all_deps}
+                queued[name] = time.time()
+                emit(name, 'started')
+                future = executor.submit(_run_stage, stage.func, upstream, stage.args)
+                running[future] = (name, cpus)
+                cpus_in_use += cpus
+                pending.remove(name)
+                progressed = True
+
+            if progressed and not running:
+                continue
+            if not running:
+                break
+
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, cpus = running.pop(future)
+                cpus_in_use -= cpus
+                try:
+                    result, error, started, finished = future.result()
+                except Exception as e:
+                    # The worker process itself died
+                    result, error = None, f"{type(e).__name__}: {e}"
+                    started = finished = time.time()
+
+                ok = error is None and not (isinstance(result, dict) and result.get('success') is False)
+                if error is None and not ok:
+                    error = result.get('error', 'Stage reported failure')
+                record(name, 'ok' if ok else 'failed', result, error, started, finished)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+
+    timings = {name: r['elapsed'] for name, r in results.items()}
+    path, seconds = critical_path(stages, timings)
+    return {
+        'stages': results,
+        'critical_path': path,
+        'critical_path_seconds': seconds,
+        'wall_time': round(time.time() - job_started, 3),
+    }
@@ -2,6 +2,12 @@
 import sys
 import os
 import subprocess
+import time
+
+import growing_file
+import cpu_governor
+from deadline import Budget
+from media_probe import probe_media
 
 sys.stdout.reconfigure(encoding='utf-8')
 os.environ['PYTHONIOENCODING'] = 'utf-8'
@@ -29,62 +35,183 @@ def extract_audio(video_path, audio_temp):
     """Extract audio from video using FFmpeg"""
     safe_print(f"[Subtitle] Extracting audio from video...")
     
+    import ffmpeg_runner
     try:
-        result = subprocess.run([
-            'ffmpeg', '-i', video_path, '-q:a', '9', '-n', audio_temp
-        ], capture_output=True, text=True, timeout=120)
+        result = ffmpeg_runner.run([
+            'ffmpeg', *cpu_governor.ffmpeg_threads(), '-i', video_path, '-q:a', '9', '-n', audio_temp
+        ], timeout=120, label='audio',
+            on_progress=ffmpeg_runner.progress_printer(safe_print, "[Subtitle] Extracted audio:"))
         
-        if result.returncode == 0 and os.path.exists(audio_temp):
+        if result['status'] == 'ok' and os.path.exists(audio_temp):
             safe_print(f"[Subtitle] Audio extracted successfully")
             return True
         else:
-            safe_print(f"[Subtitle] FFmpeg audio extraction failed")
+            safe_print(f"[Subtitle] FFmpeg audio extraction failed: {ffmpeg_runner.error_summary(result)}")
             return False
     except Exception as e:
         safe_print(f"[Subtitle] Error extracting audio: {e}")
         return False
 
-def generate_subtitles_with_whisper(video_path, output_path):
-    """Try to generate subtitles using Whisper"""
+# Growing sources are transcribed this many seconds of audio at a time
+STREAM_CHUNK_SECONDS = 30
+WHISPER_SAMPLE_RATE = 16000
+
+def stream_audio(video_path, chunk_seconds=STREAM_CHUNK_SECONDS, growing=True):
+    """Yield (offset_seconds, samples) of mono 16 kHz float32 audio, chunk by chunk
+
+    With growing, video_path is fed to ffmpeg as it is written
+    (growing_file) and chunks come as soon as enough audio arrived.
+    """
+    import numpy as np
+
+    cmd = ['ffmpeg', '-v', 'error', '-nostdin', *cpu_governor.ffmpeg_threads(), '-i', 'pipe:0' if growing else video_path,
+           '-vn', '-ac', '1', '-ar', str(WHISPER_SAMPLE_RATE), '-f', 's16le', 'pipe:1']
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE if growing else subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    feeder = growing_file.Feeder(video_path, process.stdin) if growing else None
+    chunk_bytes = int(chunk_seconds * WHISPER_SAMPLE_RATE) * 2
+    offset = 0.0
+    try:
+        while True:
+            raw = growing_file.read_exactly(process.stdout, chunk_bytes)
+            if len(raw) >= 2:
+                samples = np.frombuffer(raw[:len(raw) // 2 * 2], dtype=np.int16).astype(np.float32) / 32768.0
+                yield offset, samples
+                offset += len(samples) / float(WHISPER_SAMPLE_RATE)
+            if len(raw) < chunk_bytes:
+                break
+    finally:
+        if feeder:
+            feeder.cancel()
+        process.kill()
+        process.stdout.close()
+        process.wait()
+    if feeder:
+        feeder.join()
+        if feeder.error:
+            raise feeder.error
+
+def transcribe_growing(model, video_path, chunk_seconds=STREAM_CHUNK_SECONDS):
+    """Whisper segments of a file still being written, transcribed chunk by chunk as it arrives"""
+    segments = []
+    for offset, samples in stream_audio(video_path, chunk_seconds):
+        safe_print(f"[Subtitle] Transcribing audio from {offset:.0f}s...")
+        result = model.transcribe(samples, language='en', verbose=False, fp16=False)
+        for segment in result.get('segments', []):
+            segments.append(dict(segment, start=segment.get('start', 0) + offset, end=segment.get('end', 0) + offset))
+    return segments
+
+def transcribe_batched(video_path, model_name, growing=False):
+    """Whisper segments from the worker pool's shared batch server
+
+    Raises whisper_batcher.BatcherUnavailable when there is none, or it
+    holds another model; the caller then loads its own.
+    """
+    import whisper_batcher
+    if not whisper_batcher.server_address():
+        raise whisper_batcher.BatcherUnavailable('no batch server')
+    safe_print(f"[Subtitle] Transcribing on the shared Whisper batch server...")
+    chunks = stream_audio(video_path, whisper_batcher.WINDOW_SECONDS, growing)
+    try:
+        return whisper_batcher.transcribe_chunks(chunks, model_name)
+    finally:
+        chunks.close()
+
+def write_srt(segments, output_path):
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for i, segment in enumerate(segments, 1):
+            start = format_time_srt(segment.get('start', 0))
+            end = format_time_srt(segment.get('end', 0))
+            text = segment.get('text', '').strip()
+            
+            if text:  # Only write non-empty segments
+                f.write(f"{i}\n{start} --> {end}\n{text}\n\n")
+
+# Loaded Whisper models, kept for the life of the process (worker_pool reuses them)
+_MODEL_CACHE = {}
+
+def load_whisper_model(model_name):
+    """Load a Whisper model on CPU, reusing one already loaded in this process"""
+    if model_name not in _MODEL_CACHE:
+        import whisper
+        # torch sizes its thread pools on import; hold it to the budget
+        cpu_governor.configure_torch()
+        _MODEL_CACHE[model_name] = whisper.load_model(model_name, device='cpu')  # Force CPU
+    return _MODEL_CACHE[model_name]
+
+# Whisper models from smallest to largest, with CPU seconds per second of
+# audio used until this process has timed a transcription itself
+WHISPER_MODELS = ['tiny', 'base', 'small', 'medium', 'large']
+WHISPER_CPU_SECONDS_PER_SECOND = {'tiny': 0.1, 'base': 0.2, 'small': 0.6, 'medium': 1.8, 'large': 3.5}
+
+# Seconds per second of audio measured in this process, by model
+_MEASURED_RATES = {}
+
+def transcription_rate(model_name):
+    return _MEASURED_RATES.get(model_name, WHISPER_CPU_SECONDS_PER_SECOND.get(model_name, 1.0))
+
+def choose_whisper_model(requested, duration, budget):
+    """Largest model up to `requested` whose transcription fits the budget, or None"""
+    if not budget.limited or not duration or requested not in WHISPER_MODELS:
+        return requested
+    candidates = WHISPER_MODELS[:WHISPER_MODELS.index(requested) + 1]
+    for model_name in reversed(candidates):
+        if budget.allows(duration * transcription_rate(model_name)):
+            return model_name
+    return None
+
+def generate_subtitles_with_whisper(video_path, output_path, model_name=None, duration=None, growing=False):
+    """Try to generate subtitles using Whisper
+
+    growing: video_path is still being written; its audio is transcribed
+    in STREAM_CHUNK_SECONDS chunks while it arrives.
+    """
     safe_print(f"[Subtitle] Attempting Whisper transcription...")
     
+    # Use tiny model for fastest processing (good enough for subtitles)
+    model_name = model_name or os.environ.get('WHISPER_MODEL', 'tiny')
+    import metrics
+    import whisper_batcher
+    try:
+        started = time.time()
+        segments = transcribe_batched(video_path, model_name, growing)
+        # Not a measured rate: the time includes waiting for other jobs' windows
+        if duration and not growing:
+            metrics.observe('whisper_realtime_factor', (time.time() - started) / duration, model=model_name, mode='batched')
+        return write_whisper_srt(segments, output_path)
+    except whisper_batcher.BatcherUnavailable as e:
+        if whisper_batcher.server_address():
+            safe_print(f"[Subtitle] Batch server not used: {e}")
+    except Exception as e:
+        safe_print(f"[Subtitle] Batched transcription failed, transcribing locally: {e}")
+    
     try:
         import whisper
         
-        # Use tiny model for fastest processing (good enough for subtitles)
-        model_name = os.environ.get('WHISPER_MODEL', 'tiny')
         safe_print(f"[Subtitle] Loading Whisper model: {model_name}")
         
+        # The model that actually runs, for the measured rate
+        ran = model_name
         try:
-            model = whisper.load_model(model_name, device='cpu')  # Force CPU
+            model = load_whisper_model(model_name)
         except Exception as e:
             safe_print(f"[Subtitle] Warning: Could not load model '{model_name}': {e}")
             safe_print(f"[Subtitle] Trying fallback model: tiny")
-            model = whisper.load_model('tiny', device='cpu')
+            ran = 'tiny'
+            model = load_whisper_model(ran)
         
         safe_print(f"[Subtitle] Transcribing audio (this may take a while)...")
-        result = model.transcribe(video_path, language='en', verbose=False)
-        
-        segments = result.get('segments', [])
-        
-        if not segments:
-            safe_print(f"[Subtitle] Whisper returned no segments")
-            return False
-        
-        safe_print(f"[Subtitle] Got {len(segments)} segments, writing SRT...")
-        
-        # Write SRT file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            for i, segment in enumerate(segments, 1):
-                start = format_time_srt(segment.get('start', 0))
-                end = format_time_srt(segment.get('end', 0))
-                text = segment.get('text', '').strip()
-                
-                if text:  # Only write non-empty segments
-                    f.write(f"{i}\n{start} --> {end}\n{text}\n\n")
+        started = time.time()
+        if growing:
+            segments = transcribe_growing(model, video_path)
+        else:
+            result = model.transcribe(video_path, language='en', verbose=False)
+            if duration:
+                _MEASURED_RATES[ran] = (time.time() - started) / duration
+                metrics.observe('whisper_realtime_factor', _MEASURED_RATES[ran], model=ran, mode='local')
+            segments = result.get('segments', [])
         
-        safe_print(f"✓ Subtitles generated via Whisper: {output_path}")
-        return True
+        return write_whisper_srt(segments, output_path)
     
     except ImportError:
         safe_print(f"[Subtitle] Whisper not installed or import failed")
@@ -95,23 +222,27 @@ def generate_subtitles_with_whisper(video_path, output_path):
         traceback.print_exc()
         return False
 
-def generate_placeholder_subtitles(video_path, output_path):
+def write_whisper_srt(segments, output_path):
+    if not segments:
+        safe_print(f"[Subtitle] Whisper returned no segments")
+        return False
+    
+    safe_print(f"[Subtitle] Got {len(segments)} segments, writing SRT...")
+    
+    write_srt(segments, output_path)
+    
+    safe_print(f"✓ Subtitles generated via Whisper: {output_path}")
+    return True
+
+def generate_placeholder_subtitles(video_path, output_path, probe=None):
     """Generate placeholder subtitles with video duration info"""
     safe_print(f"[Subtitle] Generating placeholder subtitles...")
     
-    try:
-        import cv2
-        
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            safe_print(f"[Subtitle] Cannot determine video duration")
-            duration = 60
-        else:
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            duration = frame_count / fps if fps > 0 else 60
-            cap.release()
-    except:
+    probe = probe or probe_media(video_path)
+    if probe and probe.get('duration', 0) > 0:
+        duration = probe['duration']
+    else:
+        safe_print(f"[Subtitle] Cannot determine video duration")
         duration = 60
     
     # Create SRT with placeholder content
@@ -137,15 +268,16 @@ def generate_placeholder_subtitles(video_path, output_path):
     safe_print(f"[Subtitle] Placeholder subtitles created (install Whisper for AI transcription)")
     return True
 
-def main():
-    # Validate arguments
-    if len(sys.argv) < 3:
-        safe_print("Usage: python subtitle_generator.py <video_path> <output_path>")
-        sys.exit(1)
-    
-    video_path = sys.argv[1]
-    output_path = sys.argv[2]
-    
+def generate_subtitles(video_path, output_path, probe=None, budget=None, growing=False):
+    """Generate subtitles with Whisper, falling back to placeholders
+
+    budget: deadline.Budget; picks a smaller Whisper model, or
+    placeholders, when the requested one would not finish in time.
+    Placeholders, for whatever reason, are recorded as a degradation.
+    growing: video_path is still being written (growing_file) and is
+    transcribed as it arrives; placeholders wait for it to complete.
+    """
+    budget = budget or Budget()
     # Ensure output directory exists
     output_dir = os.path.dirname(output_path)
     if output_dir:
@@ -156,21 +288,40 @@ def main():
     safe_print(f"  Output: {output_path}")
     
     try:
-        # Try Whisper first
-        success = generate_subtitles_with_whisper(video_path, output_path)
+        # Try Whisper first, with the largest model the budget allows
+        requested = os.environ.get('WHISPER_MODEL', 'tiny')
+        probe = probe or probe_media(video_path)
+        # A growing file's probe only covers what has arrived so far
+        duration = None if growing else (probe or {}).get('duration')
+        model_name = choose_whisper_model(requested, duration, budget)
+        
+        if model_name is None:
+            safe_print(f"[Subtitle] No Whisper model fits the time budget")
+            budget.degrade('whisper_model', f"{requested} -> placeholder")
+            success = False
+        else:
+            if model_name != requested:
+                safe_print(f"[Subtitle] Using Whisper model '{model_name}' to fit the time budget")
+                budget.degrade('whisper_model', f"{requested} -> {model_name}")
+            success = generate_subtitles_with_whisper(video_path, output_path, model_name, duration, growing)
         
         # Fall back to placeholder if Whisper fails
+        if not success and growing:
+            growing_file.wait_until_complete(video_path)
+            probe = probe_media(video_path)
         if not success:
             safe_print(f"[Subtitle] Falling back to placeholder subtitles...")
-            success = generate_placeholder_subtitles(video_path, output_path)
+            if model_name is not None:
+                budget.degrade('whisper_model', f"{model_name} failed -> placeholder")
+            success = generate_placeholder_subtitles(video_path, output_path, probe)
         
         if success and os.path.exists(output_path):
             file_size = os.path.getsize(output_path)
             safe_print(f"✓ Subtitles saved ({file_size} bytes)")
-            sys.exit(0)
-        else:
-            safe_print(f"[Subtitle] ERROR: Could not generate subtitles")
-            sys.exit(1)
+            return True
+        
+        safe_print(f"[Subtitle] ERROR: Could not generate subtitles")
+        return False
     
     except Exception as e:
         safe_print(f"[Subtitle] FATAL ERROR: {e}")
@@ -178,11 +329,23 @@ def main():
         traceback.print_exc()
         
         # Last resort: create empty placeholder
+        budget.degrade('whisper_model', "error -> placeholder")
         try:
-            generate_placeholder_subtitles(video_path, output_path)
-            sys.exit(0)
+            return generate_placeholder_subtitles(video_path, output_path, probe)
         except:
-            sys.exit(1)
+            return False
+
+def main():
+    # Validate arguments
+    if len(sys.argv) < 3:
+        safe_print("Usage: python subtitle_generator.py <video_path> <output_path>")
+        sys.exit(1)
+    
+    video_path = sys.argv[1]
+    output_path = sys.argv[2]
+    
+    success = generate_subtitles(video_path, output_path)
+    sys.exit(0 if success else 1)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
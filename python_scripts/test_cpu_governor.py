@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import types
+import tempfile
+
+import pytest
+
+import cpu_governor
+import frame_server
+import pipeline
+
+@pytest.fixture(autouse=True)
+def no_budget(monkeypatch):
+    """Every test starts, and leaves this process, without a budget"""
+    for name in (cpu_governor.BUDGET_ENV,) + cpu_governor.THREAD_ENV_VARS:
+        monkeypatch.delenv(name, raising=False)
+
+def test_workers_get_disjoint_core_slices():
+    cores = list(range(8))
+    slices = [cpu_governor.worker_cores(i, 3, cores) for i in range(3)]
+    assert slices == [[0, 1, 2], [3, 4, 5], [6, 7]]
+    assert [cpu_governor.worker_cores(i, 4, [0, 1]) for i in range(4)] == [[0], [1], [0], [1]]
+    assert cpu_governor.worker_cores(0, 1, cores) == cores
+
+def test_limit_applies_to_every_pool_and_restores():
+    cv2 = pytest.importorskip('cv2')
+    calls = []
+    fake_torch = types.SimpleNamespace(
+        get_num_threads=lambda: 8,
+        set_num_threads=lambda n: calls.append(('intra', n)),
+        set_num_interop_threads=lambda n: calls.append(('interop', n)),
+    )
+    before = cv2.getNumThreads()
+    assert cpu_governor.ffmpeg_threads() == []
+
+    sys.modules['torch'] = fake_torch
+    try:
+        with cpu_governor.limit(3):
+            assert cv2.getNumThreads() == 3
+            assert os.environ['OMP_NUM_THREADS'] == '3'
+            assert cpu_governor.ffmpeg_threads() == ['-threads', '3']
+            assert frame_server.FrameServer('in.mp4').ffmpeg_command()[:6] == \
+                ['ffmpeg', '-v', 'error', '-nostdin', '-threads', '3']
+            assert cpu_governor.clamp(8) == 3
+            assert cpu_governor.clamp(2) == 2
+    finally:
+        del sys.modules['torch']
+
+    assert calls == [('intra', 3), ('interop', cpu_governor.TORCH_INTEROP_THREADS), ('intra', 8)]
+    assert cv2.getNumThreads() == before
+    assert cpu_governor.current() is None
+    assert 'OMP_NUM_THREADS' not in os.environ
+    assert '-threads' not in frame_server.FrameServer('in.mp4').ffmpeg_command()
+
+def test_stages_run_under_their_share_of_the_job_budget(monkeypatch):
+    seen = {}
+
+    def runner(name):
+        def run(upstream, ctx):
+            seen[name] = (cpu_governor.current(), os.environ.get('OMP_NUM_THREADS'))
+            return {'success': True}
+        return run
+
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: {'duration': 12.0, 'fps': 25.0, 'has_audio': True})
+    monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', {name: runner(name) for name in pipeline.STAGE_ORDER})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'video.mp4')
+        open(source, 'wb').close()
+        document = pipeline.run_pipeline(source, os.path.join(tmp, 'out'), options={'use_cache': False})
+
+    # Sequential: each stage has the whole (single-core) job to itself
+    assert document['success']
+    assert seen == {name: (1, '1') for name in pipeline.STAGE_ORDER}
+    assert cpu_governor.current() is None
+
+    concurrent = {'cpu_budget': 4, 'concurrent': True}
+    assert pipeline.stage_cpus('subtitles', concurrent) == 2
+    assert pipeline.stage_cpus('thumbnails', concurrent) == 1
+    assert pipeline.stage_cpus('subtitles', {'cpu_budget': 1, 'concurrent': False}) == 1
+    assert pipeline.stage_cpus('trailer', {'cpu_budget': 3, 'concurrent': False}) == 3
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import types
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+from deadline import Budget, RateMeter
+import pipeline
+import subtitle_generator
+import whisper_batcher
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_budget_split_and_degradations_are_shared():
+    clock = FakeClock()
+    budget = Budget(seconds=100, clock=clock)
+    child = budget.split(0.25)
+    assert child.remaining() == 25
+    assert budget.allows(60) and not budget.allows(60, share=0.5)
+
+    clock.now += 30
+    assert child.expired() and budget.remaining() == 70
+    child.degrade('num_candidates', '20 -> 10')
+    assert budget.degradations == [{'what': 'num_candidates', 'detail': '20 -> 10'}]
+
+    unlimited = Budget()
+    assert not unlimited.limited and unlimited.allows(1e9) and not unlimited.split(0.1).expired()
+
+def test_rate_meter_projects_from_measured_work():
+    clock = FakeClock()
+    meter = RateMeter(clock)
+    assert meter.estimate(5, default=None) is None
+    for seconds in (2.0, 4.0):
+        meter.start()
+        clock.now += seconds
+        meter.stop()
+    assert meter.per_unit() == 3.0
+    assert meter.estimate(5) == 15.0
+
+def test_whisper_model_steps_down_to_fit(monkeypatch):
+    monkeypatch.setattr(subtitle_generator, '_MEASURED_RATES', {})
+    budget = Budget(seconds=100)
+    # 300s of audio: small needs ~180s, base ~60s
+    assert subtitle_generator.choose_whisper_model('small', 300, budget) == 'base'
+    assert subtitle_generator.choose_whisper_model('small', 300, Budget()) == 'small'
+    assert subtitle_generator.choose_whisper_model('tiny', 3000, budget) is None
+
+    # A measured rate replaces the table
+    subtitle_generator._MEASURED_RATES['small'] = 0.2
+    assert subtitle_generator.choose_whisper_model('small', 300, budget) == 'small'
+
+def test_fallback_model_rate_is_recorded_under_the_model_that_ran(monkeypatch):
+    class TinyModel:
+        def transcribe(self, path, **kwargs):
+            return {'segments': [{'start': 0.0, 'end': 1.0, 'text': 'hello'}]}
+
+    def load(name):
+        if name != 'tiny':
+            raise RuntimeError('out of memory')
+        return TinyModel()
+
+    monkeypatch.setitem(sys.modules, 'whisper', types.ModuleType('whisper'))
+    monkeypatch.setattr(subtitle_generator, 'load_whisper_model', load)
+    monkeypatch.setattr(subtitle_generator, '_MEASURED_RATES', {})
+    monkeypatch.delenv(whisper_batcher.SOCKET_ENV, raising=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        srt = os.path.join(tmp, 'out.srt')
+        assert subtitle_generator.generate_subtitles_with_whisper('clip.mp4', srt, 'medium', duration=60)
+    assert list(subtitle_generator._MEASURED_RATES) == ['tiny']
+
+def test_placeholder_subtitles_are_a_degradation(monkeypatch):
+    monkeypatch.delenv('WHISPER_MODEL', raising=False)
+    monkeypatch.setattr(subtitle_generator, 'generate_subtitles_with_whisper', lambda *args: False)
+    budget = Budget()
+    with tempfile.TemporaryDirectory() as tmp:
+        srt = os.path.join(tmp, 'out.srt')
+        assert subtitle_generator.generate_subtitles('clip.mp4', srt, probe={'duration': 30.0}, budget=budget)
+    assert budget.degradations == [{'what': 'whisper_model', 'detail': 'tiny failed -> placeholder'}]
+
+def test_stage_budgets_leave_room_for_later_stages():
+    ctx = {'deadline': Budget(seconds=100).deadline, 'stages': list(pipeline.STAGE_ORDER), 'concurrent': False}
+    # Sequential: thumbnails gets 3 of 3+2+4+1 shares
+    assert 29 <= pipeline.stage_budget('thumbnails', ctx).remaining() <= 30
+    assert 99 <= pipeline.stage_budget('metadata', ctx).remaining() <= 100
+
+    ctx['concurrent'] = True
+    # Concurrent: only metadata waits on subtitles
+    assert 79 <= pipeline.stage_budget('subtitles', ctx).remaining() <= 80
+    assert 99 <= pipeline.stage_budget('trailer', ctx).remaining() <= 100
+    assert not pipeline.stage_budget('trailer', dict(ctx, deadline=None)).limited
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_tight_budget_still_returns_every_output(tmp_path):
+    pytest.importorskip('cv2')
+    video = str(tmp_path / 'clip.mp4')
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=20:size=640x360:rate=25',
+        '-f', 'lavfi', '-i', 'sine=duration=20', '-shortest', '-pix_fmt', 'yuv420p', video
+    ], check=True, timeout=120)
+
+    document = pipeline.run_pipeline(
+        video, str(tmp_path / 'out'), options={'time_budget': 4, 'use_cache': False}
+    )
+
+    assert all(s['success'] for s in document['stages'].values()), document['stages']
+    assert len(document['thumbnails']) == 10
+    assert document['trailer'] and document['subtitles'] and document['metadata']
+    assert document['degradations']
+    assert {d['stage'] for d in document['degradations']} <= set(pipeline.STAGE_ORDER)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+np = pytest.importorskip('numpy')
+
+import face_engine
+from face_engine import FaceEngine
+from bench_face_engine import draw_face, synthetic_frames, compare, baseline_detect
+
+def face_frame(cx=320, cy=180, size=110, width=640, height=360):
+    frame = np.full((height, width, 3), (90, 110, 90), np.uint8)
+    draw_face(frame, cx, cy, size)
+    return cv2.GaussianBlur(frame, (5, 5), 0)
+
+def test_boxes_are_reported_at_the_original_scale():
+    frame = face_frame()
+    result = FaceEngine().detect(frame)
+    assert result['count'] == 1 and result['method'] == 'detected'
+    (x, y, w, h), = result['boxes']
+    (bx, by, bw, bh), = baseline_detect(frame)
+    assert abs(x - bx) <= 8 and abs(y - by) <= 8 and abs(w - bw) <= 12
+
+    # Same face in a frame twice as large: boxes scale with it
+    big = cv2.resize(frame, (1280, 720))
+    (x2, y2, w2, h2), = FaceEngine().detect(big)['boxes']
+    assert abs(x2 - 2 * x) <= 12 and abs(w2 - 2 * w) <= 16
+
+def test_prefilter_skips_blank_and_skinless_frames(monkeypatch):
+    engine = FaceEngine()
+    calls = []
+    monkeypatch.setattr(engine, '_detect', lambda *a, **k: calls.append(1) or [])
+
+    assert engine.detect(np.full((360, 640, 3), 20, np.uint8))['method'] == 'prefiltered'
+    blue = np.zeros((360, 640, 3), np.uint8)
+    blue[:, :, 0] = np.tile(np.linspace(0, 255, 640, dtype=np.uint8), (360, 1))
+    assert engine.detect(blue)['method'] == 'prefiltered'
+    assert calls == []
+    assert engine.stats['prefiltered'] == 2
+
+def test_nearby_frames_track_instead_of_redetecting():
+    engine = FaceEngine(max_track_gap=10)
+    methods = []
+    for i in range(8):
+        result = engine.detect(face_frame(cx=300 + 3 * i), position=5 * i)
+        assert result['count'] == 1
+        methods.append(result['method'])
+    assert methods[0] == 'detected'
+    assert methods[1:6] == ['tracked'] * 5
+    assert methods[6] == 'detected'  # periodic full detection finds new faces
+
+    # A gap beyond max_track_gap is a fresh start
+    assert engine.detect(face_frame(), position=500)['method'] == 'detected'
+
+def test_lost_face_falls_back_to_full_detection():
+    engine = FaceEngine()
+    engine.detect(face_frame(cx=160), position=0)
+    result = engine.detect(face_frame(cx=480), position=1)
+    assert result['method'] == 'detected' and result['count'] == 1
+    assert result['boxes'][0][0] > 320
+
+def test_agrees_with_full_size_detection_on_synthetic_shots():
+    frames, positions = synthetic_frames(96, seed=3)
+    report = compare(frames, positions)
+    assert report['presence_agreement'] == 1.0
+    assert report['mean_iou'] > 0.7
+    assert report['stats']['tracked'] > 0 and report['stats']['prefiltered'] > 0
+
+def test_cascade_is_loaded_once():
+    assert face_engine.load_cascade() is face_engine.load_cascade()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+
+import pytest
+
+import ffmpeg_runner
+from ffmpeg_runner import FfmpegManager, parse_progress, with_progress, error_summary
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+
+def _realtime(seconds, output='-'):
+    """ffmpeg command taking about `seconds` of wall time"""
+    return ['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=size=160x120:rate=10:duration={seconds},realtime',
+            '-f', 'null' if output == '-' else 'mp4', '-y', output]
+
+def _ffmpeg_children():
+    """Pids of ffmpeg processes started by this process"""
+    pids = []
+    for path in glob.glob(f"/proc/{os.getpid()}/task/*/children"):
+        with open(path) as f:
+            pids.extend(f.read().split())
+    found = []
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/comm") as f:
+                if f.read().strip() == 'ffmpeg':
+                    found.append(pid)
+        except OSError:
+            pass
+    return found
+
+@pytest.fixture(autouse=True)
+def slot_dir(tmp_path, monkeypatch):
+    """Machine-wide slots of this test only"""
+    monkeypatch.setenv(ffmpeg_runner.SLOT_DIR_ENV, str(tmp_path / 'slots'))
+    return tmp_path / 'slots'
+
+def test_progress_blocks_become_events():
+    fields = {'frame': '50', 'fps': '24.5', 'out_time_us': '2000000', 'total_size': '1024',
+              'speed': '1.98x', 'progress': 'continue'}
+    event = parse_progress(fields, duration=8.0)
+    assert event == {'out_time': 2.0, 'speed': 1.98, 'fps': 24.5, 'frame': 50, 'total_size': 1024,
+                     'done': False, 'fraction': 0.25}
+    assert parse_progress({'out_time_us': 'N/A', 'speed': 'N/A', 'progress': 'end'})['done']
+    assert parse_progress({'out_time_ms': '1500000'})['out_time'] == 1.5
+
+    assert with_progress(['ffmpeg', '-i', 'a.mp4', 'b.mp4'])[:4] == ['ffmpeg', '-progress', 'pipe:1', '-nostats']
+    assert with_progress(['ffprobe', 'a.mp4']) == ['ffprobe', 'a.mp4']
+    assert error_summary({'stderr': 'one\n\ntwo\nthree\nfour', 'status': 'failed'}) == 'two | three | four'
+    assert error_summary({'stderr': '', 'status': 'failed', 'returncode': 1}) == 'exit code 1'
+
+@requires_ffmpeg
+def test_run_reports_progress_and_bounded_stderr():
+    events = []
+    result = FfmpegManager().run(
+        ['ffmpeg', '-f', 'lavfi', '-i', 'testsrc=size=160x120:rate=25:duration=3', '-f', 'null', '-'],
+        on_progress=events.append, duration=3.0, label='probe'
+    )
+    assert result['status'] == 'ok' and result['returncode'] == 0
+    assert events and events[-1]['done'] and events[-1]['label'] == 'probe'
+    assert abs(events[-1]['out_time'] - 3.0) < 0.2 and events[-1]['fraction'] > 0.9
+    assert result['progress'] == events[-1]
+
+    # -v debug writes hundreds of lines; only the tail is kept
+    failed = FfmpegManager().run(['ffmpeg', '-v', 'debug', '-i', '/nonexistent/input.mp4', '-f', 'null', '-'])
+    assert failed['status'] == 'failed'
+    assert len(failed['stderr'].splitlines()) <= ffmpeg_runner.STDERR_LINES
+    assert 'No such file' in failed['stderr']
+
+    missing = FfmpegManager().run(['/nonexistent/ffmpeg', '-version'])
+    assert missing['status'] == 'failed' and missing['returncode'] is None
+
+@requires_ffmpeg
+def test_concurrency_limit_and_timeout(monkeypatch):
+    monkeypatch.setenv(ffmpeg_runner.CONCURRENCY_ENV, '2')
+    manager = FfmpegManager()
+    started = time.time()
+    results = manager.run_many([_realtime(1) for _ in range(4)])
+    elapsed = time.time() - started
+    assert [r['status'] for r in results] == ['ok'] * 4
+    assert manager.peak_running == 2
+    # Two rounds of two, not four in a row
+    assert 1.8 < elapsed < 3.6
+
+    started = time.time()
+    result = manager.run(_realtime(30), timeout=0.5)
+    assert result['status'] == 'timeout'
+    assert time.time() - started < ffmpeg_runner.KILL_GRACE_SECONDS + 2
+    assert manager.running == 0
+
+@requires_ffmpeg
+def test_limit_is_shared_across_processes_and_probes_do_not_wait(monkeypatch):
+    monkeypatch.setenv(ffmpeg_runner.CONCURRENCY_ENV, '1')
+    # Another process holds the only slot
+    held = ffmpeg_runner.try_slot(1)
+    assert held is not None and ffmpeg_runner.try_slot(1) is None
+    manager = FfmpegManager()
+    future = manager.submit(_realtime(0.5))
+    time.sleep(0.6)
+    assert not future.done() and manager.running == 1
+
+    # ffprobe runs meanwhile
+    probe = manager.run(['ffprobe', '-v', 'error', '-f', 'lavfi', 'testsrc=duration=1'], timeout=10)
+    assert probe['status'] == 'ok'
+
+    ffmpeg_runner.release_slot(held)
+    started = time.time()
+    assert future.result(10)['status'] == 'ok'
+    assert time.time() - started > 0.4
+    # Separate managers (processes) take turns for the one slot
+    other = FfmpegManager()
+    started = time.time()
+    futures = [manager.submit(_realtime(1)), other.submit(_realtime(1))]
+    assert [f.result(10)['status'] for f in futures] == ['ok', 'ok']
+    assert time.time() - started > 1.8
+
+@requires_ffmpeg
+@pytest.mark.skipif(not os.path.exists('/proc/self/task'), reason='needs /proc')
+def test_cancelling_stops_the_process():
+    async def main():
+        task = asyncio.ensure_future(ffmpeg_runner.arun(_realtime(30)))
+        await asyncio.sleep(0.5)
+        assert _ffmpeg_children()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    deadline = time.time() + ffmpeg_runner.KILL_GRACE_SECONDS + 2
+    while _ffmpeg_children() and time.time() < deadline:
+        time.sleep(0.05)
+    assert _ffmpeg_children() == []
+
+    future = ffmpeg_runner.manager().submit(_realtime(30))
+    time.sleep(0.3)
+    ffmpeg_runner.manager().cancel_all(timeout=10)
+    assert future.cancelled()
+    assert _ffmpeg_children() == []
+
+@requires_ffmpeg
+def test_trailer_segments_encode_concurrently(monkeypatch):
+    import trailer_generator
+    monkeypatch.setenv(ffmpeg_runner.CONCURRENCY_ENV, '2')
+    monkeypatch.setattr(ffmpeg_runner, '_MANAGER', [])
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=8:size=320x240:rate=25',
+            '-f', 'lavfi', '-i', 'sine=duration=8', '-shortest', '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+        output = os.path.join(tmp, 'trailer.mp4')
+        assert trailer_generator.create_trailer_from_segments(video, output, [(0, 1.5), (2, 3.5), (4, 5.5), (6, 7.5)])
+        assert ffmpeg_runner.manager().peak_running == 2
+        assert abs(trailer_generator.get_video_duration(output) - 6.0) < 0.3
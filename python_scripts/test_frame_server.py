@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+
+from frame_server import FrameServer, FrameSubscriber, iter_frames
+
+def make_video(path, seconds=4, rate=25, size='640x360'):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi',
+        '-i', f'testsrc=duration={seconds}:size={size}:rate={rate}',
+        '-pix_fmt', 'yuv420p', path
+    ], check=True, timeout=60)
+    return path
+
+def consume(handle, results, delay=0.0):
+    import time
+    subscriber = FrameSubscriber(handle)
+    seqs, sums = [], []
+    for seq, pts, frame in subscriber:
+        seqs.append(seq)
+        sums.append(int(frame.sum()))
+        if delay:
+            time.sleep(delay)
+    subscriber.close()
+    results.put((handle['consumer'], seqs, sums))
+
+def test_consumers_in_other_processes_share_one_decode():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'))
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+
+        server = FrameServer(video, width=160, height=90, fps=5, pix_fmt='gray', num_slots=4)
+        try:
+            every_frame = server.subscribe()
+            one_per_second = server.subscribe(sample_fps=1)
+            workers = [
+                ctx.Process(target=consume, args=(every_frame, results, 0.02)),
+                ctx.Process(target=consume, args=(one_per_second, results)),
+            ]
+            for w in workers:
+                w.start()
+            server.start()
+            collected = dict((c, (s, v)) for c, s, v in (results.get(timeout=60) for _ in workers))
+            for w in workers:
+                w.join(10)
+            assert server.wait(10)
+        finally:
+            server.close()
+
+    all_seqs, all_sums = collected[every_frame['consumer']]
+    sampled_seqs, sampled_sums = collected[one_per_second['consumer']]
+
+    # A 4-slot ring and a slow consumer: nothing is dropped or overwritten early
+    assert all_seqs == list(range(20))
+    assert sampled_seqs == [0, 5, 10, 15]
+    assert sampled_sums == [all_sums[i] for i in sampled_seqs]
+
+def test_iter_frames_scales_inside_ffmpeg():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'), seconds=2)
+        frames = [(pts, frame.copy()) for pts, frame in iter_frames(video, 320, 180, fps=2)]
+
+    assert [pts for pts, _ in frames] == [0.0, 0.5, 1.0, 1.5]
+    assert all(frame.shape == (180, 320) and frame.dtype == np.uint8 for _, frame in frames)
+
+def test_bgr_frames_and_decode_errors():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'), seconds=1)
+        _, frame = next(iter_frames(video, 64, 36, fps=1, pix_fmt='bgr24'))
+        assert frame.shape == (36, 64, 3)
+
+        with pytest.raises(RuntimeError):
+            list(iter_frames(os.path.join(tmp, 'missing.mp4')))
+
+def test_chatty_decoder_does_not_stall_on_stderr():
+    import sys
+    import frame_server
+
+    class Chatty(FrameServer):
+        """Writes far more than a pipe buffer to stderr before its frames, then fails"""
+
+        def ffmpeg_command(self):
+            script = ("import sys\n"
+                      "for i in range(20000): sys.stderr.write('corrupt packet %d\\n' % i)\n"
+                      f"sys.stdout.buffer.write(bytes({self.frame_bytes * 3}))\n"
+                      "sys.exit(1)\n")
+            return [sys.executable, '-c', script]
+
+    server = Chatty('unused', 64, 36)
+    try:
+        server.start()
+        server.wait(20)
+        assert not server._thread.is_alive()
+        assert server.header[frame_server.H_WRITE_SEQ] == 3
+        assert server.header[frame_server.H_EOF] == 2
+        assert server.error.endswith('corrupt packet 19999')
+        assert server.error.count('\n') < frame_server.STDERR_LINES
+    finally:
+        server.close()
+
+def test_subscriber_timeout_is_wall_clock_and_backs_off(monkeypatch):
+    import time
+    import types
+    import frame_server
+
+    sleeps = []
+
+    def slow_sleep(seconds):
+        # A loaded machine: every sleep overshoots
+        sleeps.append(seconds)
+        time.sleep(seconds + 0.01)
+    monkeypatch.setattr(frame_server, 'time', types.SimpleNamespace(sleep=slow_sleep, monotonic=time.monotonic))
+
+    # Never started: no frame ever arrives
+    server = FrameServer('unused', 64, 36)
+    try:
+        subscriber = FrameSubscriber(server.subscribe(), timeout=0.3)
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            next(iter(subscriber))
+        assert time.monotonic() - started < 1.0
+        assert len(sleeps) < 30 and max(sleeps) <= frame_server.MAX_POLL_SECONDS
+        subscriber.close()
+    finally:
+        server.close()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+import growing_file
+import subtitle_generator
+import thumbnail_generator
+from growing_file import GrowingFileReader, IngestAborted
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+
+class ChunkedWriter(threading.Thread):
+    """Appends a file's bytes to path in chunks, like an upload, then marks it complete"""
+
+    def __init__(self, source_bytes, path, chunk_size=65536, delay=0.02, abort=False):
+        super().__init__(daemon=True)
+        self.data = source_bytes
+        self.path = path
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.abort = abort
+        self.finished_at = None
+
+    def run(self):
+        with open(self.path, 'wb') as out:
+            for start in range(0, len(self.data), self.chunk_size):
+                out.write(self.data[start:start + self.chunk_size])
+                out.flush()
+                time.sleep(self.delay)
+        self.finished_at = time.time()
+        if self.abort:
+            growing_file.mark_aborted(self.path, 'connection reset')
+        else:
+            growing_file.mark_complete(self.path)
+
+def _make_video(path, fragmented=True):
+    """12 s, three shots (dark, bright, pattern) with 11 s of tone, 5 fps"""
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', 'color=c=0x202020:size=160x90:rate=5:duration=4',
+        '-f', 'lavfi', '-i', 'color=c=0xe0e0e0:size=160x90:rate=5:duration=4',
+        '-f', 'lavfi', '-i', 'testsrc2=size=160x90:rate=5:duration=4',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:duration=11',
+        '-filter_complex', '[0:v][1:v][2:v]concat=n=3:v=1[v]', '-map', '[v]', '-map', '3:a',
+        '-g', '5', '-pix_fmt', 'yuv420p', '-c:a', 'aac',
+    ] + (['-movflags', 'frag_keyframe+empty_moov+default_base_moof'] if fragmented else []) + [path],
+        check=True, timeout=120)
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_reader_waits_for_data_until_complete():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'upload.bin')
+        data = os.urandom(300000)
+        writer = ChunkedWriter(data, path, chunk_size=30000, delay=0.03)
+        writer.start()
+
+        received, first_at = b'', None
+        with GrowingFileReader(path, poll=0.01) as reader:
+            while True:
+                chunk = reader.read(50000)
+                if not chunk:
+                    break
+                first_at = first_at or time.time()
+                received += chunk
+        writer.join()
+        assert received == data
+        # Reading started long before the writer was done
+        assert first_at < writer.finished_at - 0.1
+
+def test_aborted_and_stalled_writers_raise():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'aborted.bin')
+        writer = ChunkedWriter(b'x' * 1000, path, chunk_size=100, abort=True)
+        writer.start()
+        with pytest.raises(IngestAborted, match='connection reset'):
+            with GrowingFileReader(path, poll=0.01) as reader:
+                while reader.read(100):
+                    pass
+        with pytest.raises(IngestAborted):
+            growing_file.wait_until_complete(path)
+
+        stalled = os.path.join(tmp, 'stalled.bin')
+        with open(stalled, 'wb') as f:
+            f.write(b'partial')
+        with pytest.raises(TimeoutError):
+            with GrowingFileReader(stalled, idle_timeout=0.3, poll=0.01) as reader:
+                while reader.read(100):
+                    pass
+
+@requires_ffmpeg
+def test_streamable_containers_are_recognised():
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, fragmented in (('fragmented.mp4', True), ('plain.mp4', False)):
+            path = os.path.join(tmp, name)
+            _make_video(path, fragmented)
+            growing_file.mark_complete(path)
+            assert growing_file.is_streamable(path) == fragmented, name
+
+@requires_ffmpeg
+def test_scenes_detected_while_video_arrives():
+    pytest.importorskip('cv2')
+    with tempfile.TemporaryDirectory() as tmp:
+        complete = os.path.join(tmp, 'complete.mp4')
+        data = _make_video(complete)
+        expected = thumbnail_generator.detect_scene_changes(complete, threshold=0.3, max_scenes=5, fps=5.0)
+        assert [round(s['timestamp']) for s in expected] == [4, 8]
+
+        path = os.path.join(tmp, 'upload.mp4')
+        writer = ChunkedWriter(data, path, chunk_size=max(1, len(data) // 20), delay=0.1)
+        writer.start()
+        scenes = thumbnail_generator.detect_scene_changes(path, threshold=0.3, max_scenes=5, fps=5.0, growing=True)
+        writer.join()
+        assert [(s['timestamp'], round(s['diff'], 3)) for s in scenes] == \
+            [(s['timestamp'], round(s['diff'], 3)) for s in expected]
+
+        # Without a frame rate the timestamps still place the cuts
+        scenes = thumbnail_generator.detect_scene_changes(path, threshold=0.3, max_scenes=5, growing=True)
+        assert [s['timestamp'] for s in scenes] == [s['timestamp'] for s in expected]
+        assert all(s['frame'] is None for s in scenes)
+
+@requires_ffmpeg
+def test_growing_thumbnails_without_a_probe_take_fps_from_the_arriving_file(monkeypatch):
+    pytest.importorskip('cv2')
+    detect = thumbnail_generator.detect_scene_changes
+    rates = []
+
+    def recording_detect(*args, **kwargs):
+        rates.append(kwargs.get('fps'))
+        return detect(*args, **kwargs)
+    monkeypatch.setattr(thumbnail_generator, 'detect_scene_changes', recording_detect)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = _make_video(os.path.join(tmp, 'complete.mp4'))
+        path = os.path.join(tmp, 'upload.mp4')
+        writer = ChunkedWriter(data, path, chunk_size=max(1, len(data) // 20), delay=0.1)
+        writer.start()
+        # Wait for the stream header
+        while not os.path.exists(path) or os.path.getsize(path) < len(data) // 10:
+            time.sleep(0.05)
+        count = thumbnail_generator.generate_smart_thumbnails(path, os.path.join(tmp, 'thumbs'), 10, growing=True)
+        writer.join()
+    assert count > 0
+    assert rates == [5.0]
+
+@requires_ffmpeg
+def test_transcription_runs_chunk_by_chunk_while_video_arrives():
+    np = pytest.importorskip('numpy')
+
+    class StubModel:
+        """Whisper stand-in: one segment per chunk, recording when it was called"""
+        def __init__(self):
+            self.calls = []
+
+        def transcribe(self, audio, **kwargs):
+            self.calls.append((time.time(), len(audio), float(np.abs(audio).mean())))
+            seconds = len(audio) / float(subtitle_generator.WHISPER_SAMPLE_RATE)
+            return {'segments': [{'start': 0.0, 'end': seconds, 'text': f" chunk {len(self.calls)}"}]}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        data = _make_video(os.path.join(tmp, 'source.mp4'))
+        path = os.path.join(tmp, 'upload.mp4')
+        writer = ChunkedWriter(data, path, chunk_size=max(1, len(data) // 20), delay=0.1)
+        writer.start()
+        model = StubModel()
+        segments = subtitle_generator.transcribe_growing(model, path, chunk_seconds=4)
+        writer.join()
+
+        assert [s['text'] for s in segments] == [' chunk 1', ' chunk 2', ' chunk 3']
+        assert [s['start'] for s in segments] == [0.0, 4.0, 8.0]
+        assert abs(segments[-1]['end'] - 11.0) < 0.2
+        # Audio, not silence, and the first chunk before the upload finished
+        assert all(level > 0.01 for _, _, level in model.calls)
+        assert model.calls[0][0] < writer.finished_at
+
+        srt = os.path.join(tmp, 'subtitles.srt')
+        subtitle_generator.write_srt(segments, srt)
+        with open(srt, encoding='utf-8') as f:
+            assert '00:00:04,000 --> 00:00:08,000\nchunk 2' in f.read()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import subprocess
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPTS = [
+    'thumbnail_generator',
+    'trailer_generator',
+    'subtitle_generator',
+    'metadata_generator',
+    'youtube_downloader',
+    'pipeline',
+    'worker_pool',
+    'transcript_index',
+    'growing_file',
+    'cpu_governor',
+    'perceptual_hash',
+    'whisper_batcher',
+    'load_harness',
+    'metrics',
+]
+
+# Modules that must only be loaded when the work actually needs them
+HEAVY_MODULES = {'cv2', 'numpy', 'yt_dlp', 'torch', 'whisper', 'nltk', 'dotenv', 'asyncio'}
+
+# Startup budget per script (cumulative import time of the module itself)
+BUDGET_MS = float(os.environ.get('IMPORT_TIME_BUDGET_MS', '150'))
+
+def measure_import(module_name):
+    """Import a script under -X importtime and return (cumulative_ms, imported modules)"""
+    cmd = [sys.executable, '-X', 'importtime', '-c', f'import {module_name}']
+
+    # First run writes the .pyc so the measured run reflects a warm start
+    subprocess.run(cmd, cwd=SCRIPTS_DIR, capture_output=True, text=True, timeout=60)
+    result = subprocess.run(cmd, cwd=SCRIPTS_DIR, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+    cumulative_ms = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].strip()
+        imported.add(name.split('.')[0])
+        if name == module_name:
+            cumulative_ms = int(parts[1].strip()) / 1000.0
+
+    assert cumulative_ms is not None, f"{module_name} not found in importtime output"
+    return cumulative_ms, imported
+
+def test_scripts_do_not_import_heavy_modules():
+    for name in SCRIPTS:
+        _, imported = measure_import(name)
+        loaded = sorted(HEAVY_MODULES & imported)
+        assert not loaded, f"{name} imports {loaded} at startup"
+
+def test_scripts_import_within_budget():
+    for name in SCRIPTS:
+        cumulative_ms, _ = measure_import(name)
+        assert cumulative_ms <= BUDGET_MS, (
+            f"{name} took {cumulative_ms:.1f}ms to import (budget {BUDGET_MS:.0f}ms)"
+        )
+
+if __name__ == '__main__':
+    for name in SCRIPTS:
+        ms, imported = measure_import(name)
+        heavy = sorted(HEAVY_MODULES & imported)
+        print(f"{name:22s} {ms:8.1f}ms  heavy={heavy or '-'}")
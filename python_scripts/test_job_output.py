@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import pipeline
+import job_output
+from job_output import JobOutput, read_manifest, unique_name
+
+FAKE_PROBE = {'duration': 12.0, 'fps': 25.0, 'frame_count': 300, 'has_audio': True}
+
+def _job_runners():
+    """Stage runners writing files whose content names the source they came from"""
+    def thumbnails(upstream, ctx):
+        out_dir = pipeline.thumbnails_dir(ctx)
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(out_dir, f'thumb_{i + 1:02d}.jpg'))
+            with open(paths[-1], 'w') as f:
+                f.write(f"{ctx['source']}#{i}")
+        return {'success': True, 'thumbnails': paths}
+
+    def trailer(upstream, ctx):
+        path = pipeline.trailer_path(ctx)
+        with open(path, 'w') as f:
+            f.write(ctx['source'])
+        return {'success': True, 'trailer': path}
+
+    def subtitles(upstream, ctx):
+        path = pipeline.subtitles_path(ctx)
+        with open(path, 'w') as f:
+            f.write(ctx['source'])
+        return {'success': True, 'subtitles': path}
+
+    def metadata(upstream, ctx):
+        return {'success': True, 'metadata': {'title': ctx['source']}}
+
+    return {'thumbnails': thumbnails, 'trailer': trailer,
+            'subtitles': subtitles, 'metadata': metadata}
+
+def test_parallel_jobs_share_no_outputs(monkeypatch):
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: FAKE_PROBE)
+    monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', _job_runners())
+    # run_stage redirects stdout per stage; threads may leave it swapped, restore it after
+    monkeypatch.setattr(sys, 'stdout', sys.stdout)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sources = []
+        for i in range(6):
+            sources.append(os.path.join(tmp, f'video{i}.mp4'))
+            with open(sources[-1], 'wb') as f:
+                f.write(os.urandom(1024))
+        out = os.path.join(tmp, 'jobs')
+
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            documents = list(pool.map(
+                lambda s: pipeline.run_pipeline(s, out, options={'use_cache': False}), sources
+            ))
+
+        job_ids = [d['job_id'] for d in documents]
+        assert len(set(job_ids)) == len(sources)
+        assert sorted(os.listdir(out)) == sorted(job_ids + [job_output.STAGING_DIR])
+        assert os.listdir(os.path.join(out, job_output.STAGING_DIR)) == []
+
+        for source, document in zip(sources, documents):
+            job_dir = os.path.join(out, document['job_id'])
+            assert document['job_dir'] == job_dir
+            outputs = document['thumbnails'] + [document['trailer'], document['subtitles']]
+            for path in outputs:
+                assert path.startswith(job_dir + os.sep)
+                with open(path) as f:
+                    assert f.read().startswith(source)
+
+            manifest = read_manifest(job_dir)
+            assert manifest['job_id'] == document['job_id']
+            assert manifest['source'] == source
+            assert sorted(f['path'] for f in manifest['files']) == [
+                'subtitles.srt', 'thumbnails/thumb_01.jpg', 'thumbnails/thumb_02.jpg',
+                'thumbnails/thumb_03.jpg', 'trailer.mp4'
+            ]
+
+def test_job_is_invisible_until_published():
+    with tempfile.TemporaryDirectory() as tmp:
+        job = JobOutput(tmp, 'job-a')
+        with open(os.path.join(job.dir, 'trailer.mp4'), 'wb') as f:
+            f.write(b'x' * 10)
+        assert not os.path.exists(os.path.join(tmp, 'job-a'))
+        assert job.final_path(os.path.join(job.dir, 'trailer.mp4')) == os.path.join(tmp, 'job-a', 'trailer.mp4')
+
+        manifest = job.publish({'source': 'in.mp4', 'success': True, 'stages': {'trailer': {'success': True}}})
+        assert manifest['files'] == [{
+            'path': 'trailer.mp4', 'size': 10, 'sha256': hashlib.sha256(b'x' * 10).hexdigest(),
+        }]
+        with open(os.path.join(tmp, 'job-a', 'manifest.json')) as f:
+            assert json.load(f)['stages'] == {'trailer': True}
+
+        with pytest.raises(FileExistsError):
+            JobOutput(tmp, 'job-a')
+
+def test_failed_job_leaves_nothing_behind(monkeypatch):
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: FAKE_PROBE)
+    def broken(*args):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(pipeline, 'run_stages', broken)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'video.mp4')
+        open(source, 'wb').close()
+        out = os.path.join(tmp, 'jobs')
+        with pytest.raises(RuntimeError):
+            pipeline.run_pipeline(source, out, options={'use_cache': False})
+        assert os.listdir(os.path.join(out, job_output.STAGING_DIR)) == []
+
+def test_unique_names_do_not_collide():
+    names = {unique_name('video') for _ in range(1000)}
+    assert len(names) == 1000
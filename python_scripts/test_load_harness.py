@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+
+import pytest
+
+import load_harness
+from load_harness import MediaServer, parse_range, percentile, arrival_times
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+
+def test_ranges_percentiles_and_arrivals():
+    assert parse_range(None, 100) is None
+    assert parse_range('bytes=10-19', 100) == (10, 19)
+    assert parse_range('bytes=90-', 100) == (90, 99)
+    assert parse_range('bytes=-5', 100) == (95, 99)
+    assert parse_range('bytes=50-500', 100) == (50, 99)
+    with pytest.raises(ValueError):
+        parse_range('bytes=100-', 100)
+
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile(list(range(101)), 95) == 95
+    assert percentile([0, 10], 99) == pytest.approx(9.9)
+
+    times = arrival_times(2000, 60.0, random.Random(3))
+    assert times[0] == 0.0 and times == sorted(times)
+    # One arrival per second on average
+    assert abs(times[-1] / len(times) - 1.0) < 0.1
+    assert load_harness.parse_weights('url=3,upload') == [('url', 3.0), ('upload', 1.0)]
+
+def test_media_server_serves_byte_ranges():
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.urandom(300000)
+        with open(os.path.join(tmp, 'clip.mp4'), 'wb') as f:
+            f.write(data)
+        server = MediaServer(tmp).start()
+        try:
+            with urlopen(f"{server.url}/clip.mp4?expire=1") as response:
+                assert response.status == 200 and response.read() == data
+            request = Request(f"{server.url}/clip.mp4", headers={'Range': 'bytes=1000-1999'})
+            with urlopen(request) as response:
+                assert response.status == 206
+                assert response.headers['Content-Range'] == f"bytes 1000-1999/{len(data)}"
+                assert response.read() == data[1000:2000]
+            with urlopen(Request(f"{server.url}/clip.mp4", method='HEAD')) as response:
+                assert int(response.headers['Content-Length']) == len(data)
+            for path, headers, code in [('/clip.mp4', {'Range': 'bytes=999999-'}, 416), ('/missing.mp4', {}, 404)]:
+                with pytest.raises(HTTPError) as e:
+                    urlopen(Request(server.url + path, headers=headers))
+                assert e.value.code == code
+            assert server.requests == 5
+            assert server.bytes_sent == len(data) + 1000
+        finally:
+            server.close()
+
+@requires_ffmpeg
+def test_stub_extractor_resolves_fake_urls_to_the_server(monkeypatch):
+    import youtube_downloader
+    with tempfile.TemporaryDirectory() as tmp:
+        library = load_harness.make_library(tmp, [2], size='640x480')
+        assert library['clip_2s']['proxy_height'] == 240
+        server = MediaServer(tmp).start()
+        monkeypatch.setenv(load_harness.MEDIA_URL_ENV, server.url)
+        try:
+            result = youtube_downloader.get_video_stream_urls(
+                load_harness.FAKE_URL_PREFIX + 'clip_2s', extractor=load_harness.stub_extract, cache=False
+            )
+            assert result['url'].startswith(f"{server.url}/clip_2s.mp4?expire=")
+            assert '/clip_2s_proxy.mp4' in result['proxy_url']
+            assert result['has_audio'] and result['duration'] == 2 and result['expires_at']
+
+            path = load_harness.fetch(result['url'], tmp)
+            assert os.path.getsize(path) == os.path.getsize(os.path.join(tmp, 'clip_2s.mp4'))
+            with pytest.raises(Exception, match='max-filesize'):
+                load_harness.fetch(result['url'], tmp, max_bytes=1000)
+            with pytest.raises(Exception, match='Video unavailable'):
+                youtube_downloader.get_video_stream_urls(
+                    load_harness.FAKE_URL_PREFIX + 'nope', extractor=load_harness.stub_extract, cache=False
+                )
+        finally:
+            server.close()
+
+@requires_ffmpeg
+def test_url_and_upload_jobs_run_through_the_pool(monkeypatch):
+    pytest.importorskip('cv2')
+    import worker_pool
+    with tempfile.TemporaryDirectory() as tmp:
+        library_dir = os.path.join(tmp, 'library')
+        load_harness.make_library(library_dir, [4], size='640x480')
+        server = MediaServer(library_dir).start()
+        monkeypatch.setenv(load_harness.MEDIA_URL_ENV, server.url)
+        pool = worker_pool.WorkerPool(1, handlers=load_harness.HANDLERS, warmup=None)
+        sampler = load_harness.ResourceSampler(pool, interval=0.2)
+        sampler.start()
+        try:
+            specs = [{'index': 0, 'arrival': 0.0, 'kind': 'url', 'duration': 4},
+                     {'index': 1, 'arrival': 0.2, 'kind': 'upload', 'duration': 4}]
+            options = {'stages': ['thumbnails', 'subtitles'], 'cpu_budget': 1, 'library': library_dir,
+                       'upload_bandwidth': 2e6, 'keep_output': False}
+            records, wall = load_harness.run_load(pool, specs, tmp, options)
+        finally:
+            sampler.stop()
+            pool.close(drain=False)
+            server.close()
+
+        assert [r['success'] for r in records] == [True, True], [r['error'] for r in records]
+        # One worker: the upload waited for the URL job
+        assert records[1]['pool_wait'] > 0
+        assert records[0]['latency'] <= wall and records[1]['latency'] <= wall
+
+        report = load_harness.summarize(records, wall, sampler.summary())
+        assert report['succeeded'] == 2 and report['latency']['count'] == 2
+        assert set(report['latency_by_kind']) == {'url', 'upload'}
+        assert set(report['stages']) == {'thumbnails', 'subtitles'}
+        assert report['stages']['thumbnails']['waited']['count'] == 2
+        assert report['resources']['workers_busy_mean'] > 0.5
+        assert server.requests > 0
+        # Job output is removed after each job
+        assert [n for n in os.listdir(os.path.join(tmp, 'output')) if not n.startswith('.')] == []
+        load_harness.print_report(report)
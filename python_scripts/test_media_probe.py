@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import media_probe
+from media_probe import summarize_probe, probe_media
+
+FAKE = {'duration': 12.0, 'fps': 25.0, 'frame_count': 300, 'width': 640, 'height': 360,
+        'has_video': True, 'has_audio': True, 'streams': []}
+
+@pytest.fixture
+def probe_calls(tmp_path, monkeypatch):
+    """Count ffprobe runs; each returns FAKE (or None for names containing 'broken')"""
+    calls = []
+    def fake_run(source, timeout=30):
+        calls.append(source)
+        return None if 'broken' in source else dict(FAKE)
+    monkeypatch.setattr(media_probe, 'run_ffprobe', fake_run)
+    monkeypatch.setattr(media_probe, '_MEMO', {})
+    monkeypatch.setenv('PROBE_CACHE_DIR', str(tmp_path / 'cache'))
+    return calls
+
+def test_summary_prefers_container_frame_count_and_average_rate():
+    data = {
+        'format': {'duration': '10.0'},
+        'streams': [
+            {'index': 0, 'codec_type': 'video', 'codec_name': 'h264', 'avg_frame_rate': '30000/1001',
+             'r_frame_rate': '60/1', 'nb_frames': '299', 'width': 1280, 'height': 720},
+            {'index': 1, 'codec_type': 'audio', 'codec_name': 'aac'},
+        ],
+    }
+    summary = summarize_probe(data)
+    assert summary['frame_count'] == 299
+    assert round(summary['fps'], 3) == 29.970
+    assert summary['has_audio'] and summary['has_video']
+
+def test_local_probe_is_cached_until_file_changes(tmp_path, probe_calls):
+    video = tmp_path / 'clip.mp4'
+    video.write_bytes(b'x' * 100)
+
+    assert probe_media(str(video)) == FAKE
+    assert probe_media(str(video)) == FAKE
+    assert len(probe_calls) == 1
+
+    # A new process only has the disk cache
+    media_probe._MEMO.clear()
+    assert probe_media(str(video)) == FAKE
+    assert len(probe_calls) == 1
+
+    video.write_bytes(b'y' * 200)
+    probe_media(str(video))
+    assert len(probe_calls) == 2
+
+def test_url_probe_expires_after_ttl(probe_calls, monkeypatch):
+    url = 'https://media.example/video.mp4'
+    probe_media(url)
+    probe_media(url)
+    assert len(probe_calls) == 1
+
+    monkeypatch.setenv('PROBE_URL_TTL', '0')
+    probe_media(url)
+    assert len(probe_calls) == 2
+
+def test_failures_are_not_cached(tmp_path, probe_calls):
+    assert probe_media('https://media.example/broken.mp4') is None
+    assert probe_media('https://media.example/broken.mp4') is None
+    assert len(probe_calls) == 2
+    assert probe_media(str(tmp_path / 'missing.mp4')) is None
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+import multiprocessing
+
+import pytest
+
+import metrics
+from metrics import Histogram, Registry, Aggregator
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+
+def _parse(text):
+    """{'name{labels}': value} for every sample line of a Prometheus text file"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            series, value = line.rsplit(' ', 1)
+            samples[series] = float(value)
+    return samples
+
+def test_histogram_quantiles_and_merge():
+    rng = random.Random(7)
+    values = [rng.lognormvariate(0, 2) for _ in range(20000)] + [0.0] * 100
+    whole, left, right = Histogram(), Histogram(), Histogram()
+    for i, value in enumerate(values):
+        whole.record(value)
+        (left if i % 2 else right).record(value)
+    left.merge(right)
+    assert left.counts == whole.counts and left.zeros == whole.zeros == 100
+    assert (left.count, left.min, left.max) == (whole.count, whole.min, whole.max)
+    assert left.sum == pytest.approx(whole.sum)
+
+    exact = sorted(values)
+    for q in (0.01, 0.5, 0.9, 0.99, 0.999):
+        expected = exact[int(q * len(exact)) - 1]
+        assert whole.quantile(q) == pytest.approx(expected, rel=1.0 / metrics.SUB_BUCKETS)
+    assert whole.quantile(0.001) == 0.0
+    assert whole.quantile(1.0) == whole.max
+    assert whole.count == len(values) and whole.sum == pytest.approx(sum(values))
+    # Eight decades in a few hundred buckets
+    assert len(whole.counts) < 2000
+
+    restored = Histogram.from_dict(whole.to_dict())
+    assert restored.quantile(0.9) == whole.quantile(0.9)
+    assert Histogram().quantile(0.5) is None
+
+def test_prometheus_text():
+    registry = Registry()
+    for seconds in (0.3, 1.5, 1.6, 40.0):
+        registry.observe('stage_seconds', seconds, {'stage': 'trailer', 'duration': '1-5m'})
+    registry.inc('resolve_cache_lookups', 3, {'result': 'hit'})
+    registry.inc('errors_total', labels={'message': 'a "quoted"\nline'})
+    text = registry.to_prometheus()
+    samples = _parse(text)
+
+    assert '# TYPE ai_video_resolve_cache_lookups_total counter' in text
+    assert samples['ai_video_resolve_cache_lookups_total{result="hit"}'] == 3
+    assert samples['ai_video_errors_total{message="a \\"quoted\\"\\nline"}'] == 1
+    assert '# TYPE ai_video_stage_seconds histogram' in text
+    series = 'ai_video_stage_seconds_bucket{duration="1-5m",stage="trailer",le="%s"}'
+    assert samples[series % '0.5'] == 1
+    assert samples[series % '2'] == 3
+    assert samples[series % '50'] == 4
+    assert samples[series % '+Inf'] == 4
+    assert samples['ai_video_stage_seconds_count{duration="1-5m",stage="trailer"}'] == 4
+    assert samples['ai_video_stage_seconds_sum{duration="1-5m",stage="trailer"}'] == pytest.approx(43.4)
+    median = samples['ai_video_stage_seconds_quantile{duration="1-5m",stage="trailer",quantile="0.5"}']
+    assert median == pytest.approx(1.5, rel=0.02)
+
+    assert metrics.duration_bucket(None) == 'unknown'
+    assert metrics.duration_bucket(30) == '<1m'
+    assert metrics.duration_bucket(600) == '5-20m'
+    assert metrics.duration_bucket(7200) == '>60m'
+
+def test_recording_costs_microseconds():
+    registry = Registry()
+    labels = {'stage': 'thumbnails', 'duration': '1-5m'}
+    samples = 100000
+    started = time.perf_counter()
+    for i in range(samples):
+        registry.observe('stage_seconds', 0.001 * (i % 5000 + 1), labels)
+    per_sample = (time.perf_counter() - started) / samples
+    assert per_sample < 20e-6, f"{per_sample * 1e6:.1f} us per sample"
+
+def _record(n):
+    metrics.inc('jobs', kind='child')
+    metrics.observe('job_seconds', float(n), kind='child')
+    metrics.flush()
+
+def test_file_and_socket_sinks_merge_across_processes(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'metrics.jsonl')
+        address = os.path.join(tmp, 'socket')
+        aggregator = Aggregator(os.path.join(tmp, 'out'), address, [path])
+
+        monkeypatch.setenv(metrics.FILE_ENV, path)
+        # Samples other tests left unsent
+        metrics.registry().take()
+        metrics.inc('jobs', kind='parent')
+        # Recorded before the fork: sent by this process only
+        ctx = multiprocessing.get_context('fork')
+        children = [ctx.Process(target=_record, args=(n,)) for n in (1, 2, 3)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join(10)
+        assert metrics.flush()
+
+        # Through the socket, split into several datagrams
+        monkeypatch.setenv(metrics.SOCKET_ENV, address)
+        for i in range(3000):
+            metrics.inc('requests', path=f"/video/{i}")
+        assert metrics.flush()
+        aggregator.poll(1.0)
+        assert aggregator.messages > 2
+
+        aggregator.export()
+        with open(aggregator.prom_path, encoding='utf-8') as f:
+            samples = _parse(f.read())
+        assert samples['ai_video_jobs_total{kind="parent"}'] == 1
+        assert samples['ai_video_jobs_total{kind="child"}'] == 3
+        assert samples['ai_video_job_seconds_sum{kind="child"}'] == 6
+        assert sum(v for k, v in samples.items() if k.startswith('ai_video_requests_total')) == 3000
+        aggregator.close()
+
+        # A restart keeps the totals and does not read the file twice
+        monkeypatch.delenv(metrics.SOCKET_ENV)
+        restarted = Aggregator(os.path.join(tmp, 'out'), files=[path])
+        metrics.inc('jobs', kind='parent')
+        assert metrics.flush()
+        restarted.poll()
+        assert _parse(restarted.registry.to_prometheus())['ai_video_jobs_total{kind="parent"}'] == 2
+
+        # Nowhere to send: kept for the next flush
+        monkeypatch.delenv(metrics.FILE_ENV)
+        metrics.inc('jobs', kind='parent')
+        assert not metrics.flush()
+        assert metrics.registry().counters == {('jobs', (('kind', 'parent'),)): 1}
+        metrics.registry().take()
+
+@requires_ffmpeg
+def test_pipeline_records_stage_latency_and_cache_hits(monkeypatch):
+    import pipeline
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=3:size=160x120:rate=10',
+            '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+        path = os.path.join(tmp, 'metrics.jsonl')
+        monkeypatch.setenv(metrics.FILE_ENV, path)
+        metrics.registry().take()
+        # Placeholder subtitles are never stored; stand in for a transcript
+        import subtitle_generator
+        monkeypatch.setattr(subtitle_generator, 'generate_subtitles_with_whisper',
+                            lambda video, srt, *args: subtitle_generator.write_whisper_srt(
+                                [{'start': 0.0, 'end': 1.0, 'text': 'hello'}], srt))
+        options = {'result_store': os.path.join(tmp, 'store')}
+        for _ in range(2):
+            document = pipeline.run_pipeline(video, os.path.join(tmp, 'out'), ['subtitles'], options)
+            assert document['success']
+        metrics.flush()
+
+        aggregator = Aggregator(os.path.join(tmp, 'metrics'), files=[path])
+        aggregator.poll()
+        samples = _parse(aggregator.registry.to_prometheus())
+        assert samples['ai_video_stage_seconds_count{duration="<1m",stage="subtitles",status="ok"}'] == 1
+        assert samples['ai_video_stage_seconds_count{duration="<1m",stage="subtitles",status="cached"}'] == 1
+        assert samples['ai_video_result_store_lookups_total{result="miss",stage="subtitles"}'] == 1
+        assert samples['ai_video_result_store_lookups_total{result="hit",stage="subtitles"}'] == 1
+        assert samples['ai_video_job_seconds_count{duration="<1m",source="file",status="ok"}'] == 2
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+import perceptual_hash
+import thumbnail_generator
+from perceptual_hash import BKTree, dhash, hamming, largest_gap_midpoint
+
+def test_dhash_ignores_scale_and_brightness_not_content():
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 255, (360, 640), dtype=np.uint8), (61, 61), 0)
+    image = cv2.normalize(image, None, 0, 200, cv2.NORM_MINMAX)
+
+    smaller = cv2.resize(image, (320, 180), interpolation=cv2.INTER_AREA)
+    brighter = cv2.add(image, 40)
+    noisy = cv2.add(image, rng.integers(0, 4, image.shape, dtype=np.uint8))
+    for variant in (smaller, brighter, noisy):
+        assert hamming(dhash(image), dhash(variant)) <= perceptual_hash.NEAR_DUPLICATE_BITS
+    assert hamming(dhash(image), dhash(cv2.flip(image, 1))) > 20
+
+def test_bk_tree_radius_search_matches_brute_force():
+    rng = random.Random(7)
+    base = [rng.getrandbits(64) for _ in range(50)]
+    # Clusters of near-duplicates around each base hash
+    values = [b ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for b in base for _ in range(10)]
+    tree = BKTree()
+    for i, value in enumerate(values):
+        tree.add(value, i)
+    assert len(tree) == len(values)
+
+    for query in base[:10] + [rng.getrandbits(64) for _ in range(10)]:
+        for radius in (0, 2, 6, 12):
+            expected = sorted(hamming(query, v) for v in values if hamming(query, v) <= radius)
+            assert [d for d, _, _ in tree.find(query, radius)] == expected
+    assert tree.nearest(base[0], 4)[0] <= 2
+    assert BKTree().nearest(0, 64) is None
+
+def test_largest_gap_midpoint_explores_the_widest_stretch():
+    assert largest_gap_midpoint([], 0, 99) == 49
+    assert largest_gap_midpoint([10, 20, 90], 0, 99) == 55
+    assert largest_gap_midpoint([0, 1, 2, 3], 0, 3) is None
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_thumbnails_skip_a_static_stretch_for_new_regions(monkeypatch):
+    cv2 = pytest.importorskip('cv2')
+    import seek_index
+    with tempfile.TemporaryDirectory() as tmp:
+        # A still test pattern for 6 s, then 6 s of frames that all differ
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'testsrc2=size=640x360:rate=25', '-f', 'lavfi', '-i', 'life=size=640x360:rate=25',
+            '-filter_complex', '[0:v]trim=duration=6,format=yuv420p[a];[1:v]trim=duration=6,format=yuv420p[b];'
+                               '[a][b]concat=n=2:v=1[v]',
+            '-map', '[v]', video
+        ], check=True, timeout=60)
+        out = os.path.join(tmp, 'thumbs')
+        artifacts = {}
+        reads = []
+        open_reader = seek_index.open_frame_reader
+
+        def recording_reader(*args, **kwargs):
+            reader = open_reader(*args, **kwargs)
+            read = reader.read
+            reader.read = lambda pos: reads.append(pos) or read(pos)
+            return reader
+        monkeypatch.setattr(seek_index, 'open_frame_reader', recording_reader)
+        random.seed(4)
+        monkeypatch.setattr(random, 'seed', lambda *args: None)
+
+        count = thumbnail_generator.generate_smart_thumbnails(video, out, num_candidates=20, artifacts=artifacts)
+        assert count == thumbnail_generator.NUM_THUMBNAILS
+        stats = artifacts['candidate_pool']
+        assert stats['near_duplicates'] > 0
+        assert stats['replacements'] > 0
+        # No more frames scored than candidates asked for
+        assert stats['kept'] + stats['evicted'] <= 20
+        # Replacements behind the read position wait for a later pass: the
+        # first forward pass runs to the end of the clip before seeking back
+        backward = next(i for i, (a, b) in enumerate(zip(reads, reads[1:])) if b < a)
+        assert reads[backward] > 250
+
+        # The still pattern outscores the rest; without pruning it would
+        # fill most of the set with copies of itself
+        cap = cv2.VideoCapture(video)
+        still = dhash(cv2.cvtColor(cap.read()[1], cv2.COLOR_BGR2GRAY))
+        cap.release()
+        hashes = [dhash(cv2.imread(os.path.join(out, name), cv2.IMREAD_GRAYSCALE)) for name in sorted(os.listdir(out))]
+        assert sum(hamming(h, still) <= perceptual_hash.NEAR_DUPLICATE_BITS for h in hashes) <= 1
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import pipeline
+
+FAKE_PROBE = {'duration': 12.0, 'fps': 25.0, 'frame_count': 300, 'has_audio': True}
+
+def _fake_runners(calls):
+    def thumbnails(upstream, ctx):
+        calls.append(('thumbnails', ctx['probe']))
+        return {'success': True, 'thumbnails': ['thumb_01.jpg'], 'stats': {'face_engine': 'haar'}}
+
+    def trailer(upstream, ctx):
+        calls.append(('trailer', ctx['probe']))
+        return {'success': False, 'error': 'ffmpeg missing'}
+
+    def subtitles(upstream, ctx):
+        calls.append(('subtitles', ctx['probe']))
+        return {'success': True, 'subtitles': 'subtitles.srt'}
+
+    def metadata(upstream, ctx):
+        calls.append(('metadata', upstream['subtitles']['subtitles']))
+        return {'success': True, 'metadata': {'title': 'x'}}
+
+    return {'thumbnails': thumbnails, 'trailer': trailer,
+            'subtitles': subtitles, 'metadata': metadata}
+
+def test_pipeline_probes_once_and_shares_artifacts(monkeypatch):
+    probes = []
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: probes.append(path) or FAKE_PROBE)
+    calls = []
+    monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', _fake_runners(calls))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'video.mp4')
+        open(source, 'wb').close()
+        document = pipeline.run_pipeline(source, os.path.join(tmp, 'out'),
+                                         options={'result_store': os.path.join(tmp, 'store')})
+
+    assert probes == [source]
+    assert [c[0] for c in calls] == pipeline.STAGE_ORDER
+    assert all(c[1] is FAKE_PROBE for c in calls[:3])
+    assert calls[3] == ('metadata', 'subtitles.srt')
+
+    assert document['success']
+    assert document['thumbnails'] == ['thumb_01.jpg']
+    assert document['trailer'] is None
+    assert document['metadata'] == {'title': 'x'}
+    assert 'stats' not in document
+    assert document['stages']['trailer']['success'] is False
+    assert document['stages']['trailer']['error'] == 'ffmpeg missing'
+    assert set(document['schedule']) == {'critical_path', 'critical_path_seconds', 'wall_time'}
+
+def test_pipeline_rejects_missing_file():
+    document = pipeline.run_pipeline('/nonexistent/video.mp4', tempfile.gettempdir())
+    assert not document['success']
+    assert 'Invalid input' in document['error']
+
+def _file_runners(calls):
+    """Runners that write real output files, so results can be stored"""
+    def thumbnails(upstream, ctx):
+        calls.append('thumbnails')
+        out_dir = pipeline.thumbnails_dir(ctx)
+        os.makedirs(out_dir, exist_ok=True)
+        paths = []
+        for i in range(2):
+            paths.append(os.path.join(out_dir, f'thumb_{i + 1:02d}.jpg'))
+            with open(paths[-1], 'wb') as f:
+                f.write(b'jpeg%d' % i)
+        return {'success': True, 'thumbnails': paths}
+
+    def trailer(upstream, ctx):
+        calls.append('trailer')
+        path = pipeline.trailer_path(ctx)
+        with open(path, 'wb') as f:
+            f.write(ctx['options'].get('trailer_mode', 'highlights').encode())
+        return {'success': True, 'trailer': path}
+
+    def subtitles(upstream, ctx):
+        calls.append('subtitles')
+        path = pipeline.subtitles_path(ctx)
+        with open(path, 'w') as f:
+            f.write('1\n00:00:00,000 --> 00:00:01,000\nhello\n\n')
+        return {'success': True, 'subtitles': path}
+
+    def metadata(upstream, ctx):
+        calls.append('metadata')
+        return {'success': True, 'metadata': {'title': 'stored'}}
+
+    return {'thumbnails': thumbnails, 'trailer': trailer,
+            'subtitles': subtitles, 'metadata': metadata}
+
+def test_repeated_submission_is_served_from_result_store(monkeypatch):
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: FAKE_PROBE)
+    calls = []
+    monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', _file_runners(calls))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'video.mp4')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(4096))
+        options = {'result_store': os.path.join(tmp, 'store')}
+
+        first = pipeline.run_pipeline(source, os.path.join(tmp, 'job1'), options=options)
+        assert calls == pipeline.STAGE_ORDER
+
+        calls.clear()
+        second = pipeline.run_pipeline(source, os.path.join(tmp, 'job2'), options=options)
+        assert calls == []
+        assert all(s.get('cached') for s in second['stages'].values())
+        assert second['metadata'] == {'title': 'stored'}
+        assert [os.path.basename(p) for p in second['thumbnails']] == ['thumb_01.jpg', 'thumb_02.jpg']
+        assert all(p.startswith(os.path.join(tmp, 'job2')) for p in second['thumbnails'])
+        with open(second['trailer'], 'rb') as f:
+            assert f.read() == b'highlights'
+        assert first['fingerprint'] == second['fingerprint']
+
+        # A trailer parameter change only reruns the trailer
+        calls.clear()
+        pipeline.run_pipeline(source, os.path.join(tmp, 'job3'),
+                              options=dict(options, trailer_mode='15'))
+        assert calls == ['trailer']
+
+        # A new Whisper model reruns subtitles and the metadata built from them
+        calls.clear()
+        monkeypatch.setenv('WHISPER_MODEL', 'base')
+        pipeline.run_pipeline(source, os.path.join(tmp, 'job4'), options=options)
+        assert calls == ['subtitles', 'metadata']
+
+def test_placeholder_subtitles_and_their_metadata_are_not_stored(monkeypatch):
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: FAKE_PROBE)
+    calls = []
+    runners = _file_runners(calls)
+    transcribe = runners['subtitles']
+
+    def placeholder_subtitles(upstream, ctx):
+        ctx['budget'].degrade('whisper_model', 'tiny failed -> placeholder')
+        return transcribe(upstream, ctx)
+    monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', dict(runners, subtitles=placeholder_subtitles))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'video.mp4')
+        with open(source, 'wb') as f:
+            f.write(os.urandom(4096))
+        options = {'result_store': os.path.join(tmp, 'store')}
+
+        first = pipeline.run_pipeline(source, os.path.join(tmp, 'job1'), ['subtitles', 'metadata'], options)
+        assert first['degradations'][0]['stage'] == 'subtitles'
+
+        # The real transcript, and the metadata built from it, replace them
+        calls.clear()
+        monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', runners)
+        pipeline.run_pipeline(source, os.path.join(tmp, 'job2'), ['subtitles', 'metadata'], options)
+        assert calls == ['subtitles', 'metadata']
+        calls.clear()
+        pipeline.run_pipeline(source, os.path.join(tmp, 'job3'), ['subtitles', 'metadata'], options)
+        assert calls == []
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import tempfile
+
+from result_store import ResultStore, content_fingerprint, stage_key, SAMPLE_BLOCK_SIZE, SAMPLE_BLOCKS
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_fingerprint_tracks_size_duration_and_sampled_content():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'video.mp4')
+        data = bytearray(os.urandom(SAMPLE_BLOCK_SIZE * SAMPLE_BLOCKS * 4))
+        _write(path, data)
+        base = content_fingerprint(path, 120.0)
+
+        assert content_fingerprint(path, 120.0) == base
+        assert content_fingerprint(path, 121.0) != base
+
+        data[-1] ^= 0xFF  # the tail block is always sampled
+        _write(path, data)
+        assert content_fingerprint(path, 120.0) != base
+
+        _write(path, bytes(data) + b'x')
+        assert content_fingerprint(path, 120.0) != base
+
+def test_fingerprint_of_large_file_reads_only_samples():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'huge.mp4')
+        with open(path, 'wb') as f:
+            f.truncate(8 * 1024 ** 3)  # sparse 8 GB file
+        started = time.time()
+        content_fingerprint(path, 3600.0)
+        assert time.time() - started < 1.0
+
+def test_stage_key_chains_upstream_keys():
+    subtitles = stage_key('subtitles', {'whisper_model': 'tiny'})
+    metadata = stage_key('metadata', {}, [subtitles])
+    assert metadata != stage_key('metadata', {}, [stage_key('subtitles', {'whisper_model': 'base'})])
+    assert metadata == stage_key('metadata', {}, [subtitles])
+
+def test_store_round_trip_and_missing_artifacts():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ResultStore(os.path.join(tmp, 'store'))
+        srt = os.path.join(tmp, 'subtitles.srt')
+        _write(srt, b'1\n00:00:00,000 --> 00:00:01,000\nhi\n')
+
+        assert store.get('fp', 'subtitles', 'k1') is None
+        store.put('fp', 'subtitles', 'k1', {'subtitles': srt}, [srt])
+
+        entry = store.get('fp', 'subtitles', 'k1')
+        assert entry['result'] == {'subtitles': srt}
+        with open(entry['artifacts']['subtitles.srt'], 'rb') as f:
+            assert f.read().startswith(b'1\n')
+
+        # Deleting the source output does not affect the stored copy
+        os.remove(srt)
+        assert store.get('fp', 'subtitles', 'k1') is not None
+
+        os.remove(entry['artifacts']['subtitles.srt'])
+        assert store.get('fp', 'subtitles', 'k1') is None
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+import thumbnail_generator
+from thumbnail_generator import coarse_to_fine_cuts, coarse_step_frames
+
+def shot_labels(frame_count, cuts):
+    """Frame -> shot number for hard cuts at the given frames"""
+    labels, shot = [], 0
+    cut_set = set(cuts)
+    for f in range(frame_count):
+        if f in cut_set:
+            shot += 1
+        labels.append(shot)
+    return labels
+
+def exhaustive_cuts(hist_at, distance, frame_count, fine_step, threshold):
+    grid = list(range(0, frame_count, fine_step))
+    return [(b, distance(hist_at(a), hist_at(b))) for a, b in zip(grid, grid[1:])
+            if distance(hist_at(a), hist_at(b)) > threshold]
+
+def top_n(cuts, n):
+    return sorted(sorted(cuts, key=lambda c: c[1], reverse=True)[:n])
+
+def test_matches_exhaustive_sweep_on_long_video():
+    fps, fine_step = 30, 15
+    frame_count = 3 * 3600 * fps
+    rng = random.Random(7)
+    cut_frames = sorted(rng.sample(range(1, frame_count), 40))
+    labels = shot_labels(frame_count, cut_frames)
+    # Every shot has its own look, so cut strength varies from cut to cut
+    looks = [rng.uniform(0.0, 1.0) for _ in range(len(cut_frames) + 1)]
+
+    hist_at = lambda f: looks[labels[f]]
+    distance = lambda a, b: abs(a - b)
+    coarse_step = coarse_step_frames(frame_count, fps, fine_step)
+    assert coarse_step == 300  # capped at 10s
+
+    adaptive, decoded = coarse_to_fine_cuts(hist_at, distance, frame_count, fine_step, coarse_step, 0.05)
+    full = exhaustive_cuts(hist_at, distance, frame_count, fine_step, 0.05)
+
+    assert top_n(adaptive, 15) == top_n(full, 15)
+    # Work grows with cuts, not length: coarse points plus a short descent per cut
+    assert decoded < frame_count // coarse_step + 1 + 40 * 6
+    assert decoded < (frame_count // fine_step) / 5
+
+def test_nearby_cuts_inside_one_coarse_interval_are_all_found():
+    labels = shot_labels(1000, [310, 340, 700])
+    hist_at = lambda f: labels[f] % 2 * 1.0 + labels[f] * 0.1
+    distance = lambda a, b: abs(a - b)
+    cuts, _ = coarse_to_fine_cuts(hist_at, distance, 1000, 10, 200, 0.05)
+    assert [f for f, _ in cuts] == [310, 340, 700]
+
+def test_no_cuts_costs_only_the_coarse_sweep():
+    calls = []
+    def hist_at(f):
+        calls.append(f)
+        return 0.0
+    cuts, decoded = coarse_to_fine_cuts(hist_at, lambda a, b: abs(a - b), 30000, 15, 300, 0.1)
+    assert cuts == []
+    assert decoded == len(calls) == 101
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_adaptive_detector_finds_real_cuts(monkeypatch):
+    pytest.importorskip('cv2')
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'shots.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'color=c=black:size=320x180:rate=25:duration=6',
+            '-f', 'lavfi', '-i', 'testsrc=size=320x180:rate=25:duration=6',
+            '-f', 'lavfi', '-i', 'color=c=white:size=320x180:rate=25:duration=6',
+            '-filter_complex', '[0:v][1:v][2:v]concat=n=3:v=1[v]', '-map', '[v]',
+            '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+
+        monkeypatch.setattr(thumbnail_generator, 'COARSE_SAMPLES', 6)
+        adaptive = thumbnail_generator.detect_scene_changes(
+            video, threshold=0.3, max_scenes=5, fps=25, frame_count=450, adaptive=True
+        )
+        full = thumbnail_generator.detect_scene_changes(
+            video, threshold=0.3, max_scenes=5, fps=25, frame_count=450, adaptive=False
+        )
+
+    assert [round(s['timestamp']) for s in adaptive] == [6, 12]
+    assert [round(s['timestamp']) for s in full] == [6, 12]
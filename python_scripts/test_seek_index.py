@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytestmark = pytest.mark.skipif(
+    shutil.which('ffmpeg') is None or shutil.which('ffprobe') is None,
+    reason='ffmpeg/ffprobe not installed'
+)
+
+import seek_index
+from seek_index import IndexedFrameReader, build_index, load_or_build_index
+
+def make_video(path, seconds=4, rate=25, gop=30):
+    # B-frames make decode order differ from presentation order
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi',
+        '-i', f'testsrc2=duration={seconds}:size=320x240:rate={rate}',
+        '-c:v', 'libx264', '-g', str(gop), '-bf', '2', '-pix_fmt', 'yuv420p', path
+    ], check=True, timeout=60)
+    return path
+
+def decode_all(path, width, height):
+    raw = subprocess.run([
+        'ffmpeg', '-v', 'error', '-i', path, '-an', '-vsync', 'passthrough',
+        '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1'
+    ], capture_output=True, check=True, timeout=60).stdout
+    return np.frombuffer(raw, dtype=np.uint8).reshape(-1, height, width, 3)
+
+def test_index_lists_frames_in_presentation_order():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = build_index(make_video(os.path.join(tmp, 'clip.mp4')))
+
+    assert len(index['pts']) == 100
+    assert index['pts'] == sorted(index['pts'])
+    assert index['keyframes'][:4] == [0, 30, 60, 90]
+    assert (index['width'], index['height']) == (320, 240)
+
+def test_index_is_stored_next_to_source_and_rebuilt_when_stale():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'))
+        first = load_or_build_index(video)
+        assert os.path.exists(video + seek_index.INDEX_SUFFIX)
+
+        with open(video + seek_index.INDEX_SUFFIX, 'w') as f:
+            f.write('{"version": 1, "source_size": 0}')
+        rebuilt = load_or_build_index(video)
+        assert rebuilt['pts'] == first['pts']
+
+def test_random_reads_match_sequential_decode():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'))
+        frames = decode_all(video, 320, 240)
+        with IndexedFrameReader(video) as reader:
+            for pos in [73, 5, 99, 30, 29, 0, 61]:
+                assert np.array_equal(reader.read(pos), frames[pos]), pos
+            assert reader.read(100) is None
+
+def test_ascending_reads_decode_forward_without_seeking():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'))
+        frames = decode_all(video, 320, 240)
+        with IndexedFrameReader(video) as reader:
+            for pos in [2, 10, 25, 40, 55]:
+                assert np.array_equal(reader.read(pos), frames[pos])
+            assert reader.seeks == 1
+
+            reader.read(5)
+            assert reader.seeks == 2
+
+def test_scaled_reads_and_capture_fallback(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        video = make_video(os.path.join(tmp, 'clip.mp4'))
+        with seek_index.open_frame_reader(video, max_width=160) as reader:
+            assert isinstance(reader, IndexedFrameReader)
+            assert reader.read(10).shape == (120, 160, 3)
+
+        monkeypatch.setenv('SEEK_INDEX', '0')
+        with seek_index.open_frame_reader(video, max_width=160) as reader:
+            assert isinstance(reader, seek_index.CaptureFrameReader)
+            assert reader.read(10).shape == (120, 160, 3)
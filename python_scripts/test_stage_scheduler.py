@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from stage_scheduler import Stage, InlineExecutor, run_stages, critical_path
+
+# Stage functions must be top-level so worker processes can unpickle them
+
+def sleep_stage(upstream, seconds, value):
+    time.sleep(seconds)
+    return {'success': True, 'value': value, 'upstream': sorted(upstream)}
+
+def failing_stage(upstream):
+    raise RuntimeError('boom')
+
+def reported_failure_stage(upstream):
+    return {'success': False, 'error': 'no audio'}
+
+def test_independent_stages_run_concurrently():
+    stages = [
+        Stage('thumbnails', sleep_stage, args=(0.5, 't')),
+        Stage('trailer', sleep_stage, args=(0.5, 'r')),
+        Stage('subtitles', sleep_stage, args=(0.5, 's')),
+    ]
+    report = run_stages(stages, cpu_budget=3)
+
+    assert all(r['status'] == 'ok' for r in report['stages'].values())
+    assert report['wall_time'] < 1.2
+
+def test_cpu_budget_limits_concurrency():
+    stages = [
+        Stage('a', sleep_stage, args=(0.3, 'a')),
+        Stage('b', sleep_stage, args=(0.3, 'b')),
+        Stage('c', sleep_stage, cpus=2, args=(0.3, 'c')),
+    ]
+    report = run_stages(stages, cpu_budget=2)
+    timings = report['stages']
+
+    # a and b fill the budget; c (2 cpus) can only start when both finished
+    assert timings['c']['started'] >= max(timings['a']['finished'], timings['b']['finished']) - 0.05
+    assert report['wall_time'] >= 0.6
+    # c was runnable from the start; it waited for cpus, not dependencies
+    assert timings['c']['ready'] == 0.0
+    assert timings['c']['started'] - timings['c']['ready'] >= 0.25
+
+def test_dependent_starts_when_its_dependency_finishes():
+    stages = [
+        Stage('thumbnails', sleep_stage, args=(0.8, 't')),
+        Stage('subtitles', sleep_stage, args=(0.2, 's')),
+        Stage('metadata', sleep_stage, soft_deps=['subtitles'], args=(0.1, 'm')),
+    ]
+    report = run_stages(stages, cpu_budget=3)
+    timings = report['stages']
+
+    assert timings['metadata']['started'] >= timings['subtitles']['finished'] - 0.05
+    assert timings['metadata']['finished'] < timings['thumbnails']['finished']
+    assert timings['metadata']['result']['upstream'] == ['subtitles']
+
+def test_failures_do_not_abort_other_branches():
+    stages = [
+        Stage('subtitles', failing_stage),
+        Stage('trailer', reported_failure_stage),
+        Stage('thumbnails', sleep_stage, args=(0.0, 't')),
+        Stage('metadata', sleep_stage, soft_deps=['subtitles'], args=(0.0, 'm')),
+        Stage('index', sleep_stage, deps=['subtitles'], args=(0.0, 'i')),
+    ]
+    report = run_stages(stages, cpu_budget=1, executor=InlineExecutor())
+    status = {name: r['status'] for name, r in report['stages'].items()}
+
+    assert status == {
+        'subtitles': 'failed',
+        'trailer': 'failed',
+        'thumbnails': 'ok',
+        'metadata': 'ok',
+        'index': 'skipped',
+    }
+    assert 'boom' in report['stages']['subtitles']['error']
+    assert report['stages']['trailer']['error'] == 'no audio'
+
+def test_critical_path_follows_longest_chain():
+    stages = [
+        Stage('thumbnails', sleep_stage),
+        Stage('subtitles', sleep_stage),
+        Stage('metadata', sleep_stage, soft_deps=['subtitles']),
+    ]
+    path, seconds = critical_path(stages, {'thumbnails': 5.0, 'subtitles': 4.0, 'metadata': 2.0})
+    assert path == ['subtitles', 'metadata']
+    assert seconds == 6.0
+
+def test_rejects_cycles_and_unknown_deps():
+    with pytest.raises(ValueError):
+        run_stages([Stage('a', sleep_stage, deps=['b']), Stage('b', sleep_stage, deps=['a'])],
+                   executor=InlineExecutor())
+    with pytest.raises(ValueError):
+        run_stages([Stage('a', sleep_stage, deps=['missing'])], executor=InlineExecutor())
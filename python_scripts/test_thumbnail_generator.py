@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+
+import thumbnail_generator
+
+def make_video(path, size, source='testsrc2'):
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi',
+        '-i', f'{source}=size={size}:rate=25', '-t', '6',
+        '-pix_fmt', 'yuv420p', path
+    ], check=True, timeout=60)
+    return path
+
+def test_proxy_analysis_saves_full_resolution_thumbnails():
+    cv2 = pytest.importorskip('cv2')
+    with tempfile.TemporaryDirectory() as tmp:
+        proxy = make_video(os.path.join(tmp, 'proxy.mp4'), '640x360')
+        full = make_video(os.path.join(tmp, 'full.mp4'), '1920x1080')
+        out = os.path.join(tmp, 'thumbs')
+
+        count = thumbnail_generator.generate_smart_thumbnails(proxy, out, num_candidates=12, hq_source=full)
+        assert count == 10
+        for name in sorted(os.listdir(out)):
+            assert cv2.imread(os.path.join(out, name)).shape == (1080, 1920, 3)
+
+def test_failed_full_resolution_extract_falls_back_to_analysis_frame():
+    cv2 = pytest.importorskip('cv2')
+    with tempfile.TemporaryDirectory() as tmp:
+        proxy = make_video(os.path.join(tmp, 'proxy.mp4'), '640x360')
+        out = os.path.join(tmp, 'thumbs')
+
+        count = thumbnail_generator.generate_smart_thumbnails(
+            proxy, out, num_candidates=12, hq_source=os.path.join(tmp, 'missing.mp4')
+        )
+        assert count == 10
+        assert cv2.imread(os.path.join(out, 'thumb_01.jpg')).shape == (360, 640, 3)
+
+def test_candidate_pool_keeps_only_the_top_scores():
+    np = pytest.importorskip('numpy')
+    pool = thumbnail_generator.CandidatePool(capacity=3)
+    for i, score in enumerate([0.5, 0.9, 0.1, 0.7, 0.8]):
+        pool.add({'score': score, 'position': i}, np.zeros((10, 10, 3), np.uint8))
+    assert sorted(item['score'] for item in pool.items()) == [0.7, 0.8, 0.9]
+    assert pool.stats()['evicted'] == 2
+    assert pool.bytes == 3 * 300
+
+def test_candidate_pool_spills_to_jpeg_then_refetch_under_memory_cap():
+    np = pytest.importorskip('numpy')
+    pytest.importorskip('cv2')
+    frame_bytes = 180 * 320 * 3
+    rng = np.random.default_rng(0)
+    noisy = lambda: rng.integers(0, 255, (180, 320, 3), dtype=np.uint8)
+
+    # Room for two raw frames: the rest are compressed
+    pool = thumbnail_generator.CandidatePool(capacity=5, memory_cap=2 * frame_bytes)
+    for i in range(5):
+        pool.add({'score': i / 10.0, 'position': i}, np.full((180, 320, 3), i * 40, np.uint8))
+    assert pool.bytes <= 2 * frame_bytes
+    assert pool.stats()['spilled_to_jpeg'] >= 3
+    assert pool.frame(pool.items()[0], refetch=None).shape == (180, 320, 3)
+
+    # Incompressible frames and a tiny cap: only positions survive
+    pool = thumbnail_generator.CandidatePool(capacity=3, memory_cap=1000)
+    for i in range(3):
+        pool.add({'score': float(i), 'position': i}, noisy())
+    assert pool.bytes <= 1000
+    assert pool.stats()['refetch'] == 3
+    assert pool.frame(pool.items()[0], refetch=lambda pos: ('refetched', pos))[0] == 'refetched'
+
+def test_thumbnails_within_memory_cap_report_peak():
+    pytest.importorskip('cv2')
+    with tempfile.TemporaryDirectory() as tmp:
+        # Every frame different, so no candidate is skipped as a near-duplicate
+        video = make_video(os.path.join(tmp, 'clip.mp4'), '640x360', 'life')
+        out = os.path.join(tmp, 'thumbs')
+        artifacts = {}
+        cap = 3 * 640 * 360 * 3
+
+        count = thumbnail_generator.generate_smart_thumbnails(
+            video, out, num_candidates=30, artifacts=artifacts, memory_cap_bytes=cap
+        )
+        assert count == 10
+        stats = artifacts['candidate_pool']
+        assert stats['kept'] == thumbnail_generator.TOP_POOL
+        # At most one frame over the cap, for the candidate being added
+        assert stats['peak_bytes'] <= cap + 640 * 360 * 3
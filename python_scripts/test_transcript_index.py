@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import random
+import tempfile
+
+import pipeline
+import transcript_index
+from metadata_generator import tokenize, read_cues
+from transcript_index import TranscriptIndex, parse_query
+
+SRT = """1
+00:00:01,000 --> 00:00:03,500
+Welcome back to the channel.
+
+2
+00:00:03,500 --> 00:00:06,000
+Today we install solar
+panels on a barn roof.
+
+3
+00:01:02,250 --> 00:01:05,000
+Solar power doesn't need much upkeep.
+"""
+
+def _write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+def _brute_force(transcripts, query):
+    """Videos whose words match query, by scanning every transcript"""
+    found = []
+    for video, cues in transcripts:
+        words = [w for _, _, text in cues for w in tokenize(text)]
+        ok = True
+        for kind, value in parse_query(query):
+            if kind == 'prefix':
+                ok = ok and any(w.startswith(value) for w in words)
+            else:
+                ok = ok and any(words[i:i + len(value)] == value for i in range(len(words)))
+        if ok:
+            found.append(video)
+    return found
+
+def test_srt_queries_return_cue_timestamps():
+    with tempfile.TemporaryDirectory() as tmp:
+        srt = _write(os.path.join(tmp, 'subtitles.srt'), SRT)
+        assert read_cues(srt)[1] == (3.5, 6.0, 'Today we install solar panels on a barn roof.')
+
+        index = TranscriptIndex(os.path.join(tmp, 'index'))
+        index.add_srt(srt, video='job-1')
+
+        # The phrase spans two lines of one cue; the jump target is its cue
+        hits = index.search('"solar panels"')
+        assert [h['video'] for h in hits] == ['job-1']
+        assert hits[0]['source'] == os.path.abspath(srt)
+        assert [(m['start'], m['end']) for m in hits[0]['matches']] == [(3.5, 6.0)]
+
+        assert [m['start'] for m in index.search('solar')[0]['matches']] == [3.5, 62.25]
+        assert [m['start'] for m in index.search('upk*')[0]['matches']] == [62.25]
+        assert [m['start'] for m in index.search("doesn't")[0]['matches']] == [62.25]
+        assert [m['start'] for m in index.search('welcome barn')[0]['matches']] == [1.0, 3.5]
+        assert index.search('"panels solar"') == []
+        assert index.search('solar wind') == []
+        assert index.search('s*') == []  # too short a prefix
+
+def test_incremental_adds_match_a_full_scan():
+    rng = random.Random(3)
+    words = ['solar', 'panel', 'wind', 'energy', 'roof', 'barn', 'cheap', 'power', 'grid', 'the']
+    with tempfile.TemporaryDirectory() as tmp:
+        index = TranscriptIndex(tmp)
+        reader = TranscriptIndex(tmp)
+        transcripts = []
+        # More documents than SKIP_INTERVAL, so intersections use skips
+        for n in range(150):
+            cues = [(c * 2.0, c * 2.0 + 2, ' '.join(rng.choice(words) for _ in range(4))) for c in range(3)]
+            if n % 25 == 0:
+                cues.append((10.0, 12.0, 'rare keyword here'))
+            transcripts.append((f'video-{n}', cues))
+            if n < 100:
+                index.add(f'video-{n}', cues)
+        index.add_many([(video, cues, None) for video, cues in transcripts[100:]])
+
+        # Merged like a binary counter: a logarithmic number of segments
+        assert index.stats()['segments'] <= 8
+        assert index.stats()['videos'] == 150
+        for query in ['solar', 'rare', 'rare solar', '"solar panel"', '"the roof"', 'pow*',
+                      'rare "cheap power"', 'barn grid wind', 'keyword*']:
+            assert [h['video'] for h in index.search(query, limit=1000)] == _brute_force(transcripts, query), query
+            # Another process's reader picks up the new segments
+            assert [h['video'] for h in reader.search(query, limit=1000)] == _brute_force(transcripts, query), query
+        assert len(index.search('solar', limit=7)) == 7
+
+        live = {s['name'] for s in transcript_index._read_json(os.path.join(tmp, 'index.json'), None)['segments']}
+        assert {n for n in os.listdir(tmp) if n.endswith('.tix')} == live
+
+def test_readding_a_video_replaces_it():
+    with tempfile.TemporaryDirectory() as tmp:
+        index = TranscriptIndex(os.path.join(tmp, 'index'))
+        srt_dir = os.path.join(tmp, 'jobs')
+        os.makedirs(os.path.join(srt_dir, 'a'))
+        os.makedirs(os.path.join(srt_dir, 'b'))
+        first = _write(os.path.join(srt_dir, 'a', 'subtitles.srt'), SRT)
+        _write(os.path.join(srt_dir, 'b', 'subtitles.srt'), SRT.replace('barn', 'shed'))
+
+        assert index.update_from_directory(srt_dir) == 2
+        assert index.update_from_directory(srt_dir) == 0
+        assert len(index.search('solar')) == 2
+
+        _write(first, "1\n00:00:00,000 --> 00:00:02,000\nNothing about energy\n")
+        os.utime(first, (1, 1))
+        assert index.update_from_directory(srt_dir) == 1
+        assert [h['source'] for h in index.search('solar')] == [os.path.join(srt_dir, 'b', 'subtitles.srt')]
+        assert [h['source'] for h in index.search('energy')] == [first]
+
+        assert index.remove(first)
+        assert index.search('energy') == []
+        assert not index.remove(first)
+
+def test_pipeline_indexes_published_transcript(monkeypatch):
+    def subtitles(upstream, ctx):
+        return {'success': True, 'subtitles': _write(pipeline.subtitles_path(ctx), SRT)}
+
+    monkeypatch.setattr(pipeline, 'probe_media', lambda path: {'duration': 70.0, 'fps': 25.0, 'has_audio': True})
+    monkeypatch.setattr(pipeline, 'STAGE_RUNNERS', dict(pipeline.STAGE_RUNNERS, subtitles=subtitles))
+    monkeypatch.setattr(sys, 'stdout', sys.stdout)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'video.mp4')
+        open(source, 'wb').close()
+        index_dir = os.path.join(tmp, 'index')
+        document = pipeline.run_pipeline(source, os.path.join(tmp, 'jobs'), stages=['subtitles'],
+                                         options={'use_cache': False, 'transcript_index': index_dir})
+
+        hits = TranscriptIndex(index_dir).search('"barn roof"')
+        assert [h['video'] for h in hits] == [document['job_id']]
+        assert hits[0]['source'] == document['subtitles']
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+import video_stats
+from video_stats import parse_metadata_log, summarize, distribution
+
+LOG = """
+[Parsed_metadata_5 @ 0x55d0] frame:0    pts:0       pts_time:0
+[Parsed_metadata_5 @ 0x55d0] lavfi.signalstats.YAVG=100.5
+[Parsed_metadata_5 @ 0x55d0] lavfi.signalstats.YDIF=0
+[Parsed_metadata_5 @ 0x55d0] lavfi.scene_score=0.000000
+[Parsed_metadata_5 @ 0x55d0] frame:1    pts:1       pts_time:0.5
+[Parsed_metadata_5 @ 0x55d0] lavfi.signalstats.YAVG=110.5
+[Parsed_metadata_5 @ 0x55d0] lavfi.signalstats.YDIF=4
+[Parsed_metadata_5 @ 0x55d0] lavfi.scene_score=0.600000
+[out#0/null @ 0x55d1] video:0KiB audio:0KiB
+""".strip().splitlines()
+
+def test_metadata_log_is_parsed_per_frame():
+    frames = parse_metadata_log(LOG)
+    assert frames == [
+        {'time': 0.0, 'brightness': 100.5, 'motion': 0.0, 'scene': 0.0},
+        {'time': 0.5, 'brightness': 110.5, 'motion': 4.0, 'scene': 0.6},
+    ]
+    stats = summarize(frames, 2.0)
+    assert stats['brightness']['mean'] == 105.5
+    # The first frame has nothing to differ from
+    assert stats['motion']['mean'] == 4.0
+    assert stats['scene_changes'] == 1
+    assert stats['covered_seconds'] == 1.0
+
+def test_distribution_percentiles_and_minutes():
+    times = [i * 10.0 for i in range(18)]  # three minutes, one gap-free
+    values = [float(i) for i in range(18)]
+    d = distribution(times, values)
+    assert (d['min'], d['p50'], d['max']) == (0.0, 8.0, 17.0)
+    assert d['p10'] == 2.0 and d['p90'] == 15.0
+    assert d['per_minute'] == [2.5, 8.5, 14.5]
+    assert distribution([], []) is None
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_whole_video_pass_measures_every_minute():
+    np = pytest.importorskip('numpy')
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'two_scenes.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'color=c=0x202020:size=160x90:rate=5:duration=60',
+            '-f', 'lavfi', '-i', 'color=c=0xe0e0e0:size=160x90:rate=5:duration=70',
+            '-filter_complex', '[0:v][1:v]concat=n=2:v=1[v]', '-map', '[v]',
+            '-g', '250', '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=120)
+
+        stats, frames = video_stats.run_stats_pass(video, 1.0, frame_times=[30, 90], source_size=(160, 90))
+
+    assert stats['complete'] and stats['frames'] == 130
+    per_minute = stats['brightness']['per_minute']
+    assert len(per_minute) == 3
+    assert abs(per_minute[0] - 32) < 3 and abs(per_minute[2] - 224) < 3
+    assert stats['scene_changes'] == 1
+    assert stats['motion']['p50'] < 1
+
+    assert [t for t, _ in frames] == [30.0, 90.0]
+    assert frames[0][1].shape == (90, 160, 3)
+    assert frames[0][1].mean() < 50 < 200 < frames[1][1].mean()
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_metadata_analysis_keeps_its_fields():
+    pytest.importorskip('cv2')
+    import metadata_generator
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=8:size=320x240:rate=25',
+            '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+        whole = metadata_generator.analyze_video(video, stats_mode='pass')
+        sampled = metadata_generator.analyze_video(video, stats_mode='sampled')
+
+    fields = {'duration', 'avg_brightness', 'avg_motion', 'face_detected', 'total_faces_found'}
+    assert set(sampled) == fields
+    assert set(whole) == fields | {'visual_stats'}
+    assert whole['duration'] == sampled['duration']
+    assert abs(whole['avg_brightness'] - sampled['avg_brightness']) < 10
+    assert whole['visual_stats']['frames'] == 16
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_metadata_motion_stays_on_the_sampled_scale():
+    pytest.importorskip('cv2')
+    import metadata_generator
+    with tempfile.TemporaryDirectory() as tmp:
+        # One cut: the sampled analysis sees it in 1 of 11 differences,
+        # the pass's own motion in 1 of 119
+        video = os.path.join(tmp, 'cut.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', 'color=c=0x202020:size=160x90:rate=5:duration=30',
+            '-f', 'lavfi', '-i', 'color=c=0xe0e0e0:size=160x90:rate=5:duration=30',
+            '-filter_complex', '[0:v][1:v]concat=n=2:v=1[v]', '-map', '[v]', '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=120)
+        whole = metadata_generator.analyze_video(video, stats_mode='pass')
+        sampled = metadata_generator.analyze_video(video, stats_mode='sampled')
+
+    assert whole['visual_stats']['motion']['mean'] < 5
+    assert abs(whole['avg_motion'] - sampled['avg_motion']) < 2
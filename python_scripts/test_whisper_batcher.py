@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import shutil
+import tempfile
+import threading
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import whisper_batcher
+from whisper_batcher import BatchScheduler, BatchServer, BatcherUnavailable, segments_from_tokens, decoded_window
+
+np = pytest.importorskip('numpy')
+
+RATE = whisper_batcher.SAMPLE_RATE
+
+class StubModel:
+    """Names each window after its first sample; one batch costs the same as one window
+
+    covers: seconds of a full window its complete segments cover (default: all of it)
+    """
+
+    def __init__(self, seconds_per_batch=0.2, covers=None):
+        self.seconds_per_batch = seconds_per_batch
+        self.covers = covers
+        self.batches = []
+
+    def transcribe_batch(self, batch):
+        self.batches.append([int(window[0]) for window in batch])
+        time.sleep(self.seconds_per_batch)
+        results = []
+        for window in batch:
+            seconds = len(window) / float(RATE)
+            if self.covers and seconds >= whisper_batcher.WINDOW_SECONDS:
+                seconds = self.covers
+            results.append(([{'start': 1.0, 'end': 2.0, 'text': f"w{int(window[0])}"}], seconds))
+        return results
+
+def _recording(job, num_windows):
+    """Audio whose window i starts with the sample job * 100 + i"""
+    samples = np.zeros(num_windows * whisper_batcher.WINDOW_SECONDS * RATE, dtype=np.float32)
+    for i in range(num_windows):
+        samples[i * whisper_batcher.WINDOW_SECONDS * RATE] = job * 100 + i
+    return samples
+
+def test_segments_from_timestamp_tokens():
+    begin = 1000
+    decode = lambda tokens: ' '.join(str(t) for t in tokens)
+    tokens = [begin, 1, 2, begin + 120, begin + 120, 3, begin + 250, begin + 300, 4]
+    assert segments_from_tokens(tokens, begin, decode, duration=10.0) == [
+        {'start': 0.0, 'end': 2.4, 'text': '1 2'},
+        {'start': 2.4, 'end': 5.0, 'text': '3'},
+        {'start': 6.0, 'end': 10.0, 'text': '4'},
+    ]
+    assert segments_from_tokens([begin, begin + 50], begin, decode) == []
+
+def test_window_ends_at_its_last_complete_segment():
+    begin = 1000
+    decode = lambda tokens: ' '.join(str(t) for t in tokens)
+    # The last segment starts at 25 s and is cut off by the window edge
+    tokens = [begin, 1, begin + 120, begin + 120, 2, begin + 600, begin + 1250, 3]
+    assert decoded_window(tokens, begin, decode) == (
+        [{'start': 0.0, 'end': 2.4, 'text': '1'}, {'start': 2.4, 'end': 12.0, 'text': '2'}], 12.0
+    )
+    # Ends with a complete segment, or is the end of the audio: covered whole
+    assert decoded_window(tokens[:6], begin, decode)[1] == 30
+    assert decoded_window(tokens, begin, decode, duration=20.0)[1] == 20.0
+    assert decoded_window([1, 2], begin, decode) == ([{'start': 0.0, 'end': 30, 'text': '1 2'}], 30)
+
+    decode_result = lambda **kw: SimpleNamespace(**dict({'no_speech_prob': 0.1, 'avg_logprob': -0.3,
+                                                          'compression_ratio': 1.5}, **kw))
+    assert not whisper_batcher.needs_fallback(decode_result())
+    assert whisper_batcher.needs_fallback(decode_result(compression_ratio=3.1))
+    assert whisper_batcher.needs_fallback(decode_result(avg_logprob=-1.4))
+    # Silence is not retried
+    assert not whisper_batcher.needs_fallback(decode_result(avg_logprob=-1.4, no_speech_prob=0.9))
+
+def test_windows_from_concurrent_jobs_share_batches():
+    model = StubModel()
+    scheduler = BatchScheduler(model, max_batch=3, max_wait=0.5)
+    results = {}
+
+    def job(n):
+        results[n] = scheduler.transcribe(_recording(n, 2), job=n)
+
+    threads = [threading.Thread(target=job, args=(n,)) for n in (1, 2, 3)]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+    scheduler.close()
+
+    # Six windows in two passes instead of six; a job's next window waits for its previous one
+    assert [len(b) for b in model.batches] == [3, 3]
+    assert elapsed < 2 * model.seconds_per_batch + 0.3
+    for n in (1, 2, 3):
+        assert [s['text'] for s in results[n]] == [f"w{n * 100}", f"w{n * 100 + 1}"]
+        assert [s['start'] for s in results[n]] == [1.0, 31.0]
+
+def test_jobs_take_turns_in_a_batch():
+    release = threading.Event()
+
+    class Gated(StubModel):
+        def transcribe_batch(self, batch):
+            release.wait(5)
+            return super().transcribe_batch(batch)
+
+    model = Gated(seconds_per_batch=0)
+    scheduler = BatchScheduler(model, max_batch=2, max_wait=0)
+    first = scheduler.submit('busy', _recording(9, 1))
+    time.sleep(0.1)
+    long_job = [scheduler.submit('long', window) for _, window in whisper_batcher.windows(_recording(1, 3))]
+    short_job = scheduler.submit('short', _recording(2, 1))
+    release.set()
+    for future in [first, short_job] + long_job:
+        future.result(5)
+    scheduler.close()
+    # The short job does not wait behind the long one's three windows
+    assert model.batches == [[900], [100, 200], [101, 102]]
+
+def test_next_window_starts_after_the_last_complete_segment():
+    model = StubModel(seconds_per_batch=0, covers=20)
+    scheduler = BatchScheduler(model, max_batch=4, max_wait=0)
+    samples = np.arange(50 * RATE, dtype=np.float32) / RATE
+    segments = scheduler.transcribe_stream([(0.0, samples[:35 * RATE]), (35.0, samples[35 * RATE:])])
+    scheduler.close()
+    # 30 s windows at 0 and 20 s cover 20 s each; the 10 s left is the last window
+    assert model.batches == [[0], [20], [40]]
+    assert [s['start'] for s in segments] == [1.0, 21.0, 41.0]
+
+def test_a_lone_job_waits_at_most_max_wait():
+    model = StubModel(seconds_per_batch=0.1)
+    scheduler = BatchScheduler(model, max_batch=8, max_wait=0.2)
+    started = time.time()
+    segments = scheduler.transcribe(_recording(5, 1)[:10 * RATE])
+    elapsed = time.time() - started
+    scheduler.close()
+    assert [s['text'] for s in segments] == ['w500']
+    assert 0.3 <= elapsed < 0.6
+
+    class Broken:
+        def transcribe_batch(self, batch):
+            raise RuntimeError('out of memory')
+
+    scheduler = BatchScheduler(Broken(), max_batch=2, max_wait=0)
+    with pytest.raises(RuntimeError, match='out of memory'):
+        scheduler.transcribe(_recording(1, 1))
+    scheduler.close()
+
+def test_server_batches_streamed_jobs():
+    model = StubModel(seconds_per_batch=0.1)
+    with tempfile.TemporaryDirectory() as tmp:
+        address = os.path.join(tmp, 'socket')
+        server = BatchServer(address, 'tiny', lambda: model, max_batch=8, max_wait=0.3)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        results = {}
+
+        def job(n):
+            chunks = [(offset, window) for offset, window in whisper_batcher.windows(_recording(n, 3))]
+            results[n] = whisper_batcher.transcribe_chunks(chunks, 'tiny', address)
+
+        threads = [threading.Thread(target=job, args=(n,)) for n in (1, 2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # Both jobs' windows decoded together
+        assert max(len(b) for b in model.batches) == 2
+        for n in (1, 2):
+            assert [s['text'] for s in results[n]] == [f"w{n * 100 + i}" for i in range(3)]
+            assert [s['end'] for s in results[n]] == [2.0, 32.0, 62.0]
+
+        with pytest.raises(BatcherUnavailable, match='base'):
+            whisper_batcher.transcribe_chunks([], 'base', address)
+        server.close()
+        with pytest.raises(BatcherUnavailable):
+            whisper_batcher.transcribe_chunks([], 'tiny', address)
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_subtitles_come_from_the_batch_server(monkeypatch):
+    import subtitle_generator
+    model = StubModel(seconds_per_batch=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=70:size=160x120:rate=5',
+            '-f', 'lavfi', '-i', 'sine=duration=70', '-shortest', '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+        address = os.path.join(tmp, 'socket')
+        server = BatchServer(address, 'tiny', lambda: model, max_batch=8, max_wait=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        monkeypatch.setenv(whisper_batcher.SOCKET_ENV, address)
+
+        srt = os.path.join(tmp, 'clip.srt')
+        assert subtitle_generator.generate_subtitles_with_whisper(video, srt, 'tiny')
+        server.close()
+        # 70 s of audio: windows at 0, 30 and 60 s
+        assert sum(len(batch) for batch in model.batches) == 3
+        with open(srt, encoding='utf-8') as f:
+            assert '00:00:31,000 --> 00:00:32,000' in f.read()
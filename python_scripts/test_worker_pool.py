@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+
+from worker_pool import WorkerPool, serve_stream, serve_socket
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Handlers run in spawned workers, so they must be importable top-level functions
+
+def sleep_handler(params, progress):
+    for step in range(params.get('steps', 1)):
+        time.sleep(params.get('seconds', 0.05))
+        progress({'step': step})
+    return {'success': True, 'pid': os.getpid(), 'warm': os.environ.get('WARM_MARKER')}
+
+def fail_handler(params, progress):
+    raise ValueError('bad input')
+
+def mark_warm():
+    os.environ['WARM_MARKER'] = 'yes'
+
+HANDLERS = {'sleep': sleep_handler, 'fail': fail_handler}
+
+class Collector:
+    def __init__(self):
+        self.events = []
+        self.cond = threading.Condition()
+
+    def __call__(self, event):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def wait_for(self, job_id, kind, timeout=30):
+        with self.cond:
+            assert self.cond.wait_for(lambda: self.find(job_id, kind), timeout), self.events
+            return self.find(job_id, kind)
+
+    def find(self, job_id, kind):
+        for event in self.events:
+            if event.get('id') == job_id and event.get('event') == kind:
+                return event
+        return None
+
+    def kinds(self, job_id):
+        with self.cond:
+            return [e['event'] for e in self.events if e.get('id') == job_id]
+
+def test_jobs_stream_progress_and_results_from_warm_workers():
+    events = Collector()
+    pool = WorkerPool(num_workers=2, handlers=HANDLERS, warmup=mark_warm, emit=events)
+    try:
+        pool.submit({'id': 'a', 'type': 'sleep', 'params': {'steps': 3}})
+        pool.submit({'id': 'b', 'type': 'fail'})
+        result = events.wait_for('a', 'result')
+        error = events.wait_for('b', 'error')
+    finally:
+        pool.close()
+
+    assert result['result']['warm'] == 'yes'
+    assert events.kinds('a') == ['queued', 'started', 'progress', 'progress', 'progress', 'result']
+    assert 'bad input' in error['error']
+
+def test_workers_are_reused_between_jobs():
+    events = Collector()
+    pool = WorkerPool(num_workers=1, handlers=HANDLERS, warmup=None, emit=events)
+    try:
+        pool.submit({'id': 'a', 'type': 'sleep'})
+        pool.submit({'id': 'b', 'type': 'sleep'})
+        first = events.wait_for('a', 'result')['result']['pid']
+        second = events.wait_for('b', 'result')['result']['pid']
+    finally:
+        pool.close()
+    assert first == second
+
+def test_backpressure_rejects_when_queue_is_full():
+    events = Collector()
+    pool = WorkerPool(num_workers=1, max_pending=1, handlers=HANDLERS, warmup=None, emit=events)
+    try:
+        assert pool.submit({'id': 'run', 'type': 'sleep', 'params': {'seconds': 1.0}})
+        events.wait_for('run', 'started')
+        assert pool.submit({'id': 'wait', 'type': 'sleep'}, block=False)
+        assert not pool.submit({'id': 'over', 'type': 'sleep'}, block=False)
+        assert events.find('over', 'rejected')
+        assert not pool.submit({'id': 'bad', 'type': 'nope'}, emit=events)
+        assert 'over' not in pool._emitters and 'bad' not in pool._emitters
+
+        # A blocking submit waits for room instead of failing
+        started = time.time()
+        assert pool.submit({'id': 'blocked', 'type': 'sleep'}, block=True, timeout=10)
+        assert time.time() - started > 0.3
+        events.wait_for('blocked', 'result')
+    finally:
+        pool.close()
+
+def test_rejected_submit_keeps_the_running_jobs_emitter():
+    events, strays = Collector(), Collector()
+    pool = WorkerPool(num_workers=1, handlers=HANDLERS, warmup=None, emit=strays)
+    try:
+        pool.submit({'id': 'a', 'type': 'sleep', 'params': {'seconds': 0.5}}, emit=events)
+        events.wait_for('a', 'started')
+        assert not pool.submit({'id': 'a', 'type': 'nope'}, emit=Collector())
+        events.wait_for('a', 'result')
+    finally:
+        pool.close()
+    assert events.kinds('a') == ['queued', 'started', 'progress', 'result']
+    assert strays.events == [] and pool._emitters == {}
+
+def test_cancel_running_and_queued_jobs():
+    events = Collector()
+    pool = WorkerPool(num_workers=1, handlers=HANDLERS, warmup=None, emit=events)
+    try:
+        pool.submit({'id': 'long', 'type': 'sleep', 'params': {'seconds': 30}})
+        pool.submit({'id': 'queued', 'type': 'sleep'})
+        events.wait_for('long', 'started')
+
+        pool.cancel('queued')
+        assert events.wait_for('queued', 'cancelled')['state'] == 'queued'
+        pool.cancel('long')
+        assert events.wait_for('long', 'cancelled')['state'] == 'running'
+
+        # The replacement worker picks up new work
+        pool.submit({'id': 'after', 'type': 'sleep'})
+        events.wait_for('after', 'result')
+    finally:
+        pool.close()
+
+    assert events.find('long', 'result') is None
+    assert events.find('queued', 'started') is None
+
+def test_json_lines_stream_protocol():
+    pool = WorkerPool(num_workers=1, handlers=HANDLERS, warmup=None)
+    requests = io.StringIO("\n".join([
+        json.dumps({'id': 'x', 'type': 'sleep'}),
+        'not json',
+        json.dumps({'id': 'y', 'type': 'unknown'}),
+    ]) + "\n")
+    out = io.StringIO()
+    try:
+        serve_stream(pool, requests, out)
+    finally:
+        pool.close(drain=True)
+
+    lines = [json.loads(l) for l in out.getvalue().splitlines()]
+    assert [e['event'] for e in lines if e.get('id') == 'x'] == ['queued', 'started', 'progress', 'result']
+    assert any(e['event'] == 'error' and 'Invalid JSON' in e['error'] for e in lines)
+    assert any(e.get('id') == 'y' and e['event'] == 'rejected' for e in lines)
+
+def test_unix_socket_protocol():
+    pool = WorkerPool(num_workers=1, handlers=HANDLERS, warmup=None)
+    socket_path = os.path.join(tempfile.mkdtemp(), 'pool.sock')
+    server = serve_socket(pool, socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(socket_path)
+        client.sendall((json.dumps({'id': 's', 'type': 'sleep'}) + "\n").encode('utf-8'))
+        reader = client.makefile('r', encoding='utf-8')
+        events = []
+        while not events or events[-1]['event'] != 'result':
+            events.append(json.loads(reader.readline()))
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        pool.close()
+
+    assert [e['event'] for e in events] == ['queued', 'started', 'progress', 'result']
+
+def test_cli_keeps_stdout_for_protocol():
+    requests = json.dumps({'id': 'r', 'type': 'nope'}) + "\n"
+    result = subprocess.run(
+        [sys.executable, 'worker_pool.py', '--workers', '1', '--no-warmup'],
+        cwd=SCRIPTS_DIR, input=requests, capture_output=True, text=True, timeout=60
+    )
+    lines = [json.loads(l) for l in result.stdout.splitlines()]
+    assert lines == [{'id': 'r', 'event': 'rejected', 'error': 'Unknown job type: nope'}]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import signal
+import tempfile
+import subprocess
+
+import pytest
+
+import workspace
+from workspace import Workspace, WorkspaceQuotaError, reclaim_orphans
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def write(path, nbytes):
+    with open(path, 'wb') as f:
+        f.write(b'\0' * nbytes)
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def test_job_quota_is_enforced_and_space_freed_on_exit():
+    with tempfile.TemporaryDirectory() as tmp:
+        with Workspace('q', quota_bytes=1000, root=tmp, tmpfs_root='') as ws:
+            write(ws.path('a.bin'), 800)
+            assert ws.usage() == 800
+            assert ws.available() == 200
+            ws.reserve(200)
+            with pytest.raises(WorkspaceQuotaError):
+                ws.reserve(201)
+            write(ws.path('b.bin'), 400)
+            with pytest.raises(WorkspaceQuotaError):
+                ws.check()
+            job_dir = ws.dir
+        assert not os.path.exists(job_dir)
+
+def test_global_quota_counts_every_job(monkeypatch):
+    monkeypatch.setenv('WORKSPACE_TOTAL_QUOTA_MB', str(3000 / workspace.MB))
+    with tempfile.TemporaryDirectory() as tmp:
+        first = Workspace('a', root=tmp, tmpfs_root='')
+        second = Workspace('b', root=tmp, tmpfs_root='')
+        write(first.path('x.bin'), 2000)
+        assert second.available() == 1000
+        with pytest.raises(WorkspaceQuotaError):
+            second.reserve(1500)
+        first.cleanup()
+        second.reserve(1500)
+        second.cleanup()
+
+def test_cleanup_on_exception_and_small_files_on_tmpfs():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpfs = os.path.join(tmp, 'shm')
+        os.makedirs(tmpfs)
+        with pytest.raises(RuntimeError):
+            with Workspace('t', root=os.path.join(tmp, 'scratch'), tmpfs_root=tmpfs) as ws:
+                small = ws.small_path('list.txt', 100)
+                large = ws.small_path('seg.mp4', 10 ** 9)
+                assert small.startswith(tmpfs + os.sep)
+                assert large.startswith(os.path.join(tmp, 'scratch') + os.sep)
+                write(small, 10)
+                raise RuntimeError('stage crashed')
+        assert not os.path.exists(small)
+        assert os.listdir(os.path.join(tmp, 'scratch')) == []
+
+def test_orphans_of_dead_processes_are_reclaimed():
+    with tempfile.TemporaryDirectory() as tmp:
+        orphan = os.path.join(tmp, f'{dead_pid()}-job-abc')
+        alive = os.path.join(tmp, f'{os.getppid()}-job-def')
+        for path in (orphan, alive):
+            os.makedirs(path)
+            write(os.path.join(path, 'video.mp4'), 500)
+
+        assert reclaim_orphans(tmp, '') == 500
+        assert not os.path.exists(orphan)
+        assert os.path.exists(alive)
+
+@pytest.mark.skipif(os.name == 'nt', reason='POSIX signals')
+def test_sigterm_removes_workspace_and_sigkill_leaves_it_for_reclaim():
+    script = (
+        "import sys, time, workspace\n"
+        "ws = workspace.Workspace('sig', root=sys.argv[1], tmpfs_root='')\n"
+        "open(ws.path('partial.mp4'), 'wb').write(b'x' * 100)\n"
+        "print(ws.dir, flush=True)\n"
+        "time.sleep(60)\n"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        for signum, survives in ((signal.SIGTERM, False), (signal.SIGKILL, True)):
+            process = subprocess.Popen([sys.executable, '-c', script, tmp], cwd=HERE,
+                                       stdout=subprocess.PIPE, text=True)
+            job_dir = process.stdout.readline().strip()
+            assert os.path.isdir(job_dir)
+            process.send_signal(signum)
+            assert process.wait(timeout=10) == -signum
+            assert os.path.exists(job_dir) == survives
+
+        # The next workspace created reclaims what the killed process left
+        with Workspace('next', root=tmp, tmpfs_root='') as ws:
+            job_dir = ws.dir
+            assert os.listdir(tmp) == [os.path.basename(job_dir)]
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_trailer_segments_stay_out_of_the_output_directory():
+    import trailer_generator
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=6:size=320x240:rate=25',
+            '-f', 'lavfi', '-i', 'sine=duration=6', '-shortest', '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+        out_dir = os.path.join(tmp, 'out')
+        os.makedirs(out_dir)
+        scratch = os.path.join(tmp, 'scratch')
+
+        with Workspace('trailer', root=scratch, tmpfs_root='') as ws:
+            ok = trailer_generator.create_trailer_from_segments(
+                video, os.path.join(out_dir, 'trailer.mp4'), [(0, 2), (3, 5)], workspace=ws
+            )
+            assert ok
+            assert os.listdir(out_dir) == ['trailer.mp4']
+        assert os.listdir(scratch) == []
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='ffmpeg not installed')
+def test_trailer_segment_cut_short_by_the_quota_is_dropped(monkeypatch):
+    import ffmpeg_runner
+    import trailer_generator
+    from deadline import Budget
+    monkeypatch.setenv(ffmpeg_runner.CONCURRENCY_ENV, '1')
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, 'clip.mp4')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', 'testsrc2=duration=6:size=320x240:rate=25',
+            '-pix_fmt', 'yuv420p', video
+        ], check=True, timeout=60)
+        budget = Budget()
+
+        # Room for the first segment, not for a second one next to it
+        with Workspace('trailer', quota_bytes=40000, root=os.path.join(tmp, 'scratch'), tmpfs_root='') as ws:
+            ok = trailer_generator.create_trailer_from_segments(
+                video, os.path.join(tmp, 'trailer.mp4'), [(0, 2), (3, 5)], budget, ws
+            )
+        assert ok
+        assert budget.degradations == [{'what': 'trailer_segments', 'detail': 'segment 2 over the workspace quota'}]
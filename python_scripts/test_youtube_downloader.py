@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+
+import pytest
+
+import youtube_downloader
+from youtube_downloader import select_proxy_format, resolve_urls, stream_expiry, ResolveCache
+
+def fmt(format_id, height, ext='mp4', vcodec='avc1', acodec='mp4a'):
+    return {'format_id': format_id, 'url': f'https://media/{format_id}', 'height': height,
+            'ext': ext, 'vcodec': vcodec, 'acodec': acodec}
+
+def video_info(video_id, expire=None, acodec='mp4a'):
+    query = f'?id={video_id}' + (f'&expire={expire}' if expire else '')
+    return {
+        'id': video_id, 'title': f'Video {video_id}', 'duration': 60,
+        'url': f'https://media/{video_id}/720{query}', 'ext': 'mp4', 'format_id': '22',
+        'width': 1280, 'height': 720, 'acodec': acodec, 'vcodec': 'avc1',
+        'formats': [fmt('18', 360), fmt('22', 720)],
+    }
+
+class StubExtractor:
+    """Canned info dicts; records calls and the peak number of concurrent calls"""
+
+    def __init__(self, infos, delay=0.0):
+        self.infos = infos
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, url):
+        with self.lock:
+            self.calls.append(url)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            if url not in self.infos:
+                raise Exception(f"Video unavailable: {url}")
+            return self.infos[url]
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def test_proxy_is_largest_progressive_mp4_at_or_below_360p():
+    info = {'formats': [
+        fmt('144', 144), fmt('240', 240), fmt('360', 360), fmt('720', 720),
+        fmt('360-webm', 360, ext='webm'), fmt('480-video-only', 480, acodec='none'),
+    ]}
+    assert select_proxy_format(info)['format_id'] == '360'
+
+def test_proxy_falls_back_to_smallest_format():
+    info = {'formats': [fmt('1080', 1080), fmt('720', 720), fmt('audio', None, vcodec='none')]}
+    assert select_proxy_format(info)['format_id'] == '720'
+    assert select_proxy_format({'formats': []}) is None
+
+def test_resolves_concurrently_in_input_order_with_bounded_workers():
+    infos = {f'https://yt/{i}': video_info(str(i)) for i in range(8)}
+    extractor = StubExtractor(infos, delay=0.05)
+
+    results = resolve_urls(list(infos) + ['https://yt/missing'], max_workers=3,
+                           extractor=extractor, cache=False)
+
+    assert [r['source'] for r in results] == list(infos) + ['https://yt/missing']
+    assert all(r['success'] for r in results[:-1])
+    assert 'unavailable' in results[-1]['error']
+    assert results[0]['proxy_url'] == 'https://media/18'
+    assert 2 <= extractor.peak <= 3
+
+def test_audio_comes_from_info_dict_without_probing(monkeypatch):
+    monkeypatch.setattr(youtube_downloader, 'check_audio_presence',
+                        lambda url: (_ for _ in ()).throw(AssertionError('probed')))
+    extractor = StubExtractor({'https://yt/a': video_info('a'), 'https://yt/m': video_info('m', acodec='none')})
+    results = resolve_urls(['https://yt/a', 'https://yt/m'], extractor=extractor, cache=False)
+    assert [r['has_audio'] for r in results] == [True, False]
+
+def test_playlists_expand_to_their_entries():
+    infos = {
+        'https://yt/list': {'_type': 'playlist', 'entries': [
+            {'url': 'https://yt/p1'}, None, {'url': 'https://yt/p2'},
+        ]},
+        'https://yt/p1': video_info('p1'),
+        'https://yt/p2': video_info('p2'),
+        'https://yt/solo': video_info('solo'),
+    }
+    results = resolve_urls(['https://yt/list', 'https://yt/solo'],
+                           extractor=StubExtractor(infos), cache=False)
+    assert [r['source'] for r in results] == ['https://yt/p1', 'https://yt/p2', 'https://yt/solo']
+
+def test_nested_and_empty_playlists():
+    infos = {
+        'https://yt/outer': {'_type': 'playlist', 'entries': [
+            {'url': 'https://yt/inner'}, {'url': 'https://yt/p3'}, {'url': 'https://yt/empty'},
+        ]},
+        'https://yt/inner': {'_type': 'playlist', 'entries': [{'url': 'https://yt/p1'}, {'url': 'https://yt/p2'}]},
+        'https://yt/empty': {'_type': 'playlist', 'entries': []},
+        'https://yt/loop': {'_type': 'playlist', 'entries': [{'url': 'https://yt/loop'}]},
+        'https://yt/p1': video_info('p1'),
+        'https://yt/p2': video_info('p2'),
+        'https://yt/p3': video_info('p3'),
+    }
+    results = resolve_urls(['https://yt/outer', 'https://yt/empty', 'https://yt/loop'],
+                           extractor=StubExtractor(infos), cache=False)
+    assert [r['source'] for r in results] == [
+        'https://yt/p1', 'https://yt/p2', 'https://yt/p3', 'https://yt/empty', 'https://yt/empty', 'https://yt/loop'
+    ]
+    assert [r['success'] for r in results] == [True, True, True, False, False, False]
+    assert 'no entries' in results[3]['error'] and 'nested' in results[5]['error']
+
+    with pytest.raises(Exception, match='no entries'):
+        youtube_downloader.get_video_stream_urls('https://yt/empty', extractor=StubExtractor(infos), cache=False)
+
+def test_cache_serves_until_stream_url_expires(tmp_path):
+    now = time.time()
+    infos = {
+        'https://yt/fresh': video_info('fresh', expire=int(now + 3600)),
+        'https://yt/stale': video_info('stale', expire=int(now + 60)),
+    }
+    extractor = StubExtractor(infos)
+    cache = ResolveCache(str(tmp_path))
+
+    for _ in range(2):
+        results = resolve_urls(list(infos), extractor=extractor, cache=cache)
+    assert extractor.calls.count('https://yt/fresh') == 1
+    assert results[0]['cached'] and results[0]['expires_at'] == int(now + 3600)
+    # Within the safety margin of its expiry, a URL is never served from cache
+    assert extractor.calls.count('https://yt/stale') == 2
+
+    assert cache.get('https://yt/fresh', now=now + 3600) is None
+
+def test_stream_expiry_formats():
+    assert stream_expiry('https://r1.googlevideo.com/videoplayback?expire=1700000000&ei=x') == 1700000000
+    assert stream_expiry('https://manifest.googlevideo.com/api/manifest/hls/expire/1700000000/ei/x') == 1700000000
+    assert stream_expiry('https://example.com/video.mp4') is None
@@ -1,12 +1,20 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
-import cv2
-import numpy as np
+import heapq
+import bisect
 import random
 import time
-import yt_dlp
-import tempfile
+
+import growing_file
+import cpu_governor
+import perceptual_hash
+import seek_index
+from deadline import Budget, RateMeter
+from face_engine import FaceEngine
+from job_output import unique_name
+from media_probe import probe_media
+from workspace import Workspace
 
 sys.stdout.reconfigure(encoding='utf-8')
 os.environ['PYTHONIOENCODING'] = 'utf-8'
@@ -22,22 +30,31 @@ def safe_print(text):
         except:
             pass
 
-def download_streaming_video(url, temp_dir):
-    """Download streaming video (HLS/DASH) to temporary local file"""
+# Low-resolution format analysed in two-tier mode; winners come from the full stream
+PROXY_FORMAT = 'best[height<=360][ext=mp4]/worst[ext=mp4]/worst'
+
+def download_streaming_video(url, temp_dir, format_spec='best[ext=mp4]/best', max_bytes=None):
+    """Download streaming video (HLS/DASH) to temporary local file
+
+    max_bytes: abort instead of writing a larger file (workspace quota).
+    """
     safe_print("[Thumbnail] Downloading streaming video to temp file...")
+    import yt_dlp
     
-    timestamp = int(time.time())
-    base_name = f"video_{timestamp}"
+    # Unique per download, so concurrent jobs never pick up each other's files
+    base_name = unique_name("video")
     base_path = os.path.join(temp_dir, base_name)
     
     ydl_opts = {
-        'format': 'best[ext=mp4]/best',
+        'format': format_spec,
         'quiet': False,
         'no_warnings': True,
         'outtmpl': base_path,  # No extension - yt-dlp adds it
         'socket_timeout': 30,
         'http_chunk_size': 10485760,  # 10MB chunks
     }
+    if max_bytes is not None:
+        ydl_opts['max_filesize'] = max_bytes
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
@@ -76,64 +93,292 @@ def download_streaming_video(url, temp_dir):
         traceback.print_exc()
         raise
 
-def detect_scene_changes(video_path, threshold=25.0, max_scenes=5):
-    """Detect scene boundaries using histogram difference"""
-    safe_print("[Thumbnail] Detecting scene changes...")
+def _scene_samples_capture(video_path):
+    """Sample ~2 frames per second with OpenCV, returns None if the video cannot be opened"""
+    import cv2
 
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
-        safe_print("[Thumbnail] Warning: Cannot analyze scenes")
-        return []
+        return None
 
     fps = cap.get(cv2.CAP_PROP_FPS)
-    prev_hist = None
-    scenes = []
-    frame_num = 0
     sample_rate = max(1, int(fps / 2)) if fps > 0 else 1
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def samples():
+        frame_num = 0
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if frame_num % sample_rate == 0:
+                    small = cv2.resize(frame, (320, 180))
+                    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+                    yield frame_num, frame_num / fps if fps > 0 else 0, gray
+                frame_num += 1
+        finally:
+            cap.release()
 
-        if frame_num % sample_rate != 0:
-            frame_num += 1
-            continue
+    return samples()
+
+def _scene_samples_frame_server(video_path, fps, growing=False):
+    """Sample 2 frames per second decoded and scaled to 320x180 gray inside ffmpeg
 
+    Frames are numbered from their timestamps at fps; with fps unknown
+    the number is None and only the timestamp places the sample.
+    """
+    from frame_server import iter_frames
+
+    def samples():
+        for timestamp, gray in iter_frames(video_path, 320, 180, fps=2.0, pix_fmt='gray', growing=growing):
+            yield int(round(timestamp * fps)) if fps else None, float(timestamp), gray
+
+    return samples()
+
+def _scene_samples_keyframes(video_path):
+    """Decode keyframes only (ffmpeg -skip_frame nokey), 320x180 gray, timed by the seek index"""
+    import subprocess
+    import numpy as np
+
+    index = seek_index.load_or_build_index(video_path)
+    frame_bytes = 320 * 180
+
+    def samples():
+        process = subprocess.Popen([
+            'ffmpeg', '-v', 'error', '-nostdin', *cpu_governor.ffmpeg_threads(),
+            '-skip_frame', 'nokey', '-i', video_path,
+            '-an', '-vsync', 'passthrough', '-vf', 'scale=320:180',
+            '-pix_fmt', 'gray', '-f', 'rawvideo', 'pipe:1'
+        ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
         try:
-            small = cv2.resize(frame, (320, 180))
-            gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
-            hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+            for frame_num in index['keyframes']:
+                raw = process.stdout.read(frame_bytes)
+                if len(raw) < frame_bytes:
+                    break
+                timestamp = index['pts'][frame_num] - index['start_time']
+                yield frame_num, timestamp, np.frombuffer(raw, dtype=np.uint8).reshape(180, 320)
+        finally:
+            process.kill()
+            process.stdout.close()
+            process.wait()
 
-            if prev_hist is not None:
-                hist_diff = cv2.compareHist(
-                    prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA
-                )
+    return samples()
 
-                if hist_diff > threshold:
-                    scenes.append({
-                        'frame': frame_num,
-                        'timestamp': frame_num / fps if fps > 0 else 0,
-                        'diff': float(hist_diff)
-                    })
+# Full sweeps project their cost after this many samples and fall back
+# to keyframes only if it would not fit the budget
+CALIBRATION_SAMPLES = 10
 
-            prev_hist = hist
-        except:
-            pass
+# Adaptive scene detection: aim for this many coarse samples, never coarser than MAX_COARSE_SECONDS
+COARSE_SAMPLES = 300
+MAX_COARSE_SECONDS = 10.0
+
+def coarse_step_frames(frame_count, fps, fine_step):
+    """Coarse sweep interval in frames, scaled to duration and aligned to the fine grid"""
+    duration = frame_count / fps if fps > 0 else 0
+    seconds = min(MAX_COARSE_SECONDS, duration / COARSE_SAMPLES)
+    return max(1, int(seconds * fps / fine_step)) * fine_step
 
-        frame_num += 1
+def coarse_to_fine_cuts(hist_at, distance, frame_count, fine_step, coarse_step, threshold):
+    """Find cuts on the fine_step grid while decoding only around them
 
-    cap.release()
+    Sweeps the grid every coarse_step frames; intervals whose endpoint
+    distance exceeds threshold are halved recursively (both halves when
+    both exceed it) down to adjacent fine samples. A cut is reported at
+    the later frame of a fine pair, with that pair's distance, which is
+    what an exhaustive sweep at fine_step reports. Returns
+    (cuts as [(frame, diff)], number of frames decoded).
+    """
+    cache = {}
+
+    def hist(frame_num):
+        if frame_num not in cache:
+            cache[frame_num] = hist_at(frame_num)
+        return cache[frame_num]
 
-    scenes.sort(key=lambda x: x['diff'], reverse=True)
-    scenes = scenes[:max_scenes]
-    scenes.sort(key=lambda x: x['timestamp'])
+    def refine(a, b, cuts):
+        d = distance(hist(a), hist(b))
+        if d <= threshold:
+            return
+        if b - a <= fine_step:
+            cuts.append((b, d))
+            return
+        mid = a + ((b - a) // fine_step // 2) * fine_step
+        refine(a, mid, cuts)
+        refine(mid, b, cuts)
 
-    safe_print(f"[Thumbnail] Found {len(scenes)} scene changes")
-    return scenes
+    last = ((frame_count - 1) // fine_step) * fine_step
+    points = list(range(0, last + 1, coarse_step))
+    if points[-1] != last:
+        points.append(last)
+
+    cuts = []
+    for a, b in zip(points, points[1:]):
+        refine(a, b, cuts)
+    return cuts, len(cache)
+
+def _detect_scenes_adaptive(video_path, threshold, fps, frame_count, fine_step, coarse_step, budget=None):
+    import cv2
+
+    reader = seek_index.open_frame_reader(video_path, max_width=320)
+    frame_count = min(frame_count, reader.frame_count)
+    out_of_time = []
+
+    def hist_at(frame_num):
+        if budget and budget.expired():
+            # Unread samples compare as identical, so refinement stops here
+            if not out_of_time:
+                out_of_time.append(frame_num)
+                budget.degrade('scene_detection', f"stopped at {frame_num / fps:.1f}s of {frame_count / fps:.1f}s")
+            return None
+        frame = reader.read(frame_num)
+        if frame is None:
+            return None
+        gray = cv2.cvtColor(cv2.resize(frame, (320, 180)), cv2.COLOR_BGR2GRAY)
+        return cv2.calcHist([gray], [0], None, [256], [0, 256])
+
+    def distance(h1, h2):
+        if h1 is None or h2 is None:
+            return 0.0
+        return cv2.compareHist(h1, h2, cv2.HISTCMP_BHATTACHARYYA)
+
+    try:
+        cuts, decoded = coarse_to_fine_cuts(hist_at, distance, frame_count, fine_step, coarse_step, threshold)
+    finally:
+        reader.close()
+
+    safe_print(f"[Thumbnail] Adaptive scene scan decoded {decoded} frames "
+               f"(full scan: {frame_count // fine_step + 1})")
+    return [{'frame': f, 'timestamp': f / fps, 'diff': float(d)} for f, d in cuts]
+
+def _scenes_from_samples(samples, threshold, on_sample=None):
+    """Histogram-difference cuts over (frame, timestamp, gray) samples
+
+    on_sample(count, timestamp) may return True to stop early.
+    """
+    import cv2
+
+    prev_hist = None
+    scenes = []
+    count = 0
 
-def score_frame_quality(frame, motion=0.0):
-    """Rate frame quality on multiple dimensions"""
+    try:
+        for frame_num, timestamp, gray in samples:
+            try:
+                hist = cv2.calcHist([gray], [0], None, [256], [0, 256])
+
+                if prev_hist is not None:
+                    hist_diff = cv2.compareHist(
+                        prev_hist, hist, cv2.HISTCMP_BHATTACHARYYA
+                    )
+
+                    if hist_diff > threshold:
+                        scenes.append({
+                            'frame': frame_num,
+                            'timestamp': timestamp,
+                            'diff': float(hist_diff)
+                        })
+
+                prev_hist = hist
+            except:
+                pass
+            count += 1
+            if on_sample and on_sample(count, timestamp):
+                samples.close()
+                return scenes, False
+    except Exception as e:
+        safe_print(f"[Thumbnail] Warning: Scene analysis stopped early: {e}")
+
+    return scenes, True
+
+def detect_scene_changes(video_path, threshold=25.0, max_scenes=5, fps=None, frame_count=None, adaptive=None,
+                         budget=None, growing=False):
+    """Detect scene boundaries using histogram difference
+
+    adaptive: coarse-to-fine search instead of a full sweep; by default
+    used when fps and frame_count are known and the video is long
+    enough for the coarse interval to exceed the fine one. budget: a
+    deadline.Budget; a full sweep projected to overrun it is replaced
+    by a keyframe-only sweep. growing: video_path is still being written
+    (growing_file); it is swept once as it arrives, needing ffmpeg.
+    """
+    from frame_server import ffmpeg_available
+    safe_print("[Thumbnail] Detecting scene changes...")
+
+    def top(scenes):
+        scenes.sort(key=lambda x: x['diff'], reverse=True)
+        scenes = scenes[:max_scenes]
+        scenes.sort(key=lambda x: x['timestamp'])
+        safe_print(f"[Thumbnail] Found {len(scenes)} scene changes")
+        return scenes
+
+    if growing:
+        scenes, _ = _scenes_from_samples(_scene_samples_frame_server(video_path, fps, growing=True), threshold)
+        return top(scenes)
+
+    if fps and frame_count:
+        fine_step = max(1, int(fps / 2))
+        coarse_step = coarse_step_frames(frame_count, fps, fine_step)
+        if adaptive is None:
+            adaptive = coarse_step > fine_step
+        if adaptive:
+            return top(_detect_scenes_adaptive(video_path, threshold, fps, frame_count, fine_step, coarse_step, budget))
+
+    if ffmpeg_available() and fps:
+        samples = _scene_samples_frame_server(video_path, fps)
+    else:
+        samples = _scene_samples_capture(video_path)
+
+    if samples is None:
+        safe_print("[Thumbnail] Warning: Cannot analyze scenes")
+        return []
+
+    duration = frame_count / fps if fps and frame_count else 0
+    started = time.time()
+
+    def over_budget(count, timestamp):
+        if not (budget and budget.limited and duration and count == CALIBRATION_SAMPLES and timestamp > 0):
+            return False
+        projected = (time.time() - started) / timestamp * (duration - timestamp)
+        return not budget.allows(projected)
+
+    scenes, complete = _scenes_from_samples(samples, threshold, over_budget)
+    if complete:
+        return top(scenes)
+
+    safe_print("[Thumbnail] Full scene sweep would overrun the time budget, using keyframes only")
+    budget.degrade('scene_detection', 'keyframes only')
+    try:
+        scenes, _ = _scenes_from_samples(_scene_samples_keyframes(video_path), threshold)
+    except Exception as e:
+        safe_print(f"[Thumbnail] Warning: Keyframe scene analysis failed: {e}")
+    return top(scenes)
+
+def extract_full_resolution_frame(source, timestamp, output_path, timeout=60):
+    """Save one frame of source (file or stream URL) at full resolution
+
+    Input-side -ss lets ffmpeg seek by byte range on HTTP sources, so
+    only the data around the timestamp is transferred and decoded.
+    """
+    import subprocess
+    cmd = [
+        'ffmpeg', '-v', 'error', '-y', '-nostdin', *cpu_governor.ffmpeg_threads(),
+        '-ss', f"{max(0.0, timestamp):.3f}", '-i', source,
+        '-frames:v', '1', '-q:v', '2', output_path
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False
+    return result.returncode == 0 and os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+def score_frame_quality(frame, motion=0.0, face_engine=None, position=None):
+    """Rate frame quality on multiple dimensions
+
+    face_engine: a face_engine.FaceEngine shared across the frames of
+    one video, so faces can be tracked between nearby positions.
+    """
+    import cv2
+    import numpy as np
     try:
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
@@ -149,11 +394,8 @@ def score_frame_quality(frame, motion=0.0):
 
         face_score = 0.3
         try:
-            face_cascade = cv2.CascadeClassifier(
-                cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-            )
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4, minSize=(30, 30))
-            if len(faces) > 0:
+            faces = (face_engine or FaceEngine(track=False)).detect(frame, position)
+            if faces['count'] > 0:
                 face_score = 1.0
         except:
             pass
@@ -172,18 +414,162 @@ def score_frame_quality(frame, motion=0.0):
     except:
         return 0.0
 
-def generate_smart_thumbnails(video_path, output_dir, num_candidates=20):
-    """Generate smart thumbnails from video"""
-    
-    # If it's a streaming URL, download it first
+# Shares of the remaining time budget: scene detection, then candidate
+# sampling (the rest is kept for saving)
+SCENE_BUDGET_SHARE = 0.3
+SAMPLING_BUDGET_SHARE = 0.8
+# Candidates always evaluated, whatever the budget
+MIN_CANDIDATES = 10
+
+# Candidates that can still be picked: the best TOP_POOL are shuffled and NUM_THUMBNAILS kept
+TOP_POOL = 20
+NUM_THUMBNAILS = 10
+DEFAULT_CANDIDATE_MEMORY_MB = 64
+
+class CandidatePool:
+    """Best `capacity` candidates by score, holding frames within a memory cap
+
+    Candidates that fall out of the top are dropped with their frames.
+    When the frames held exceed memory_cap bytes, the lowest-scoring
+    ones are re-encoded as JPEG; if that is still too much, their bytes
+    are dropped and only the position is kept so the frame can be
+    fetched again when saving.
+    """
+
+    def __init__(self, capacity=TOP_POOL, memory_cap=None):
+        self.capacity = capacity
+        self.memory_cap = memory_cap
+        self.heap = []
+        self.seq = 0
+        self.bytes = 0
+        self.peak_bytes = 0
+        self.evicted = 0
+        self.spilled = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _size(item):
+        if item.get('frame') is not None:
+            return item['frame'].nbytes
+        return len(item['jpeg']) if item.get('jpeg') else 0
+
+    def add(self, item, frame):
+        """Offer a scored candidate; returns False if it cannot make the top"""
+        if len(self.heap) >= self.capacity and item['score'] <= self.heap[0][0]:
+            self.evicted += 1
+            return False
+
+        item['frame'] = frame
+        item['jpeg'] = None
+        heapq.heappush(self.heap, (item['score'], self.seq, item))
+        self.seq += 1
+        self.bytes += self._size(item)
+        self.peak_bytes = max(self.peak_bytes, self.bytes)
+
+        if len(self.heap) > self.capacity:
+            _, _, worst = heapq.heappop(self.heap)
+            self.bytes -= self._size(worst)
+            worst['frame'] = worst['jpeg'] = None
+            self.evicted += 1
+
+        self._enforce_cap()
+        return True
+
+    def _enforce_cap(self):
+        if self.memory_cap is None or self.bytes <= self.memory_cap:
+            return
+        import cv2
+        by_score = [entry[2] for entry in sorted(self.heap)]
+        for item in by_score:
+            if self.bytes <= self.memory_cap:
+                return
+            if item['frame'] is not None:
+                ok, buf = cv2.imencode('.jpg', item['frame'], [cv2.IMWRITE_JPEG_QUALITY, 95])
+                self.bytes -= item['frame'].nbytes
+                item['frame'] = None
+                if ok:
+                    item['jpeg'] = buf.tobytes()
+                    self.bytes += len(item['jpeg'])
+                    self.spilled += 1
+        for item in by_score:
+            if self.bytes <= self.memory_cap:
+                return
+            if item['jpeg']:
+                self.bytes -= len(item['jpeg'])
+                item['jpeg'] = None
+                self.dropped += 1
+
+    def items(self):
+        return [entry[2] for entry in self.heap]
+
+    def frame(self, item, refetch):
+        """Frame for a kept candidate, decoding or re-fetching it if needed"""
+        if item.get('frame') is not None:
+            return item['frame']
+        if item.get('jpeg'):
+            import cv2
+            import numpy as np
+            return cv2.imdecode(np.frombuffer(item['jpeg'], dtype=np.uint8), cv2.IMREAD_COLOR)
+        return refetch(item['position'])
+
+    def stats(self):
+        return {
+            'kept': len(self.heap),
+            'evicted': self.evicted,
+            'spilled_to_jpeg': self.spilled,
+            'refetch': self.dropped,
+            'memory_cap_bytes': self.memory_cap,
+            'peak_bytes': self.peak_bytes,
+        }
+
+def generate_smart_thumbnails(video_path, output_dir, num_candidates=20, probe=None, artifacts=None, hq_source=None,
+                              memory_cap_bytes=None, budget=None, growing=False):
+    """Generate smart thumbnails from video
+
+    probe: optional media_probe summary for video_path, reused instead of
+    reading stream properties from OpenCV. artifacts: optional dict that
+    receives statistics for the pipeline's stage report.
+    hq_source: full-resolution file or stream URL; when given, video_path
+    is treated as a low-resolution proxy used only for analysis, and the
+    saved thumbnails are extracted from hq_source.
+    memory_cap_bytes: limit for candidate frames held in memory (default:
+    CANDIDATE_MEMORY_MB, 64 MB); the pool's statistics, including its
+    peak, go to artifacts['candidate_pool']. budget: deadline.Budget; scene
+    detection, candidate count and full-resolution extraction are cut
+    back to finish within it (recorded in budget.degradations).
+    Downloads go to a workspace.Workspace removed before returning.
+    growing: video_path is still being written (growing_file); scenes
+    are detected while it arrives, candidates sampled once it is complete.
+    """
+    with Workspace('thumbnails') as workspace:
+        return _generate_smart_thumbnails(video_path, output_dir, num_candidates, probe, artifacts, hq_source,
+                                          memory_cap_bytes, budget or Budget(), workspace, growing)
+
+def _generate_smart_thumbnails(video_path, output_dir, num_candidates, probe, artifacts, hq_source,
+                               memory_cap_bytes, budget, workspace, growing=False):
+    # If it's a streaming URL, download it first (a low-resolution proxy
+    # unless THUMBNAIL_PROXY=0)
     if video_path.startswith('http'):
-        temp_dir = tempfile.mkdtemp()
+        format_spec = 'best[ext=mp4]/best'
+        if os.environ.get('THUMBNAIL_PROXY', '1') != '0':
+            hq_source = hq_source or video_path
+            format_spec = PROXY_FORMAT
         try:
-            video_path = download_streaming_video(video_path, temp_dir)
+            video_path = download_streaming_video(video_path, workspace.dir, format_spec, workspace.available())
+            workspace.check()
         except Exception as e:
             safe_print(f"[Thumbnail] ERROR: Failed to download video: {e}")
             return 0
     
+    scenes = None
+    if growing:
+        # The stream header is usually there before the rest; not cached, the file is still changing
+        fps = (probe or {}).get('fps') or (probe_media(video_path, use_cache=False) or {}).get('fps')
+        scenes = detect_scene_changes(video_path, threshold=15.0, max_scenes=15, fps=fps, growing=True)
+        growing_file.wait_until_complete(video_path)
+        probe = probe_media(video_path)
+
+    import cv2
     safe_print(f"[Thumbnail] Opening video: {video_path}")
     
     cap = cv2.VideoCapture(video_path)
@@ -192,9 +578,15 @@ def generate_smart_thumbnails(video_path, output_dir, num_candidates=20):
         safe_print("[Thumbnail] ERROR: Cannot open video file")
         return 0
     
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    duration = frame_count / fps if fps > 0 else 0
+    probe = probe or probe_media(video_path)
+    if probe and probe.get('frame_count', 0) > 0:
+        fps = probe['fps']
+        frame_count = probe['frame_count']
+        duration = probe['duration']
+    else:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration = frame_count / fps if fps > 0 else 0
     
     if frame_count <= 0:
         safe_print(f"[Thumbnail] ERROR: Invalid frame count: {frame_count}")
@@ -205,7 +597,9 @@ def generate_smart_thumbnails(video_path, output_dir, num_candidates=20):
     
     os.makedirs(output_dir, exist_ok=True)
     
-    scenes = detect_scene_changes(video_path, threshold=15.0, max_scenes=15)
+    if scenes is None:
+        scenes = detect_scene_changes(video_path, threshold=15.0, max_scenes=15, fps=fps, frame_count=frame_count,
+                                      budget=budget.split(SCENE_BUDGET_SHARE))
     sample_positions = [int(s['timestamp'] * fps) for s in scenes]
 
     random.seed(time.time())
@@ -222,18 +616,52 @@ def generate_smart_thumbnails(video_path, output_dir, num_candidates=20):
 
     sample_positions = list(set(sample_positions))
     random.shuffle(sample_positions)
-    sample_positions = sample_positions[:num_candidates]
+    # Read in stream order so the reader decodes forward instead of seeking back
+    sample_positions = sorted(sample_positions[:num_candidates])
     safe_print(f"[Thumbnail] Sampling {len(sample_positions)} candidate frames...")
     
-    candidates = []
+    cap.release()
+    reader = seek_index.open_frame_reader(video_path, max_width=640)
+    
+    if memory_cap_bytes is None:
+        memory_cap_bytes = int(float(os.environ.get('CANDIDATE_MEMORY_MB', DEFAULT_CANDIDATE_MEMORY_MB)) * 1024 * 1024)
+    pool = CandidatePool(TOP_POOL, memory_cap_bytes)
+    evaluated = 0
     prev_gray = None
+    sampling_budget = budget.split(SAMPLING_BUDGET_SHARE)
+    meter = RateMeter()
+    # Positions within a second of each other count as adjacent for face tracking
+    faces = FaceEngine(max_track_gap=max(1, int(round(fps))))
+    # Hashes of the frames scored so far; a near-duplicate is not scored
+    # and its place goes to the least-sampled stretch of the video
+    hashes = perceptual_hash.BKTree()
+    pending = list(sample_positions)
+    taken = set(sample_positions)
+    # Replacements behind the read position wait for the next forward pass
+    behind = []
+    near_duplicates = []
+    replacements = 0
+    idx = -1
     
-    for idx, pos in enumerate(sample_positions):
+    refill = False
+    while pending or behind or (not refill and near_duplicates and evaluated < NUM_THUMBNAILS):
+        if not pending and behind:
+            pending, behind = behind, []
+        elif not pending:
+            # Too few distinct frames for a full set: score the duplicates after all
+            refill = True
+            pending = sorted(near_duplicates[:NUM_THUMBNAILS - evaluated])
+        pos = pending.pop(0)
+        idx += 1
+        if evaluated >= MIN_CANDIDATES and not sampling_budget.allows(meter.per_unit(0.0)):
+            safe_print(f"[Thumbnail] Time budget reached, stopping after {evaluated} candidates")
+            budget.degrade('num_candidates', f"{len(sample_positions)} -> {evaluated}")
+            break
+        meter.start()
         try:
-            cap.set(cv2.CAP_PROP_POS_FRAMES, pos)
-            ret, frame = cap.read()
+            frame = reader.read(min(pos, reader.frame_count - 1))
             
-            if not ret or frame is None:
+            if frame is None:
                 continue
             
             h, w = frame.shape[:2]
@@ -250,47 +678,95 @@ def generate_smart_thumbnails(video_path, output_dir, num_candidates=20):
                 motion = 0.0
             
             prev_gray = gray
-            score = score_frame_quality(frame, motion)
+            frame_hash = perceptual_hash.dhash(gray)
+            if not refill and hashes.nearest(frame_hash, perceptual_hash.NEAR_DUPLICATE_BITS):
+                near_duplicates.append(pos)
+                if replacements < len(sample_positions):
+                    new_pos = perceptual_hash.largest_gap_midpoint(taken, 0, frame_count - 1)
+                    if new_pos is not None:
+                        taken.add(new_pos)
+                        bisect.insort(pending if new_pos > pos else behind, new_pos)
+                        replacements += 1
+                # The decode counts towards the cost of the candidates scored
+                meter.stop(units=0)
+                continue
+            hashes.add(frame_hash, pos)
+            score = score_frame_quality(frame, motion, faces, pos)
             
-            candidates.append({
-                'frame': frame,
+            pool.add({
                 'score': score,
                 'position': pos,
                 'timestamp': pos / fps if fps > 0 else 0,
                 'motion': motion
-            })
+            }, frame)
+            evaluated += 1
+            meter.stop()
         
         except Exception as e:
             safe_print(f"[Thumbnail] Error sampling frame {idx}: {e}")
             continue
     
-    cap.release()
+    reader.close()
     
-    if not candidates:
+    if not evaluated:
         safe_print("[Thumbnail] ERROR: No frames could be sampled")
         return 0
     
-    safe_print(f"[Thumbnail] Evaluated {len(candidates)} frames")
+    stats = dict(pool.stats(), near_duplicates=len(near_duplicates), replacements=replacements)
+    if artifacts is not None:
+        artifacts['candidate_pool'] = stats
+        artifacts['face_engine'] = dict(faces.stats)
+    safe_print(f"[Thumbnail] Evaluated {evaluated} frames "
+               f"(peak candidate memory {stats['peak_bytes'] / 1024 / 1024:.1f} MB, "
+               f"{stats['spilled_to_jpeg']} spilled to JPEG, {stats['refetch']} to re-fetch, "
+               f"{len(near_duplicates)} near-duplicates skipped)")
+    
+    refetch_reader = []
     
-    candidates.sort(key=lambda x: x['score'], reverse=True)
-    top_candidates = candidates[:20]
+    def refetch(position):
+        if not refetch_reader:
+            refetch_reader.append(seek_index.open_frame_reader(video_path, max_width=640))
+        return refetch_reader[0].read(min(position, refetch_reader[0].frame_count - 1))
+    
+    top_candidates = pool.items()
     random.shuffle(top_candidates)
-    best_frames = top_candidates[:10]
+    best_frames = top_candidates[:NUM_THUMBNAILS]
     
     best_frames.sort(key=lambda x: x['position'])
     
-    safe_print(f"[Thumbnail] Saving top 10 thumbnails...")
+    safe_print(f"[Thumbnail] Saving top {NUM_THUMBNAILS} thumbnails...")
     saved_count = 0
+    extract_meter = RateMeter()
     
     for i, item in enumerate(best_frames):
         try:
             output_path = os.path.join(output_dir, f'thumb_{i+1:02d}.jpg')
             
-            success = cv2.imwrite(
-                output_path, 
-                item['frame'], 
-                [cv2.IMWRITE_JPEG_QUALITY, 95]
-            )
+            success = False
+            if hq_source and not budget.allows(extract_meter.per_unit(0.0)):
+                safe_print(f"  [!] Time budget reached, saving analysis frames")
+                budget.degrade('full_resolution_thumbnails', f"{i} of {len(best_frames)}")
+                hq_source = None
+            if hq_source:
+                extract_meter.start()
+                success = extract_full_resolution_frame(hq_source, item['timestamp'], output_path)
+                extract_meter.stop()
+                if not success:
+                    safe_print(f"  [!] Full-resolution extract failed, using analysis frame")
+            
+            if not success and item.get('jpeg'):
+                # Already encoded at the same quality
+                with open(output_path, 'wb') as f:
+                    f.write(item['jpeg'])
+                success = True
+            
+            if not success:
+                frame = pool.frame(item, refetch)
+                success = frame is not None and cv2.imwrite(
+                    output_path, 
+                    frame, 
+                    [cv2.IMWRITE_JPEG_QUALITY, 95]
+                )
             
             if success:
                 safe_print(f"  [{i+1}] thumb_{i+1:02d}.jpg (score: {item['score']:.3f}, time: {item['timestamp']:.1f}s)")
@@ -301,6 +777,9 @@ def generate_smart_thumbnails(video_path, output_dir, num_candidates=20):
         except Exception as e:
             safe_print(f"  [!] Error saving thumbnail {i+1}: {e}")
     
+    for r in refetch_reader:
+        r.close()
+    
     safe_print(f"✓ Generated {saved_count} thumbnails")
     return saved_count
 
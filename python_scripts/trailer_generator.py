@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
-import subprocess
-import tempfile
-import time
-import yt_dlp
+
+import cpu_governor
+from deadline import Budget, RateMeter
+from job_output import unique_name
+from media_probe import probe_media
+from workspace import Workspace
 
 sys.stdout.reconfigure(encoding='utf-8')
 os.environ['PYTHONIOENCODING'] = 'utf-8'
@@ -20,12 +22,16 @@ def safe_print(text):
         except:
             pass
 
-def download_streaming_url(url, temp_dir):
-    """Download streaming video to temp file"""
+# Rough size of an extracted segment, to decide whether it fits on tmpfs
+SEGMENT_BYTES_PER_SECOND = 1024 * 1024
+
+def download_streaming_url(url, temp_dir, max_bytes=None):
+    """Download streaming video to temp file, at most max_bytes if given"""
     safe_print("[Trailer] Downloading streaming video to temp file...")
+    import yt_dlp
     
-    timestamp = int(time.time())
-    base_name = f"trailer_video_{timestamp}"
+    # Unique per download, so concurrent jobs never pick up each other's files
+    base_name = unique_name("trailer_video")
     base_path = os.path.join(temp_dir, base_name)
     
     ydl_opts = {
@@ -36,6 +42,8 @@ def download_streaming_url(url, temp_dir):
         'socket_timeout': 30,
         'http_chunk_size': 10485760,
     }
+    if max_bytes is not None:
+        ydl_opts['max_filesize'] = max_bytes
     
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
@@ -68,25 +76,27 @@ def download_streaming_url(url, temp_dir):
         raise
 
 def get_video_duration(video_path):
-    """Get video duration using ffprobe"""
-    try:
-        ffprobe_cmd = [
-            'ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1:nokey=1', video_path
-        ]
-        
-        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True, timeout=30)
-        
-        if result.returncode == 0:
-            return float(result.stdout.strip())
-        else:
-            return None
-    except:
-        return None
+    """Get video duration from the shared media probe"""
+    probe = probe_media(video_path)
+    if probe and probe['duration'] > 0:
+        return probe['duration']
+    return None
 
-def generate_highlight_trailer(video_path, output_path, mode='highlights'):
-    """Create trailer - works with both local files and streaming URLs"""
-    
+def generate_highlight_trailer(video_path, output_path, mode='highlights', probe=None, segment_source=None,
+                               budget=None):
+    """Create trailer - works with both local files and streaming URLs
+
+    probe: optional media_probe summary for video_path, reused instead of
+    running ffprobe again. segment_source: full-resolution file or stream
+    URL to cut the segments from when video_path is a low-resolution proxy.
+    budget: deadline.Budget; segments that would not fit are dropped.
+    Downloads and segments go to a workspace.Workspace removed before
+    returning.
+    """
+    with Workspace('trailer') as workspace:
+        return _generate_highlight_trailer(video_path, output_path, mode, probe, segment_source, budget, workspace)
+
+def _generate_highlight_trailer(video_path, output_path, mode, probe, segment_source, budget, workspace):
     output_dir = os.path.dirname(output_path)
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
@@ -96,19 +106,21 @@ def generate_highlight_trailer(video_path, output_path, mode='highlights'):
     # Check if it's a streaming URL or local file
     is_streaming = video_path.startswith('http://') or video_path.startswith('https://')
     actual_video_path = video_path
-    temp_dir = None
     
-    # If streaming URL, download to temp file
-    if is_streaming:
-        temp_dir = tempfile.mkdtemp()
+    # If streaming URL, download to temp file (not needed when cutting from segment_source)
+    if is_streaming and not segment_source:
         try:
-            actual_video_path = download_streaming_url(video_path, temp_dir)
+            actual_video_path = download_streaming_url(video_path, workspace.dir, workspace.available())
+            workspace.check()
         except Exception as e:
             safe_print(f"[Trailer] ERROR: Failed to download video: {e}")
             return False
     
     # Get video duration
-    total_duration = get_video_duration(actual_video_path)
+    if probe and probe.get('duration', 0) > 0:
+        total_duration = probe['duration']
+    else:
+        total_duration = get_video_duration(segment_source or actual_video_path)
     
     if not total_duration or total_duration <= 0:
         safe_print("[Trailer] ERROR: Could not determine video duration")
@@ -148,88 +160,111 @@ def generate_highlight_trailer(video_path, output_path, mode='highlights'):
         return False
     
     # Create trailer
-    success = create_trailer_from_segments(actual_video_path, output_path, segments)
-    
-    # Cleanup temp directory if we created one
-    if temp_dir and os.path.exists(temp_dir):
-        try:
-            import shutil
-            shutil.rmtree(temp_dir)
-            safe_print(f"[Trailer] Cleaned up temp directory")
-        except:
-            pass
-    
-    return success
+    return create_trailer_from_segments(segment_source or actual_video_path, output_path, segments, budget, workspace)
 
-def create_trailer_from_segments(video_path, output_path, segments):
-    """Extract segments and concatenate"""
+def create_trailer_from_segments(video_path, output_path, segments, budget=None, workspace=None):
+    """Extract segments and concatenate
+
+    Segments are encoded up to ffmpeg_runner.concurrency_limit() at a
+    time, splitting the CPU budget between them. With a budget, stops
+    extracting once another batch plus the concatenation (about half a
+    segment's time per segment, measured so far) would overrun it;
+    segments are tried until one succeeds. Segments are written to
+    workspace (tmpfs when small), limited to its remaining quota; one
+    cut short by the quota is dropped and recorded as a degradation.
+    """
+    if workspace is None:
+        with Workspace('trailer') as workspace:
+            return create_trailer_from_segments(video_path, output_path, segments, budget, workspace)
+    import ffmpeg_runner
+    budget = budget or Budget()
+    meter = RateMeter()
     
     temp_files = []
     concat_list = []
-    
-    safe_print(f"[Trailer] Extracting {len(segments)} segments...")
-    
-    for i, (start, end) in enumerate(segments):
-        temp_file = f"{output_path}_seg_{i}.mp4"
-        temp_files.append(temp_file)
+    parallel = max(1, min(ffmpeg_runner.concurrency_limit(), len(segments)))
+    threads = cpu_governor.ffmpeg_threads(share=parallel)
+    on_progress = ffmpeg_runner.progress_printer(safe_print, "  Segment {label}:")
+    
+    safe_print(f"[Trailer] Extracting {len(segments)} segments, {parallel} at a time...")
+    
+    numbered = list(enumerate(segments))
+    for first in range(0, len(numbered), parallel):
+        batch = numbered[first:first + parallel]
+        if concat_list:
+            per_batch = meter.per_unit(0.0)
+            concat_estimate = 0.5 * per_batch / parallel * (len(concat_list) + len(batch))
+            if not budget.allows(per_batch + concat_estimate):
+                safe_print(f"[Trailer] Time budget reached, using {len(concat_list)} of {len(segments)} segments")
+                budget.degrade('trailer_segments', f"{len(concat_list)} of {len(segments)}")
+                break
         
-        ff_cmd = [
-            'ffmpeg', '-y', '-i', video_path,
-            '-ss', str(start),
-            '-to', str(end),
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-preset', 'veryfast',
-            '-crf', '28',
-            '-pix_fmt', 'yuv420p',
-            temp_file
-        ]
+        batch_files = []
+        commands = []
+        # Stop at the workspace quota instead of filling the disk
+        max_bytes = workspace.available() // len(batch)
+        for i, (start, end) in batch:
+            temp_file = workspace.small_path(f"seg_{i}.mp4", (end - start) * SEGMENT_BYTES_PER_SECOND)
+            temp_files.append(temp_file)
+            batch_files.append(temp_file)
+            
+            # Input-side seek: jumps to the segment instead of decoding (or
+            # downloading, for stream URLs) everything before it
+            commands.append([
+                'ffmpeg', '-y',
+                *threads,
+                '-ss', str(start),
+                '-i', video_path,
+                '-t', str(end - start),
+                *threads,
+                '-c:v', 'libx264',
+                '-c:a', 'aac',
+                '-preset', 'veryfast',
+                '-crf', '28',
+                '-pix_fmt', 'yuv420p',
+                '-fs', str(max_bytes),
+                temp_file
+            ])
+            safe_print(f"  Segment {i+1}: {start:.1f}s - {end:.1f}s")
         
-        safe_print(f"  Segment {i+1}: {start:.1f}s - {end:.1f}s")
+        meter.start()
+        results = ffmpeg_runner.run_many(commands, labels=[i + 1 for i, _ in batch], timeout=60,
+                                         on_progress=on_progress)
+        meter.stop()
         
-        try:
-            result = subprocess.run(ff_cmd, capture_output=True, text=True, timeout=60)
-            
-            if result.returncode == 0 and os.path.exists(temp_file) and os.path.getsize(temp_file) > 5000:
+        for (i, _), temp_file, result in zip(batch, batch_files, results):
+            size = os.path.getsize(temp_file) if os.path.exists(temp_file) else 0
+            if result['status'] == 'ok' and size >= max_bytes:
+                # -fs ends the encode early and still exits 0
+                safe_print(f"  [Warning] Segment {i+1} cut short at the workspace quota")
+                budget.degrade('trailer_segments', f"segment {i+1} over the workspace quota")
+            elif result['status'] == 'ok' and size > 5000:
                 concat_list.append(f"file '{temp_file}'")
+            elif result['status'] == 'timeout':
+                safe_print(f"  [Warning] Segment {i+1} timed out")
             else:
-                safe_print(f"  [Warning] Failed to extract segment {i+1}")
-        except subprocess.TimeoutExpired:
-            safe_print(f"  [Warning] Segment {i+1} timed out")
-        except Exception as e:
-            safe_print(f"  [Warning] Segment {i+1} error: {e}")
+                safe_print(f"  [Warning] Failed to extract segment {i+1}: {ffmpeg_runner.error_summary(result)}")
     
     if not concat_list:
         safe_print("[Trailer] ERROR: No segments extracted")
-        for f in temp_files:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-            except:
-                pass
         return False
     
     # Create concat file
-    concat_file = f"{output_path}_concat.txt"
+    concat_file = workspace.small_path("concat.txt", 4096)
     try:
         with open(concat_file, 'w') as f:
             f.write('\n'.join(concat_list))
     except Exception as e:
         safe_print(f"[Trailer] ERROR: Cannot write concat file: {e}")
-        for f in temp_files + [concat_file]:
-            try:
-                if os.path.exists(f):
-                    os.remove(f)
-            except:
-                pass
         return False
     
     # Concatenate
     safe_print("[Trailer] Concatenating segments...")
     
     concat_cmd = [
-        'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
+        'ffmpeg', '-y', *cpu_governor.ffmpeg_threads(), '-f', 'concat', '-safe', '0',
         '-i', concat_file,
+        *cpu_governor.ffmpeg_threads(),
         '-c:v', 'libx264',
         '-c:a', 'aac',
         '-preset', 'veryfast',
@@ -238,11 +273,10 @@ def create_trailer_from_segments(video_path, output_path, segments):
         output_path
     ]
     
-    try:
-        result = subprocess.run(concat_cmd, capture_output=True, text=True, timeout=120)
-    except subprocess.TimeoutExpired:
+    result = ffmpeg_runner.run(concat_cmd, timeout=120, label='concat',
+                               on_progress=ffmpeg_runner.progress_printer(safe_print, "  Concatenating:"))
+    if result['status'] == 'timeout':
         safe_print("[Trailer] ERROR: Concatenation timed out")
-        result = None
     
     # Cleanup
     for f in temp_files + [concat_file]:
@@ -252,8 +286,8 @@ def create_trailer_from_segments(video_path, output_path, segments):
         except:
             pass
     
-    if not result or result.returncode != 0:
-        safe_print("[Trailer] ERROR: Concatenation failed")
+    if result['status'] != 'ok':
+        safe_print(f"[Trailer] ERROR: Concatenation failed: {ffmpeg_runner.error_summary(result)}")
         return False
     
     # Verify
@@ -0,0 +1,732 @@
+# -*- coding: utf-8 -*-
+"""On-disk inverted index over transcripts, for library search
+
+Usage:
+    python transcript_index.py add <file.srt> [--video ID] [--index DIR]
+    python transcript_index.py scan <directory> [--index DIR]
+    python transcript_index.py search "<query>" [--limit N] [--index DIR]
+    python transcript_index.py stats [--index DIR]
+
+Queries: words must all occur ("solar panel"), quoted words as a phrase
+("\\"solar panel\\""), word* matches every word starting with word.
+"""
+import os
+import re
+import sys
+import json
+import mmap
+import uuid
+import heapq
+import bisect
+import struct
+import itertools
+import argparse
+import contextlib
+
+from metadata_generator import tokenize, read_cues
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', '.cache', 'transcript_index')
+
+MANIFEST = 'index.json'
+VIDEOS = 'videos.json'
+SEGMENT_SUFFIX = '.tix'
+
+# Segment file: header, postings, term dictionary (sorted), documents
+MAGIC = b'TIX1'
+HEADER = struct.Struct('<4sII7Q')
+TERM_OFFSET = struct.Struct('<II')
+TERM_INFO = struct.Struct('<QIII')
+DOC_ID = struct.Struct('<I')
+DOC_OFFSET = struct.Struct('<QQ')
+
+# A skip entry every this many documents of a term, so intersections
+# jump over documents instead of decoding them
+SKIP_INTERVAL = 64
+
+# Prefix queries: at least this many characters, at most this many words
+MIN_PREFIX = 2
+MAX_PREFIX_TERMS = 128
+
+DEFAULT_LIMIT = 20
+MAX_MATCHES_PER_VIDEO = 20
+
+_QUERY = re.compile(r'"([^"]*)"|(\S+)')
+
+def safe_print(text):
+    """Print to stderr to avoid interfering with JSON output"""
+    try:
+        sys.stderr.write(str(text) + "\n")
+        sys.stderr.flush()
+    except:
+        pass
+
+def put_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def get_varint(data, pos):
+    """(value, next position) of the varint at data[pos]"""
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def encode_positions(positions):
+    out = bytearray()
+    previous = 0
+    for p in positions:
+        put_varint(out, p - previous)
+        previous = p
+    return bytes(out)
+
+def parse_query(query):
+    """Clauses that must all match: ('phrase', [terms]) or ('prefix', term)"""
+    clauses = []
+    for phrase, word in _QUERY.findall(query or ''):
+        if word.endswith('*'):
+            terms = tokenize(word.rstrip('*'))
+            if terms and len(terms[-1]) >= MIN_PREFIX:
+                if len(terms) > 1:
+                    clauses.append(('phrase', terms[:-1]))
+                clauses.append(('prefix', terms[-1]))
+            continue
+        terms = tokenize(phrase or word)
+        if terms:
+            clauses.append(('phrase', terms))
+    return clauses
+
+class _Postings:
+    """Cursor over one term's postings, in document order
+
+    Layout: varint skip count, skips as (last doc before the block,
+    block offset), then per document: doc delta, term frequency, byte
+    length of the positions, positions as deltas.
+    """
+
+    def __init__(self, data, df):
+        self.data = data
+        self.df = df
+        count, pos = get_varint(data, 0)
+        self.skips = []
+        for _ in range(count):
+            doc, pos = get_varint(data, pos)
+            offset, pos = get_varint(data, pos)
+            self.skips.append((doc, offset))
+        self.body = pos
+        self.pos = pos
+        self.doc = 0
+        self.tf = 0
+        self._span = (pos, pos)
+        self._next_skip = 0
+
+    def next(self):
+        """Next document id, None when exhausted"""
+        if self.doc is None or self.pos >= len(self.data):
+            self.doc = None
+            return None
+        delta, pos = get_varint(self.data, self.pos)
+        self.tf, pos = get_varint(self.data, pos)
+        length, pos = get_varint(self.data, pos)
+        self.doc += delta
+        self._span = (pos, pos + length)
+        self.pos = pos + length
+        return self.doc
+
+    def advance(self, target):
+        """First document id >= target, None when there is none"""
+        if self.doc is None or (self.doc >= target and self.pos > self.body):
+            return self.doc
+        while self._next_skip < len(self.skips) and self.skips[self._next_skip][0] < target:
+            doc, offset = self.skips[self._next_skip]
+            self._next_skip += 1
+            if self.body + offset > self.pos:
+                self.pos = self.body + offset
+                self.doc = doc
+        while True:
+            doc = self.next()
+            if doc is None or doc >= target:
+                return doc
+
+    def positions(self):
+        """Token positions of the term in the current document"""
+        pos, end = self._span
+        out = []
+        value = 0
+        while pos < end:
+            delta, pos = get_varint(self.data, pos)
+            value += delta
+            out.append(value)
+        return out
+
+    def raw_positions(self):
+        return bytes(self.data[self._span[0]:self._span[1]])
+
+def _postings_bytes(skips, body):
+    out = bytearray()
+    put_varint(out, len(skips))
+    for doc, offset in skips:
+        put_varint(out, doc)
+        put_varint(out, offset)
+    return bytes(out + body)
+
+def encode_postings(entries):
+    """(postings bytes, document count, last doc) for (doc, tf, position bytes) in doc order"""
+    body = bytearray()
+    skips = []
+    previous = 0
+    count = 0
+    for doc, tf, positions in entries:
+        if count and count % SKIP_INTERVAL == 0:
+            skips.append((previous, len(body)))
+        put_varint(body, doc - previous)
+        put_varint(body, tf)
+        put_varint(body, len(positions))
+        body += positions
+        previous = doc
+        count += 1
+    return _postings_bytes(skips, body), count, previous
+
+def concat_postings(parts):
+    """Postings of (cursor, last doc) parts with ascending, disjoint documents
+
+    The bytes of each part are copied; only the first document delta of
+    each later part is re-encoded and skip offsets shifted, with a skip
+    entry added at every junction.
+    """
+    body = bytearray()
+    skips = []
+    previous = 0
+    count = 0
+    for cursor, last in parts:
+        data = cursor.data
+        first, pos = get_varint(data, cursor.body)
+        if count:
+            skips.append((previous, len(body)))
+        put_varint(body, first - previous)
+        start = len(body)
+        body += data[pos:]
+        # Skip offsets are relative to the part's first entry
+        skips.extend((doc, start + cursor.body + offset - pos) for doc, offset in cursor.skips)
+        previous = last
+        count += cursor.df
+    return _postings_bytes(skips, body), count, previous
+
+def write_segment(path, terms, docs):
+    """Write a segment file
+
+    terms: (term, (postings bytes, document count, last doc)) in term
+    order; docs: (doc_id, JSON bytes) in doc id order.
+    Written to a temporary name and renamed, so the file is complete
+    whenever it exists.
+    """
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    term_offsets, term_blob, term_info = bytearray(), bytearray(), bytearray()
+    with open(tmp, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        postings_at = f.tell()
+        written = 0
+        num_terms = 0
+        for term, (data, df, last) in terms:
+            if not df:
+                continue
+            encoded = term.encode('utf-8')
+            term_offsets += TERM_OFFSET.pack(len(term_blob), len(term_blob) + len(encoded))
+            term_blob += encoded
+            term_info += TERM_INFO.pack(written, len(data), df, last)
+            f.write(data)
+            written += len(data)
+            num_terms += 1
+
+        sections = [postings_at]
+        for blob in (term_offsets, term_blob, term_info):
+            sections.append(f.tell())
+            f.write(blob)
+        doc_ids, doc_offsets = bytearray(), bytearray()
+        doc_blob_size = 0
+        for doc_id, blob in docs:
+            doc_ids += DOC_ID.pack(doc_id)
+            doc_offsets += DOC_OFFSET.pack(doc_blob_size, len(blob))
+            doc_blob_size += len(blob)
+        sections.append(f.tell())
+        f.write(doc_ids)
+        sections.append(f.tell())
+        f.write(doc_offsets)
+        sections.append(f.tell())
+        for _, blob in docs:
+            f.write(blob)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, num_terms, len(docs), *sections))
+    os.replace(tmp, path)
+
+class Segment:
+    """One immutable segment file, memory-mapped"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mm)
+        fields = HEADER.unpack_from(self._mm, 0)
+        if fields[0] != MAGIC:
+            raise ValueError(f"Not a transcript index segment: {path}")
+        self.num_terms, self.num_docs = fields[1], fields[2]
+        (self._postings, self._term_offsets, self._term_blob, self._term_info,
+         self._doc_ids, self._doc_offsets, self._doc_blob) = fields[3:]
+
+    def term_bytes(self, i):
+        start, end = TERM_OFFSET.unpack_from(self._mm, self._term_offsets + TERM_OFFSET.size * i)
+        return self._mm[self._term_blob + start:self._term_blob + end]
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lookup(self, term):
+        """Index of term in the dictionary, None if absent"""
+        key = term.encode('utf-8')
+        i = self._lower_bound(key)
+        return i if i < self.num_terms and self.term_bytes(i) == key else None
+
+    def prefixed(self, prefix, limit=MAX_PREFIX_TERMS):
+        key = prefix.encode('utf-8')
+        found = []
+        i = self._lower_bound(key)
+        while i < self.num_terms and len(found) < limit and self.term_bytes(i).startswith(key):
+            found.append(i)
+            i += 1
+        return found
+
+    def df(self, i):
+        return TERM_INFO.unpack_from(self._mm, self._term_info + TERM_INFO.size * i)[2]
+
+    def last_doc(self, i):
+        return TERM_INFO.unpack_from(self._mm, self._term_info + TERM_INFO.size * i)[3]
+
+    def postings(self, i):
+        offset, length, df, _ = TERM_INFO.unpack_from(self._mm, self._term_info + TERM_INFO.size * i)
+        start = self._postings + offset
+        return _Postings(self._view[start:start + length], df)
+
+    def doc_id(self, index):
+        return DOC_ID.unpack_from(self._mm, self._doc_ids + DOC_ID.size * index)[0]
+
+    def doc_blob(self, index):
+        offset, length = DOC_OFFSET.unpack_from(self._mm, self._doc_offsets + DOC_OFFSET.size * index)
+        return self._mm[self._doc_blob + offset:self._doc_blob + offset + length]
+
+    def doc(self, doc_id):
+        lo, hi = 0, self.num_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.doc_id(mid) < doc_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_docs and self.doc_id(lo) == doc_id:
+            return json.loads(self.doc_blob(lo).decode('utf-8'))
+        return None
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # postings still referenced; closed when collected
+
+@contextlib.contextmanager
+def _locked(root):
+    """Exclusive lock on the index for writers; readers never wait"""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, 'lock'), 'a+b') as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _read_json(path, default):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _write_json(path, value):
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+class TranscriptIndex:
+    """Inverted index from words to (video, cue) over SRT transcripts
+
+    Every add writes a new immutable segment holding just the new
+    transcripts: postings of each word as documents and token positions,
+    varint delta coded, plus the cue timestamps and text. Segments are
+    memory-mapped for queries and merged in the background of adds so
+    that their number stays logarithmic in the number of transcripts;
+    merging copies postings without re-tokenizing. Re-adding a video
+    replaces its previous transcript. Writers from several processes
+    are serialized by a lock file; readers see the manifest as it was
+    when they last loaded it.
+    """
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get('TRANSCRIPT_INDEX_DIR') or DEFAULT_INDEX_DIR)
+        self._segments = {}
+        self._manifest = None
+        self._manifest_stamp = None
+        self._deleted = set()
+
+    # Reading
+
+    def _manifest_path(self):
+        return os.path.join(self.root, MANIFEST)
+
+    def _load(self):
+        """Refresh the manifest and open segments when another writer changed them"""
+        try:
+            st = os.stat(self._manifest_path())
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self._manifest_stamp and self._manifest is not None:
+            return self._manifest
+        manifest = _read_json(self._manifest_path(), None) or self._empty_manifest()
+        names = {s['name'] for s in manifest['segments']}
+        for name in list(self._segments):
+            if name not in names:
+                self._segments.pop(name).close()
+        for name in names:
+            if name not in self._segments:
+                self._segments[name] = Segment(os.path.join(self.root, name))
+        self._manifest = manifest
+        self._manifest_stamp = stamp
+        self._deleted = set(manifest['deleted'])
+        return manifest
+
+    @staticmethod
+    def _empty_manifest():
+        return {'version': 1, 'next_doc': 1, 'segments': [], 'deleted': []}
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """Videos matching query, in the order they were indexed
+
+        Each hit is {'video', 'source', 'matches': [{'start', 'end',
+        'text'}, ...], 'count'}: the cues where a match starts, to jump to.
+        """
+        clauses = parse_query(query)
+        if not clauses:
+            return []
+        manifest = self._load()
+        hits = []
+        for entry in manifest['segments']:
+            for hit in self._search_segment(self._segments[entry['name']], clauses):
+                hits.append(hit)
+                if len(hits) >= limit:
+                    return hits
+        return hits
+
+    def _search_segment(self, segment, clauses):
+        # Each clause: alternatives (prefix expansions), each a phrase of term indices
+        resolved = []
+        for kind, value in clauses:
+            if kind == 'prefix':
+                alternatives = [[i] for i in segment.prefixed(value)]
+            else:
+                found = [segment.lookup(t) for t in value]
+                alternatives = [found] if None not in found else []
+            if not alternatives:
+                return
+            resolved.append(alternatives)
+
+        # Candidates come from the rarest clause, the others are checked by skipping
+        cost = [sum(min(segment.df(i) for i in alt) for alt in alts) for alts in resolved]
+        driver = resolved[cost.index(min(cost))]
+
+        def documents(cursor):
+            while cursor.next() is not None:
+                yield cursor.doc
+
+        candidates = heapq.merge(*[
+            documents(segment.postings(min(alt, key=segment.df))) for alt in driver
+        ])
+        cursors = [[[segment.postings(i) for i in alt] for alt in alts] for alts in resolved]
+        last = None
+        for doc_id in candidates:
+            if doc_id == last or doc_id in self._deleted:
+                continue
+            last = doc_id
+            starts = set()
+            for clause in cursors:
+                matched = self._match(clause, doc_id)
+                if not matched:
+                    break
+                starts |= matched
+            else:
+                yield self._hit(segment.doc(doc_id), starts)
+
+    @staticmethod
+    def _match(alternatives, doc_id):
+        """Positions in doc_id where any alternative phrase starts"""
+        starts = set()
+        for phrase in alternatives:
+            if any(cursor.advance(doc_id) != doc_id for cursor in phrase):
+                continue
+            first = phrase[0].positions()
+            if len(phrase) == 1:
+                starts.update(first)
+                continue
+            following = [set(cursor.positions()) for cursor in phrase[1:]]
+            starts.update(p for p in first if all(p + k + 1 in s for k, s in enumerate(following)))
+        return starts
+
+    @staticmethod
+    def _hit(doc, starts):
+        cues = sorted({bisect.bisect_right(doc['starts'], p) - 1 for p in starts})
+        return {
+            'video': doc['video'],
+            'source': doc.get('source'),
+            'matches': [
+                {'start': doc['cues'][c][0], 'end': doc['cues'][c][1], 'text': doc['cues'][c][2]}
+                for c in cues[:MAX_MATCHES_PER_VIDEO]
+            ],
+            'count': len(cues),
+        }
+
+    def stats(self):
+        manifest = self._load()
+        return {
+            'root': self.root,
+            'segments': len(manifest['segments']),
+            'videos': sum(s['docs'] for s in manifest['segments']) - len(manifest['deleted']),
+            'terms': sum(self._segments[s['name']].num_terms for s in manifest['segments']),
+            'bytes': sum(os.path.getsize(self._segments[s['name']].path) for s in manifest['segments']),
+        }
+
+    def close(self):
+        for segment in self._segments.values():
+            segment.close()
+        self._segments = {}
+        self._manifest = self._manifest_stamp = None
+
+    # Writing
+
+    def add(self, video, cues, source=None):
+        """Index one transcript, cues as (start, end, text); returns its document id"""
+        return self.add_many([(video, cues, source)])[0]
+
+    def add_srt(self, srt_path, video=None):
+        """Index an SRT file, by default under its absolute path"""
+        return self.update([srt_path], videos=[video] if video else None, force=True)[0]
+
+    def update(self, srt_paths, videos=None, force=False):
+        """Index SRT files new or changed since they were last indexed
+
+        Returns the document id of every path, None for unchanged ones.
+        """
+        videos = videos or [None] * len(srt_paths)
+        known = _read_json(os.path.join(self.root, VIDEOS), {})
+        batch, slots = [], []
+        for index, (path, video) in enumerate(zip(srt_paths, videos)):
+            path = os.path.abspath(path)
+            video = video or path
+            st = os.stat(path)
+            previous = known.get(video)
+            if not force and previous and previous.get('size') == st.st_size and previous.get('mtime') == st.st_mtime:
+                continue
+            batch.append((video, read_cues(path), path, {'size': st.st_size, 'mtime': st.st_mtime}))
+            slots.append(index)
+        ids = [None] * len(srt_paths)
+        for slot, doc_id in zip(slots, self.add_many(batch)):
+            ids[slot] = doc_id
+        return ids
+
+    def update_from_directory(self, directory, suffix='.srt'):
+        """Index every new or changed transcript below directory; returns how many"""
+        paths = sorted(
+            os.path.join(dirpath, name)
+            for dirpath, _, names in os.walk(directory)
+            for name in names if name.endswith(suffix)
+        )
+        return sum(1 for doc_id in self.update(paths) if doc_id is not None)
+
+    def add_many(self, transcripts):
+        """Index (video, cues, source[, file info]) tuples as one new segment"""
+        if not transcripts:
+            return []
+        with _locked(self.root):
+            manifest = _read_json(self._manifest_path(), None) or self._empty_manifest()
+            known = _read_json(os.path.join(self.root, VIDEOS), {})
+            deleted = set(manifest['deleted'])
+
+            postings = {}
+            docs = []
+            ids = []
+            for transcript in transcripts:
+                video, cues, source = transcript[:3]
+                doc_id = manifest['next_doc']
+                manifest['next_doc'] += 1
+                starts, position = [], 0
+                for _, _, text in cues:
+                    starts.append(position)
+                    for token in tokenize(text):
+                        postings.setdefault(token, {}).setdefault(doc_id, []).append(position)
+                        position += 1
+                document = {'video': video, 'source': source, 'starts': starts,
+                            'cues': [[round(s, 3), round(e, 3), t] for s, e, t in cues]}
+                docs.append((doc_id, json.dumps(document, ensure_ascii=False).encode('utf-8')))
+                if video in known:
+                    deleted.add(known[video]['doc'])
+                known[video] = dict(transcript[3] if len(transcript) > 3 else {}, doc=doc_id, source=source)
+                ids.append(doc_id)
+
+            terms = (
+                (term, encode_postings((doc, len(p), encode_positions(p)) for doc, p in sorted(by_doc.items())))
+                for term, by_doc in sorted(postings.items())
+            )
+            name = f"seg-{ids[0]:010d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+            write_segment(os.path.join(self.root, name), terms, docs)
+            manifest['segments'].append({'name': name, 'docs': len(docs), 'min_doc': ids[0], 'max_doc': ids[-1]})
+            manifest['deleted'] = sorted(deleted)
+
+            self._merge_tail(manifest)
+            _write_json(os.path.join(self.root, VIDEOS), known)
+            _write_json(self._manifest_path(), manifest)
+            self._sweep(manifest)
+        return ids
+
+    def remove(self, video):
+        """Drop a video from search results; returns whether it was indexed"""
+        with _locked(self.root):
+            manifest = _read_json(self._manifest_path(), None) or self._empty_manifest()
+            known = _read_json(os.path.join(self.root, VIDEOS), {})
+            entry = known.pop(video, None)
+            if not entry:
+                return False
+            manifest['deleted'] = sorted(set(manifest['deleted']) | {entry['doc']})
+            _write_json(os.path.join(self.root, VIDEOS), known)
+            _write_json(self._manifest_path(), manifest)
+        return True
+
+    def _merge_tail(self, manifest):
+        """Merge the newest segments while the last is as large as the one before
+
+        Like a binary counter: every transcript is rewritten about
+        log2(transcripts) times and there are about as many segments.
+        """
+        segments = manifest['segments']
+        while len(segments) >= 2 and segments[-2]['docs'] <= segments[-1]['docs']:
+            merged = self._merge(segments[-2], segments[-1], set(manifest['deleted']))
+            dropped = set(range(segments[-2]['min_doc'], segments[-1]['max_doc'] + 1))
+            manifest['deleted'] = [d for d in manifest['deleted'] if d not in dropped]
+            segments[-2:] = [merged]
+
+    def _merge(self, older, newer, deleted):
+        parts = [Segment(os.path.join(self.root, s['name'])) for s in (older, newer)]
+        try:
+            # Parts holding deleted documents are decoded to drop them, the others copied
+            clean = [not any(s['min_doc'] <= d <= s['max_doc'] for d in deleted) for s in (older, newer)]
+
+            def live_entries(locations):
+                for k, i in locations:
+                    cursor = parts[k].postings(i)
+                    while cursor.next() is not None:
+                        if cursor.doc not in deleted:
+                            yield cursor.doc, cursor.tf, cursor.raw_positions()
+
+            def postings(locations):
+                if all(clean[k] for k, _ in locations):
+                    return concat_postings([(parts[k].postings(i), parts[k].last_doc(i)) for k, i in locations])
+                return encode_postings(live_entries(locations))
+
+            def vocabulary(k, part):
+                for i in range(part.num_terms):
+                    yield part.term_bytes(i), k, i
+
+            # Both dictionaries are sorted: walk them together, older part first
+            merged = heapq.merge(*[vocabulary(k, part) for k, part in enumerate(parts)])
+            terms = (
+                (term.decode('utf-8'), postings([(k, i) for _, k, i in group]))
+                for term, group in itertools.groupby(merged, key=lambda item: item[0])
+            )
+            docs = [
+                (part.doc_id(i), part.doc_blob(i))
+                for part in parts for i in range(part.num_docs) if part.doc_id(i) not in deleted
+            ]
+            name = f"seg-{older['min_doc']:010d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+            write_segment(os.path.join(self.root, name), terms, docs)
+        finally:
+            for part in parts:
+                part.close()
+        return {'name': name, 'docs': len(docs), 'min_doc': older['min_doc'], 'max_doc': newer['max_doc']}
+
+    def _sweep(self, manifest):
+        """Delete segment files no longer in the manifest"""
+        live = {s['name'] for s in manifest['segments']}
+        for name in os.listdir(self.root):
+            if (name.endswith(SEGMENT_SUFFIX) or name.endswith('.tmp')) and name not in live:
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except OSError:
+                    pass  # still mapped on Windows, removed by a later sweep
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcript search index')
+    parser.add_argument('--index', help='Index directory (default: TRANSCRIPT_INDEX_DIR or backend/.cache/transcript_index)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='Index an SRT file')
+    add.add_argument('srt')
+    add.add_argument('--video', help='Video id reported in results (default: the SRT path)')
+    scan = commands.add_parser('scan', help='Index new or changed SRT files below a directory')
+    scan.add_argument('directory')
+    search = commands.add_parser('search', help='Search the index')
+    search.add_argument('query')
+    search.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    commands.add_parser('stats', help='Show index size')
+    args = parser.parse_args()
+
+    index = TranscriptIndex(args.index)
+    if args.command == 'add':
+        result = {'doc': index.add_srt(args.srt, args.video)}
+    elif args.command == 'scan':
+        result = {'added': index.update_from_directory(args.directory)}
+    elif args.command == 'search':
+        result = {'query': args.query, 'hits': index.search(args.query, args.limit)}
+    else:
+        result = index.stats()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import re
+import subprocess
+import threading
+from shutil import which
+
+import cpu_governor
+
+# Frames per second of video that are measured; the pass costs one
+# decode plus filtering at this rate, whatever the GOP length
+DEFAULT_SAMPLE_FPS = 2.0
+# Statistics are taken on a grey copy this wide
+STATS_WIDTH = 160
+# Scene scores (0-1) above this count as cuts
+SCENE_CUT_SCORE = 0.3
+
+_LINE = re.compile(r'\]\s+(?:frame:(\d+)\s+pts:\S+\s+pts_time:(\S+)|lavfi\.(signalstats\.YAVG|signalstats\.YDIF|scene_score)=(\S+))')
+
+def available():
+    return which('ffmpeg') is not None
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+def distribution(times, values):
+    """Mean, spread, percentiles and per-minute means of a per-frame series"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    minutes = {}
+    for t, v in zip(times, values):
+        minutes.setdefault(int(t // 60), []).append(v)
+    per_minute = [
+        round(sum(minutes[m]) / len(minutes[m]), 2) if m in minutes else None
+        for m in range(max(minutes) + 1)
+    ]
+    return {
+        'mean': round(sum(values) / len(values), 2),
+        'min': round(ordered[0], 2),
+        'max': round(ordered[-1], 2),
+        'p10': round(percentile(ordered, 10), 2),
+        'p50': round(percentile(ordered, 50), 2),
+        'p90': round(percentile(ordered, 90), 2),
+        'per_minute': per_minute,
+    }
+
+def parse_metadata_log(lines):
+    """Per-frame {'time', 'brightness', 'motion', 'scene'} from metadata=print log lines"""
+    frames = []
+    for line in lines:
+        match = _LINE.search(line)
+        if not match:
+            continue
+        if match.group(1) is not None:
+            frames.append({'time': float(match.group(2))})
+        elif frames:
+            key = {'signalstats.YAVG': 'brightness', 'signalstats.YDIF': 'motion', 'scene_score': 'scene'}[match.group(3)]
+            frames[-1][key] = float(match.group(4))
+    return frames
+
+def summarize(frames, sample_fps):
+    """Whole-video statistics from parsed frames"""
+    frames = [f for f in frames if 'brightness' in f]
+    times = [f['time'] for f in frames]
+    # The first frame has no predecessor to differ from
+    moving = frames[1:]
+    scenes = [f.get('scene', 0.0) for f in moving]
+    return {
+        'sample_fps': sample_fps,
+        'frames': len(frames),
+        'covered_seconds': round(times[-1] + 1.0 / sample_fps, 2) if times else 0.0,
+        'brightness': distribution(times, [f['brightness'] for f in frames]),
+        'motion': distribution([f['time'] for f in moving], [f.get('motion', 0.0) for f in moving]),
+        'scene_score': distribution([f['time'] for f in moving], scenes),
+        'scene_changes': sum(1 for s in scenes if s > SCENE_CUT_SCORE),
+    }
+
+def _frame_size(width, height, max_width):
+    if not width or not height:
+        return None
+    out_w = min(max_width, width)
+    out_h = max(2, int(round(height * out_w / float(width) / 2.0)) * 2)
+    return out_w - out_w % 2, out_h
+
+def run_stats_pass(video_path, sample_fps=DEFAULT_SAMPLE_FPS, frame_times=(), source_size=None,
+                   frame_width=640, timeout=None):
+    """One ffmpeg pass measuring luma, frame difference and scene score
+
+    Brightness is the mean full-range luma (0-255, like an OpenCV grey
+    frame), motion the mean absolute luma difference from the previous
+    measured frame, both at sample_fps on a STATS_WIDTH grey copy.
+    frame_times: seconds whose frames are also returned (BGR, at most
+    frame_width wide; needs source_size=(width, height)), so callers
+    need no seeks of their own. On timeout the pass is stopped and the
+    statistics cover the part measured so far. Returns (stats, frames)
+    with frames a list of (time, ndarray), or (None, []) on failure.
+    """
+    wanted = sorted(set(int(t * sample_fps) for t in frame_times))
+    size = _frame_size(*(source_size or (0, 0)), frame_width) if wanted else None
+    stats_chain = (f"scale={STATS_WIDTH}:-2:out_range=full,format=gray,signalstats,"
+                   f"select='gte(scene\\,0)',metadata=mode=print")
+    if size:
+        select = '+'.join(f"eq(n\\,{n})" for n in wanted)
+        graph = (f"[0:v]fps={sample_fps},split=2[s][f];[s]{stats_chain},nullsink;"
+                 f"[f]select='{select}',scale={size[0]}:{size[1]},format=bgr24[frames]")
+        outputs = ['-map', '[frames]', '-vsync', 'passthrough', '-f', 'rawvideo', 'pipe:1']
+    else:
+        graph = f"[0:v]fps={sample_fps},{stats_chain}[out]"
+        outputs = ['-map', '[out]', '-f', 'null', '-']
+
+    cmd = ['ffmpeg', '-hide_banner', '-nostdin', '-nostats', '-v', 'info', *cpu_governor.ffmpeg_threads(), '-i', video_path,
+           '-an', '-sn', '-filter_complex', graph] + outputs
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None, []
+
+    log = []
+    reader = threading.Thread(target=lambda: log.extend(l.decode('utf-8', 'replace') for l in process.stderr))
+    reader.daemon = True
+    reader.start()
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, process.kill)
+        timer.start()
+
+    frames = []
+    if size:
+        import numpy as np
+        frame_bytes = size[0] * size[1] * 3
+        while len(frames) < len(wanted):
+            raw = process.stdout.read(frame_bytes)
+            if len(raw) < frame_bytes:
+                break
+            frames.append((wanted[len(frames)] / float(sample_fps),
+                           np.frombuffer(raw, dtype=np.uint8).reshape(size[1], size[0], 3)))
+    process.stdout.read()
+    process.wait()
+    reader.join()
+    timed_out = timer is not None and not timer.is_alive() and process.returncode != 0
+    if timer:
+        timer.cancel()
+
+    parsed = parse_metadata_log(log)
+    if not parsed or (process.returncode != 0 and not timed_out):
+        return None, frames
+    stats = summarize(parsed, sample_fps)
+    stats['complete'] = process.returncode == 0
+    return stats, frames
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""Whisper transcription shared by concurrent jobs, decoded in batches.
+
+One process holds the model (BatchServer) and listens on a Unix socket.
+Each job streams its audio to it in 30 s windows (transcribe_chunks()).
+The BatchScheduler collects windows from every connected job and runs
+up to WHISPER_BATCH_SIZE of them through one batched encoder/decoder
+pass, waiting at most WHISPER_BATCH_WAIT_MS for a batch to fill. Each
+job gets its segments back in order, with their times in the job's
+audio.
+
+As in model.transcribe(), a job's next window starts where the last
+complete segment of the previous one ended, so words at a window edge
+are decoded whole, and windows that look like failed decodes (too
+repetitive or too unlikely) are decoded again at higher temperatures.
+A job therefore has one window in flight at a time; batches are filled
+from different jobs. Unlike model.transcribe(), windows are not
+prompted with the previous window's text: whisper.decode() takes one
+prompt for the whole batch.
+"""
+import os
+import sys
+import time
+import itertools
+import threading
+import collections
+from concurrent.futures import Future
+
+# Windows decoded together in one forward pass, at most
+BATCH_SIZE_ENV = 'WHISPER_BATCH_SIZE'
+DEFAULT_BATCH_SIZE = 8
+
+# Longest the first window of a batch waits for others to join it
+BATCH_WAIT_ENV = 'WHISPER_BATCH_WAIT_MS'
+DEFAULT_BATCH_WAIT_MS = 50
+
+# Socket of the process-wide server; set by worker_pool for its workers
+SOCKET_ENV = 'WHISPER_BATCH_SOCKET'
+# Set to 0 to keep one Whisper model per worker instead
+ENABLE_ENV = 'WHISPER_BATCH'
+
+# Whisper's input window
+WINDOW_SECONDS = 30
+SAMPLE_RATE = 16000
+# Seconds per timestamp token
+TIME_PRECISION = 0.02
+
+# A window is silence when Whisper is this sure of it and the decoded
+# text is this unlikely (the thresholds model.transcribe() uses)
+NO_SPEECH_THRESHOLD = 0.6
+LOGPROB_THRESHOLD = -1.0
+# A decode is retried at the next temperature when its text compresses
+# better than this (repetition loops) or is less likely than LOGPROB_THRESHOLD
+COMPRESSION_RATIO_THRESHOLD = 2.4
+TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+def safe_print(text):
+    try:
+        print(text, flush=True)
+    except UnicodeEncodeError:
+        pass
+
+class BatcherUnavailable(Exception):
+    """No batch server to send this job to; transcribe it locally"""
+
+def batch_size():
+    try:
+        return max(1, int(os.environ[BATCH_SIZE_ENV]))
+    except (KeyError, ValueError):
+        return DEFAULT_BATCH_SIZE
+
+def batch_wait():
+    """Seconds a window may wait for its batch to fill"""
+    try:
+        return max(0.0, float(os.environ[BATCH_WAIT_ENV]) / 1000.0)
+    except (KeyError, ValueError):
+        return DEFAULT_BATCH_WAIT_MS / 1000.0
+
+def windows(samples, seconds=WINDOW_SECONDS):
+    """Split 16 kHz samples into (offset_seconds, window) pieces of at most `seconds`"""
+    size = int(seconds * SAMPLE_RATE)
+    return [(start / float(SAMPLE_RATE), samples[start:start + size]) for start in range(0, len(samples), size)]
+
+def segments_from_tokens(tokens, timestamp_begin, decode, duration=WINDOW_SECONDS):
+    """Segments of one window from decoded tokens, times relative to the window
+
+    Text runs between timestamp tokens (<|0.00|> text <|2.40|>); text
+    after the last timestamp ends with the window.
+    """
+    segments = []
+    start = 0.0
+    text = []
+    for token in tokens:
+        if token < timestamp_begin:
+            text.append(token)
+            continue
+        at = (token - timestamp_begin) * TIME_PRECISION
+        if text:
+            segments.append({'start': start, 'end': min(at, duration), 'text': decode(text)})
+            text = []
+        start = at
+    if text:
+        segments.append({'start': start, 'end': duration, 'text': decode(text)})
+    return [s for s in segments if s['text'].strip()]
+
+def decoded_window(tokens, timestamp_begin, decode, duration=WINDOW_SECONDS):
+    """(segments, seconds) of one decoded window: its complete segments, and how much of it they cover
+
+    A window that ends in the middle of a segment (the tokens end after
+    a pair of timestamps: <|end|><|start|> text...) covers only up to
+    the end of its last complete segment; the next window starts there.
+    Windows shorter than WINDOW_SECONDS are the end of the audio and
+    are covered whole.
+    """
+    cut = None
+    if duration >= WINDOW_SECONDS and not (len(tokens) >= 2 and tokens[-1] >= timestamp_begin > tokens[-2]):
+        for i in range(len(tokens) - 1, 0, -1):
+            if tokens[i] >= timestamp_begin and tokens[i - 1] >= timestamp_begin:
+                cut = i
+                break
+    if cut is not None:
+        seconds = (tokens[cut - 1] - timestamp_begin) * TIME_PRECISION
+        if seconds > 0:
+            return segments_from_tokens(tokens[:cut], timestamp_begin, decode, duration), seconds
+    return segments_from_tokens(tokens, timestamp_begin, decode, duration), duration
+
+def needs_fallback(result):
+    """Whether a decode looks failed and is worth retrying at a higher temperature"""
+    if result.no_speech_prob > NO_SPEECH_THRESHOLD:
+        return False
+    return result.compression_ratio > COMPRESSION_RATIO_THRESHOLD or result.avg_logprob < LOGPROB_THRESHOLD
+
+class BatchedWhisper:
+    """Whisper model decoding a list of windows in one forward pass"""
+
+    def __init__(self, model):
+        import whisper
+        from whisper.tokenizer import get_tokenizer
+        self.model = model
+        kwargs = {'language': 'en', 'task': 'transcribe'}
+        if hasattr(model, 'num_languages'):
+            kwargs['num_languages'] = model.num_languages
+        self.tokenizer = get_tokenizer(model.is_multilingual, **kwargs)
+        self.n_mels = getattr(model.dims, 'n_mels', 80)
+        self.options = [whisper.DecodingOptions(language='en', task='transcribe', fp16=False,
+                                                without_timestamps=False, temperature=t)
+                        for t in TEMPERATURES]
+
+    def _decode(self, mels):
+        """Decode results of each mel, retrying failed ones at higher temperatures"""
+        import whisper
+        results = [None] * len(mels)
+        todo = list(range(len(mels)))
+        for options in self.options:
+            retry = []
+            for i, result in zip(todo, whisper.decode(self.model, mels[todo], options)):
+                results[i] = result
+                if needs_fallback(result):
+                    retry.append(i)
+            todo = retry
+            if not todo:
+                break
+        return results
+
+    def transcribe_batch(self, batch):
+        """(segments, seconds) of each window (float32 16 kHz samples), see decoded_window()"""
+        import torch
+        import whisper
+        from whisper.audio import N_FRAMES
+        # Only newer releases take n_mels (128 for large-v3)
+        kwargs = {'n_mels': self.n_mels} if self.n_mels != 80 else {}
+        mels = torch.stack([
+            whisper.pad_or_trim(whisper.log_mel_spectrogram(torch.from_numpy(window), **kwargs), N_FRAMES)
+            for window in batch
+        ])
+        with torch.no_grad():
+            results = self._decode(mels)
+
+        decoded = []
+        for window, result in zip(batch, results):
+            duration = len(window) / float(SAMPLE_RATE)
+            if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                decoded.append(([], duration))
+                continue
+            decoded.append(decoded_window(list(result.tokens), self.tokenizer.timestamp_begin,
+                                          self.tokenizer.decode, duration))
+        return decoded
+
+class BatchScheduler:
+    """Queues windows per job and feeds them to the model in batches
+
+    model.transcribe_batch(windows) returns each window's (segments,
+    seconds covered). A batch takes windows from the queued jobs in
+    turn, so a long video does not hold up a short one. It runs when max_batch windows are
+    queued, or when its first window has waited max_wait seconds.
+    """
+
+    def __init__(self, model, max_batch=None, max_wait=None):
+        self.model = model
+        self.max_batch = max_batch or batch_size()
+        self.max_wait = batch_wait() if max_wait is None else max_wait
+        self.batches = 0
+        self.windows = 0
+        self._cond = threading.Condition()
+        self._queues = collections.OrderedDict()
+        self._queued = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='whisper-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, job, window):
+        """Future of one window's (segments, seconds covered)"""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('BatchScheduler is closed')
+            self._queues.setdefault(job, collections.deque()).append((time.time(), window, future))
+            self._queued += 1
+            self._cond.notify()
+        return future
+
+    def transcribe(self, samples, job=None):
+        """Segments of a whole recording, decoded window by window in batches"""
+        return self.transcribe_stream([(0.0, samples)], job)
+
+    def transcribe_stream(self, chunks, job=None):
+        """Segments of audio arriving as consecutive (offset_seconds, samples) chunks
+
+        Each window starts where the previous one's last complete
+        segment ended; chunks are read only as far as the next window
+        needs.
+        """
+        import numpy as np
+        job = job if job is not None else object()
+        size = WINDOW_SECONDS * SAMPLE_RATE
+        chunks = iter(chunks)
+        buffered = np.zeros(0, dtype=np.float32)
+        start = 0
+        ended = False
+        segments = []
+        while True:
+            while not ended and len(buffered) < size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    ended = True
+                else:
+                    buffered = np.concatenate([buffered, chunk[1]])
+            if not len(buffered):
+                return segments
+            window = buffered[:size]
+            window_segments, seconds = self.submit(job, window).result()
+            segments.extend(offset_segments([(start / float(SAMPLE_RATE), window_segments)]))
+            covered = int(round(seconds * SAMPLE_RATE))
+            if not 0 < covered <= len(window):
+                covered = len(window)
+            buffered = buffered[covered:]
+            start += covered
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _oldest(self):
+        return min(queue[0][0] for queue in self._queues.values())
+
+    def _take(self):
+        """Up to max_batch queued windows, one job at a time in turn"""
+        batch = []
+        while len(batch) < self.max_batch and self._queues:
+            job, queue = next(iter(self._queues.items()))
+            batch.append(queue.popleft())
+            # Move the job to the back; drop it once it has nothing queued
+            del self._queues[job]
+            if queue:
+                self._queues[job] = queue
+        self._queued -= len(batch)
+        return batch
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queued and not self._closed:
+                    self._cond.wait()
+                if not self._queued:
+                    return
+                deadline = self._oldest() + self.max_wait
+                while self._queued < self.max_batch and not self._closed and time.time() < deadline:
+                    self._cond.wait(deadline - time.time())
+                batch = self._take()
+
+            futures = [future for _, _, future in batch]
+            try:
+                results = self.model.transcribe_batch([window for _, window, _ in batch])
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            self.batches += 1
+            self.windows += len(batch)
+
+def offset_segments(results):
+    """One list of segments from (offset_seconds, segments) pairs in order"""
+    segments = []
+    for offset, window_segments in results:
+        for segment in window_segments:
+            segments.append(dict(segment, start=segment['start'] + offset, end=segment['end'] + offset))
+    return segments
+
+def server_address():
+    return os.environ.get(SOCKET_ENV) or None
+
+def transcribe_chunks(chunks, model_name, address=None):
+    """Segments of (offset_seconds, samples) chunks, decoded by the batch server
+
+    Chunks are sent as they come, so a growing file is decoded while it
+    arrives. Raises BatcherUnavailable when there is no server, or it
+    holds another model.
+    """
+    from multiprocessing import connection
+    address = address or server_address()
+    if not address:
+        raise BatcherUnavailable('no batch server')
+    try:
+        conn = connection.Client(address, family='AF_UNIX')
+    except OSError as e:
+        raise BatcherUnavailable(f"cannot reach {address}: {e}")
+    try:
+        conn.send({'model': model_name, 'pid': os.getpid()})
+        reply = conn.recv()
+        if 'error' in reply:
+            raise BatcherUnavailable(reply['error'])
+        for offset, samples in chunks:
+            conn.send({'offset': offset, 'samples': samples})
+        conn.send({'end': True})
+        reply = conn.recv()
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['segments']
+    finally:
+        conn.close()
+
+class BatchServer:
+    """Serves transcribe_chunks() requests from a Unix socket through one scheduler
+
+    load_model() runs in the background once the socket is listening;
+    requests wait for it. The model it returns must have
+    transcribe_batch().
+    """
+
+    def __init__(self, address, model_name, load_model, max_batch=None, max_wait=None):
+        from multiprocessing import connection
+        self.address = address
+        self.model_name = model_name
+        self.scheduler = None
+        self.error = None
+        self._loaded = threading.Event()
+        self._job_ids = itertools.count(1)
+        if os.path.exists(address):
+            os.unlink(address)
+        self._listener = connection.Listener(address, family='AF_UNIX')
+        threading.Thread(target=self._load, args=(load_model, max_batch, max_wait), daemon=True).start()
+
+    def _load(self, load_model, max_batch, max_wait):
+        try:
+            self.scheduler = BatchScheduler(load_model(), max_batch, max_wait)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            safe_print(f"[Batcher] Could not load Whisper model '{self.model_name}': {self.error}")
+        self._loaded.set()
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        try:
+            header = conn.recv()
+            self._loaded.wait()
+            if self.scheduler is None:
+                conn.send({'error': self.error})
+                return
+            if header.get('model') != self.model_name:
+                conn.send({'error': f"server holds '{self.model_name}', not '{header.get('model')}'"})
+                return
+            conn.send({'ok': True})
+
+            job = next(self._job_ids)
+            started = time.time()
+            received = [0.0]
+
+            def chunks():
+                while True:
+                    message = conn.recv()
+                    if message.get('end'):
+                        return
+                    received[0] = message['offset'] + len(message['samples']) / float(SAMPLE_RATE)
+                    yield message['offset'], message['samples']
+
+            stream = chunks()
+            try:
+                segments = self.scheduler.transcribe_stream(stream, job)
+                reply = {'segments': segments}
+            except Exception as e:
+                reply = {'error': f"{type(e).__name__}: {e}"}
+            # The client sends all of its audio before reading the reply
+            for _ in stream:
+                pass
+            conn.send(reply)
+            safe_print(f"[Batcher] Job {job} (pid {header.get('pid')}): {received[0]:.0f}s of audio "
+                       f"in {time.time() - started:.1f}s; {self.scheduler.windows / max(1, self.scheduler.batches):.1f} "
+                       f"windows per batch so far")
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        self._listener.close()
+        if self.scheduler:
+            self.scheduler.close()
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+def _server_main(address, model_name):
+    """Batch server process: the whole machine's cores for one model"""
+    import signal
+    import cpu_governor
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Started by worker_pool, whose stdout carries protocol events
+    try:
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    except (OSError, ValueError, AttributeError):
+        pass
+    cpu_governor.apply(len(cpu_governor.available_cores()))
+
+    def load_model():
+        import subtitle_generator
+        return BatchedWhisper(subtitle_generator.load_whisper_model(model_name))
+
+    BatchServer(address, model_name, load_model).serve_forever()
+
+def start_server(ctx, model_name=None):
+    """Start the batch server process and point this process's children at it
+
+    Returns the process; stop_server() ends it.
+    """
+    import tempfile
+    model_name = model_name or os.environ.get('WHISPER_MODEL', 'tiny')
+    address = os.path.join(tempfile.mkdtemp(prefix='whisper_batch_'), 'socket')
+    process = ctx.Process(target=_server_main, args=(address, model_name), daemon=True)
+    process.start()
+    os.environ[SOCKET_ENV] = address
+    return process
+
+def stop_server(process):
+    address = os.environ.pop(SOCKET_ENV, None)
+    process.terminate()
+    process.join(5)
+    if address:
+        try:
+            os.unlink(address)
+        except OSError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(address))
+        except OSError:
+            pass
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Serve batched Whisper transcription on a Unix socket')
+    parser.add_argument('socket')
+    parser.add_argument('--model', default=os.environ.get('WHISPER_MODEL', 'tiny'))
+    args = parser.parse_args()
+    safe_print(f"[Batcher] Serving Whisper '{args.model}' on {args.socket}")
+    try:
+        _server_main(args.socket, args.model)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""Long-running pool of warm Python workers speaking a JSON-lines protocol.
+
+Requests (one JSON object per line, on stdin or a Unix socket):
+    {"id": "job-1", "type": "pipeline", "params": {...}}
+    {"id": "job-1", "type": "cancel"}
+    {"type": "shutdown"}
+
+Events written back, one JSON object per line:
+    {"id": ..., "event": "queued" | "started" | "progress" | "result"
+                         | "error" | "cancelled" | "rejected", ...}
+"""
+import sys
+import os
+import json
+import time
+import signal
+import argparse
+import threading
+import collections
+import multiprocessing
+from multiprocessing import connection
+
+def safe_print(text):
+    """Log to stderr, stdout carries protocol events"""
+    try:
+        sys.stderr.write(str(text) + "\n")
+        sys.stderr.flush()
+    except:
+        pass
+
+def warm_up():
+    """Preload the heavy libraries and models every job needs"""
+    try:
+        import face_engine
+        face_engine.load_cascade()
+    except ImportError:
+        safe_print("[Worker] OpenCV not available")
+
+    try:
+        import nltk
+        from nltk.corpus import stopwords
+        stopwords.words('english')
+        nltk.data.find('tokenizers/punkt')
+    except Exception as e:
+        safe_print(f"[Worker] NLTK not ready: {e}")
+
+    try:
+        import whisper_batcher
+        # The pool's batch server holds the model for every worker
+        if not whisper_batcher.server_address():
+            import subtitle_generator
+            subtitle_generator.load_whisper_model(os.environ.get('WHISPER_MODEL', 'tiny'))
+    except Exception as e:
+        safe_print(f"[Worker] Whisper model not loaded: {e}")
+
+def handle_pipeline(params, progress):
+    import pipeline
+    import cpu_governor
+
+    def on_event(stage, status, info):
+        progress({'stage': stage, 'status': status, 'elapsed': info.get('elapsed')})
+
+    return pipeline.run_pipeline(
+        params['source'], params['output_dir'],
+        stages=params.get('stages'),
+        options=params.get('options'),
+        # Never more than this worker's share of the cores
+        cpu_budget=cpu_governor.clamp(params.get('cpu_budget', 1)),
+        on_event=on_event,
+    )
+
+def handle_resolve(params, progress):
+    """Resolve params['url'], or params['urls'] (videos and playlists) concurrently"""
+    import youtube_downloader
+    if 'urls' in params:
+        videos = youtube_downloader.resolve_urls(params['urls'])
+        return {'success': bool(videos) and all(v['success'] for v in videos), 'videos': videos}
+    return youtube_downloader.get_video_stream_urls(params['url'])
+
+# Open indexes by directory; segments stay mapped between searches
+_INDEXES = {}
+
+def handle_search(params, progress):
+    """Search the transcript index: params['query'], optional 'limit' and 'index_dir'"""
+    import transcript_index
+    root = params.get('index_dir')
+    if root not in _INDEXES:
+        _INDEXES[root] = transcript_index.TranscriptIndex(root)
+    hits = _INDEXES[root].search(params['query'], params.get('limit', transcript_index.DEFAULT_LIMIT))
+    return {'success': True, 'query': params['query'], 'hits': hits}
+
+DEFAULT_HANDLERS = {
+    'pipeline': handle_pipeline,
+    'resolve': handle_resolve,
+    'search': handle_search,
+}
+
+def _worker_main(conn, handlers, warmup, index=0, num_workers=1):
+    """Worker process: warm up once, then run jobs sent over conn"""
+    if hasattr(os, 'setsid'):
+        # Own process group, so cancelling also stops ffmpeg and stage children
+        os.setsid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Stage scripts print progress to stdout, which belongs to the protocol
+    try:
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    except (OSError, ValueError, AttributeError):
+        pass
+    sys.stdout = sys.stderr
+
+    # Before warm-up loads the models, so their thread pools fit the share
+    import cpu_governor
+    cpus = cpu_governor.init_worker(index, num_workers)
+    safe_print(f"[Worker] {os.getpid()} budgeted to {cpus} of {len(cpu_governor.available_cores())} cores")
+
+    if warmup:
+        try:
+            warmup()
+        except Exception as e:
+            safe_print(f"[Worker] Warm-up failed: {e}")
+    conn.send({'event': 'ready'})
+
+    import metrics
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+
+        job_id = job['id']
+
+        def progress(info, job_id=job_id):
+            conn.send(dict(info, id=job_id, event='progress'))
+
+        started = time.time()
+        try:
+            result = handlers[job['type']](job.get('params') or {}, progress)
+            conn.send({'id': job_id, 'event': 'result', 'result': result})
+            status = 'ok'
+        except Exception as e:
+            conn.send({'id': job_id, 'event': 'error', 'error': f"{type(e).__name__}: {e}"})
+            status = 'error'
+        metrics.observe('worker_job_seconds', time.time() - started, type=job['type'], status=status)
+
+    # Worker processes exit without running atexit handlers
+    metrics.flush()
+
+class _Worker:
+    def __init__(self, ctx, handlers, warmup, index=0, num_workers=1):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child_conn, handlers, warmup, index, num_workers))
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.job = None
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        pid = self.process.pid
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(pid, signal.SIGTERM)
+            else:
+                self.process.terminate()
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.join(3)
+        if self.process.is_alive():
+            try:
+                if hasattr(os, 'killpg'):
+                    os.killpg(pid, signal.SIGKILL)
+                else:
+                    self.process.kill()
+            except (ProcessLookupError, PermissionError):
+                pass
+            self.process.join(3)
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+class WorkerPool:
+    """Fixed set of warm worker processes with a bounded job queue
+
+    submit() blocks while max_pending jobs are already waiting
+    (backpressure); cancel() drops a queued job or kills the worker
+    running it and starts a fresh one. Events are delivered to the
+    per-job emit callback, or the pool-wide one.
+    """
+
+    def __init__(self, num_workers=2, max_pending=8, handlers=None, warmup=warm_up, emit=None):
+        self.handlers = dict(handlers or DEFAULT_HANDLERS)
+        self.warmup = warmup
+        self.max_pending = max(1, max_pending)
+        self.default_emit = emit or (lambda event: None)
+
+        # spawn: workers are long-lived, and forking a threaded parent is unsafe
+        self._ctx = multiprocessing.get_context('spawn')
+        self._lock = threading.Condition()
+        self._pending = collections.deque()
+        self._emitters = {}
+        self._cancels = []
+        self._closing = False
+        self._wake_r, self._wake_w = self._ctx.Pipe(duplex=False)
+
+        self.num_workers = max(1, num_workers)
+        self.workers = [self._spawn(i) for i in range(self.num_workers)]
+        self._thread = threading.Thread(target=self._loop, name='worker-pool', daemon=True)
+        self._thread.start()
+
+    def _spawn(self, index):
+        return _Worker(self._ctx, self.handlers, self.warmup, index, self.num_workers)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(None)
+        except (OSError, ValueError):
+            pass
+
+    def _emit(self, event, emit=None):
+        """Send event to emit, or to its job's emitter, dropped once the job ends"""
+        job_emit = emit is None
+        if job_emit:
+            emit = self._emitters.get(event.get('id'), self.default_emit)
+        try:
+            emit(event)
+        except Exception as e:
+            safe_print(f"[WorkerPool] emit failed: {e}")
+        if job_emit and event.get('event') in ('result', 'error', 'cancelled'):
+            self._emitters.pop(event.get('id'), None)
+
+    def submit(self, job, emit=None, block=True, timeout=None):
+        """Queue a job dict {id, type, params}; returns False if it was not accepted"""
+        job_id = job.get('id')
+        emit = emit or self.default_emit
+
+        # Rejected jobs never get an emitter; a running job with the same id keeps its own
+        if job.get('type') not in self.handlers:
+            self._emit({'id': job_id, 'event': 'rejected', 'error': f"Unknown job type: {job.get('type')}"}, emit)
+            return False
+
+        with self._lock:
+            if self._closing:
+                accepted = False
+            elif not block:
+                accepted = len(self._pending) < self.max_pending
+            else:
+                accepted = self._lock.wait_for(
+                    lambda: self._closing or len(self._pending) < self.max_pending, timeout
+                ) and not self._closing
+            if accepted:
+                self._emitters[job_id] = emit
+                # Before _dispatch can see the job, so 'started' always comes after
+                self._emit({'id': job_id, 'event': 'queued'})
+                self._pending.append(job)
+
+        if not accepted:
+            self._emit({'id': job_id, 'event': 'rejected', 'error': 'Queue full' if not self._closing else 'Shutting down'}, emit)
+            return False
+
+        self._wake()
+        return True
+
+    def cancel(self, job_id):
+        with self._lock:
+            self._cancels.append(job_id)
+        self._wake()
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def running_jobs(self):
+        return [w.job['id'] for w in self.workers if w.job]
+
+    def close(self, drain=True, timeout=None):
+        """Stop accepting jobs; wait for queued and running jobs unless drain=False"""
+        with self._lock:
+            self._closing = True
+            if not drain:
+                self._cancels.extend(job['id'] for job in self._pending)
+                self._cancels.extend(w.job['id'] for w in self.workers if w.job)
+            self._lock.notify_all()
+        self._wake()
+        self._thread.join(timeout)
+        for worker in self.workers:
+            worker.stop()
+
+    def _handle_cancels(self):
+        with self._lock:
+            cancels, self._cancels = self._cancels, []
+            for job_id in cancels:
+                for job in list(self._pending):
+                    if job['id'] == job_id:
+                        self._pending.remove(job)
+                        self._emit({'id': job_id, 'event': 'cancelled', 'state': 'queued'})
+            self._lock.notify_all()
+
+        for job_id in cancels:
+            for i, worker in enumerate(self.workers):
+                if worker.job and worker.job['id'] == job_id:
+                    worker.kill()
+                    self._emit({'id': job_id, 'event': 'cancelled', 'state': 'running'})
+                    self.workers[i] = self._spawn(i)
+
+    def _dispatch(self):
+        with self._lock:
+            for worker in self.workers:
+                if not self._pending:
+                    break
+                if worker.ready and worker.job is None:
+                    worker.job = self._pending.popleft()
+                    worker.conn.send(worker.job)
+                    self._emit({'id': worker.job['id'], 'event': 'started', 'pid': worker.process.pid})
+            self._lock.notify_all()
+
+    def _reap_dead(self):
+        for i, worker in enumerate(self.workers):
+            if worker.process.is_alive():
+                continue
+            if worker.job:
+                self._emit({'id': worker.job['id'], 'event': 'error',
+                            'error': f"Worker exited with code {worker.process.exitcode}"})
+            worker.kill()
+            if not self._closing:
+                self.workers[i] = self._spawn(i)
+
+    def _loop(self):
+        while True:
+            self._handle_cancels()
+            self._dispatch()
+
+            with self._lock:
+                idle = not self._pending and not any(w.job for w in self.workers)
+                if self._closing and idle:
+                    return
+
+            conns = {w.conn: w for w in self.workers}
+            ready = connection.wait(list(conns) + [self._wake_r], timeout=1.0)
+            for conn in ready:
+                if conn is self._wake_r:
+                    while self._wake_r.poll():
+                        self._wake_r.recv()
+                    continue
+
+                worker = conns[conn]
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    continue
+                if message.get('event') == 'ready':
+                    worker.ready = True
+                    continue
+                if message.get('event') in ('result', 'error'):
+                    worker.job = None
+                self._emit(message)
+
+            self._reap_dead()
+
+def serve_stream(pool, instream, outstream):
+    """Serve JSON-lines requests from instream until EOF or a shutdown request"""
+    write_lock = threading.Lock()
+
+    def write(event):
+        with write_lock:
+            outstream.write(json.dumps(event, ensure_ascii=False) + "\n")
+            outstream.flush()
+
+    for line in instream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            write({'event': 'error', 'error': f"Invalid JSON: {e}"})
+            continue
+
+        kind = request.get('type')
+        if kind == 'shutdown':
+            break
+        if kind == 'cancel':
+            pool.cancel(request.get('id'))
+            continue
+        if not request.get('id'):
+            write({'event': 'rejected', 'error': 'Missing job id'})
+            continue
+
+        # Blocks while the queue is full, which stops us reading further input
+        pool.submit(request, emit=write)
+
+def serve_socket(pool, socket_path):
+    """Serve JSON-lines requests on a Unix socket, one stream per connection"""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            outstream = self.wfile
+            text_out = _SocketWriter(outstream)
+            serve_stream(pool, (l.decode('utf-8') for l in self.rfile), text_out)
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    return server
+
+class _SocketWriter:
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        try:
+            self.wfile.write(text.encode('utf-8'))
+        except OSError:
+            pass
+
+    def flush(self):
+        try:
+            self.wfile.flush()
+        except OSError:
+            pass
+
+def start_whisper_batcher(num_workers):
+    """Start the shared Whisper batch server when there are several workers
+
+    Workers started afterwards find it through the environment. Returns
+    the server process, or None.
+    """
+    import whisper_batcher
+    if num_workers <= 1 or os.environ.get(whisper_batcher.ENABLE_ENV, '1') == '0':
+        return None
+    batcher = whisper_batcher.start_server(multiprocessing.get_context('spawn'))
+    safe_print(f"[WorkerPool] Whisper batch server at {os.environ[whisper_batcher.SOCKET_ENV]}")
+    return batcher
+
+def start_metrics_aggregator():
+    """Start the metrics aggregator the workers report to
+
+    Writes the Prometheus text file to METRICS_DIR (see metrics).
+    Returns the aggregator process, or None when METRICS=0.
+    """
+    import metrics
+    if os.environ.get(metrics.ENABLE_ENV, '1') == '0':
+        return None
+    aggregator = metrics.start_aggregator(multiprocessing.get_context('spawn'))
+    safe_print(f"[WorkerPool] Metrics in {os.path.join(metrics.metrics_dir(), 'metrics.prom')}")
+    return aggregator
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm Python worker pool (JSON lines)')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=8)
+    parser.add_argument('--socket', help='Listen on this Unix socket instead of stdin/stdout')
+    parser.add_argument('--no-warmup', action='store_true', help='Skip preloading models')
+    args = parser.parse_args()
+
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    # Scratch space left behind by workers that died with the last pool
+    import workspace
+    freed = workspace.reclaim_orphans()
+    if freed:
+        safe_print(f"[WorkerPool] Reclaimed {freed / 1024 / 1024:.1f} MB of orphaned scratch space")
+
+    aggregator = start_metrics_aggregator()
+    batcher = start_whisper_batcher(args.workers)
+    pool = WorkerPool(args.workers, args.max_pending, warmup=None if args.no_warmup else warm_up)
+    safe_print(f"[WorkerPool] Started {args.workers} workers")
+
+    try:
+        if args.socket:
+            server = serve_socket(pool, args.socket)
+            safe_print(f"[WorkerPool] Listening on {args.socket}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                if os.path.exists(args.socket):
+                    os.unlink(args.socket)
+        else:
+            serve_stream(pool, sys.stdin, stdout)
+    finally:
+        pool.close(drain=True)
+        if batcher:
+            import whisper_batcher
+            whisper_batcher.stop_server(batcher)
+        if aggregator:
+            import metrics
+            metrics.stop_aggregator(aggregator)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import atexit
+import shutil
+import signal
+import tempfile
+import threading
+
+# Scratch space for downloads, segments and other intermediates
+DEFAULT_ROOT = os.path.join(tempfile.gettempdir(), 'ai_video_workspace')
+# RAM-backed filesystem for small intermediates; WORKSPACE_TMPFS='' disables it
+DEFAULT_TMPFS = '/dev/shm'
+
+MB = 1024 * 1024
+DEFAULT_JOB_QUOTA_MB = 8192
+DEFAULT_TOTAL_QUOTA_MB = 32768
+# Never fill the scratch disk beyond leaving this much free
+DEFAULT_MIN_FREE_MB = 512
+# Intermediates up to this size go to tmpfs when it has room
+DEFAULT_SMALL_FILE_MB = 16
+
+# Workspaces of processes that cannot be checked for liveness are
+# reclaimed after this long
+ORPHAN_MAX_AGE_SECONDS = 24 * 3600
+
+class WorkspaceQuotaError(OSError):
+    """Scratch space needed would exceed the job or global quota, or the disk"""
+
+def _env_mb(name, default):
+    try:
+        return int(float(os.environ.get(name, default)) * MB)
+    except ValueError:
+        return default * MB
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate it; assume alive and rely on age
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _owner_pid(name):
+    try:
+        return int(name.split('-', 1)[0])
+    except ValueError:
+        return None
+
+_LIVE = []
+_LOCK = threading.Lock()
+_RECLAIMED = set()
+_HOOKS_INSTALLED = []
+
+def reclaim_orphans(root=None, tmpfs_root=None):
+    """Remove workspaces whose process has died, returns the bytes freed
+
+    Workspace directories are named <pid>-..., so a dead owner (killed
+    with SIGKILL, out of memory, power loss) is recognised without any
+    state beyond the directory itself.
+    """
+    freed = 0
+    now = time.time()
+    for base in (_root(root), _tmpfs_base(tmpfs_root)):
+        if not base or not os.path.isdir(base):
+            continue
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            pid = _owner_pid(name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except OSError:
+                continue
+            if pid == os.getpid():
+                continue
+            dead = pid is not None and not _pid_alive(pid)
+            unverifiable = pid is None or os.name == 'nt'
+            if dead or unverifiable and age > ORPHAN_MAX_AGE_SECONDS:
+                freed += _tree_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+    return freed
+
+def _root(root=None):
+    return os.path.abspath(root or os.environ.get('WORKSPACE_ROOT') or DEFAULT_ROOT)
+
+def _tmpfs_base(tmpfs_root=None):
+    tmpfs = tmpfs_root if tmpfs_root is not None else os.environ.get('WORKSPACE_TMPFS', DEFAULT_TMPFS)
+    if not tmpfs or not os.path.isdir(tmpfs) or not os.access(tmpfs, os.W_OK):
+        return None
+    return os.path.join(tmpfs, 'ai_video_workspace')
+
+def cleanup_all():
+    """Remove every workspace this process still holds"""
+    with _LOCK:
+        live = [w for w in _LIVE if w.pid == os.getpid()]
+    for workspace in live:
+        workspace.cleanup()
+
+def _on_signal(signum, frame):
+    cleanup_all()
+    previous = _HOOKS_INSTALLED[0].get(signum, signal.SIG_DFL) if _HOOKS_INSTALLED else signal.SIG_DFL
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+def _install_hooks():
+    """Clean up on normal exit and on SIGTERM/SIGHUP, chaining existing handlers"""
+    if _HOOKS_INSTALLED:
+        return
+    previous = {}
+    atexit.register(cleanup_all)
+    if threading.current_thread() is threading.main_thread():
+        for name in ('SIGTERM', 'SIGHUP'):
+            signum = getattr(signal, name, None)
+            if signum is None:
+                continue
+            try:
+                previous[signum] = signal.getsignal(signum)
+                signal.signal(signum, _on_signal)
+            except (ValueError, OSError):
+                pass
+    _HOOKS_INSTALLED.append(previous)
+
+class Workspace:
+    """Scratch directory for one job, removed when the job ends
+
+    Space is counted against a per-job quota (WORKSPACE_JOB_QUOTA_MB)
+    and a quota for everything under the root (WORKSPACE_TOTAL_QUOTA_MB),
+    and never allowed to leave less than WORKSPACE_MIN_FREE_MB free on
+    the disk. The directory is created on first use under WORKSPACE_ROOT
+    and removed on cleanup(), leaving a with-block, normal exit, SIGTERM
+    or SIGHUP; the first workspace of a process also reclaims those left
+    by dead processes. Small files can go to tmpfs (small_path).
+    """
+
+    def __init__(self, name='job', quota_bytes=None, root=None, tmpfs_root=None):
+        self.name = name
+        self.root = _root(root)
+        self.tmpfs_root = tmpfs_root
+        self.tmpfs_base = _tmpfs_base(tmpfs_root)
+        self.quota_bytes = quota_bytes if quota_bytes is not None else _env_mb('WORKSPACE_JOB_QUOTA_MB', DEFAULT_JOB_QUOTA_MB)
+        self.total_quota_bytes = _env_mb('WORKSPACE_TOTAL_QUOTA_MB', DEFAULT_TOTAL_QUOTA_MB)
+        self.min_free_bytes = _env_mb('WORKSPACE_MIN_FREE_MB', DEFAULT_MIN_FREE_MB)
+        self.small_file_bytes = _env_mb('WORKSPACE_SMALL_FILE_MB', DEFAULT_SMALL_FILE_MB)
+        self.pid = os.getpid()
+        self.id = f"{self.pid}-{name}-{uuid.uuid4().hex[:12]}"
+        self._dir = None
+        self._tmpfs_dir = None
+
+    @property
+    def dir(self):
+        if self._dir is None:
+            with _LOCK:
+                if self.root not in _RECLAIMED:
+                    _RECLAIMED.add(self.root)
+                    reclaim_orphans(self.root, self.tmpfs_root)
+                _install_hooks()
+                os.makedirs(self.root, exist_ok=True)
+                path = os.path.join(self.root, self.id)
+                os.makedirs(path)
+                self._dir = path
+                _LIVE.append(self)
+        return self._dir
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def small_path(self, name, size_hint):
+        """Path for an intermediate of about size_hint bytes, on tmpfs when it fits"""
+        if self.tmpfs_base and size_hint <= self.small_file_bytes:
+            try:
+                if shutil.disk_usage(os.path.dirname(self.tmpfs_base)).free > 4 * size_hint + self.small_file_bytes:
+                    if self._tmpfs_dir is None:
+                        self.dir  # registers the workspace for cleanup
+                        os.makedirs(os.path.join(self.tmpfs_base, self.id))
+                        self._tmpfs_dir = os.path.join(self.tmpfs_base, self.id)
+                    return os.path.join(self._tmpfs_dir, name)
+            except OSError:
+                pass
+        return self.path(name)
+
+    def usage(self):
+        return sum(_tree_size(d) for d in (self._dir, self._tmpfs_dir) if d)
+
+    def available(self):
+        """Bytes this job may still write to disk"""
+        job_left = self.quota_bytes - self.usage()
+        os.makedirs(self.root, exist_ok=True)
+        total_left = self.total_quota_bytes - _tree_size(self.root)
+        disk_left = shutil.disk_usage(self.root).free - self.min_free_bytes
+        return max(0, min(job_left, total_left, disk_left))
+
+    def reserve(self, nbytes):
+        """Raise WorkspaceQuotaError unless nbytes more fit"""
+        available = self.available()
+        if nbytes > available:
+            raise WorkspaceQuotaError(
+                f"Workspace {self.id} needs {nbytes / MB:.1f} MB, only {available / MB:.1f} MB available"
+            )
+
+    def check(self):
+        """Raise WorkspaceQuotaError if the job is already over a quota"""
+        self.reserve(0)
+        if self.usage() > self.quota_bytes:
+            raise WorkspaceQuotaError(f"Workspace {self.id} exceeds its {self.quota_bytes / MB:.0f} MB quota")
+
+    def cleanup(self):
+        for path in (self._dir, self._tmpfs_dir):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+        self._dir = self._tmpfs_dir = None
+        with _LOCK:
+            if self in _LIVE:
+                _LIVE.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+        return False
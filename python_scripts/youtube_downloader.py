@@ -1,92 +1,249 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import re
 import json
-import yt_dlp
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from media_probe import probe_media
 
 # Force UTF-8 encoding for output
 sys.stdout.reconfigure(encoding='utf-8')
 os.environ['PYTHONIOENCODING'] = 'utf-8'
 
-def get_video_stream_url(url):
-    """Extract direct stream URL without downloading the entire file"""
-    
+# Analysis proxy: the largest progressive format at or below this height
+PROXY_MAX_HEIGHT = 360
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', '.cache', 'youtube')
+
+# Stream URLs carry their own expiry; stop serving them this long before it
+EXPIRY_MARGIN_SECONDS = 300
+# Used when a stream URL has no expire parameter
+DEFAULT_TTL_SECONDS = 1800
+
+MAX_RESOLVE_WORKERS = 4
+
+# Playlists inside playlists are expanded this many levels deep
+MAX_PLAYLIST_DEPTH = 3
+
+def select_proxy_format(info, max_height=PROXY_MAX_HEIGHT):
+    """Pick a low-resolution format with both video and audio from an info dict"""
+    formats = [
+        f for f in info.get('formats') or []
+        if f.get('url') and f.get('height')
+        and f.get('vcodec', 'none') != 'none' and f.get('acodec', 'none') != 'none'
+    ]
+    if not formats:
+        return None
+    # Prefer mp4, then the closest height not above max_height, else the smallest
+    formats.sort(key=lambda f: (f.get('ext') != 'mp4', f['height'] > max_height,
+                                -f['height'] if f['height'] <= max_height else f['height']))
+    return formats[0]
+
+def stream_expiry(stream_url):
+    """Unix time a signed stream URL stops working (expire= or /expire/), or None"""
+    match = re.search(r'[?&/]expire[=/](\d+)', stream_url or '')
+    return int(match.group(1)) if match else None
+
+def info_has_audio(info):
+    """Audio presence from the selected format(s); None when the extractor does not say"""
+    selected = info.get('requested_formats') or [info]
+    codecs = [f.get('acodec') for f in selected]
+    if any(c and c != 'none' for c in codecs):
+        return True
+    if codecs and all(c == 'none' for c in codecs):
+        return False
+    return None
+
+def ytdlp_extract(url):
+    """Default extractor: yt-dlp info dict, playlists listed flat"""
+    import yt_dlp
+
     ydl_opts = {
         'format': 'best[ext=mp4]/best',
         'quiet': True,
         'no_warnings': True,
         'socket_timeout': 30,
+        'extract_flat': 'in_playlist',
     }
-    
+
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-        
-        if not info:
-            raise Exception("Could not extract video info")
-        
-        stream_url = info.get('url')
-        
-        if not stream_url:
-            raise Exception("No stream URL found in video info")
-        
-        return stream_url
+        return ydl.extract_info(url, download=False)
+
+def summarize_info(source, info):
+    """Resolution result for one video info dict"""
+    if not info:
+        raise Exception("Could not extract video info")
+
+    stream_url = info.get('url')
+
+    if not stream_url:
+        raise Exception("No stream URL found in video info")
+
+    proxy = select_proxy_format(info)
+    proxy_url = None
+    if proxy and proxy['url'] != stream_url and proxy['height'] < (info.get('height') or 0):
+        proxy_url = proxy['url']
+
+    has_audio = info_has_audio(info)
+    if has_audio is None:
+        has_audio = check_audio_presence(stream_url)
+
+    expiries = [e for e in (stream_expiry(stream_url), stream_expiry(proxy_url)) if e]
+
+    return {
+        'success': True,
+        'source': source,
+        'url': stream_url,
+        'proxy_url': proxy_url,
+        'type': 'streaming',
+        'has_audio': has_audio,
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'width': info.get('width'),
+        'height': info.get('height'),
+        'ext': info.get('ext'),
+        'format_id': info.get('format_id'),
+        'expires_at': min(expiries) if expiries else None,
+    }
+
+class ResolveCache:
+    """Resolved stream URLs on disk, kept until shortly before they expire"""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or os.environ.get('YOUTUBE_CACHE_DIR') or DEFAULT_CACHE_DIR)
+
+    def _path(self, url):
+        return os.path.join(self.root, hashlib.blake2b(url.encode('utf-8'), digest_size=16).hexdigest() + '.json')
+
+    def get(self, url, now=None):
+        try:
+            with open(self._path(url), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (now or time.time()) >= entry.get('valid_until', 0):
+            return None
+        return entry['result']
+
+    def put(self, url, result, now=None):
+        now = now or time.time()
+        expires_at = result.get('expires_at')
+        valid_until = expires_at - EXPIRY_MARGIN_SECONDS if expires_at else now + DEFAULT_TTL_SECONDS
+        if valid_until <= now:
+            return
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            path = self._path(url)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'result': result, 'valid_until': valid_until}, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+def _playlist_entry_url(entry):
+    return entry.get('url') or entry.get('webpage_url') or entry.get('id')
+
+def resolve_urls(urls, max_workers=MAX_RESOLVE_WORKERS, extractor=None, cache=None):
+    """Resolve video and playlist URLs concurrently, in input order
+
+    Playlists expand to one result per entry, nested playlists
+    included; an empty playlist gives one failed result. extractor(url) returns a
+    yt-dlp style info dict (default: ytdlp_extract); cache is a
+    ResolveCache, or False to disable caching. Failed URLs give
+    {'success': False, 'source': url, 'error': ...} instead of raising.
+    """
+    import metrics
+    extractor = extractor or ytdlp_extract
+    if cache is None:
+        cache = ResolveCache()
+
+    def resolve_one(url):
+        cached = cache.get(url) if cache else None
+        if cache:
+            metrics.inc('resolve_cache_lookups', result='hit' if cached else 'miss')
+        if cached:
+            return [dict(cached, cached=True)]
+        try:
+            info = extractor(url)
+            if info and info.get('_type') == 'playlist':
+                entries = [e for e in info.get('entries') or [] if e]
+                if not entries:
+                    return [{'success': False, 'source': url, 'error': 'Playlist has no entries'}]
+                return [('entry', _playlist_entry_url(e)) for e in entries]
+            result = summarize_info(url, info)
+        except Exception as e:
+            return [{'success': False, 'source': url, 'error': str(e)}]
+        if cache:
+            cache.put(url, result)
+        return [result]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        results = [item for batch in pool.map(resolve_one, urls) for item in batch]
+        # Playlist entries are resolved in further rounds on the same pool,
+        # one per level of nesting
+        for _ in range(MAX_PLAYLIST_DEPTH):
+            pending = [r[1] for r in results if isinstance(r, tuple)]
+            if not pending:
+                break
+            resolved = iter(list(pool.map(resolve_one, pending)))
+            results = [item for r in results for item in (next(resolved) if isinstance(r, tuple) else [r])]
+
+    return [{'success': False, 'source': r[1], 'error': 'Playlist nested too deeply'} if isinstance(r, tuple) else r
+            for r in results]
+
+def get_video_stream_urls(url, extractor=None, cache=None):
+    """Resolve one video URL, returns its result dict (url, proxy_url, has_audio, ...)
+
+    proxy_url is None when no smaller format than the stream exists.
+    """
+    result = resolve_urls([url], max_workers=1, extractor=extractor, cache=cache)[0]
+    if not result['success']:
+        raise Exception(result['error'])
+    return result
+
+def get_video_stream_url(url):
+    """Extract direct stream URL without downloading the entire file"""
+    return get_video_stream_urls(url)['url']
 
 def check_audio_presence(video_url):
-    """Check if video URL has audio stream using ffprobe"""
-    try:
-        import subprocess
-        result = subprocess.run(
-            ['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', video_url],
-            capture_output=True, text=True, timeout=15
-        )
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            streams = data.get('streams', [])
-            has_audio = any(s.get('codec_type') == 'audio' for s in streams)
-            return has_audio
-        else:
-            return False
-    except:
-        return False
+    """Check if video URL has audio stream using the shared media probe"""
+    probe = probe_media(video_url, timeout=15)
+    return bool(probe and probe['has_audio'])
 
 def main():
     # Validate arguments
     if len(sys.argv) < 2:
         result = {
             'success': False,
-            'error': 'Usage: python youtube_downloader.py <URL>'
+            'error': 'Usage: python youtube_downloader.py <URL> [URL ...]'
         }
         print(json.dumps(result))
         sys.exit(1)
-    
-    url = sys.argv[1]
-    
+
+    urls = sys.argv[1:]
+
     try:
-        # Get streaming URL instead of downloading
-        stream_url = get_video_stream_url(url)
-        
-        # Check for audio
-        has_audio = check_audio_presence(stream_url)
-        
-        # Return as JSON only - NO other output
-        result = {
-            'success': True,
-            'url': stream_url,
-            'type': 'streaming',
-            'has_audio': has_audio
-        }
-        
-        print(json.dumps(result))
-        sys.exit(0)
-    
+        results = resolve_urls(urls)
     except Exception as e:
-        result = {
-            'success': False,
-            'error': str(e),
-            'type': 'streaming'
-        }
+        results = [{'success': False, 'error': str(e)}]
+
+    # Return as JSON only - NO other output. A single video keeps the original shape
+    if len(urls) == 1 and len(results) == 1:
+        result = results[0]
+        if result['success']:
+            result = {k: result[k] for k in ('success', 'url', 'proxy_url', 'type', 'has_audio')}
+        else:
+            result = {'success': False, 'error': result['error'], 'type': 'streaming'}
         print(json.dumps(result))
-        sys.exit(1)
+        sys.exit(0 if result['success'] else 1)
+
+    success = bool(results) and all(r['success'] for r in results)
+    print(json.dumps({'success': success, 'videos': results}))
+    sys.exit(0 if success else 1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()